@@ -3,15 +3,25 @@
 e-Gov法令API、国会会議録検索システムAPI、官報情報の取得テスト
 """
 
+import os
 import json
-import urllib.request
 import urllib.parse
-import urllib.error
 import time
 import re
 from datetime import datetime, timedelta
 import sys
 
+import requests
+
+USER_AGENT = 'Mozilla/5.0 (compatible; LegalPipelineTest/1.0)'
+
+# Gemini APIのベースURL（ローカルのフェイクサーバーに向ける場合は環境変数で上書き）
+GEMINI_API_BASE_URL = os.getenv("GEMINI_API_BASE_URL", "https://generativelanguage.googleapis.com")
+GEMINI_REST_MODEL = os.getenv("GEMINI_REST_MODEL", "gemini-1.5-flash")
+
+# テスト間で共有するセッション（Keep-Alive接続を使い回す）
+api_client = requests.Session()
+
 def test_egov_api():
     """
     e-Gov法令APIの接続テスト
@@ -35,13 +45,11 @@ def test_egov_api():
         print(f"リクエスト URL: {url}")
         print("e-Gov法令APIにリクエスト送信中...")
         
-        req = urllib.request.Request(url)
-        req.add_header('User-Agent', 'Mozilla/5.0 (compatible; LegalPipelineTest/1.0)')
+        response = api_client.get(url, headers={'User-Agent': USER_AGENT}, timeout=30)
+        response.raise_for_status()
+        content = response.content.decode('utf-8')
+        content_type = response.headers.get('Content-Type', '')
         
-        with urllib.request.urlopen(req, timeout=30) as response:
-            content = response.read().decode('utf-8')
-            content_type = response.headers.get('Content-Type', '')
-            
         print(f"✅ e-Gov API接続成功")
         print(f"レスポンス形式: {content_type}")
         print(f"レスポンスサイズ: {len(content)} 文字")
@@ -68,13 +76,13 @@ def test_egov_api():
         
         return True
         
-    except urllib.error.HTTPError as e:
-        print(f"❌ e-Gov API HTTPエラー: {e.code}")
-        if e.code == 403:
+    except requests.HTTPError as e:
+        print(f"❌ e-Gov API HTTPエラー: {e.response.status_code}")
+        if e.response.status_code == 403:
             print("アクセス拒否: API利用に認証が必要な可能性")
-        elif e.code == 429:
+        elif e.response.status_code == 429:
             print("レート制限: リクエスト頻度制限に引っかかった可能性")
-        error_body = e.read().decode('utf-8') if hasattr(e, 'read') else "詳細不明"
+        error_body = e.response.text or "詳細不明"
         print(f"エラー詳細: {error_body}")
         return False
     except Exception as e:
@@ -104,12 +112,10 @@ def test_kokkai_api():
         print(f"リクエスト URL: {url}")
         print("国会会議録APIにリクエスト送信中...")
         
-        req = urllib.request.Request(url)
-        req.add_header('User-Agent', 'Mozilla/5.0 (compatible; LegalPipelineTest/1.0)')
+        response = api_client.get(url, headers={'User-Agent': USER_AGENT}, timeout=30)
+        response.raise_for_status()
+        content = response.content.decode('utf-8')
         
-        with urllib.request.urlopen(req, timeout=30) as response:
-            content = response.read().decode('utf-8')
-            
         print(f"✅ 国会会議録API接続成功")
         print(f"レスポンスサイズ: {len(content)} 文字")
         
@@ -150,9 +156,9 @@ def test_kokkai_api():
         
         return True
         
-    except urllib.error.HTTPError as e:
-        print(f"❌ 国会会議録API HTTPエラー: {e.code}")
-        error_body = e.read().decode('utf-8') if hasattr(e, 'read') else "詳細不明"
+    except requests.HTTPError as e:
+        print(f"❌ 国会会議録API HTTPエラー: {e.response.status_code}")
+        error_body = e.response.text or "詳細不明"
         print(f"エラー詳細: {error_body}")
         return False
     except Exception as e:
@@ -171,12 +177,10 @@ def test_kanpo_access():
         
         print(f"官報サイトへのアクセステスト: {base_url}")
         
-        req = urllib.request.Request(base_url)
-        req.add_header('User-Agent', 'Mozilla/5.0 (compatible; LegalPipelineTest/1.0)')
+        response = api_client.get(base_url, headers={'User-Agent': USER_AGENT}, timeout=30)
+        response.raise_for_status()
+        content = response.content.decode('utf-8', errors='ignore')
         
-        with urllib.request.urlopen(req, timeout=30) as response:
-            content = response.read().decode('utf-8', errors='ignore')
-            
         print(f"✅ 官報サイトアクセス成功")
         print(f"レスポンスサイズ: {len(content)} 文字")
         
@@ -272,7 +276,7 @@ def test_ai_impact_analysis(api_key=None):
     
     try:
         # Gemini APIを使用した実際の影響度分析
-        url = f"https://generativelanguage.googleapis.com/v1beta/models/gemini-1.5-flash:generateContent?key={api_key}"
+        url = f"{GEMINI_API_BASE_URL}/v1beta/models/{GEMINI_REST_MODEL}:generateContent?key={api_key}"
         
         sample_law_change = """
 宅地建物取引業法の改正内容:
@@ -304,13 +308,10 @@ def test_ai_impact_analysis(api_key=None):
             "generationConfig": {"temperature": 0.1, "maxOutputTokens": 1000}
         }
         
-        data = json.dumps(payload).encode('utf-8')
-        req = urllib.request.Request(url, data=data)
-        req.add_header('Content-Type', 'application/json')
-        
         print("Gemini APIで影響度分析中...")
-        with urllib.request.urlopen(req, timeout=30) as response:
-            result = json.loads(response.read().decode('utf-8'))
+        response = api_client.post(url, json=payload, timeout=30)
+        response.raise_for_status()
+        result = response.json()
         
         if "candidates" in result and result["candidates"]:
             response_text = result["candidates"][0]["content"]["parts"][0]["text"]
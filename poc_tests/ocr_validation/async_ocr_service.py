@@ -0,0 +1,382 @@
+"""
+OCR サービス実装（asyncio版）
+Vision API / Gemini の呼び出しを非同期化し、上流ごとのセマフォで同時実行数を制限する
+ラスタライズ・前処理はエグゼキュータに逃がしてイベントループを塞がない
+"""
+
+import os
+import time
+import asyncio
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, List, Optional, Sequence, Tuple, Union
+
+from google.cloud import vision
+from vertexai.generative_models import GenerativeModel
+
+from config import TARGET_FIELDS
+from ocr_service import OCRService, VISION_CONCURRENCY, RULE_EXTRACTION_ENABLED
+from image_preprocessing import DEFAULT_PREPROCESS_PROFILE
+from pdf_rasterizer import DEFAULT_RENDER_DPI, DEFAULT_RENDER_WORKERS
+from page_spool import PageSpool, PAGE_SPOOL_ENABLED
+from deed_layout import DocumentLayout, LAYOUT_CROP_ENABLED, sections_for_fields, combine_section_results
+from pdf_text_layer import TEXT_LAYER_ENABLED, TEXT_LAYER_CONFIDENCE
+from preprocess_pool import PREPROCESS_PROCESSES
+from ocr_cache import OCR_CACHE_ENABLED
+from structuring_cache import GEMINI_CACHE_ENABLED
+from prompt_compaction import usage_from_sdk_response, filter_sections, PROMPT_COMPACTION_ENABLED
+from structured_output import STRUCTURED_OUTPUT_ENABLED
+from deed_field_extractor import merge_structured_data
+from tracing import span, bind
+
+# ログ設定
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# 上流ごとの同時実行数・同時処理ドキュメント数
+GEMINI_CONCURRENCY = int(os.getenv("OCR_GEMINI_CONCURRENCY", "4"))
+DOCUMENT_CONCURRENCY = int(os.getenv("OCR_DOCUMENT_CONCURRENCY", "16"))
+PREPROCESS_WORKERS = int(os.getenv("OCR_PREPROCESS_WORKERS", str(os.cpu_count() or 1)))
+
+
+class AsyncOCRService(OCRService):
+    def __init__(
+        self,
+        vision_concurrency: int = VISION_CONCURRENCY,
+        gemini_concurrency: int = GEMINI_CONCURRENCY,
+        preprocess_workers: int = PREPROCESS_WORKERS,
+        render_dpi: int = DEFAULT_RENDER_DPI,
+        render_workers: int = DEFAULT_RENDER_WORKERS,
+        preprocess_profile: str = DEFAULT_PREPROCESS_PROFILE,
+        use_cache: bool = OCR_CACHE_ENABLED,
+        use_structuring_cache: bool = GEMINI_CACHE_ENABLED,
+        use_rule_extraction: bool = RULE_EXTRACTION_ENABLED,
+        use_text_layer: bool = TEXT_LAYER_ENABLED,
+        preprocess_processes: int = PREPROCESS_PROCESSES,
+        use_prompt_compaction: bool = PROMPT_COMPACTION_ENABLED,
+        use_structured_output: bool = STRUCTURED_OUTPUT_ENABLED,
+        use_page_spool: bool = PAGE_SPOOL_ENABLED,
+        use_layout_crop: bool = LAYOUT_CROP_ENABLED,
+        vision_client: Optional[vision.ImageAnnotatorClient] = None,
+        gemini_model: Optional[GenerativeModel] = None,
+        vision_async_client_factory: Optional[Callable[[], vision.ImageAnnotatorAsyncClient]] = None
+    ):
+        """
+        OCRサービスの初期化（asyncio版）
+        vision_async_client_factory を指定した場合は、イベントループごとにその関数で Vision の非同期クライアントを作成する
+        （vision_client・gemini_model と合わせてローカルのフェイクサーバーに向ける場合など）
+        """
+        super().__init__(
+            render_dpi=render_dpi,
+            render_workers=render_workers,
+            preprocess_profile=preprocess_profile,
+            use_cache=use_cache,
+            use_structuring_cache=use_structuring_cache,
+            use_rule_extraction=use_rule_extraction,
+            use_text_layer=use_text_layer,
+            preprocess_processes=preprocess_processes,
+            use_prompt_compaction=use_prompt_compaction,
+            use_structured_output=use_structured_output,
+            use_page_spool=use_page_spool,
+            use_layout_crop=use_layout_crop,
+            vision_client=vision_client,
+            gemini_model=gemini_model
+        )
+        self.vision_concurrency = vision_concurrency
+        self.vision_async_client_factory = vision_async_client_factory or vision.ImageAnnotatorAsyncClient
+        self.gemini_concurrency = gemini_concurrency
+
+        # 前処理・キャッシュ参照をイベントループから切り離すスレッドプール
+        # （Non-local Means はGILを長く保持するため、CPUを使い切るには preprocess_processes でプロセスプールを併用する）
+        self.preprocess_executor = ThreadPoolExecutor(max_workers=preprocess_workers)
+
+        # 非同期クライアントとセマフォは実行中のイベントループで生成する（ループを跨いで使い回さない）
+        self._vision_async_client: Optional[vision.ImageAnnotatorAsyncClient] = None
+        self._semaphores: Dict[str, asyncio.Semaphore] = {}
+        self._bound_loop: Optional[asyncio.AbstractEventLoop] = None
+
+        logger.info(
+            f"AsyncOCRService initialized (vision={vision_concurrency}, gemini={gemini_concurrency})"
+        )
+
+    def _bind_loop(self):
+        loop = asyncio.get_running_loop()
+        if self._bound_loop is not loop:
+            self._vision_async_client = self.vision_async_client_factory()
+            self._semaphores = {
+                "vision": asyncio.Semaphore(self.vision_concurrency),
+                "gemini": asyncio.Semaphore(self.gemini_concurrency),
+            }
+            self._bound_loop = loop
+
+    def _semaphore(self, upstream: str) -> asyncio.Semaphore:
+        self._bind_loop()
+        return self._semaphores[upstream]
+
+    @property
+    def vision_async_client(self) -> vision.ImageAnnotatorAsyncClient:
+        self._bind_loop()
+        return self._vision_async_client
+
+    async def extract_text_with_vision_async(self, image_data: bytes) -> Tuple[str, float]:
+        """
+        Google Cloud Vision API（非同期）でテキスト抽出
+
+        Returns:
+            Tuple[str, float]: (抽出テキスト, 信頼度)
+        """
+        try:
+            loop = asyncio.get_running_loop()
+
+            # 前処理・キャッシュ参照（エグゼキュータで実行。現在のスパンは bind で引き継ぐ）
+            processed_image = await loop.run_in_executor(
+                self.preprocess_executor, bind(self.preprocess_image), image_data
+            )
+            cache_key, cached = await loop.run_in_executor(
+                self.preprocess_executor, self._lookup_cache, processed_image
+            )
+            if cached is not None:
+                logger.info("Vision API結果をキャッシュから取得")
+                return cached
+
+            request = {
+                "image": {"content": processed_image},
+                "features": [{"type_": vision.Feature.Type.TEXT_DETECTION}],
+            }
+
+            async with self._semaphore("vision"):
+                start_time = time.time()
+                with span("vision", image_bytes=len(processed_image)):
+                    response = await self.vision_async_client.batch_annotate_images(requests=[request])
+                processing_time = time.time() - start_time
+
+            with span("parse", upstream="vision"):
+                full_text, confidence = self._parse_vision_response(response.responses[0])
+            await loop.run_in_executor(
+                self.preprocess_executor, self._store_cache, cache_key, full_text, confidence, processing_time
+            )
+            logger.info(f"Vision API処理時間: {processing_time:.2f}秒, 信頼度: {confidence:.2%}")
+
+            return full_text, confidence
+
+        except Exception as e:
+            logger.error(f"Vision API エラー: {e}")
+            return "", 0.0
+
+    async def structure_data_with_gemini_async(self, text: str, fields: Optional[List[str]] = None) -> Dict:
+        """
+        Gemini Flash（非同期）で構造化データに変換
+        fields を指定した場合はその項目のみを問い合わせる
+        """
+        try:
+            cache_key, cached = self._lookup_structuring_cache(text, fields)
+            if cached is not None:
+                logger.info("構造化結果をキャッシュから取得")
+                return cached
+
+            prompt = self._create_extraction_prompt(text, fields)
+
+            async with self._semaphore("gemini"):
+                start_time = time.time()
+                with span("gemini", fields=len(fields or TARGET_FIELDS)):
+                    response = await self.gemini_model.generate_content_async(
+                        prompt, generation_config=self._generation_config(fields)
+                    )
+                processing_time = time.time() - start_time
+            self.usage_log.record(prompt, processing_time, usage_from_sdk_response(response), response.text)
+
+            logger.info(f"Gemini処理時間: {processing_time:.2f}秒")
+            with span("parse", upstream="gemini"):
+                structured_data = self._parse_gemini_response(response.text)
+            self._store_structuring_cache(cache_key, structured_data, processing_time)
+            return structured_data
+
+        except Exception as e:
+            logger.error(f"Gemini API エラー: {e}")
+            return {"error": str(e)}
+
+    async def structure_data_with_gemini_hybrid_async(self, text: str, sectioned: bool = False) -> Dict:
+        """
+        ルールベース抽出で埋まらなかった項目のみ Gemini（非同期）で構造化して統合
+        sectioned: text がレイアウト解析で区ごとに切り出したOCRテキスト（区の見出しタグ付き）の場合に True
+        """
+        if self.field_extractor is None:
+            return await self.structure_data_with_gemini_async(text)
+
+        rule_result = self.field_extractor.extract(text, TARGET_FIELDS)
+        missing = self.field_extractor.missing_fields(rule_result, TARGET_FIELDS)
+
+        # 区ごとに切り出したテキストは、未抽出項目の記載される区だけを Gemini に渡す
+        if sectioned:
+            text = filter_sections(text, sections_for_fields(missing))
+        llm_result = await self.structure_data_with_gemini_async(text, fields=missing) if missing else None
+        return merge_structured_data(rule_result, llm_result, TARGET_FIELDS, missing)
+
+    async def _render_page_async(
+        self, pdf_path: str, page_index: int, spool: Optional[PageSpool] = None
+    ) -> Union[bytes, memoryview]:
+        """
+        1ページをプロセスプールでレンダリング
+        spool を指定した場合はレンダリング結果をスプールに書き出し、Vision APIの同時実行枠を待つ間はメモリに保持しない
+        （スプールへの書き出しはファイルI/Oのため、イベントループを止めないようエグゼキュータで実行する）
+        """
+        with span("rasterize", page=page_index):
+            image_data = await asyncio.wrap_future(self.rasterizer.submit(pdf_path, page_index))
+            if spool is not None:
+                loop = asyncio.get_running_loop()
+                await loop.run_in_executor(self.preprocess_executor, spool.write, page_index, image_data)
+                image_data = spool.view(page_index)
+        return image_data
+
+    async def _extract_page_async(
+        self, pdf_path: str, page_index: int, spool: Optional[PageSpool] = None
+    ) -> Tuple[str, float]:
+        """1ページをレンダリングしてVision APIに投入（スプール上のページは抽出後に解放する）"""
+        image_data = await self._render_page_async(pdf_path, page_index, spool)
+        try:
+            return await self.extract_text_with_vision_async(image_data)
+        finally:
+            if spool is not None:
+                spool.release(page_index)
+
+    async def _extract_regions_async(
+        self, regions: Sequence[Tuple[Optional[str], bytes]], page_index: int, spool: Optional[PageSpool] = None
+    ) -> Tuple[str, float]:
+        """レイアウト解析で切り出した区（またはページ全体）をVision APIに投入してページの結果にまとめる"""
+        if regions and regions[0][0] is None:
+            try:
+                return await self.extract_text_with_vision_async(regions[0][1])
+            finally:
+                if spool is not None:
+                    spool.release(page_index)
+        # 切り出した画像は元のページと別のバッファのため、スプール上のページはここで解放する
+        if spool is not None:
+            spool.release(page_index)
+        if not regions:
+            return "", 0.0
+        results = await asyncio.gather(*(self.extract_text_with_vision_async(crop) for _, crop in regions))
+        return combine_section_results([(section, result) for (section, _), result in zip(regions, results)])
+
+    async def _extract_pages_with_layout_async(
+        self,
+        pdf_path: str,
+        page_texts: List[Optional[str]],
+        ocr_pages: List[int],
+        spool: Optional[PageSpool] = None
+    ) -> List[Tuple[str, float]]:
+        """
+        同期版の _extract_pages と同じく、レイアウト解析で必要な区だけを切り出してVision APIに投入
+        レンダリングは並行して進め、区の判定は前のページの区を引き継ぐためページ順に行う
+
+        Returns:
+            ocr_pages の順の (抽出テキスト, 信頼度) のリスト
+        """
+        loop = asyncio.get_running_loop()
+        # テキストレイヤーのページは画像化しないため、その見出しで区の判定を進める
+        layout = DocumentLayout(self.layout_sections, text_pages=page_texts)
+        renders = [asyncio.ensure_future(self._render_page_async(pdf_path, page_index, spool)) for page_index in ocr_pages]
+        pages: List[asyncio.Future] = []
+        try:
+            for page_index, render in zip(ocr_pages, renders):
+                image_data = await render
+                with span("layout", page=page_index):
+                    regions = await loop.run_in_executor(
+                        self.preprocess_executor, bind(layout.split_page), image_data, page_index
+                    )
+                pages.append(asyncio.ensure_future(self._extract_regions_async(regions, page_index, spool)))
+            results = list(await asyncio.gather(*pages))
+            logger.info(f"レイアウト解析: {layout.stats()}")
+            return results
+        finally:
+            # 失敗した場合も、スプールを閉じる前に残りのレンダリング・Vision APIの呼び出しを止める
+            pending = [task for task in renders + pages if not task.done()]
+            for task in pending:
+                task.cancel()
+            await asyncio.gather(*pending, return_exceptions=True)
+
+    async def process_pdf_async(self, pdf_path: str) -> Dict:
+        """
+        PDFファイル全体を処理（非同期）
+        ページごとのタスクは作成時のコンテキストを引き継ぐため、各ページのスパンも process_pdf スパン配下になる
+        """
+        with span("process_pdf", file=os.path.basename(pdf_path)):
+            try:
+                start_time = time.time()
+                logger.info(f"PDF処理開始: {pdf_path}")
+
+                loop = asyncio.get_running_loop()
+                page_count, page_texts = await loop.run_in_executor(
+                    self.preprocess_executor, bind(self._read_pages), pdf_path
+                )
+
+                if page_count == 0:
+                    return {"error": "PDFにページが含まれていません"}
+
+                # テキストレイヤーのないページを並行して処理（Vision APIの同時実行数はセマフォで制限）
+                page_results: List[Tuple[str, float]] = [
+                    (text, TEXT_LAYER_CONFIDENCE) if text is not None else ("", 0.0) for text in page_texts
+                ]
+                ocr_pages = [page_index for page_index, text in enumerate(page_texts) if text is None]
+                spool = PageSpool() if self.use_page_spool and ocr_pages else None
+                try:
+                    if self.layout_sections is None:
+                        ocr_results = await asyncio.gather(
+                            *(self._extract_page_async(pdf_path, page_index, spool) for page_index in ocr_pages)
+                        )
+                    else:
+                        ocr_results = await self._extract_pages_with_layout_async(pdf_path, page_texts, ocr_pages, spool)
+                finally:
+                    if spool is not None:
+                        spool.close()
+                for page_index, page_result in zip(ocr_pages, ocr_results):
+                    page_results[page_index] = page_result
+
+                combined = self._combine_page_results(page_results)
+                if combined is None:
+                    return {"error": "テキスト抽出に失敗しました"}
+
+                extracted_text, vision_confidence = combined
+
+                # Geminiで構造化
+                structuring_start = time.time()
+                structured_data = await self.structure_data_with_gemini_hybrid_async(
+                    extracted_text, sectioned=self.layout_sections is not None
+                )
+
+                return self._build_result(
+                    start_time, page_count, extracted_text, vision_confidence, structured_data,
+                    text_layer_pages=len(page_texts) - len(ocr_pages),
+                    timings={"structuring": (time.time() - structuring_start) * 1000}
+                )
+
+            except Exception as e:
+                logger.error(f"PDF処理エラー: {e}")
+                return {"error": str(e), "success": False}
+
+    async def process_batch_async(
+        self, pdf_paths: List[str], max_documents_in_flight: int = DOCUMENT_CONCURRENCY
+    ) -> List[Dict]:
+        """
+        複数PDFを最大 max_documents_in_flight 件まで同時に処理
+
+        Returns:
+            入力順の {"file": パス, "result": process_pdf_async の結果} のリスト
+        """
+        documents_in_flight = asyncio.Semaphore(max_documents_in_flight)
+
+        async def process_one(pdf_path: str) -> Dict:
+            async with documents_in_flight:
+                return {"file": pdf_path, "result": await self.process_pdf_async(pdf_path)}
+
+        return list(await asyncio.gather(*(process_one(path) for path in pdf_paths)))
+
+    def process_batch(self, pdf_paths: List[str], max_documents_in_flight: int = DOCUMENT_CONCURRENCY) -> List[Dict]:
+        """
+        process_batch_async の同期呼び出し用ラッパー
+        """
+        return asyncio.run(self.process_batch_async(pdf_paths, max_documents_in_flight))
+
+    def shutdown(self):
+        """エグゼキュータを停止"""
+        self.preprocess_executor.shutdown(wait=True)
+        super().shutdown()
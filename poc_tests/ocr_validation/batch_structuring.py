@@ -0,0 +1,145 @@
+"""
+複数文書の一括構造化（1回の Gemini 呼び出しで複数の謄本を処理）
+大量取り込み時に呼び出しごとの固定オーバーヘッドを分散するため、文書IDで区切ったOCRテキストをまとめて送信し、
+文書IDをキーにした JSON で回答させる
+
+- バッチサイズは出力トークン上限に収まるよう、観測した文書あたりの出力トークン数から適応的に決める
+- 検証に失敗した文書（欠落・項目不足・途中で切れた応答）のみ再送する
+"""
+
+import os
+import re
+import json
+import threading
+import logging
+from typing import Dict, List, Tuple
+
+from incremental_json import parse_partial_json
+from prompt_compaction import compact_ocr_text, estimate_tokens
+
+# ログ設定
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# 1バッチの最大文書数
+BATCH_MAX_DOCUMENTS = int(os.getenv("GEMINI_BATCH_MAX_DOCUMENTS", "10"))
+# 1回の呼び出しの出力トークン上限（generationConfig.maxOutputTokens）
+BATCH_MAX_OUTPUT_TOKENS = int(os.getenv("GEMINI_BATCH_MAX_OUTPUT_TOKENS", "8192"))
+# 1回の呼び出しの入力トークン数の目安上限
+BATCH_MAX_INPUT_TOKENS = int(os.getenv("GEMINI_BATCH_MAX_INPUT_TOKENS", "100000"))
+# 出力トークン見込みに対する余裕（見込み×文書数 が上限のこの割合に収まるようにする）
+BATCH_OUTPUT_HEADROOM = float(os.getenv("GEMINI_BATCH_OUTPUT_HEADROOM", "0.8"))
+# 検証に失敗した文書を一括で再送する回数（超えた文書は1件ずつ問い合わせる）
+BATCH_RETRY_ROUNDS = int(os.getenv("GEMINI_BATCH_RETRY_ROUNDS", "1"))
+
+# 観測値がない場合の項目あたりの出力トークン数（値・信頼度・キーの合計の見込み）
+_INITIAL_TOKENS_PER_FIELD = 24
+# 文書あたりの出力トークン数の指数移動平均の重み
+_EWMA_ALPHA = 0.3
+
+_DOCUMENT_TAG = '<document id="{doc_id}">\n{text}\n</document>'
+
+
+class BatchSizer:
+    """
+    文書あたりの出力トークン数の見込みを観測値で更新し、出力上限に収まるバッチに分割する（スレッドセーフ）
+    """
+
+    def __init__(
+        self,
+        max_documents: int = BATCH_MAX_DOCUMENTS,
+        max_output_tokens: int = BATCH_MAX_OUTPUT_TOKENS,
+        max_input_tokens: int = BATCH_MAX_INPUT_TOKENS,
+        headroom: float = BATCH_OUTPUT_HEADROOM
+    ):
+        self.max_documents = max(1, max_documents)
+        self.max_output_tokens = max_output_tokens
+        self.max_input_tokens = max_input_tokens
+        self.headroom = headroom
+        self._lock = threading.Lock()
+        self._tokens_per_document: Dict[int, float] = {}
+
+    def output_tokens_per_document(self, field_count: int) -> float:
+        with self._lock:
+            return self._tokens_per_document.get(field_count, field_count * _INITIAL_TOKENS_PER_FIELD)
+
+    def batch_size(self, field_count: int) -> int:
+        """現在の見込みで出力上限に収まる文書数"""
+        per_document = self.output_tokens_per_document(field_count)
+        fits = int(self.max_output_tokens * self.headroom // max(1.0, per_document))
+        return max(1, min(self.max_documents, fits))
+
+    def observe(self, field_count: int, documents: int, output_tokens: int, truncated: bool = False):
+        """
+        呼び出し結果から見込みを更新
+        出力上限で切れた場合は、次のバッチが半分の文書数になるよう見込みを引き上げる
+        """
+        if documents <= 0:
+            return
+        with self._lock:
+            current = self._tokens_per_document.get(field_count, field_count * _INITIAL_TOKENS_PER_FIELD)
+            if truncated:
+                updated = max(current, self.max_output_tokens * self.headroom / max(1, documents // 2))
+            else:
+                updated = (1 - _EWMA_ALPHA) * current + _EWMA_ALPHA * (output_tokens / documents)
+            self._tokens_per_document[field_count] = updated
+
+    def plan(self, documents: List[Tuple[str, str]], field_count: int) -> List[List[Tuple[str, str]]]:
+        """
+        (文書ID, テキスト) のリストを、文書数・入力トークン数の上限内のバッチに順に詰める
+        """
+        size = self.batch_size(field_count)
+        batches: List[List[Tuple[str, str]]] = []
+        current: List[Tuple[str, str]] = []
+        current_tokens = 0
+        for doc_id, text in documents:
+            tokens = estimate_tokens(text)
+            if current and (len(current) >= size or current_tokens + tokens > self.max_input_tokens):
+                batches.append(current)
+                current, current_tokens = [], 0
+            current.append((doc_id, text))
+            current_tokens += tokens
+        if current:
+            batches.append(current)
+        return batches
+
+
+def build_batch_prompt(documents: List[Tuple[str, str]], fields: List[str], compact_text: bool = True) -> str:
+    """
+    複数文書の抽出プロンプトを作成（各文書は <document id="..."> で区切る）
+    """
+    skeleton = ", ".join(f'"{field}": ""' for field in fields)
+    ids = ", ".join(f'"{doc_id}"' for doc_id, _ in documents)
+    body = "\n".join(
+        _DOCUMENT_TAG.format(doc_id=doc_id, text=compact_ocr_text(text) if compact_text else text)
+        for doc_id, text in documents
+    )
+    return f"""以下の {len(documents)} 件の登記簿謄本のOCRテキストから、文書ごとに項目を抽出してください。
+文書IDごとに次のJSONの "" を値で埋め（該当なしは ""）、文書IDをキーにしたJSONのみで回答してください。
+{{"documents": {{文書ID: {{"extracted_data": {{{skeleton}}}, "confidence_scores": {{項目: 0.0〜1.0}}, "metadata": {{"total_fields": {len(fields)}, "average_confidence": 平均}}}}}}}}
+文書ID: [{ids}]
+{body}
+"""
+
+
+def parse_batch_response(response_text: str) -> Dict[str, Dict]:
+    """
+    一括応答を文書IDごとの結果に分解
+    応答が途中で切れている場合も、解釈できた文書までを返す（途中の文書は検証で弾く）
+    """
+    try:
+        parsed = json.loads(response_text)
+    except json.JSONDecodeError:
+        parsed, _ = parse_partial_json(response_text)
+    if not isinstance(parsed, dict):
+        return {}
+    documents = parsed.get("documents", parsed)
+    return documents if isinstance(documents, dict) else {}
+
+
+_ID_PATTERN = re.compile(r'<document id="([^"]+)">')
+
+
+def document_ids(prompt: str) -> List[str]:
+    """プロンプトに含まれる文書ID（フェイクサーバーでの応答作成に使用）"""
+    return _ID_PATTERN.findall(prompt)
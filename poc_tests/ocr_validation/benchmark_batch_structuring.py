@@ -0,0 +1,106 @@
+"""
+複数文書の一括構造化ベンチマーク
+1文書ずつ Gemini に問い合わせる従来方式と、複数文書を1回の呼び出しにまとめる一括方式で
+文書/秒・文書あたりのトークン数・呼び出し回数を比較する
+
+使用例:
+    python benchmark_batch_structuring.py --fake_server --documents 40 --latency_ms 800 --output_token_ms 4
+    python benchmark_batch_structuring.py --documents 20 --max_documents 5     # 実APIで実行（GOOGLE_API_KEY が必要）
+"""
+
+import os
+import json
+import time
+import argparse
+from typing import Callable, Dict, List
+
+from ocr_service_apikey import OCRServiceAPIKey
+from fake_google_server import SAMPLE_DEED_TEXT, start_fake_server
+from http_client import GEMINI_REST_MODEL
+
+
+def build_documents(count: int) -> List[str]:
+    """文書ごとに地番・受付番号を変えたサンプル謄本テキスト"""
+    return [
+        SAMPLE_DEED_TEXT.replace("地番: 1番1", f"地番: {index + 1}番1").replace("第5678号", f"第{5678 + index}号")
+        for index in range(count)
+    ]
+
+
+def run_mode(service: OCRServiceAPIKey, label: str, call: Callable[[], List[Dict]], documents: int) -> Dict:
+    before = service.usage_log.summary()
+    start = time.perf_counter()
+    results = call()
+    elapsed = time.perf_counter() - start
+    after = service.usage_log.summary()
+
+    tokens_in = after["tokens_in"] - before["tokens_in"]
+    tokens_out = after["tokens_out"] - before["tokens_out"]
+    return {
+        "mode": label,
+        "documents": documents,
+        "succeeded": sum(1 for result in results if result.get("extracted_data") and "error" not in result),
+        "gemini_calls": after["calls"] - before["calls"],
+        "elapsed_seconds": elapsed,
+        "documents_per_second": documents / elapsed,
+        "tokens_in_per_document": tokens_in / documents,
+        "tokens_out_per_document": tokens_out / documents,
+    }
+
+
+def print_report(results: List[Dict]):
+    print("\n=== 一括構造化ベンチマーク ===")
+    header = f"{'mode':<8}{'成功':>8}{'呼び出し':>10}{'文書/秒':>10}{'入力tok/文書':>14}{'出力tok/文書':>14}"
+    print(header)
+    print("-" * (len(header) + 8))
+    for r in results:
+        print(f"{r['mode']:<8}{r['succeeded']:>5}/{r['documents']:<3}{r['gemini_calls']:>8}"
+              f"{r['documents_per_second']:>10.2f}{r['tokens_in_per_document']:>14.0f}{r['tokens_out_per_document']:>14.0f}")
+    if len(results) == 2 and results[0]["documents_per_second"]:
+        print(f"\n一括方式のスループット: 従来方式の {results[1]['documents_per_second'] / results[0]['documents_per_second']:.2f}倍")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="複数文書の一括構造化ベンチマーク（1文書ずつ vs 一括）")
+    parser.add_argument("--documents", type=int, default=40, help="文書数")
+    parser.add_argument("--max_documents", type=int, help="1バッチの最大文書数（省略時は GEMINI_BATCH_MAX_DOCUMENTS）")
+    parser.add_argument("--fake_server", action="store_true", help="フェイクサーバーを起動してGeminiを模擬")
+    parser.add_argument("--latency_ms", type=float, default=800.0, help="フェイクサーバーの呼び出しごとの遅延(ms)")
+    parser.add_argument("--output_token_ms", type=float, default=4.0, help="フェイクサーバーの出力トークンあたりの生成時間(ms)")
+    parser.add_argument("--output", help="結果出力JSONファイルパス")
+    args = parser.parse_args()
+
+    server = None
+    if args.fake_server:
+        os.environ.setdefault("GOOGLE_API_KEY", "dummy")
+        server = start_fake_server(latency_ms=args.latency_ms, output_token_ms=args.output_token_ms)
+
+    # キャッシュが効くと比較にならないため無効化（ルール抽出は両方式とも使わず全項目を問い合わせる）
+    service = OCRServiceAPIKey(use_cache=False, use_structuring_cache=False, use_streaming=False)
+    if server:
+        service.gemini_endpoint = f"{server.base_url}/v1beta/models/{GEMINI_REST_MODEL}:generateContent?key=dummy"
+    if args.max_documents:
+        service.batch_sizer.max_documents = args.max_documents
+
+    texts = build_documents(args.documents)
+    try:
+        results = [
+            run_mode(service, "single", lambda: [service.structure_data_with_gemini_api(text) for text in texts],
+                     args.documents),
+            run_mode(service, "batch", lambda: service.structure_data_with_gemini_api_batch(texts), args.documents),
+        ]
+    finally:
+        if server:
+            server.shutdown()
+            server.server_close()
+
+    print_report(results)
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(results, f, ensure_ascii=False, indent=2)
+        print(f"\n結果をファイルに出力しました: {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,241 @@
+"""
+項目抽出ベンチマーク
+全項目を Gemini に問い合わせる従来方式と、ルールベース抽出＋不足項目のみ Gemini に問い合わせる方式で
+項目ごとの正解率・レイテンシ・プロンプト長（トークン量の目安）を比較する
+
+使用例:
+    python benchmark_field_extraction.py --fake_server --latency_ms 800
+    python benchmark_field_extraction.py --cases cases.json --iterations 5
+    （cases.json: [{"name": ..., "text": OCRテキスト, "expected": {項目: 正解値}}]）
+"""
+
+import os
+import json
+import time
+import argparse
+import statistics
+import timeit
+from typing import Dict, List
+
+from config import TARGET_FIELDS
+from ocr_service_apikey import OCRServiceAPIKey
+from fake_google_server import SAMPLE_DEED_TEXT, SAMPLE_STRUCTURED_DATA, start_fake_server
+from http_client import GEMINI_REST_MODEL
+from structuring_cache import normalize_ocr_text
+from prompt_compaction import estimate_tokens
+
+# 所有権保存・所有権移転の2件の登記がある甲区と、抵当権の乙区（甲区の項目は最新の登記が正解）
+MULTI_ENTRY_DEED_TEXT = """表 題 部 （土地の表示）
+所在 東京都新宿区西新宿二丁目
+地番 1番1
+地目 宅地
+地積 500.00平方メートル
+権 利 部 （甲 区） （所有権に関する事項）
+順位番号 1
+登記の目的 所有権保存
+受付年月日・受付番号 平成20年3月15日 第5678号
+所有者 東京都新宿区西新宿一丁目1番1号
+田中太郎
+順位番号 2
+登記の目的 所有権移転
+受付年月日・受付番号 令和3年4月1日 第1234号
+原因 令和3年4月1日売買
+所有者 神奈川県横浜市中区本町一丁目2番3号
+山田花子
+権 利 部 （乙 区） （所有権以外の権利に関する事項）
+順位番号 1
+登記の目的 抵当権設定
+受付年月日・受付番号 令和3年4月1日 第1235号
+原因 令和3年4月1日金銭消費貸借同日設定
+"""
+
+# 所有者の行に住所、次の行に氏名が記載されるレイアウト
+OWNER_ADDRESS_DEED_TEXT = """所在: 東京都千代田区丸の内一丁目
+地番: 2番3
+地目: 宅地
+地積: 320.15平方メートル
+権利部（甲区）
+登記の目的: 所有権移転
+受付年月日・受付番号: 令和2年7月10日 第4321号
+原因: 令和2年7月1日相続
+所有者 東京都新宿区西新宿一丁目1番1号
+田中太郎
+"""
+
+# フェイクサーバーの Gemini は常に SAMPLE_STRUCTURED_DATA を返すため、
+# サンプル以外のケースの「全項目Gemini」の正解率は実際の Gemini で計測する
+DEFAULT_CASES = [
+    {
+        "name": "サンプル謄本（土地）",
+        "text": SAMPLE_DEED_TEXT,
+        "expected": SAMPLE_STRUCTURED_DATA["extracted_data"],
+    },
+    {
+        "name": "甲区に複数の登記（所有権移転）",
+        "text": MULTI_ENTRY_DEED_TEXT,
+        "expected": {
+            "不動産の表示": "東京都新宿区西新宿二丁目 1番1",
+            "所在": "東京都新宿区西新宿二丁目",
+            "地番": "1番1",
+            "地目": "宅地",
+            "地積": "500.00平方メートル",
+            "所有者の氏名又は名称": "山田花子",
+            "住所": "神奈川県横浜市中区本町一丁目2番3号",
+            "登記の目的": "所有権移転",
+            "受付年月日・受付番号": "令和3年4月1日 第1234号",
+            "登記原因": "令和3年4月1日売買",
+            "権利者その他の事項": "原因 令和3年4月1日売買 所有者 神奈川県横浜市中区本町一丁目2番3号 山田花子",
+        },
+    },
+    {
+        "name": "所有者の行に住所（次の行に氏名）",
+        "text": OWNER_ADDRESS_DEED_TEXT,
+        "expected": {
+            "不動産の表示": "東京都千代田区丸の内一丁目 2番3",
+            "所在": "東京都千代田区丸の内一丁目",
+            "地番": "2番3",
+            "地目": "宅地",
+            "地積": "320.15平方メートル",
+            "所有者の氏名又は名称": "田中太郎",
+            "住所": "東京都新宿区西新宿一丁目1番1号",
+            "登記の目的": "所有権移転",
+            "受付年月日・受付番号": "令和2年7月10日 第4321号",
+            "登記原因": "令和2年7月1日相続",
+            "権利者その他の事項": "原因 令和2年7月1日相続 所有者 東京都新宿区西新宿一丁目1番1号 田中太郎",
+        },
+    },
+]
+
+
+def _canonical(value) -> str:
+    return normalize_ocr_text(str(value or "")).replace(" ", "").replace("\n", "")
+
+
+def field_accuracy(extracted_data: Dict, expected: Dict) -> float:
+    """
+    TARGET_FIELDS のうち正解値と一致した項目の割合（空文字同士も一致とみなす）
+    """
+    correct = sum(
+        1 for field in TARGET_FIELDS
+        if _canonical(extracted_data.get(field)) == _canonical(expected.get(field))
+    )
+    return correct / len(TARGET_FIELDS)
+
+
+def _measure(call, iterations: int):
+    latencies: List[float] = []
+    result: Dict = {}
+    for _ in range(iterations):
+        start = time.perf_counter()
+        result = call()
+        latencies.append((time.perf_counter() - start) * 1000)
+    return result, latencies
+
+
+def run_case(service: OCRServiceAPIKey, case: Dict, iterations: int) -> Dict:
+    """
+    1ケースについて従来方式とハイブリッド方式を比較
+    """
+    text = case["text"]
+    expected = case["expected"]
+
+    # ルールベース抽出のみ
+    rule_result = service.field_extractor.extract(text, TARGET_FIELDS)
+    missing = service.field_extractor.missing_fields(rule_result, TARGET_FIELDS)
+    rule_us = timeit.timeit(lambda: service.field_extractor.extract(text, TARGET_FIELDS), number=1000) * 1000
+
+    llm_result, llm_latencies = _measure(lambda: service.structure_data_with_gemini_api(text), iterations)
+    hybrid_result, hybrid_latencies = _measure(lambda: service.structure_data_with_gemini_api_hybrid(text), iterations)
+
+    return {
+        "name": case.get("name", ""),
+        "rule_extraction": {
+            "fields_filled": len(TARGET_FIELDS) - len(missing),
+            "missing_fields": missing,
+            "latency_us": rule_us,
+            "accuracy_on_filled": (
+                sum(
+                    1 for field in rule_result["extracted_data"]
+                    if field not in missing
+                    and _canonical(rule_result["extracted_data"][field]) == _canonical(expected.get(field))
+                ) / (len(TARGET_FIELDS) - len(missing))
+                if len(missing) < len(TARGET_FIELDS) else 0.0
+            ),
+        },
+        "all_llm": {
+            "accuracy": field_accuracy(llm_result.get("extracted_data", {}), expected),
+            "p50_ms": statistics.median(llm_latencies),
+            "prompt_chars": len(service._create_extraction_prompt(text)),
+            "prompt_tokens": estimate_tokens(service._create_extraction_prompt(text)),
+            "gemini_calls": 1,
+        },
+        "hybrid": {
+            "accuracy": field_accuracy(hybrid_result.get("extracted_data", {}), expected),
+            "p50_ms": statistics.median(hybrid_latencies),
+            "prompt_chars": len(service._create_extraction_prompt(text, missing)) if missing else 0,
+            "prompt_tokens": estimate_tokens(service._create_extraction_prompt(text, missing)) if missing else 0,
+            "gemini_calls": 1 if missing else 0,
+        },
+    }
+
+
+def print_report(results: List[Dict]):
+    print("\n=== 項目抽出ベンチマーク ===")
+    for r in results:
+        rule = r["rule_extraction"]
+        print(f"\n{r['name']}")
+        print(f"  ルール抽出: {rule['fields_filled']}/{len(TARGET_FIELDS)}項目, "
+              f"{rule['latency_us']:.1f}µs, 抽出項目の正解率 {rule['accuracy_on_filled']:.1%}")
+        if rule["missing_fields"]:
+            print(f"  Gemini問い合わせ項目: {', '.join(rule['missing_fields'])}")
+        for label, key in (("全項目Gemini", "all_llm"), ("ルール＋Gemini", "hybrid")):
+            m = r[key]
+            print(f"  {label}: 正解率 {m['accuracy']:.1%}, p50 {m['p50_ms']:.1f}ms, "
+                  f"プロンプト {m['prompt_chars']}文字（推定 {m['prompt_tokens']} tokens）, "
+                  f"Gemini呼び出し {m['gemini_calls']}回")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="項目抽出ベンチマーク（ルールベース vs 全項目Gemini）")
+    parser.add_argument("--cases", help="テストケースJSONファイル（省略時は組み込みサンプル）")
+    parser.add_argument("--iterations", type=int, default=3, help="方式ごとの計測回数")
+    parser.add_argument("--fake_server", action="store_true", help="フェイクサーバーを起動してGeminiを模擬")
+    parser.add_argument("--latency_ms", type=float, default=800.0, help="フェイクサーバーの応答遅延(ms)")
+    parser.add_argument("--output", help="結果出力JSONファイルパス")
+    args = parser.parse_args()
+
+    cases = DEFAULT_CASES
+    if args.cases:
+        with open(args.cases, 'r', encoding='utf-8') as f:
+            cases = json.load(f)
+
+    server = None
+    if args.fake_server:
+        os.environ.setdefault("GOOGLE_API_KEY", "dummy")
+        server = start_fake_server(latency_ms=args.latency_ms)
+
+    # キャッシュが効くと比較にならないため無効化
+    service = OCRServiceAPIKey(use_cache=False, use_structuring_cache=False)
+    if server:
+        service.gemini_endpoint = f"{server.base_url}/v1beta/models/{GEMINI_REST_MODEL}:generateContent?key=dummy"
+
+    try:
+        results = [run_case(service, case, args.iterations) for case in cases]
+    finally:
+        if server:
+            server.shutdown()
+            server.server_close()
+
+    print_report(results)
+    usage = service.usage_log.summary()
+    print(f"\nGemini使用量: {usage['calls']}回, 入力 {usage['tokens_in']} tokens, 出力 {usage['tokens_out']} tokens, "
+          f"p50 {usage['p50_ms']:.0f}ms")
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(results, f, ensure_ascii=False, indent=2)
+        print(f"\n結果をファイルに出力しました: {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,126 @@
+"""
+HTTPクライアントベンチマーク
+ローカルのフェイクサーバーに対し、毎回接続する urllib と共通クライアント（Keep-Alive）を比較する
+"""
+
+import json
+import time
+import argparse
+import statistics
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, List
+
+from fake_google_server import start_fake_server
+from http_client import PooledHTTPClient, create_client
+
+SAMPLE_PAYLOAD = {
+    "contents": [{"parts": [{"text": "これはベンチマークです。"}]}],
+    "generationConfig": {"temperature": 0.1, "maxOutputTokens": 100},
+}
+
+
+def _urllib_post(url: str):
+    data = json.dumps(SAMPLE_PAYLOAD).encode('utf-8')
+    req = urllib.request.Request(url, data=data)
+    req.add_header('Content-Type', 'application/json')
+    with urllib.request.urlopen(req, timeout=30) as response:
+        json.loads(response.read().decode('utf-8'))
+
+
+def _run(label: str, send: Callable[[], None], requests_count: int, concurrency: int) -> Dict:
+    latencies: List[float] = []
+
+    def timed_send():
+        start = time.perf_counter()
+        send()
+        latencies.append((time.perf_counter() - start) * 1000)
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        for future in [pool.submit(timed_send) for _ in range(requests_count)]:
+            future.result()
+    elapsed = time.perf_counter() - start
+
+    latencies.sort()
+    return {
+        "client": label,
+        "requests": requests_count,
+        "requests_per_second": requests_count / elapsed,
+        "p50_ms": statistics.median(latencies),
+        "p95_ms": latencies[int(len(latencies) * 0.95) - 1],
+    }
+
+
+def run_benchmark(requests_count: int, concurrency: int, latency_ms: float) -> List[Dict]:
+    """
+    各クライアントで同じリクエストを送信して比較
+    """
+    server = start_fake_server(latency_ms=latency_ms)
+    url = f"{server.base_url}/v1beta/models/gemini-1.5-flash:generateContent?key=dummy"
+    results = []
+
+    try:
+        connections_before = server.connection_count
+        result = _run("urllib (接続毎回)", lambda: _urllib_post(url), requests_count, concurrency)
+        result["server_connections"] = server.connection_count - connections_before
+        results.append(result)
+
+        clients = [("共通クライアント HTTP/1.1", PooledHTTPClient(pool_size=concurrency))]
+        http2_client = create_client(http2=True, pool_size=concurrency)
+        if not isinstance(http2_client, PooledHTTPClient):
+            clients.append(("共通クライアント httpx", http2_client))
+
+        for label, client in clients:
+            connections_before = server.connection_count
+            result = _run(label, lambda: client.post(url, json=SAMPLE_PAYLOAD).raise_for_status(),
+                          requests_count, concurrency)
+            result["server_connections"] = server.connection_count - connections_before
+            result["client_stats"] = client.stats.as_dict()
+            results.append(result)
+            client.close()
+    finally:
+        server.shutdown()
+        server.server_close()
+
+    return results
+
+
+def print_report(results: List[Dict]):
+    print("\n=== HTTPクライアントベンチマーク ===")
+    for r in results:
+        print(f"\n{r['client']}")
+        print(f"  スループット: {r['requests_per_second']:.1f} req/s")
+        print(f"  p50: {r['p50_ms']:.2f}ms / p95: {r['p95_ms']:.2f}ms")
+        print(f"  サーバー側接続数: {r['server_connections']}")
+        stats = r.get("client_stats")
+        if stats:
+            print(f"  接続再利用率: {stats['reuse_rate']:.1%} "
+                  f"(新規 {stats['new_connections']} / 再利用 {stats['reused_connections']})")
+            if stats["dns_ms_total"] is None:
+                print(f"  TCP（DNS解決を含む）: {stats['tcp_connect_ms_total']:.1f}ms "
+                      f"/ TLS: {stats['tls_ms_total']:.1f}ms (合計)")
+            else:
+                print(f"  DNS: {stats['dns_ms_total']:.1f}ms / TCP: {stats['tcp_connect_ms_total']:.1f}ms "
+                      f"/ TLS: {stats['tls_ms_total']:.1f}ms (合計)")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="HTTPクライアントベンチマーク")
+    parser.add_argument("--requests", type=int, default=500, help="総リクエスト数")
+    parser.add_argument("--concurrency", type=int, default=8, help="同時リクエスト数")
+    parser.add_argument("--latency_ms", type=float, default=0.0, help="フェイクサーバーの応答遅延(ms)")
+    parser.add_argument("--output", help="結果出力JSONファイルパス")
+    args = parser.parse_args()
+
+    results = run_benchmark(args.requests, args.concurrency, args.latency_ms)
+    print_report(results)
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(results, f, ensure_ascii=False, indent=2)
+        print(f"\n結果をファイルに出力しました: {args.output}")
+
+
+if __name__ == "__main__":
+    main()
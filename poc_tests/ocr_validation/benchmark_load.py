@@ -0,0 +1,402 @@
+"""
+OCRサービスの負荷ベンチマーク（ローカルのフェイクサーバーに対して一定の到着レートで実行）
+Vision API / Gemini をフェイクサーバー（fake_google_server.py）で模擬し、ワーカー数ごとに
+スループット・レイテンシ（p50/p95/p99）・CPU使用率・RSS を計測する
+
+- 到着はワーカーの空きを待たない一定間隔（オープンループ）。レイテンシは予定到着時刻から完了までで、キュー待ちを含む
+- ワーカー数ごとに新しいプロセスで実行し、CPU時間・RSS が前の実行の影響を受けないようにする
+- 結果はコミットごとに比較できる JSON で出力し、--baseline で前回の結果と比較して回帰を検出する
+- --target sdk は OCRService（Vision/Vertex AI SDK）を REST トランスポートでフェイクサーバーに接続する
+  （REST トランスポート対応版の google-cloud-vision / google-cloud-aiplatform が必要）
+
+使用例:
+    python benchmark_load.py --workers 1,2,4,8 --rate 20 --duration 30 --output load.json
+    python benchmark_load.py --workload structuring --gemini_latency_ms 800 --latency_distribution lognormal --latency_spread 0.4
+    python benchmark_load.py --workload pdf --pdf sample_documents/登記簿サンプル.pdf --rate 1 --duration 60
+    python benchmark_load.py --baseline load_main.json --output load.json     # 前回の結果と比較（回帰がある場合は終了コード1）
+"""
+
+import os
+import sys
+import json
+import time
+import logging
+import argparse
+import platform
+import threading
+import subprocess
+import multiprocessing
+from datetime import datetime, timezone
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Callable, Dict, List, Optional, Tuple
+
+import cv2
+import numpy as np
+
+from fake_google_server import SAMPLE_DEED_TEXT, start_fake_server, add_latency_arguments, latency_options
+from tracing import percentile
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+BENCHMARK_NAME = "ocr_load"
+WORKLOADS = ("page", "structuring", "pdf")
+
+
+def make_page_image(width: int, height: int, density: float, seed: int = 0) -> bytes:
+    """
+    文字の代わりに黒画素を density の割合で散らした白地のページ画像（PNG）
+    画素の割合で PNG のサイズ（送信ペイロード）と前処理の負荷を調整する
+    """
+    generator = np.random.default_rng(seed)
+    page = np.full((height, width), 255, dtype=np.uint8)
+    page[generator.random((height, width)) < density] = 0
+    ok, encoded = cv2.imencode(".png", page)
+    if not ok:
+        raise ValueError("ページ画像のエンコードに失敗しました")
+    return encoded.tobytes()
+
+
+def _rss_bytes() -> Optional[int]:
+    """現在の RSS（/proc のない環境では None）"""
+    try:
+        with open("/proc/self/statm", encoding="ascii") as statm:
+            return int(statm.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, AttributeError):
+        return None
+
+
+class _ResourceSampler(threading.Thread):
+    """実行中の RSS を一定間隔で記録"""
+
+    def __init__(self, interval: float = 0.1):
+        super().__init__(daemon=True)
+        self.interval = interval
+        self.samples: List[int] = []
+        self._stop_event = threading.Event()
+
+    def run(self):
+        while not self._stop_event.is_set():
+            rss = _rss_bytes()
+            if rss is not None:
+                self.samples.append(rss)
+            self._stop_event.wait(self.interval)
+
+    def stop(self) -> Dict[str, float]:
+        self._stop_event.set()
+        self.join()
+        if not self.samples and resource is not None:
+            # /proc がない場合はピークのみ（macOS はバイト、Linux はKB単位）
+            peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+            peak_bytes = peak if sys.platform == "darwin" else peak * 1024
+            return {"peak": peak_bytes / 2**20, "mean": peak_bytes / 2**20}
+        if not self.samples:
+            return {"peak": 0.0, "mean": 0.0}
+        return {"peak": max(self.samples) / 2**20, "mean": sum(self.samples) / len(self.samples) / 2**20}
+
+
+def _children_cpu_seconds() -> float:
+    """終了済みの子プロセス（レンダリング・前処理ワーカー）のCPU時間"""
+    if resource is None:
+        return 0.0
+    usage = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return usage.ru_utime + usage.ru_stime
+
+
+def create_service(config: Dict):
+    """ベンチマーク対象のサービスをフェイクサーバーに向けて作成（キャッシュ・クォータ制御は無効）"""
+    base_url = config["base_url"]
+    if config["target"] == "apikey":
+        from ocr_service_apikey import OCRServiceAPIKey
+        from http_client import GEMINI_REST_MODEL
+
+        service = OCRServiceAPIKey(
+            preprocess_profile=config["preprocess_profile"], use_cache=False, use_structuring_cache=False,
+            use_streaming=False, use_quota=False
+        )
+        service.vision_endpoint = f"{base_url}/v1/images:annotate?key=dummy"
+        service.gemini_endpoint = f"{base_url}/v1beta/models/{GEMINI_REST_MODEL}:generateContent?key=dummy"
+        return service
+
+    from google.auth.credentials import AnonymousCredentials
+    from google.cloud import vision
+    import vertexai
+    from vertexai.generative_models import GenerativeModel
+    from config import GEMINI_MODEL, VERTEX_AI_LOCATION
+    from ocr_service import OCRService
+
+    vision_client = vision.ImageAnnotatorClient(
+        transport="rest", credentials=AnonymousCredentials(), client_options={"api_endpoint": base_url}
+    )
+    vertexai.init(
+        project="benchmark", location=VERTEX_AI_LOCATION, credentials=AnonymousCredentials(),
+        api_endpoint=base_url, api_transport="rest"
+    )
+    return OCRService(
+        preprocess_profile=config["preprocess_profile"], use_cache=False, use_structuring_cache=False,
+        vision_client=vision_client, gemini_model=GenerativeModel(GEMINI_MODEL)
+    )
+
+
+def make_job(service, config: Dict) -> Callable[[], bool]:
+    """1リクエスト分の処理（成功した場合 True）"""
+    workload = config["workload"]
+    apikey = config["target"] == "apikey"
+    if workload == "page":
+        image = make_page_image(config["image_width"], config["image_height"], config["image_density"])
+        extract = service.extract_text_with_vision_api if apikey else service.extract_text_with_vision
+        return lambda: bool(extract(image)[0])
+    if workload == "structuring":
+        # ルール抽出を経由せず、全項目を Gemini に問い合わせる
+        structure = service.structure_data_with_gemini_api if apikey else service.structure_data_with_gemini
+        return lambda: "error" not in structure(SAMPLE_DEED_TEXT)
+    pdf_path = config["pdf"]
+    return lambda: bool(service.process_pdf(pdf_path).get("success"))
+
+
+def _timed(job: Callable[[], bool], scheduled: float) -> Tuple[bool, float, float]:
+    try:
+        ok = job()
+    except Exception as e:
+        logging.getLogger(__name__).debug(f"リクエストエラー: {e}")
+        ok = False
+    finished = time.perf_counter()
+    return ok, (finished - scheduled) * 1000, finished
+
+
+def run_load(config: Dict) -> Dict:
+    """
+    1つのワーカー数での負荷実行（ワーカー数ごとに新しいプロセスで呼ばれる）
+    rate 件/秒の間隔で duration 秒分のリクエストを投入し、全件の完了を待つ
+    """
+    logging.getLogger().setLevel(logging.WARNING)
+    service = create_service(config)
+    job = make_job(service, config)
+    for _ in range(config["warmup"]):
+        job()
+
+    requests = max(1, int(config["rate"] * config["duration"]))
+    interval = 1 / config["rate"]
+    sampler = _ResourceSampler()
+    sampler.start()
+    cpu_start = time.process_time()
+    children_cpu_start = _children_cpu_seconds()
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=config["workers"]) as executor:
+        futures = []
+        for index in range(requests):
+            scheduled = start + index * interval
+            delay = scheduled - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+            futures.append(executor.submit(_timed, job, scheduled))
+        outcomes = [future.result() for future in futures]
+    elapsed = max(finished for _, _, finished in outcomes) - start
+
+    cpu_seconds = time.process_time() - cpu_start
+    rss_mb = sampler.stop()
+    service.shutdown()
+    children_cpu_seconds = _children_cpu_seconds() - children_cpu_start
+
+    latencies = sorted(latency for _, latency, _ in outcomes)
+    succeeded = sum(1 for ok, _, _ in outcomes if ok)
+    return {
+        "workers": config["workers"],
+        "requests": requests,
+        "succeeded": succeeded,
+        "errors": requests - succeeded,
+        "offered_rps": config["rate"],
+        "throughput_rps": succeeded / elapsed,
+        "elapsed_seconds": elapsed,
+        "latency_ms": {
+            "mean": sum(latencies) / len(latencies),
+            "p50": percentile(latencies, 50),
+            "p95": percentile(latencies, 95),
+            "p99": percentile(latencies, 99),
+            "max": latencies[-1],
+        },
+        "cpu_seconds": cpu_seconds,
+        "children_cpu_seconds": children_cpu_seconds,
+        # 1.0 で1コア分
+        "cpu_utilization": (cpu_seconds + children_cpu_seconds) / elapsed,
+        "rss_mb": rss_mb,
+    }
+
+
+def run_in_process(config: Dict) -> Dict:
+    """run_load を新しいプロセス（spawn）で実行"""
+    context = multiprocessing.get_context("spawn")
+    with ProcessPoolExecutor(max_workers=1, mp_context=context) as executor:
+        return executor.submit(run_load, config).result()
+
+
+def _git_commit() -> Optional[str]:
+    try:
+        completed = subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True,
+            cwd=os.path.dirname(os.path.abspath(__file__))
+        )
+        return completed.stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare_results(baseline: Dict, current: Dict, threshold: float) -> List[str]:
+    """
+    ワーカー数ごとに前回の結果と比較して表示し、回帰（スループット低下・p95/p99 悪化が threshold を超える）を返す
+    """
+    if baseline.get("config") != current.get("config"):
+        print("\n※ 前回と実行条件（config）が異なるため、差分は参考値です")
+    baseline_runs = {run["workers"]: run for run in baseline.get("runs", [])}
+    regressions: List[str] = []
+    print(f"\n=== 前回との比較（{baseline.get('meta', {}).get('commit')} → {current['meta']['commit']}） ===")
+    print(f"{'workers':>8}{'スループット':>14}{'p95':>12}{'p99':>12}")
+    for run in current["runs"]:
+        previous = baseline_runs.get(run["workers"])
+        if previous is None:
+            continue
+        changes = {
+            "throughput_rps": (run["throughput_rps"] / previous["throughput_rps"] - 1) if previous["throughput_rps"] else 0.0,
+            "p95": run["latency_ms"]["p95"] / previous["latency_ms"]["p95"] - 1 if previous["latency_ms"]["p95"] else 0.0,
+            "p99": run["latency_ms"]["p99"] / previous["latency_ms"]["p99"] - 1 if previous["latency_ms"]["p99"] else 0.0,
+        }
+        print(f"{run['workers']:>8}{changes['throughput_rps']:>+14.1%}{changes['p95']:>+12.1%}{changes['p99']:>+12.1%}")
+        if changes["throughput_rps"] < -threshold:
+            regressions.append(f"workers={run['workers']}: スループット {changes['throughput_rps']:+.1%}")
+        for key in ("p95", "p99"):
+            if changes[key] > threshold:
+                regressions.append(f"workers={run['workers']}: {key} {changes[key]:+.1%}")
+    return regressions
+
+
+def print_report(result: Dict):
+    config = result["config"]
+    print(f"\n=== 負荷ベンチマーク（{config['target']} / {config['workload']}, {config['rate']}件/秒 × {config['duration']}秒） ===")
+    header = (f"{'workers':>8}{'成功':>10}{'件/秒':>8}{'p50':>10}{'p95':>10}{'p99':>10}"
+              f"{'CPU':>8}{'RSS peak':>10}{'上流req':>8}")
+    print(header)
+    print("-" * (len(header) + 8))
+    for run in result["runs"]:
+        latency = run["latency_ms"]
+        print(f"{run['workers']:>8}{run['succeeded']:>6}/{run['requests']:<4}{run['throughput_rps']:>8.1f}"
+              f"{latency['p50']:>8.0f}ms{latency['p95']:>8.0f}ms{latency['p99']:>8.0f}ms"
+              f"{run['cpu_utilization']:>8.2f}{run['rss_mb']['peak']:>8.0f}MB{sum(run['server']['requests'].values()):>8}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="OCRサービスの負荷ベンチマーク（フェイクサーバー使用）")
+    parser.add_argument("--target", choices=("apikey", "sdk"), default="apikey",
+                        help="apikey: OCRServiceAPIKey（REST）, sdk: OCRService（Vision/Vertex AI SDK）")
+    parser.add_argument("--workload", choices=WORKLOADS, default="page",
+                        help="page: 1ページのOCR, structuring: Gemini構造化, pdf: process_pdf")
+    parser.add_argument("--pdf", help="workload=pdf で処理するPDF")
+    parser.add_argument("--workers", default="1,2,4,8", help="ワーカー数（カンマ区切りで複数指定）")
+    parser.add_argument("--rate", type=float, default=10.0, help="到着レート（件/秒）")
+    parser.add_argument("--duration", type=float, default=20.0, help="投入する時間（秒）")
+    parser.add_argument("--warmup", type=int, default=2, help="計測前に実行する件数")
+    parser.add_argument("--preprocess_profile", default="fast", help="前処理プロファイル")
+    parser.add_argument("--image_width", type=int, default=1240, help="page の画像の幅（px）")
+    parser.add_argument("--image_height", type=int, default=1754, help="page の画像の高さ（px）")
+    parser.add_argument("--image_density", type=float, default=0.05, help="page の画像の黒画素の割合（PNGサイズの調整）")
+    parser.add_argument("--latency_ms", type=float, default=300.0, help="フェイクサーバーの基本遅延(ms)")
+    add_latency_arguments(parser)
+    parser.add_argument("--error_rate", type=float, default=0.0, help="エラー応答の割合")
+    parser.add_argument("--error_status", type=int, default=503, help="エラー応答のステータス")
+    parser.add_argument("--slow_rate", type=float, default=0.0, help="遅延応答の割合")
+    parser.add_argument("--slow_ms", type=float, default=0.0, help="遅延応答の追加遅延(ms)")
+    parser.add_argument("--response_text_repeat", type=int, default=1, help="Vision 応答のテキストを繰り返す回数")
+    parser.add_argument("--seed", type=int, default=0, help="遅延・障害注入の乱数シード")
+    parser.add_argument("--output", help="結果出力JSONファイルパス")
+    parser.add_argument("--baseline", help="比較する前回の結果JSON")
+    parser.add_argument("--regression_threshold", type=float, default=0.1, help="回帰とみなす悪化の割合")
+    args = parser.parse_args()
+
+    if args.workload == "pdf" and not args.pdf:
+        parser.error("--workload pdf には --pdf が必要です")
+
+    # フェイクサーバーはCPU時間に含めないよう、ベンチマーク対象とは別のプロセス（このプロセス）で動かす
+    os.environ.setdefault("GOOGLE_API_KEY", "dummy")
+    server = start_fake_server(
+        latency_ms=args.latency_ms, error_rate=args.error_rate, error_status=args.error_status,
+        slow_rate=args.slow_rate, slow_ms=args.slow_ms, seed=args.seed,
+        response_text_repeat=args.response_text_repeat, **latency_options(args)
+    )
+    config = {
+        "target": args.target,
+        "workload": args.workload,
+        "pdf": args.pdf,
+        "rate": args.rate,
+        "duration": args.duration,
+        "warmup": args.warmup,
+        "preprocess_profile": args.preprocess_profile,
+        "image_width": args.image_width,
+        "image_height": args.image_height,
+        "image_density": args.image_density,
+        "server": {
+            "latency_ms": args.latency_ms,
+            "vision_latency_ms": args.vision_latency_ms,
+            "gemini_latency_ms": args.gemini_latency_ms,
+            "latency_distribution": args.latency_distribution,
+            "latency_spread": args.latency_spread,
+            "error_rate": args.error_rate,
+            "error_status": args.error_status,
+            "slow_rate": args.slow_rate,
+            "slow_ms": args.slow_ms,
+            "response_text_repeat": args.response_text_repeat,
+            "seed": args.seed,
+        },
+    }
+
+    runs = []
+    try:
+        for workers in (int(value) for value in args.workers.split(",")):
+            requests_before = dict(server.request_counts)
+            errors_before = server.injected_errors
+            run = run_in_process(dict(config, workers=workers, base_url=server.base_url))
+            run["server"] = {
+                "requests": {
+                    endpoint: count - requests_before.get(endpoint, 0)
+                    for endpoint, count in server.request_counts.items()
+                    if count - requests_before.get(endpoint, 0)
+                },
+                "injected_errors": server.injected_errors - errors_before,
+            }
+            runs.append(run)
+    finally:
+        server.shutdown()
+        server.server_close()
+
+    result = {
+        "benchmark": BENCHMARK_NAME,
+        "meta": {
+            "commit": _git_commit(),
+            "timestamp": datetime.now(timezone.utc).isoformat(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+        },
+        "config": config,
+        "runs": runs,
+    }
+    print_report(result)
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(result, f, ensure_ascii=False, indent=2)
+        print(f"\n結果をファイルに出力しました: {args.output}")
+
+    if args.baseline:
+        with open(args.baseline, encoding='utf-8') as f:
+            regressions = compare_results(json.load(f), result, args.regression_threshold)
+        if regressions:
+            print("\n回帰を検出しました:")
+            for regression in regressions:
+                print(f"  - {regression}")
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
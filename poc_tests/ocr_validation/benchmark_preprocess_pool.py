@@ -0,0 +1,107 @@
+"""
+前処理プロセスプールのスループットベンチマーク
+ワーカー数 1/2/4/8 について、スレッドプール（ImagePreprocessor）と
+プロセスプール（PreprocessPool: 共有メモリ受け渡し）のページ/秒を比較する
+
+使用例:
+    python benchmark_preprocess_pool.py --pages 32
+    python benchmark_preprocess_pool.py --pdf_path sample_documents/登記簿サンプル.pdf --profile quality
+"""
+
+import json
+import time
+import argparse
+import statistics
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Callable, Dict, List
+
+from benchmark_preprocessing import build_page_image
+from image_preprocessing import ImagePreprocessor, PREPROCESS_PROFILES, DEFAULT_PREPROCESS_PROFILE
+from preprocess_pool import PreprocessPool, PREPROCESS_MAX_TASKS_PER_CHILD
+
+BENCHMARK_WORKERS = [1, 2, 4, 8]
+
+
+def _run(process: Callable[[bytes], bytes], workers: int, images: List[bytes]) -> Dict:
+    """images を workers 並列で前処理し、スループットとページごとの所要時間を返す"""
+    latencies: List[float] = []
+
+    def timed(image_data: bytes):
+        start = time.perf_counter()
+        process(image_data)
+        latencies.append((time.perf_counter() - start) * 1000)
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        list(executor.map(timed, images))
+    elapsed = time.perf_counter() - start
+    return {
+        "pages_per_second": len(images) / elapsed,
+        "elapsed_seconds": elapsed,
+        "p50_ms": statistics.median(latencies),
+    }
+
+
+def run_benchmark(profile: str, images: List[bytes], max_tasks_per_child: int) -> List[Dict]:
+    results = []
+    preprocessor = ImagePreprocessor(profile)
+    for workers in BENCHMARK_WORKERS:
+        thread_result = _run(preprocessor.process, workers, images)
+
+        pool = PreprocessPool(profile, max_workers=workers, max_tasks_per_child=max_tasks_per_child)
+        try:
+            # ワーカーの起動（spawn）を計測に含めないよう先に1周させる
+            _run(pool.process, workers, images[:workers])
+            process_result = _run(pool.process, workers, images)
+        finally:
+            pool.shutdown()
+
+        results.append({"workers": workers, "threads": thread_result, "processes": process_result})
+    return results
+
+
+def print_report(results: List[Dict], profile: str, pages: int):
+    print(f"\n=== 前処理プールベンチマーク（profile={profile}, {pages}ページ）===")
+    baseline = results[0]["threads"]["pages_per_second"]
+    header = f"{'workers':>8}{'threads p/s':>14}{'processes p/s':>16}{'p50(thr)':>11}{'p50(proc)':>11}{'速度比':>8}"
+    print(header)
+    print("-" * len(header))
+    for r in results:
+        threads, processes = r["threads"], r["processes"]
+        print(f"{r['workers']:>8}{threads['pages_per_second']:>14.2f}{processes['pages_per_second']:>16.2f}"
+              f"{threads['p50_ms']:>9.0f}ms{processes['p50_ms']:>9.0f}ms"
+              f"{processes['pages_per_second'] / baseline:>7.2f}x")
+    print("速度比: プロセスプールのスループット / スレッド1本のスループット")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="前処理プロセスプールのスループットベンチマーク")
+    parser.add_argument("--profile", default=DEFAULT_PREPROCESS_PROFILE,
+                        choices=list(PREPROCESS_PROFILES.keys()), help="前処理プロファイル")
+    parser.add_argument("--pages", type=int, default=32, help="処理するページ数")
+    parser.add_argument("--dpi", type=int, default=300, help="入力ページのDPI")
+    parser.add_argument("--pdf_path", help="入力に使うPDF（省略時は合成ページ）")
+    parser.add_argument("--max_tasks_per_child", type=int, default=PREPROCESS_MAX_TASKS_PER_CHILD,
+                        help="ワーカーを再起動するまでの処理件数")
+    parser.add_argument("--output", help="結果出力JSONファイルパス")
+    args = parser.parse_args()
+
+    if args.pdf_path and not Path(args.pdf_path).is_file():
+        print(f"❌ 無効なパス: {args.pdf_path}")
+        return
+
+    image_data = build_page_image(args.dpi, args.pdf_path)
+    images = [image_data] * args.pages
+
+    results = run_benchmark(args.profile, images, args.max_tasks_per_child)
+    print_report(results, args.profile, args.pages)
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(results, f, ensure_ascii=False, indent=2)
+        print(f"\n結果をファイルに出力しました: {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,151 @@
+"""
+画像前処理ベンチマーク
+DPI（200/300/400）・プロファイルごとにステージ別処理時間とピークRSSを測定する
+"""
+
+import json
+import argparse
+import resource
+import statistics
+import multiprocessing
+from pathlib import Path
+from typing import Dict, List, Optional
+
+import cv2
+import numpy as np
+
+from image_preprocessing import ImagePreprocessor, PREPROCESS_PROFILES
+
+BENCHMARK_DPIS = [200, 300, 400]
+STAGES = ["decode", "denoise", "threshold", "encode"]
+
+# A4サイズ（inch）
+A4_WIDTH_INCH = 8.27
+A4_HEIGHT_INCH = 11.69
+
+
+def build_page_image(dpi: int, pdf_path: Optional[str] = None) -> bytes:
+    """
+    ベンチマーク用のページ画像を作成
+    PDFが指定されていれば1ページ目をレンダリングし、なければA4の合成ページを生成する
+    """
+    if pdf_path:
+        from pdf_rasterizer import render_page
+        return render_page(pdf_path, 0, dpi)
+
+    width = int(A4_WIDTH_INCH * dpi)
+    height = int(A4_HEIGHT_INCH * dpi)
+    page = np.full((height, width), 255, dtype=np.uint8)
+
+    # 罫線と文字列らしいパターンを描画してスキャンノイズを加える
+    line_height = max(20, dpi // 6)
+    for y in range(line_height * 2, height - line_height, line_height):
+        cv2.line(page, (dpi // 2, y), (width - dpi // 2, y), 0, 1)
+        cv2.putText(page, "Shozai Chiban 1-1 Takuchi 500.00m2", (dpi // 2 + 10, y - 8),
+                    cv2.FONT_HERSHEY_SIMPLEX, dpi / 300, 0, 2)
+    rng = np.random.default_rng(0)
+    noise = rng.normal(0, 12, page.shape)
+    page = np.clip(page.astype(np.float32) + noise, 0, 255).astype(np.uint8)
+
+    ok, encoded = cv2.imencode('.png', page)
+    return encoded.tobytes()
+
+
+def _peak_rss_mb() -> float:
+    """
+    プロセスのピークRSS(MB)
+    ru_maxrss は execve を跨いで親の値を引き継ぐため、Linux では VmHWM を優先する
+    """
+    try:
+        with open("/proc/self/status", encoding="ascii") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    # ru_maxrss は Linux では KB 単位
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def _run_case(dpi: int, profile: str, iterations: int, image_data: bytes, queue):
+    """
+    1ケースを専用プロセスで実行（ピークRSSをケースごとに分離するため）
+    """
+    baseline_rss = _peak_rss_mb()
+    preprocessor = ImagePreprocessor(profile)
+
+    samples: Dict[str, List[float]] = {stage: [] for stage in STAGES}
+    for _ in range(iterations):
+        timings: Dict[str, float] = {}
+        preprocessor.process(image_data, timings)
+        for stage in STAGES:
+            samples[stage].append(timings[stage])
+
+    stage_ms = {stage: statistics.median(values) for stage, values in samples.items()}
+    queue.put({
+        "dpi": dpi,
+        "profile": profile,
+        "input_bytes": len(image_data),
+        "stage_ms": stage_ms,
+        "total_ms": sum(stage_ms.values()),
+        "peak_rss_mb": _peak_rss_mb(),
+        "baseline_rss_mb": baseline_rss,
+    })
+
+
+def run_benchmark(profiles: List[str], iterations: int, pdf_path: Optional[str] = None) -> List[Dict]:
+    """
+    全DPI×プロファイルのベンチマークを実行
+    """
+    context = multiprocessing.get_context("spawn")
+    results = []
+    for dpi in BENCHMARK_DPIS:
+        # 入力画像の生成分がピークRSSに混ざらないよう親プロセスで作成して渡す
+        image_data = build_page_image(dpi, pdf_path)
+        for profile in profiles:
+            queue = context.Queue()
+            process = context.Process(target=_run_case, args=(dpi, profile, iterations, image_data, queue))
+            process.start()
+            results.append(queue.get())
+            process.join()
+    return results
+
+
+def print_report(results: List[Dict]):
+    """
+    結果を表形式で表示
+    """
+    print("\n=== 画像前処理ベンチマーク ===")
+    header = f"{'DPI':>4} {'profile':<10}" + "".join(f"{stage:>11}" for stage in STAGES) + f"{'total':>11}{'peakRSS':>10}{'ΔRSS':>10}"
+    print(header)
+    print("-" * len(header))
+    for r in results:
+        stages = "".join(f"{r['stage_ms'][stage]:>9.1f}ms" for stage in STAGES)
+        print(f"{r['dpi']:>4} {r['profile']:<10}{stages}{r['total_ms']:>9.1f}ms{r['peak_rss_mb']:>8.1f}MB"
+              f"{r['peak_rss_mb'] - r['baseline_rss_mb']:>8.1f}MB")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="画像前処理ベンチマーク")
+    parser.add_argument("--profiles", nargs="+", default=list(PREPROCESS_PROFILES.keys()),
+                        choices=list(PREPROCESS_PROFILES.keys()), help="測定するプロファイル")
+    parser.add_argument("--iterations", type=int, default=5, help="ケースごとの繰り返し回数")
+    parser.add_argument("--pdf_path", help="入力に使うPDF（省略時は合成ページ）")
+    parser.add_argument("--output", help="結果出力JSONファイルパス")
+    args = parser.parse_args()
+
+    if args.pdf_path and not Path(args.pdf_path).is_file():
+        print(f"❌ 無効なパス: {args.pdf_path}")
+        return
+
+    results = run_benchmark(args.profiles, args.iterations, args.pdf_path)
+    print_report(results)
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(results, f, ensure_ascii=False, indent=2)
+        print(f"\n結果をファイルに出力しました: {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,120 @@
+"""
+耐障害クライアントのベンチマーク（障害注入したフェイクサーバーに対して実行）
+素のHTTPクライアントと ResilientClient で、成功率・レイテンシ分布・再試行/ヘッジ回数を比較する
+
+使用例:
+    python benchmark_resilient_client.py --error_rate 0.1 --slow_rate 0.05 --slow_ms 1000
+    python benchmark_resilient_client.py --error_rate 0.8 --requests 200      # サーキットブレーカーの確認
+    python benchmark_resilient_client.py --prometheus                         # メトリクスをPrometheus形式で出力
+"""
+
+import json
+import time
+import argparse
+import statistics
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List
+
+from fake_google_server import start_fake_server
+from http_client import PooledHTTPClient, GEMINI_REST_MODEL
+from resilient_client import ResilientClient, CircuitOpenError
+
+
+def run_requests(client, url: str, payload: Dict, requests: int, concurrency: int) -> Dict:
+    """requests 件を concurrency 並列で送信し、成功率とレイテンシ分布を返す"""
+    latencies: List[float] = []
+    outcomes: Dict[str, int] = {"success": 0, "http_error": 0, "exception": 0, "circuit_open": 0}
+
+    def call(_):
+        start = time.perf_counter()
+        try:
+            response = client.post(url, json=payload)
+            outcome = "success" if response.status < 400 else "http_error"
+        except CircuitOpenError:
+            outcome = "circuit_open"
+        except Exception:
+            outcome = "exception"
+        return outcome, (time.perf_counter() - start) * 1000
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        for outcome, latency in executor.map(call, range(requests)):
+            outcomes[outcome] += 1
+            latencies.append(latency)
+    elapsed = time.perf_counter() - start
+
+    ordered = sorted(latencies)
+    return {
+        "success_rate": outcomes["success"] / requests,
+        "outcomes": outcomes,
+        "elapsed_seconds": elapsed,
+        "p50_ms": statistics.median(ordered),
+        "p95_ms": ordered[int(0.95 * (len(ordered) - 1))],
+        "p99_ms": ordered[int(0.99 * (len(ordered) - 1))],
+    }
+
+
+def print_report(results: Dict, metrics: Dict):
+    print("\n=== 耐障害クライアントベンチマーク ===")
+    header = f"{'client':<12}{'成功率':>8}{'p50':>10}{'p95':>10}{'p99':>10}  内訳"
+    print(header)
+    print("-" * (len(header) + 30))
+    for label, r in results.items():
+        print(f"{label:<12}{r['success_rate']:>8.1%}{r['p50_ms']:>8.0f}ms{r['p95_ms']:>8.0f}ms"
+              f"{r['p99_ms']:>8.0f}ms  {r['outcomes']}")
+    for name, endpoint in metrics["endpoints"].items():
+        print(f"\n{name}: 試行 {endpoint['attempts']}, 再試行 {endpoint['retries']}, "
+              f"バジェット枯渇 {endpoint['retry_budget_exhausted']}, ヘッジ {endpoint['hedges']} "
+              f"(勝ち {endpoint['hedge_wins']}), ブレーカー {endpoint['circuit_state']} "
+              f"(開放 {endpoint['circuit_opened']}回, 拒否 {endpoint['circuit_rejections']})")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="耐障害クライアントのベンチマーク")
+    parser.add_argument("--requests", type=int, default=300, help="リクエスト数")
+    parser.add_argument("--concurrency", type=int, default=8, help="同時実行数")
+    parser.add_argument("--latency_ms", type=float, default=50.0, help="フェイクサーバーの基本遅延(ms)")
+    parser.add_argument("--error_rate", type=float, default=0.1, help="エラー応答の割合")
+    parser.add_argument("--error_status", type=int, default=503, help="エラー応答のステータス")
+    parser.add_argument("--slow_rate", type=float, default=0.05, help="遅延応答の割合")
+    parser.add_argument("--slow_ms", type=float, default=1000.0, help="遅延応答の追加遅延(ms)")
+    parser.add_argument("--seed", type=int, default=0, help="障害注入の乱数シード")
+    parser.add_argument("--prometheus", action="store_true", help="メトリクスをPrometheus形式で出力")
+    parser.add_argument("--output", help="結果出力JSONファイルパス")
+    args = parser.parse_args()
+
+    faults = dict(
+        error_rate=args.error_rate, error_status=args.error_status,
+        slow_rate=args.slow_rate, slow_ms=args.slow_ms, seed=args.seed
+    )
+    payload = {"contents": [{"parts": [{"text": "ping"}]}]}
+    results: Dict[str, Dict] = {}
+    metrics: Dict = {}
+
+    for label in ("plain", "resilient"):
+        # 同じ障害パターンで比較するため、クライアントごとにサーバーを起動し直す
+        server = start_fake_server(latency_ms=args.latency_ms, **faults)
+        url = f"{server.base_url}/v1beta/models/{GEMINI_REST_MODEL}:generateContent?key=dummy"
+        base_client = PooledHTTPClient(pool_size=args.concurrency)
+        client = ResilientClient(base_client) if label == "resilient" else base_client
+        try:
+            results[label] = run_requests(client, url, payload, args.requests, args.concurrency)
+            if isinstance(client, ResilientClient):
+                metrics = client.metrics()
+                if args.prometheus:
+                    print(client.prometheus_text())
+        finally:
+            client.close()
+            server.shutdown()
+            server.server_close()
+
+    print_report(results, metrics)
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump({"results": results, "metrics": metrics}, f, ensure_ascii=False, indent=2)
+        print(f"\n結果をファイルに出力しました: {args.output}")
+
+
+if __name__ == "__main__":
+    main()
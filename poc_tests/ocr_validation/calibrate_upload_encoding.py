@@ -0,0 +1,215 @@
+"""
+送信画像エンコード方式のキャリブレーション
+sample_documents のPDFを各エンコード方式（1bit PNG・可逆WebP・G4 TIFF・縮小）で処理し、
+ページごとの送信バイト数・エンコード時間・フル解像度PNGのOCR結果との文字差分を記録する
+OCR精度を保てる方式のうち送信バイト数が最小のものを OCR_UPLOAD_ENCODING の推奨値として出力する
+
+使用例:
+    python calibrate_upload_encoding.py                        # Vision API で文字差分まで計測
+    python calibrate_upload_encoding.py --offline              # バイト数・エンコード時間のみ
+    python calibrate_upload_encoding.py --encodings png png1 png1@200 --uplink_mbps 2
+"""
+
+import os
+import json
+import time
+import base64
+import difflib
+import argparse
+import statistics
+from pathlib import Path
+from typing import Dict, List, Optional
+
+import numpy as np
+import PyPDF2
+
+from image_preprocessing import ImagePreprocessor, PREPROCESS_PROFILES, DEFAULT_PREPROCESS_PROFILE
+from upload_encoding import UploadEncoder, UPLOAD_FORMATS, parse_encoding
+from pdf_rasterizer import render_page, DEFAULT_RENDER_DPI
+from http_client import get_shared_client, vision_annotate_url
+from structuring_cache import normalize_ocr_text
+
+DEFAULT_SAMPLE_DIRECTORY = Path(__file__).parent / "sample_documents"
+DEFAULT_ENCODINGS = ["png", "png1", "webp", "tiff_g4", "png1@200", "webp@200", "png1@150"]
+REFERENCE_ENCODING = "png"
+
+
+def binarize_page(preprocessor: ImagePreprocessor, image_data: bytes) -> np.ndarray:
+    """前処理（デコード・ノイズ除去・二値化）までを実行した二値画像"""
+    gray = preprocessor.decode(image_data)
+    denoised = preprocessor.denoise(gray, np.empty_like(gray))
+    return preprocessor.binarize(denoised, np.empty_like(gray))
+
+
+def character_error_rate(reference: str, text: str) -> float:
+    """正規化・空白除去後の文字列の差分率（1 - 一致率）"""
+    a = normalize_ocr_text(reference).replace(" ", "").replace("\n", "")
+    b = normalize_ocr_text(text).replace(" ", "").replace("\n", "")
+    if not a and not b:
+        return 0.0
+    return 1.0 - difflib.SequenceMatcher(None, a, b, autojunk=False).ratio()
+
+
+def ocr_image(endpoint: str, image: bytes) -> str:
+    """Vision API（images:annotate）で全文テキストを取得"""
+    payload = {
+        "requests": [{
+            "image": {"content": base64.b64encode(image).decode('utf-8')},
+            "features": [{"type": "DOCUMENT_TEXT_DETECTION", "maxResults": 1}],
+            "imageContext": {"languageHints": ["ja"]},
+        }]
+    }
+    response = get_shared_client().post(endpoint, json=payload)
+    response.raise_for_status()
+    result = response.json()["responses"][0]
+    if "error" in result:
+        raise Exception(f'Vision API Error: {result["error"]}')
+    return result.get("fullTextAnnotation", {}).get("text", "")
+
+
+def calibrate_page(
+    binary: np.ndarray, dpi: int, encodings: List[str], iterations: int, endpoint: Optional[str]
+) -> Dict[str, Dict]:
+    """
+    1ページを各エンコード方式で処理した結果（方式 → 計測値）
+    """
+    results: Dict[str, Dict] = {}
+    for spec in encodings:
+        encoder = UploadEncoder(spec, source_dpi=dpi)
+        samples: List[float] = []
+        for _ in range(iterations):
+            start = time.perf_counter()
+            encoded = encoder.encode(binary)
+            samples.append((time.perf_counter() - start) * 1000)
+
+        result = {"bytes": len(encoded), "encode_ms": statistics.median(samples), "text": None}
+        if endpoint and encoder.format.images_annotate:
+            try:
+                result["text"] = ocr_image(endpoint, encoded)
+            except Exception as e:
+                print(f"⚠️ Vision API エラー（{spec}）: {e}")
+        results[spec] = result
+
+    reference = results.get(REFERENCE_ENCODING, {}).get("text")
+    for result in results.values():
+        text = result.pop("text")
+        result["cer"] = (
+            character_error_rate(reference, text) if reference is not None and text is not None else None
+        )
+    return results
+
+
+def summarize(pages: List[Dict], encodings: List[str], uplink_mbps: float, max_cer: float) -> Dict:
+    """
+    方式ごとの集計と推奨方式
+    """
+    reference_bytes = sum(page["encodings"][REFERENCE_ENCODING]["bytes"] for page in pages) \
+        if REFERENCE_ENCODING in encodings else None
+
+    summary: Dict[str, Dict] = {}
+    for spec in encodings:
+        rows = [page["encodings"][spec] for page in pages]
+        total_bytes = sum(row["bytes"] for row in rows)
+        cers = [row["cer"] for row in rows if row["cer"] is not None]
+        summary[spec] = {
+            "images_annotate": UPLOAD_FORMATS[parse_encoding(spec)[0]].images_annotate,
+            "total_bytes": total_bytes,
+            "bytes_ratio": total_bytes / reference_bytes if reference_bytes else None,
+            "encode_ms_median": statistics.median(row["encode_ms"] for row in rows),
+            # Base64でおよそ4/3倍になった送信量を上り回線の帯域で割った目安
+            "upload_ms_per_page": (total_bytes * 4 / 3 * 8) / (uplink_mbps * 1000) / len(rows),
+            "cer_mean": statistics.mean(cers) if len(cers) == len(rows) else None,
+            "cer_max": max(cers) if len(cers) == len(rows) else None,
+        }
+
+    candidates = [
+        spec for spec, row in summary.items()
+        if row["images_annotate"] and row["cer_max"] is not None and row["cer_max"] <= max_cer
+    ]
+    recommended = min(candidates, key=lambda spec: summary[spec]["total_bytes"]) if candidates else None
+    return {"encodings": summary, "recommended": recommended, "max_cer": max_cer}
+
+
+def print_report(report: Dict):
+    print("\n=== 送信画像エンコード方式キャリブレーション ===")
+    print(f"ページ数: {len(report['pages'])}, 上り回線 {report['uplink_mbps']} Mbps 想定")
+    header = f"{'方式':<12}{'合計KB':>10}{'比率':>8}{'encode':>10}{'送信/頁':>10}{'CER平均':>9}{'CER最大':>9}"
+    print(header)
+    print("-" * (len(header) + 6))
+    for spec, row in report["summary"]["encodings"].items():
+        ratio = f"{row['bytes_ratio']:.2f}" if row["bytes_ratio"] is not None else "-"
+        cer_mean = f"{row['cer_mean']:.2%}" if row["cer_mean"] is not None else "-"
+        cer_max = f"{row['cer_max']:.2%}" if row["cer_max"] is not None else "-"
+        note = "" if row["images_annotate"] else "  (images:annotate 非対応)"
+        print(f"{spec:<12}{row['total_bytes'] / 1024:>10.1f}{ratio:>8}{row['encode_ms_median']:>8.1f}ms"
+              f"{row['upload_ms_per_page']:>8.0f}ms{cer_mean:>9}{cer_max:>9}{note}")
+
+    recommended = report["summary"]["recommended"]
+    if recommended:
+        print(f"\n推奨: OCR_UPLOAD_ENCODING={recommended}（CER {report['summary']['max_cer']:.2%} 以内で最小）")
+    else:
+        print("\n推奨方式なし（Vision API による文字差分が計測されていません）")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="送信画像エンコード方式のキャリブレーション")
+    parser.add_argument("--sample_directory", default=str(DEFAULT_SAMPLE_DIRECTORY), help="サンプルPDFディレクトリ")
+    parser.add_argument("--encodings", nargs="+", default=DEFAULT_ENCODINGS, help="比較するエンコード方式")
+    parser.add_argument("--dpi", type=int, default=DEFAULT_RENDER_DPI, help="レンダリングDPI")
+    parser.add_argument("--profile", default=DEFAULT_PREPROCESS_PROFILE,
+                        choices=list(PREPROCESS_PROFILES.keys()), help="前処理プロファイル")
+    parser.add_argument("--iterations", type=int, default=3, help="エンコード時間の計測回数")
+    parser.add_argument("--uplink_mbps", type=float, default=5.0, help="送信時間の目安に使う上り回線帯域")
+    parser.add_argument("--max_cer", type=float, default=0.005, help="推奨に採用する文字差分率の上限")
+    parser.add_argument("--offline", action="store_true", help="Vision APIを呼ばずにバイト数・時間のみ計測")
+    parser.add_argument("--output", help="結果出力JSONファイルパス")
+    args = parser.parse_args()
+
+    pdf_paths = sorted(Path(args.sample_directory).glob("*.pdf"))
+    if not pdf_paths:
+        print(f"❌ PDFファイルが見つかりません: {args.sample_directory}")
+        return
+    if REFERENCE_ENCODING not in args.encodings:
+        args.encodings.insert(0, REFERENCE_ENCODING)
+    for spec in args.encodings:
+        UploadEncoder(spec, source_dpi=args.dpi)
+
+    endpoint = None
+    if not args.offline:
+        api_key = os.getenv("GOOGLE_API_KEY")
+        if not api_key:
+            print("⚠️ GOOGLE_API_KEY が未設定のため文字差分は計測しません（--offline と同じ）")
+        else:
+            endpoint = vision_annotate_url(api_key)
+
+    preprocessor = ImagePreprocessor(args.profile)
+    pages: List[Dict] = []
+    for pdf_path in pdf_paths:
+        with open(pdf_path, 'rb') as file:
+            page_count = len(PyPDF2.PdfReader(file).pages)
+        for page_index in range(page_count):
+            print(f"処理中: {pdf_path.name} {page_index + 1}/{page_count}ページ")
+            binary = binarize_page(preprocessor, render_page(str(pdf_path), page_index, args.dpi))
+            pages.append({
+                "file": pdf_path.name,
+                "page": page_index + 1,
+                "encodings": calibrate_page(binary, args.dpi, args.encodings, args.iterations, endpoint),
+            })
+
+    report = {
+        "dpi": args.dpi,
+        "profile": args.profile,
+        "uplink_mbps": args.uplink_mbps,
+        "pages": pages,
+        "summary": summarize(pages, args.encodings, args.uplink_mbps, args.max_cer),
+    }
+    print_report(report)
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        print(f"\n結果をファイルに出力しました: {args.output}")
+
+
+if __name__ == "__main__":
+    main()
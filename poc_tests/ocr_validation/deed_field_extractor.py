@@ -0,0 +1,243 @@
+"""
+登記簿謄本のルールベース項目抽出（Gemini呼び出し前の高速パス）
+定型レイアウトの項目（所在・地番・地目・地積・家屋番号・構造・床面積・受付年月日・受付番号 等）を
+事前コンパイルした正規表現で抽出し、項目ごとに信頼度を付与する
+抽出できなかった項目・信頼度の低い項目のみ Gemini に問い合わせる
+甲区の項目（登記の目的・受付・原因・所有者 等）は、甲区の最新の登記（最後の順位番号）からまとめて抽出する
+"""
+
+import os
+import re
+import logging
+from typing import Callable, Dict, List, Optional, Tuple
+
+from structuring_cache import normalize_ocr_text
+
+# ログ設定
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# この信頼度未満の項目は Gemini に問い合わせる
+RULE_MIN_CONFIDENCE = float(os.getenv("OCR_RULE_MIN_CONFIDENCE", "0.85"))
+
+# 項目名の後の区切り（「所在: 」「所在：」「所在 」）
+_SEP = r"[ ]*[:：]?[ ]*"
+
+# 地目（不動産登記規則第99条）
+_LAND_CATEGORIES = (
+    "田|畑|宅地|学校用地|鉄道用地|塩田|鉱泉地|池沼|山林|牧場|原野|墓地|境内地|運河用地|"
+    "水道用地|用悪水路|ため池|堤|井溝|保安林|公衆用道路|公園|雑種地"
+)
+_AREA = r"[\d,]+(?:\.\d+)?[ ]*(?:平方メートル|m2)"
+_ERA_DATE = r"(?:明治|大正|昭和|平成|令和)\d+年\d+月\d+日"
+
+# 住所らしい値（都道府県で始まる、番地・号の数字を含む）。所有者の氏名として採用しない
+_ADDRESS_PATTERN = re.compile(r"^(?:東京都|北海道|(?:京都|大阪)府|\S{2,3}県)|\d|丁目|番地")
+
+# 甲区（所有権に関する事項）の範囲（見出しから乙区・共同担保目録の見出しまで。正規化後のテキストで照合）
+_OWNERSHIP_HEADING = re.compile(r"^(?:.*権 ?利 ?部 ?\( ?甲 ?区 ?\).*|【甲区】)$", re.MULTILINE)
+_NEXT_SECTION_HEADING = re.compile(
+    r"^(?:.*権 ?利 ?部 ?\( ?乙 ?区 ?\).*|.*共 ?同 ?担 ?保 ?目 ?録.*|【(?:乙区|共同担保目録|その他)】)$", re.MULTILINE
+)
+# 甲区の1件の登記の始まり（順位番号の行、登記の目的の行、「2 所有権移転」のような順位番号付きの行）
+_ENTRY_START = re.compile(
+    rf"^(?:順位番号{_SEP}\d+|登記の目的{_SEP}\S|\d+ (?:所有権|持分|差押|仮差押|仮登記|\S+登記)\S*)", re.MULTILINE
+)
+_RANK_LINE = re.compile(rf"順位番号{_SEP}\d+")
+# 最新の登記から抽出する項目
+OWNERSHIP_FIELDS = frozenset({"登記の目的", "受付年月日・受付番号", "登記原因", "所有者の氏名又は名称", "住所", "持分"})
+
+
+def _join_lines(value: str) -> str:
+    return " ".join(line.strip() for line in value.splitlines() if line.strip())
+
+
+def _owner_name(value: str) -> str:
+    """所有者の行の値が住所の場合は採用しない（次の行の氏名を別のパターンで探す）"""
+    value = value.strip()
+    return "" if _ADDRESS_PATTERN.search(value) else value
+
+
+def latest_ownership_entry(text: str) -> str:
+    """
+    正規化済みのテキストから甲区の最新の登記（最後の順位番号）の部分を返す
+    甲区の見出しがない場合は全体を甲区とみなし、登記の区切りが見つからない場合は甲区全体を返す
+    """
+    heading = _OWNERSHIP_HEADING.search(text)
+    if heading is not None:
+        text = text[heading.end():]
+        next_section = _NEXT_SECTION_HEADING.search(text)
+        if next_section is not None:
+            text = text[:next_section.start()]
+    starts = [found.start() for found in _ENTRY_START.finditer(text)]
+    # 順位番号だけの行は、続く登記の目的の行と同じ登記
+    entries = [text[start:end] for start, end in zip(starts, starts[1:] + [len(text)])]
+    while len(entries) > 1 and _RANK_LINE.fullmatch(entries[-2].strip()):
+        entries[-2:] = [entries[-2] + entries[-1]]
+    return entries[-1] if entries else text
+
+
+class _FieldRule:
+    """1項目の抽出ルール（先に定義したパターンほど優先）"""
+
+    def __init__(self, field: str, patterns: List[Tuple[str, float]], postprocess: Callable[[str], str] = str.strip):
+        self.field = field
+        self.patterns = [(re.compile(pattern, re.MULTILINE), confidence) for pattern, confidence in patterns]
+        self.postprocess = postprocess
+
+    def match(self, text: str) -> Optional[Tuple[str, float]]:
+        for pattern, confidence in self.patterns:
+            found = pattern.search(text)
+            if found:
+                value = self.postprocess(found.group("value"))
+                if value:
+                    return value, confidence
+        return None
+
+
+FIELD_RULES: List[_FieldRule] = [
+    _FieldRule("所在", [
+        (rf"^所在{_SEP}(?P<value>\S.*)$", 0.95),
+    ]),
+    _FieldRule("地番", [
+        (rf"^地番{_SEP}(?P<value>\d+番(?:\d+)?)[ ]*$", 0.95),
+        (rf"^地番{_SEP}(?P<value>\S.*)$", 0.75),
+    ]),
+    _FieldRule("地目", [
+        (rf"^地目{_SEP}(?P<value>{_LAND_CATEGORIES})[ ]*$", 0.95),
+        (rf"^地目{_SEP}(?P<value>\S.*)$", 0.7),
+    ]),
+    _FieldRule("地積", [
+        (rf"^地積{_SEP}(?P<value>{_AREA})", 0.95),
+    ]),
+    _FieldRule("家屋番号", [
+        (rf"^家屋番号{_SEP}(?P<value>\d+番\d*(?:の\d+)?)[ ]*$", 0.95),
+        (rf"^家屋番号{_SEP}(?P<value>\S.*)$", 0.75),
+    ]),
+    _FieldRule("構造", [
+        (rf"^構造{_SEP}(?P<value>\S*造\S*)[ ]*$", 0.9),
+        (rf"^構造{_SEP}(?P<value>\S.*)$", 0.7),
+    ]),
+    _FieldRule("床面積", [
+        # 階ごとに改行される（「床面積: 1階 200.00平方メートル」の後に「2階 …」が続く）
+        (rf"^床面積{_SEP}(?P<value>\d+階[ ]*{_AREA}(?:\n\d+階[ ]*{_AREA})*)", 0.9),
+        (rf"^床面積{_SEP}(?P<value>{_AREA})", 0.9),
+    ], postprocess=_join_lines),
+    _FieldRule("受付年月日・受付番号", [
+        (rf"^受付年月日・受付番号{_SEP}(?P<value>{_ERA_DATE}[ ]*第\d+号)", 0.95),
+        # 見出しのない受付の行（「令和3年4月1日受付 第1234号」）。登記原因などの行中の日付・番号は拾わない
+        (rf"^(?:受付{_SEP})?(?P<value>{_ERA_DATE}[ ]*受付[ ]*第\d+号)[ ]*$", 0.85),
+        (rf"(?P<value>{_ERA_DATE}[ ]*第\d+号)", 0.8),
+    ]),
+    _FieldRule("登記の目的", [
+        (rf"^登記の目的{_SEP}(?P<value>\S.*)$", 0.9),
+    ]),
+    _FieldRule("登記原因", [
+        (rf"^(?:登記)?原因{_SEP}(?P<value>{_ERA_DATE}\S*)", 0.9),
+    ]),
+    # 氏名の誤り（住所の取り違え・表記ゆれ）の影響が大きいため、ルールの値は Gemini の回答がない場合のみ使う
+    _FieldRule("所有者の氏名又は名称", [
+        (rf"^(?:所有者|共有者){_SEP}(?P<value>[^\s\d][^\s]*)[ ]*$", 0.8),
+        # 「所有者 東京都新宿区西新宿一丁目1番1号」の次の行に氏名
+        (rf"^(?:所有者|共有者){_SEP}\S.*\n(?P<value>[^\s\d][^\s]*)[ ]*$", 0.8),
+    ], postprocess=_owner_name),
+    _FieldRule("住所", [
+        (rf"^住所{_SEP}(?P<value>\S.*)$", 0.85),
+    ]),
+    _FieldRule("持分", [
+        (r"持分[ ]*(?P<value>\d+分の\d+)", 0.9),
+    ]),
+]
+
+
+class DeedFieldExtractor:
+    """
+    ルールベースの項目抽出
+    テキストの正規化（NFKC・空白・和暦表記）後にルールを適用する
+    """
+
+    def __init__(self, rules: Optional[List[_FieldRule]] = None, min_confidence: float = RULE_MIN_CONFIDENCE):
+        self.rules = rules if rules is not None else FIELD_RULES
+        self.min_confidence = min_confidence
+
+    def extract(self, text: str, fields: Optional[List[str]] = None) -> Dict:
+        """
+        ルールで抽出できた項目を Gemini と同じ形式で返す
+
+        Args:
+            text: OCRテキスト
+            fields: 抽出対象の項目（省略時は全ルール）
+        Returns:
+            {"extracted_data": {...}, "confidence_scores": {...}}（抽出できた項目のみ）
+        """
+        normalized = normalize_ocr_text(text)
+        # 甲区の項目は同じ登記から抽出する（受付と原因・所有者が別の登記から取られないようにする）
+        ownership = latest_ownership_entry(normalized)
+        extracted_data: Dict[str, str] = {}
+        confidence_scores: Dict[str, float] = {}
+
+        for rule in self.rules:
+            if fields is not None and rule.field not in fields:
+                continue
+            matched = rule.match(ownership if rule.field in OWNERSHIP_FIELDS else normalized)
+            if matched:
+                extracted_data[rule.field], confidence_scores[rule.field] = matched
+
+        return {"extracted_data": extracted_data, "confidence_scores": confidence_scores}
+
+    def missing_fields(self, rule_result: Dict, fields: List[str]) -> List[str]:
+        """
+        ルールで抽出できなかった項目・信頼度が閾値未満の項目（Gemini に問い合わせる項目）
+        """
+        scores = rule_result["confidence_scores"]
+        return [field for field in fields if scores.get(field, 0.0) < self.min_confidence]
+
+
+def merge_structured_data(
+    rule_result: Dict, llm_result: Optional[Dict], fields: List[str], llm_fields: Optional[List[str]] = None
+) -> Dict:
+    """
+    ルール抽出結果と Gemini の結果（不足項目のみ）を TARGET_FIELDS 順に統合
+
+    Gemini が値を返した項目は Gemini の値を、それ以外はルールの値（なければ空文字）を採用する
+    llm_fields を指定した場合、Gemini の値はその項目（問い合わせた項目）についてのみ採用する
+    """
+    llm_data = (llm_result or {}).get("extracted_data", {}) or {}
+    llm_scores = (llm_result or {}).get("confidence_scores", {}) or {}
+
+    extracted_data: Dict[str, str] = {}
+    confidence_scores: Dict[str, float] = {}
+    sources: Dict[str, str] = {}
+
+    for field in fields:
+        if llm_data.get(field) and (llm_fields is None or field in llm_fields):
+            extracted_data[field] = llm_data[field]
+            confidence_scores[field] = llm_scores.get(field, 0.0)
+            sources[field] = "gemini"
+        elif field in rule_result["extracted_data"]:
+            extracted_data[field] = rule_result["extracted_data"][field]
+            confidence_scores[field] = rule_result["confidence_scores"][field]
+            sources[field] = "rule"
+        else:
+            extracted_data[field] = ""
+            confidence_scores[field] = 0.0
+
+    filled_scores = [confidence_scores[field] for field in fields if extracted_data[field]]
+    merged = {
+        "extracted_data": extracted_data,
+        "confidence_scores": confidence_scores,
+        "metadata": {
+            "total_fields": len(filled_scores),
+            "average_confidence": sum(filled_scores) / len(filled_scores) if filled_scores else 0.0,
+            "field_sources": sources,
+            "rule_fields": sum(1 for source in sources.values() if source == "rule"),
+            "gemini_fields": sum(1 for source in sources.values() if source == "gemini"),
+        }
+    }
+
+    if llm_result and "error" in llm_result:
+        merged["gemini_error"] = llm_result["error"]
+    if llm_result and llm_result.get("partial"):
+        merged["partial"] = True
+
+    return merged
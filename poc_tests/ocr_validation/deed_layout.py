@@ -0,0 +1,278 @@
+"""
+登記簿謄本のレイアウト解析（区ごとの切り出し）
+登記事項証明書は 表題部・権利部（甲区）・権利部（乙区）・共同担保目録 がそれぞれ罫線で囲まれた表になっているため、
+OpenCV で罫線を検出して区ごとの表を切り出し、抽出項目に必要な区だけを Vision API に送る
+（送信する画素数を減らし、Gemini に渡すテキストも必要な区に絞る）
+
+- 区の判定: 文書の最初の表は表題部。見出し行（1行目）に縦罫線がない表で次の区に進み、
+  縦罫線がある表（列見出しから始まる表）は前の区の続き（改ページで分かれた表）とみなす
+- テキストレイヤーから読んだページ（画像化しないページ）は、本文中の区の見出しで区の判定を進める
+  文書の先頭のテキストレイヤーのページに見出しがない場合は区を判定できないため、見出しが現れるまでページ全体を送る
+- 罫線の表が見つからないページ、対応表にない抽出項目がある場合はページ全体を送る
+"""
+
+import os
+import re
+import logging
+from typing import Dict, FrozenSet, Iterable, List, Optional, Sequence, Tuple
+
+import cv2
+import numpy as np
+
+# ログ設定
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+LAYOUT_CROP_ENABLED = os.getenv("OCR_LAYOUT_CROP", "false").lower() == "true"
+# 切り出す範囲に加える余白（ページ幅に対する割合）
+LAYOUT_MARGIN_RATIO = float(os.getenv("OCR_LAYOUT_MARGIN_RATIO", "0.005"))
+
+SECTION_TITLE = "表題部"
+SECTION_OWNERSHIP = "甲区"
+SECTION_OTHER_RIGHTS = "乙区"
+SECTION_COLLATERAL = "共同担保目録"
+SECTION_UNKNOWN = "その他"
+# 登記事項証明書での区の並び順
+SECTION_ORDER = (SECTION_TITLE, SECTION_OWNERSHIP, SECTION_OTHER_RIGHTS, SECTION_COLLATERAL)
+# 区ごとのテキストの見出しタグ（切り出した区のOCRテキストの前に付ける）
+SECTION_TAG = "【{section}】"
+
+# 抽出項目ごとに記載される区
+FIELD_SECTIONS: Dict[str, Tuple[str, ...]] = {
+    "不動産の表示": (SECTION_TITLE,),
+    "所在": (SECTION_TITLE,),
+    "地番": (SECTION_TITLE,),
+    "地目": (SECTION_TITLE,),
+    "地積": (SECTION_TITLE,),
+    "建物の表示": (SECTION_TITLE,),
+    "家屋番号": (SECTION_TITLE,),
+    "種類": (SECTION_TITLE,),
+    "構造": (SECTION_TITLE,),
+    "床面積": (SECTION_TITLE,),
+    # 未登記の建物などは表題部に所有者が記載される
+    "所有者の氏名又は名称": (SECTION_TITLE, SECTION_OWNERSHIP),
+    "住所": (SECTION_TITLE, SECTION_OWNERSHIP),
+    "持分": (SECTION_OWNERSHIP,),
+    "登記の目的": (SECTION_OWNERSHIP, SECTION_OTHER_RIGHTS),
+    "受付年月日・受付番号": (SECTION_OWNERSHIP, SECTION_OTHER_RIGHTS),
+    "登記原因": (SECTION_OWNERSHIP, SECTION_OTHER_RIGHTS),
+    "権利者その他の事項": (SECTION_OWNERSHIP, SECTION_OTHER_RIGHTS),
+}
+
+# テキストレイヤーの区の見出し（空白を除いた本文で照合する）
+_SECTION_HEADINGS = (
+    (SECTION_TITLE, re.compile(r"表題部")),
+    (SECTION_OWNERSHIP, re.compile(r"権利部[（(]甲区[）)]")),
+    (SECTION_OTHER_RIGHTS, re.compile(r"権利部[（(]乙区[）)]")),
+    (SECTION_COLLATERAL, re.compile(r"共同担保目録")),
+)
+_WHITESPACE = re.compile(r"\s+")
+
+# 表とみなす罫線の塊の最小サイズ（ページの幅・高さに対する割合）
+_MIN_TABLE_WIDTH = 0.5
+_MIN_TABLE_HEIGHT = 0.02
+# 罫線とみなす線の最小長（ページの幅・高さに対する割合）
+_HORIZONTAL_LINE = 1 / 20
+_VERTICAL_LINE = 1 / 60
+
+
+def last_section_heading(text: str) -> Optional[str]:
+    """テキスト中で最後に現れる区の見出し（見出しがない場合は None）"""
+    compact = _WHITESPACE.sub("", text)
+    found = [
+        (match.start(), section)
+        for section, pattern in _SECTION_HEADINGS
+        for match in pattern.finditer(compact)
+    ]
+    return max(found)[1] if found else None
+
+
+def sections_for_fields(fields: Iterable[str]) -> Optional[FrozenSet[str]]:
+    """抽出項目に必要な区（対応表にない項目を含む場合は None = 切り出さない）"""
+    sections = set()
+    for field in fields:
+        if field not in FIELD_SECTIONS:
+            return None
+        sections.update(FIELD_SECTIONS[field])
+    return frozenset(sections)
+
+
+class TableBox:
+    """ページ上の罫線の表（座標はピクセル）"""
+
+    __slots__ = ("left", "top", "width", "height", "starts_section")
+
+    def __init__(self, left: int, top: int, width: int, height: int, starts_section: bool):
+        self.left = left
+        self.top = top
+        self.width = width
+        self.height = height
+        # 1行目が縦罫線のない見出し行（新しい区の始まり）
+        self.starts_section = starts_section
+
+
+def _line_positions(profile: np.ndarray, threshold: float) -> List[int]:
+    """罫線の射影（行・列ごとの画素数）から罫線の位置を求める（隣接する位置は1本にまとめる）"""
+    positions: List[int] = []
+    previous = -2
+    for position in np.flatnonzero(profile >= threshold):
+        if position - previous > 1:
+            positions.append(int(position))
+        previous = position
+    return positions
+
+
+def detect_tables(gray: np.ndarray) -> List[TableBox]:
+    """
+    グレースケールのページ画像から罫線の表を検出し、上から順に返す
+    背景の地紋（複写防止の模様）は罫線より淡いため、大津の二値化で除く
+    """
+    height, width = gray.shape
+    _, binary = cv2.threshold(gray, 0, 255, cv2.THRESH_BINARY_INV | cv2.THRESH_OTSU)
+    horizontal = cv2.morphologyEx(
+        binary, cv2.MORPH_OPEN, cv2.getStructuringElement(cv2.MORPH_RECT, (max(1, int(width * _HORIZONTAL_LINE)), 1))
+    )
+    vertical = cv2.morphologyEx(
+        binary, cv2.MORPH_OPEN, cv2.getStructuringElement(cv2.MORPH_RECT, (1, max(1, int(height * _VERTICAL_LINE))))
+    )
+    grid = cv2.dilate(cv2.bitwise_or(horizontal, vertical), np.ones((3, 3), np.uint8))
+
+    tables: List[TableBox] = []
+    count, _, stats, _ = cv2.connectedComponentsWithStats(grid)
+    for left, top, box_width, box_height, _ in stats[1:count]:
+        if box_width < width * _MIN_TABLE_WIDTH or box_height < height * _MIN_TABLE_HEIGHT:
+            continue
+        rows = _line_positions(
+            horizontal[top:top + box_height, left:left + box_width].sum(axis=1) / 255, box_width * 0.5
+        )
+        starts_section = False
+        if len(rows) >= 2:
+            # 1行目（外枠の内側）に縦罫線があるかを確認する
+            inset = max(2, box_width // 100)
+            band = vertical[top + rows[0] + inset:top + rows[1] - inset, left + inset:left + box_width - inset]
+            if band.size:
+                starts_section = not _line_positions(band.sum(axis=0) / 255, band.shape[0] * 0.8)
+        tables.append(TableBox(int(left), int(top), int(box_width), int(box_height), starts_section))
+    tables.sort(key=lambda table: table.top)
+    return tables
+
+
+class DocumentLayout:
+    """
+    1文書分のレイアウト解析（区の判定はページをまたいで引き継ぐため、ページ順に split_page を呼ぶ）
+    text_pages はページごとのテキストレイヤー（画像化しないページ以外は None）。指定した場合は
+    split_page にページ番号を渡し、それより前のテキストレイヤーのページの見出しで区の判定を進める
+    """
+
+    def __init__(
+        self,
+        sections: FrozenSet[str],
+        margin_ratio: float = LAYOUT_MARGIN_RATIO,
+        text_pages: Optional[Sequence[Optional[str]]] = None
+    ):
+        self.sections = sections
+        self.margin_ratio = margin_ratio
+        self.text_pages = text_pages
+        self._section_index = -1
+        # 文書の先頭から見出しのないテキストレイヤーのページが続き、区を判定できない状態
+        self._unknown = False
+        self._next_text_page = 0
+        self.pages = 0
+        self.page_pixels = 0
+        self.uploaded_pixels = 0
+
+    def _observe_text_pages(self, page_index: int):
+        """page_index より前のテキストレイヤーのページの見出しで区の判定を進める"""
+        for text in self.text_pages[self._next_text_page:page_index]:
+            if text is None:
+                continue
+            section = last_section_heading(text)
+            if section is not None:
+                self._section_index = SECTION_ORDER.index(section)
+                self._unknown = False
+            elif self._section_index < 0:
+                # 見出しのないページは直前の区の続き。文書の先頭から見出しがない場合は区を判定できない
+                self._unknown = True
+        self._next_text_page = max(self._next_text_page, page_index + 1)
+
+    def _label(self, table: TableBox) -> str:
+        if self._section_index < 0:
+            self._section_index = 0
+        elif table.starts_section:
+            self._section_index += 1
+        if self._section_index < len(SECTION_ORDER):
+            return SECTION_ORDER[self._section_index]
+        return SECTION_UNKNOWN
+
+    def split_page(self, image_data: bytes, page_index: Optional[int] = None) -> List[Tuple[Optional[str], bytes]]:
+        """
+        ページ画像を必要な区ごとの画像に分割
+        同じ区の表が続く場合は1枚にまとめる。区の表が見つからない・区を判定できない場合は [(None, ページ画像)] を返す
+
+        Returns:
+            上から順の (区, PNGバイト列) のリスト（必要な区がないページは空）
+        """
+        gray = cv2.imdecode(np.frombuffer(image_data, dtype=np.uint8), cv2.IMREAD_GRAYSCALE)
+        if gray is None:
+            raise ValueError("画像のデコードに失敗しました")
+        height, width = gray.shape
+        self.pages += 1
+        self.page_pixels += gray.size
+
+        if self.text_pages is not None and page_index is not None:
+            self._observe_text_pages(page_index)
+        tables = [] if self._unknown else detect_tables(gray)
+        if not tables:
+            self.uploaded_pixels += gray.size
+            return [(None, image_data)]
+
+        # (区, 上端, 下端, 左端, 右端)
+        regions: List[List] = []
+        for table in tables:
+            section = self._label(table)
+            bottom, right = table.top + table.height, table.left + table.width
+            if regions and regions[-1][0] == section:
+                region = regions[-1]
+                region[2], region[3], region[4] = bottom, min(region[3], table.left), max(region[4], right)
+            else:
+                regions.append([section, table.top, bottom, table.left, right])
+
+        margin = int(width * self.margin_ratio)
+        crops: List[Tuple[Optional[str], bytes]] = []
+        for section, top, bottom, left, right in regions:
+            if section not in self.sections:
+                continue
+            crop = gray[max(0, top - margin):min(height, bottom + margin), max(0, left - margin):min(width, right + margin)]
+            ok, encoded = cv2.imencode(".png", crop, [cv2.IMWRITE_PNG_COMPRESSION, 1])
+            if not ok:
+                raise ValueError("画像のエンコードに失敗しました")
+            self.uploaded_pixels += crop.size
+            crops.append((section, encoded.tobytes()))
+        return crops
+
+    def stats(self) -> Dict:
+        return {
+            "pages": self.pages,
+            "page_pixels": self.page_pixels,
+            "uploaded_pixels": self.uploaded_pixels,
+            "uploaded_ratio": self.uploaded_pixels / self.page_pixels if self.page_pixels else 0.0,
+        }
+
+
+def tag_sections(parts: List[Tuple[str, str]]) -> str:
+    """(区, テキスト) を区の見出しタグを付けて連結"""
+    return "\n".join(f"{SECTION_TAG.format(section=section)}\n{text}" for section, text in parts)
+
+
+def combine_section_results(parts: Sequence[Tuple[Optional[str], Tuple[str, float]]]) -> Tuple[str, float]:
+    """
+    区ごとの (抽出テキスト, 信頼度) をページの結果にまとめる（テキストは区の見出しタグを付けて連結）
+    ページ全体を送った場合はその結果をそのまま返す
+    """
+    if len(parts) == 1 and parts[0][0] is None:
+        return parts[0][1]
+    found = [(section, text, confidence) for section, (text, confidence) in parts if text]
+    if not found:
+        return "", 0.0
+    text = tag_sections([(section, text) for section, text, _ in found])
+    return text, sum(confidence for _, _, confidence in found) / len(found)
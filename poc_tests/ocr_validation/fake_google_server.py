@@ -0,0 +1,366 @@
+"""
+Vision API / Gemini API のローカルフェイクサーバー
+オフラインでのベンチマーク・動作確認用（HTTP/1.1 Keep-Alive、gzip応答、streamGenerateContent のSSE応答対応）
+障害注入: 一定割合のリクエストにエラー応答（429/503 等）を返す・応答を遅らせる（再試行・ヘッジの確認用）
+遅延はエンドポイントごとの基本値と分布（fixed / uniform / exponential / lognormal）で指定できる
+
+使用例:
+    python fake_google_server.py --port 8765
+    python fake_google_server.py --port 8765 --error_rate 0.2 --error_status 503 --slow_rate 0.05 --slow_ms 2000
+    python fake_google_server.py --port 8765 --vision_latency_ms 400 --gemini_latency_ms 1500 --latency_distribution lognormal
+    export VISION_API_BASE_URL=http://127.0.0.1:8765
+    export GEMINI_API_BASE_URL=http://127.0.0.1:8765
+"""
+
+import gzip
+import json
+import math
+import time
+import random
+import argparse
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List, Optional, Tuple, Union
+
+from prompt_compaction import estimate_tokens
+from batch_structuring import document_ids
+
+LATENCY_DISTRIBUTIONS = ("fixed", "uniform", "exponential", "lognormal")
+
+SAMPLE_DEED_TEXT = """登記簿謄本
+不動産の表示
+所在: 東京都新宿区西新宿
+地番: 1番1
+地目: 宅地
+地積: 500.00平方メートル
+権利部（甲区）
+登記の目的: 所有権保存
+受付年月日・受付番号: 平成20年3月15日 第5678号
+所有者 田中太郎
+住所 東京都新宿区西新宿1-1-1
+"""
+
+SAMPLE_STRUCTURED_DATA = {
+    "extracted_data": {
+        "不動産の表示": "東京都新宿区西新宿 1番1",
+        "所在": "東京都新宿区西新宿",
+        "地番": "1番1",
+        "地目": "宅地",
+        "地積": "500.00平方メートル",
+        "所有者の氏名又は名称": "田中太郎",
+        "住所": "東京都新宿区西新宿1-1-1",
+        "持分": "",
+        "登記の目的": "所有権保存",
+        "受付年月日・受付番号": "平成20年3月15日 第5678号",
+        "登記原因": "",
+        "権利者その他の事項": "所有者 田中太郎",
+        "建物の表示": "",
+        "家屋番号": "",
+        "構造": ""
+    },
+    "confidence_scores": {},
+    "metadata": {
+        "total_fields": 15,
+        "average_confidence": 0.9
+    }
+}
+
+
+class FakeGoogleHandler(BaseHTTPRequestHandler):
+    """images:annotate と generateContent を模擬するハンドラ"""
+
+    protocol_version = "HTTP/1.1"
+    # ヘッダーと本文を別セグメントで送るため、Nagle+遅延ACKによる待ちを避ける
+    disable_nagle_algorithm = True
+    server: "FakeGoogleServer"
+
+    def log_message(self, format, *args):
+        # ベンチマーク時の出力を抑制
+        pass
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length", "0"))
+        body = self.rfile.read(length)
+        endpoint = self.server.record_request(self.path, len(body))
+
+        error_status, delay_ms = self.server.inject_fault(endpoint)
+        if delay_ms:
+            time.sleep(delay_ms / 1000)
+        if error_status:
+            headers = {"Retry-After": str(self.server.retry_after)} if self.server.retry_after is not None else None
+            self._send_json(
+                error_status, {"error": {"code": error_status, "message": "Injected fault"}}, headers
+            )
+            return
+
+        try:
+            payload = json.loads(body or b"{}")
+        except json.JSONDecodeError:
+            self._send_json(400, {"error": {"code": 400, "message": "Invalid JSON payload"}})
+            return
+
+        status, response = self.server.route(self.path, payload)
+        if isinstance(response, dict) and self.server.output_token_ms:
+            # 生成時間を模擬（出力トークン数に比例）
+            output_tokens = response.get("usageMetadata", {}).get("candidatesTokenCount", 0)
+            time.sleep(output_tokens * self.server.output_token_ms / 1000)
+        if isinstance(response, list):
+            self._send_sse(status, response)
+        else:
+            self._send_json(status, response)
+
+    def _send_json(self, status: int, response: Dict, extra_headers: Optional[Dict[str, str]] = None):
+        content = json.dumps(response, ensure_ascii=False).encode('utf-8')
+        headers = {"Content-Type": "application/json; charset=UTF-8", **(extra_headers or {})}
+        if "gzip" in self.headers.get("Accept-Encoding", ""):
+            content = gzip.compress(content)
+            headers["Content-Encoding"] = "gzip"
+
+        self.send_response(status)
+        for name, value in headers.items():
+            self.send_header(name, value)
+        self.send_header("Content-Length", str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
+
+
+    def _send_sse(self, status: int, events: List[Dict]):
+        """イベントごとにチャンク転送で送信（イベント間に stream_interval_ms の間隔を空ける）"""
+        self.send_response(status)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        for index, event in enumerate(events):
+            if index and self.server.stream_interval_ms:
+                time.sleep(self.server.stream_interval_ms / 1000)
+            content = f"data: {json.dumps(event, ensure_ascii=False)}\r\n\r\n".encode('utf-8')
+            self.wfile.write(f"{len(content):x}\r\n".encode('ascii') + content + b"\r\n")
+            self.wfile.flush()
+        self.wfile.write(b"0\r\n\r\n")
+
+
+class FakeGoogleServer(ThreadingHTTPServer):
+    """フェイクサーバー本体（リクエスト数・接続数を記録）"""
+
+    daemon_threads = True
+
+    def __init__(
+        self,
+        address: Tuple[str, int],
+        latency_ms: float = 0.0,
+        stream_chunks: int = 8,
+        stream_interval_ms: float = 0.0,
+        error_rate: float = 0.0,
+        error_status: int = 503,
+        retry_after: Optional[float] = None,
+        slow_rate: float = 0.0,
+        slow_ms: float = 0.0,
+        seed: Optional[int] = None,
+        output_token_ms: float = 0.0,
+        latency_distribution: str = "fixed",
+        latency_spread: float = 0.0,
+        endpoint_latency_ms: Optional[Dict[str, float]] = None,
+        response_text_repeat: int = 1
+    ):
+        super().__init__(address, FakeGoogleHandler)
+        if latency_distribution not in LATENCY_DISTRIBUTIONS:
+            raise ValueError(f"未知の遅延分布です: {latency_distribution}")
+        self.latency_ms = latency_ms
+        # 遅延の分布（latency_ms / endpoint_latency_ms を中央値・平均とし、latency_spread で広がりを指定）
+        self.latency_distribution = latency_distribution
+        self.latency_spread = latency_spread
+        # エンドポイント（"annotate" / "generateContent" 等）ごとの基本遅延（指定のないものは latency_ms）
+        self.endpoint_latency_ms = dict(endpoint_latency_ms or {})
+        # images:annotate の応答テキストを繰り返す回数（応答サイズ・解析時間の調整用）
+        self.response_text_repeat = max(1, response_text_repeat)
+        self.stream_chunks = stream_chunks
+        self.stream_interval_ms = stream_interval_ms
+        # 障害注入（error_rate の割合で error_status を返し、slow_rate の割合で slow_ms 余分に遅らせる）
+        self.error_rate = error_rate
+        self.error_status = error_status
+        self.retry_after = retry_after
+        self.slow_rate = slow_rate
+        self.slow_ms = slow_ms
+        self._random = random.Random(seed)
+        # generateContent の出力トークンあたりの生成時間
+        self.output_token_ms = output_token_ms
+        self._lock = threading.Lock()
+        self.request_counts: Dict[str, int] = {}
+        self.connection_count = 0
+        self.bytes_received = 0
+        self.injected_errors = 0
+        self.injected_slow = 0
+
+    def process_request(self, request, client_address):
+        with self._lock:
+            self.connection_count += 1
+        super().process_request(request, client_address)
+
+    def record_request(self, path: str, body_bytes: int) -> str:
+        """リクエストを記録し、エンドポイント名（"annotate" / "generateContent" 等）を返す"""
+        endpoint = path.split("?")[0].rsplit(":", 1)[-1]
+        with self._lock:
+            self.request_counts[endpoint] = self.request_counts.get(endpoint, 0) + 1
+            self.bytes_received += body_bytes
+        return endpoint
+
+    def _sample_latency(self, base_ms: float) -> float:
+        """基本遅延と分布から1リクエスト分の遅延(ms)を生成（呼び出し元でロックを保持）"""
+        if base_ms <= 0 or self.latency_distribution == "fixed":
+            return base_ms
+        if self.latency_distribution == "uniform":
+            return max(0.0, self._random.uniform(base_ms - self.latency_spread, base_ms + self.latency_spread))
+        if self.latency_distribution == "exponential":
+            return self._random.expovariate(1 / base_ms)
+        # lognormal: 中央値が base_ms、latency_spread が対数の標準偏差（省略時は 0.5）
+        return self._random.lognormvariate(math.log(base_ms), self.latency_spread or 0.5)
+
+    def inject_fault(self, endpoint: str = "") -> Tuple[Optional[int], float]:
+        """
+        このリクエストに注入する障害
+
+        Returns:
+            (エラー応答のステータス（注入しない場合は None）, 応答前の遅延ms)
+        """
+        with self._lock:
+            delay_ms = self._sample_latency(self.endpoint_latency_ms.get(endpoint, self.latency_ms))
+            if self.slow_rate and self._random.random() < self.slow_rate:
+                self.injected_slow += 1
+                delay_ms += self.slow_ms
+            if self.error_rate and self._random.random() < self.error_rate:
+                self.injected_errors += 1
+                return self.error_status, delay_ms
+            return None, delay_ms
+
+    @property
+    def base_url(self) -> str:
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def route(self, path: str, payload: Dict) -> Tuple[int, Union[Dict, List[Dict]]]:
+        """応答本文（SSEの場合はイベントのリスト）を返す"""
+        endpoint = path.split("?")[0]
+        if endpoint.endswith("/images:annotate"):
+            return 200, self.annotate_response(payload)
+        if endpoint.endswith(":generateContent"):
+            return 200, self.generate_content_response(payload)
+        if endpoint.endswith(":streamGenerateContent"):
+            return 200, self.stream_generate_content_events(payload)
+        return 404, {"error": {"code": 404, "message": f"Unknown endpoint: {endpoint}"}}
+
+    def annotate_response(self, payload: Dict) -> Dict:
+        """requests 配列の要素数だけ textAnnotations を返す"""
+        page_text = SAMPLE_DEED_TEXT * self.response_text_repeat
+        annotation = {
+            "textAnnotations": [{"description": page_text}]
+            + [{"description": word, "confidence": 0.95} for word in page_text.split()]
+        }
+        return {"responses": [annotation for _ in payload.get("requests", [])]}
+
+    def generate_content_response(self, payload: Dict) -> Dict:
+        """固定の構造化結果を返す（複数文書の一括プロンプトには文書IDごとに返す）"""
+        prompt = "".join(
+            part.get("text", "") for content in payload.get("contents", []) for part in content.get("parts", [])
+        )
+        ids = document_ids(prompt)
+        if ids:
+            text = json.dumps({"documents": {doc_id: SAMPLE_STRUCTURED_DATA for doc_id in ids}}, ensure_ascii=False)
+        else:
+            text = json.dumps(SAMPLE_STRUCTURED_DATA, ensure_ascii=False)
+        return {
+            "candidates": [{"content": {"parts": [{"text": text}], "role": "model"}, "finishReason": "STOP"}],
+            "usageMetadata": {
+                "promptTokenCount": estimate_tokens(prompt),
+                "candidatesTokenCount": estimate_tokens(text),
+            },
+        }
+
+
+    def stream_generate_content_events(self, payload: Dict) -> List[Dict]:
+        """generateContent の応答テキストを stream_chunks 個に分割したイベント列"""
+        response = self.generate_content_response(payload)
+        text = response["candidates"][0]["content"]["parts"][0]["text"]
+        size = max(1, -(-len(text) // self.stream_chunks))
+        chunks = [text[i:i + size] for i in range(0, len(text), size)]
+        events = [
+            {"candidates": [{"content": {"parts": [{"text": chunk}], "role": "model"}}]}
+            for chunk in chunks
+        ]
+        events[-1]["candidates"][0]["finishReason"] = "STOP"
+        events[-1]["usageMetadata"] = response["usageMetadata"]
+        return events
+
+
+def start_fake_server(
+    host: str = "127.0.0.1", port: int = 0, latency_ms: float = 0.0, stream_interval_ms: float = 0.0, **faults
+) -> FakeGoogleServer:
+    """
+    フェイクサーバーをバックグラウンドスレッドで起動（port=0 で空きポートを使用）
+    faults には FakeGoogleServer の障害注入パラメータ（error_rate 等）を指定できる
+    """
+    server = FakeGoogleServer(
+        (host, port), latency_ms=latency_ms, stream_interval_ms=stream_interval_ms, **faults
+    )
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    return server
+
+
+def add_latency_arguments(parser: argparse.ArgumentParser):
+    """エンドポイントごとの遅延・分布のコマンドライン引数（ベンチマークと共通）"""
+    parser.add_argument("--vision_latency_ms", type=float, help="images:annotate の基本遅延(ms)（省略時は --latency_ms）")
+    parser.add_argument("--gemini_latency_ms", type=float, help="generateContent の基本遅延(ms)（省略時は --latency_ms）")
+    parser.add_argument("--latency_distribution", choices=LATENCY_DISTRIBUTIONS, default="fixed", help="遅延の分布")
+    parser.add_argument("--latency_spread", type=float, default=0.0,
+                        help="遅延の広がり（uniform は±ms、lognormal は対数の標準偏差）")
+
+
+def latency_options(args: argparse.Namespace) -> Dict:
+    """add_latency_arguments の引数から FakeGoogleServer の遅延パラメータを作成"""
+    endpoint_latency_ms = {}
+    if args.vision_latency_ms is not None:
+        endpoint_latency_ms["annotate"] = args.vision_latency_ms
+    if args.gemini_latency_ms is not None:
+        endpoint_latency_ms["generateContent"] = args.gemini_latency_ms
+        endpoint_latency_ms["streamGenerateContent"] = args.gemini_latency_ms
+    return {
+        "latency_distribution": args.latency_distribution,
+        "latency_spread": args.latency_spread,
+        "endpoint_latency_ms": endpoint_latency_ms,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Vision/Gemini フェイクサーバー")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--latency_ms", type=float, default=0.0, help="応答ごとの固定遅延(ms)")
+    parser.add_argument("--stream_interval_ms", type=float, default=0.0, help="ストリーミング応答のイベント間隔(ms)")
+    parser.add_argument("--error_rate", type=float, default=0.0, help="エラー応答を返す割合（0〜1）")
+    parser.add_argument("--error_status", type=int, default=503, help="注入するエラー応答のステータス")
+    parser.add_argument("--retry_after", type=float, help="エラー応答に付ける Retry-After（秒）")
+    parser.add_argument("--slow_rate", type=float, default=0.0, help="応答を遅らせる割合（0〜1）")
+    parser.add_argument("--slow_ms", type=float, default=0.0, help="遅らせる場合の追加遅延(ms)")
+    parser.add_argument("--seed", type=int, help="障害注入の乱数シード")
+    parser.add_argument("--output_token_ms", type=float, default=0.0, help="出力トークンあたりの生成時間(ms)")
+    add_latency_arguments(parser)
+    parser.add_argument("--response_text_repeat", type=int, default=1, help="Vision 応答のテキストを繰り返す回数")
+    args = parser.parse_args()
+
+    server = FakeGoogleServer(
+        (args.host, args.port), latency_ms=args.latency_ms, stream_interval_ms=args.stream_interval_ms,
+        error_rate=args.error_rate, error_status=args.error_status, retry_after=args.retry_after,
+        slow_rate=args.slow_rate, slow_ms=args.slow_ms, seed=args.seed, output_token_ms=args.output_token_ms,
+        response_text_repeat=args.response_text_repeat, **latency_options(args)
+    )
+    print(f"フェイクサーバー起動: {server.base_url}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == "__main__":
+    main()
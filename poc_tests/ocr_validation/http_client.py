@@ -0,0 +1,595 @@
+"""
+Google REST API 共通HTTPクライアント
+ホストごとのKeep-Alive接続プール、接続/読み取りタイムアウト、gzip応答、ストリーミング（SSE）受信、
+ファイルオブジェクトのリクエストボディ（ブロック単位で送信）、
+接続再利用率・DNS/TCP/TLS所要時間の統計を提供する（requests.Session のアダプターで接続を計測）
+
+プロキシ（HTTPS_PROXY / NO_PROXY）と CA バンドル（REQUESTS_CA_BUNDLE / SSL_CERT_FILE）は環境変数に従う
+"""
+
+import os
+import json
+import socket
+import time
+import threading
+import logging
+import urllib.error
+import urllib.parse
+import urllib.request
+from io import BytesIO
+from typing import Any, BinaryIO, Callable, Dict, Iterator, List, Mapping, Optional, Tuple, Union
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3 import HTTPConnectionPool, HTTPSConnectionPool
+from urllib3.connection import HTTPConnection, HTTPSConnection
+from urllib3.exceptions import ConnectTimeoutError
+from urllib3.util.connection import allowed_gai_family
+from urllib3.util.retry import Retry
+
+from tracing import span
+
+# ログ設定
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+DEFAULT_CONNECT_TIMEOUT = float(os.getenv("HTTP_CONNECT_TIMEOUT", "5"))
+DEFAULT_READ_TIMEOUT = float(os.getenv("HTTP_READ_TIMEOUT", "60"))
+DEFAULT_POOL_SIZE = int(os.getenv("HTTP_POOL_SIZE", "10"))
+HTTP2_ENABLED = os.getenv("HTTP2_ENABLED", "true").lower() == "true"
+# ファイルオブジェクトのリクエストボディを送信する際の読み込み単位
+UPLOAD_BLOCK_SIZE = 64 * 1024
+
+# エンドポイントのベースURL（ローカルのフェイクサーバーに向ける場合は環境変数で上書き）
+VISION_API_BASE_URL = os.getenv("VISION_API_BASE_URL", "https://vision.googleapis.com")
+GEMINI_API_BASE_URL = os.getenv("GEMINI_API_BASE_URL", "https://generativelanguage.googleapis.com")
+GEMINI_REST_MODEL = os.getenv("GEMINI_REST_MODEL", "gemini-1.5-flash")
+
+USER_AGENT = "real-estate-dx-ocr-poc/1.0"
+
+def vision_annotate_url(api_key: str) -> str:
+    """Vision API images:annotate のURL"""
+    return f"{VISION_API_BASE_URL}/v1/images:annotate?key={api_key}"
+
+
+def gemini_url(api_key: str, method: str = "generateContent", model: str = GEMINI_REST_MODEL) -> str:
+    """Gemini API（generativelanguage）のURL"""
+    return f"{GEMINI_API_BASE_URL}/v1beta/models/{model}:{method}?key={api_key}"
+
+
+# リクエストボディ（bytes または読み込み可能なファイルオブジェクト）
+RequestBody = Union[bytes, BinaryIO, None]
+# 上流へリクエストを送る直前に呼ぶフック（クォータの予約など。耐障害クライアントは再試行・ヘッジのたびに呼ぶ）
+BeforeAttempt = Optional[Callable[[], Any]]
+
+
+def _is_file_body(data: RequestBody) -> bool:
+    return hasattr(data, "read")
+
+
+def _body_length(data: RequestBody) -> int:
+    """リクエストボディのバイト数（ファイルオブジェクトの場合は先頭に巻き戻す）"""
+    if data is None:
+        return 0
+    if _is_file_body(data):
+        length = data.seek(0, os.SEEK_END)
+        data.seek(0)
+        return length
+    return len(data)
+
+
+def _iter_file_body(data: BinaryIO) -> Iterator[bytes]:
+    data.seek(0)
+    while True:
+        block = data.read(UPLOAD_BLOCK_SIZE)
+        if not block:
+            break
+        yield block
+
+
+class HTTPResponse:
+    """
+    読み取り済みのHTTPレスポンス
+    raise_for_status() は urllib と同じ urllib.error.HTTPError を送出する
+    """
+
+    def __init__(self, url: str, status: int, reason: str, headers: Mapping[str, str], content: bytes):
+        self.url = url
+        self.status = status
+        self.reason = reason
+        self.headers = headers
+        self.content = content
+
+    @property
+    def text(self) -> str:
+        return self.content.decode('utf-8', errors='replace')
+
+    def json(self) -> Any:
+        return json.loads(self.content)
+
+    def raise_for_status(self):
+        if self.status >= 400:
+            raise urllib.error.HTTPError(
+                self.url, self.status, self.reason, self.headers, BytesIO(self.content)
+            )
+
+
+class ConnectionStats:
+    """接続プールの統計（スレッドセーフ）"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.requests = 0
+        self.new_connections = 0
+        self.reused_connections = 0
+        # 名前解決を計測した接続数（HTTP/2 クライアントは名前解決をTCP接続時間に含めるため数えない）
+        self.dns_lookups = 0
+        self.dns_ms = 0.0
+        self.tcp_connect_ms = 0.0
+        self.tls_ms = 0.0
+        self.bytes_sent = 0
+        self.bytes_received = 0
+        self.bytes_decoded = 0
+
+    def record_connect(self, dns_ms: Optional[float], tcp_connect_ms: float, tls_ms: float):
+        """dns_ms が None の場合は名前解決を計測していない（tcp_connect_ms に含まれる）"""
+        with self._lock:
+            self.new_connections += 1
+            if dns_ms is not None:
+                self.dns_lookups += 1
+                self.dns_ms += dns_ms
+            self.tcp_connect_ms += tcp_connect_ms
+            self.tls_ms += tls_ms
+
+    def record_request(self, reused: bool, bytes_sent: int, bytes_received: int, bytes_decoded: int):
+        with self._lock:
+            self.requests += 1
+            if reused:
+                self.reused_connections += 1
+            self.bytes_sent += bytes_sent
+            self.bytes_received += bytes_received
+            self.bytes_decoded += bytes_decoded
+
+    def as_dict(self) -> Dict:
+        with self._lock:
+            return {
+                "requests": self.requests,
+                "new_connections": self.new_connections,
+                "reused_connections": self.reused_connections,
+                "reuse_rate": self.reused_connections / self.requests if self.requests else 0.0,
+                "dns_ms_total": self.dns_ms if self.dns_lookups else None,
+                "tcp_connect_ms_total": self.tcp_connect_ms,
+                "tls_ms_total": self.tls_ms,
+                "bytes_sent": self.bytes_sent,
+                "bytes_received": self.bytes_received,
+                "bytes_decoded": self.bytes_decoded,
+            }
+
+
+class _TimedConnectMixin:
+    """
+    DNS解決・TCP接続・TLSハンドシェイクの所要時間を計測する urllib3 の接続
+    リクエストの送信（ボディのアップロード）までを upload スパンとして記録する
+    """
+
+    stats: ConnectionStats
+    on_connect: Any
+
+    def _new_conn(self):
+        # 名前解決を計測し、解決済みのアドレスに順に接続する（urllib3 が再度名前解決しないようにする）
+        host = self._dns_host
+        start = time.perf_counter()
+        try:
+            addresses = [
+                info[4][0] for info in socket.getaddrinfo(host, self.port, allowed_gai_family(), socket.SOCK_STREAM)
+            ]
+        except socket.gaierror:
+            # 名前解決のエラーは urllib3 の接続処理で NameResolutionError として送出させる
+            addresses = [host]
+        connect_start = time.perf_counter()
+        self._dns_ms = (connect_start - start) * 1000
+        try:
+            for index, address in enumerate(addresses):
+                self._dns_host = address
+                try:
+                    sock = super()._new_conn()
+                    break
+                except ConnectTimeoutError:
+                    if index == len(addresses) - 1:
+                        raise
+        finally:
+            self._dns_host = host
+        self._tcp_ms = (time.perf_counter() - connect_start) * 1000
+        return sock
+
+    def connect(self):
+        start = time.perf_counter()
+        super().connect()
+        total_ms = (time.perf_counter() - start) * 1000
+        dns_ms = getattr(self, "_dns_ms", 0.0)
+        tcp_ms = getattr(self, "_tcp_ms", total_ms - dns_ms)
+        self.stats.record_connect(dns_ms, tcp_ms, total_ms - dns_ms - tcp_ms)
+        self.on_connect()
+
+    def request(self, method, url, body=None, headers=None, **kwargs):
+        # URLはAPIキーを含むため記録しない
+        body_bytes = len(body) if isinstance(body, (bytes, bytearray)) else int((headers or {}).get("Content-Length", 0))
+        with span("upload", method=method, body_bytes=body_bytes):
+            return super().request(method, url, body=body, headers=headers, **kwargs)
+
+
+class _TimedHTTPAdapter(HTTPAdapter):
+    """接続を計測する接続プールを使う HTTPAdapter（プロキシ経由の接続も同じ）"""
+
+    def __init__(self, stats: ConnectionStats, on_connect, pool_size: int):
+        attributes = {"stats": stats, "on_connect": staticmethod(on_connect)}
+        self._pool_classes = {
+            "http": type("_TimedHTTPConnectionPool", (HTTPConnectionPool,), {
+                "ConnectionCls": type("_TimedHTTPConnection", (_TimedConnectMixin, HTTPConnection), attributes),
+            }),
+            "https": type("_TimedHTTPSConnectionPool", (HTTPSConnectionPool,), {
+                "ConnectionCls": type("_TimedHTTPSConnection", (_TimedConnectMixin, HTTPSConnection), attributes),
+            }),
+        }
+        # 接続エラーは1回だけ新しい接続で再試行する（応答の再試行は resilient_client が行う）
+        super().__init__(
+            pool_connections=pool_size, pool_maxsize=pool_size,
+            max_retries=Retry(total=1, connect=1, read=0, redirect=0, status=0, other=0, raise_on_status=False)
+        )
+
+    def init_poolmanager(self, connections, maxsize, block=False, **pool_kwargs):
+        super().init_poolmanager(connections, maxsize, block=block, blocksize=UPLOAD_BLOCK_SIZE, **pool_kwargs)
+        self.poolmanager.pool_classes_by_scheme = self._pool_classes
+
+    def proxy_manager_for(self, proxy, **proxy_kwargs):
+        manager = super().proxy_manager_for(proxy, blocksize=UPLOAD_BLOCK_SIZE, **proxy_kwargs)
+        manager.pool_classes_by_scheme = self._pool_classes
+        return manager
+
+
+def _ca_bundle():
+    """証明書の検証に使う CA バンドル（REQUESTS_CA_BUNDLE / SSL_CERT_FILE、未指定は requests の既定）"""
+    return os.getenv("REQUESTS_CA_BUNDLE") or os.getenv("SSL_CERT_FILE") or True
+
+
+class PooledHTTPClient:
+    """
+    ホスト単位でKeep-Alive接続を使い回すHTTP/1.1クライアント（requests.Session）
+    プールに戻すのは応答を最後まで読み切った接続のみ（読み取り・展開に失敗した接続は閉じる）
+    """
+
+    def __init__(
+        self,
+        pool_size: int = DEFAULT_POOL_SIZE,
+        connect_timeout: float = DEFAULT_CONNECT_TIMEOUT,
+        read_timeout: float = DEFAULT_READ_TIMEOUT,
+    ):
+        self.pool_size = pool_size
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+        self.stats = ConnectionStats()
+        self._local = threading.local()
+        self._session = requests.Session()
+        self._session.headers.update({"User-Agent": USER_AGENT, "Accept-Encoding": "gzip"})
+        self._session.verify = _ca_bundle()
+        # requests はリクエストごとに環境変数を走査してプロキシを決めるため、作成時に一度だけ読み込み、
+        # ホストごとの判定結果を使い回す（.netrc の参照も行わない）
+        self._session.trust_env = False
+        self._environ_proxies = urllib.request.getproxies()
+        self._host_proxies: Dict[Tuple[str, str], Dict[str, str]] = {}
+        adapter = _TimedHTTPAdapter(self.stats, self._on_connect, pool_size)
+        self._session.mount("https://", adapter)
+        self._session.mount("http://", adapter)
+
+    def _on_connect(self):
+        self._local.new_connection = True
+
+    def _proxies_for(self, url: str) -> Dict[str, str]:
+        """URLに使うプロキシ（HTTPS_PROXY / HTTP_PROXY、NO_PROXY に該当するホストは直接接続）"""
+        parsed = urllib.parse.urlsplit(url)
+        key = (parsed.scheme, parsed.hostname or "")
+        proxies = self._host_proxies.get(key)
+        if proxies is None:
+            proxy = self._environ_proxies.get(parsed.scheme)
+            if proxy and not urllib.request.proxy_bypass_environment(key[1], self._environ_proxies):
+                proxies = {parsed.scheme: proxy}
+            else:
+                proxies = {}
+            self._host_proxies[key] = proxies
+        return proxies
+
+    def _send(
+        self, method: str, url: str, json: Any, data: RequestBody, headers: Optional[Dict[str, str]],
+        timeout: Optional[float], stream: bool, before_attempt: BeforeAttempt
+    ) -> Tuple[requests.Response, RequestBody, bool]:
+        """(応答, 統計用のボディ, 接続を再利用したか)"""
+        if before_attempt is not None:
+            before_attempt()
+        if json is not None:
+            data = _json_dumps(json)
+            headers = {"Content-Type": "application/json", **(headers or {})}
+        elif _is_file_body(data):
+            # 再送時もファイルの先頭から送信する
+            data.seek(0)
+        self._local.new_connection = False
+        read_timeout = timeout if timeout is not None else self.read_timeout
+        response = self._session.request(
+            method, url, data=data, headers=headers, timeout=(self.connect_timeout, read_timeout), stream=stream,
+            proxies=self._proxies_for(url)
+        )
+        return response, data, not self._local.new_connection
+
+    def request(
+        self,
+        method: str,
+        url: str,
+        json: Any = None,
+        data: RequestBody = None,
+        headers: Optional[Dict[str, str]] = None,
+        timeout: Optional[float] = None,
+        before_attempt: BeforeAttempt = None,
+    ) -> HTTPResponse:
+        """
+        リクエストを送信し、応答本文を読み切って返す
+        timeout は読み取りタイムアウト（接続タイムアウトはクライアント設定を使用）
+        before_attempt は送信の直前に1回呼ぶ
+        """
+        response, data, reused = self._send(method, url, json, data, headers, timeout, True, before_attempt)
+        try:
+            # requests が gzip を展開する（展開前のバイト数は urllib3 の応答から取得）
+            content = response.content
+            wire_bytes = response.raw.tell()
+        except Exception:
+            response.close()
+            raise
+        self.stats.record_request(reused, _body_length(data), wire_bytes, len(content))
+        return HTTPResponse(url, response.status_code, response.reason, response.headers, content)
+
+    def stream_lines(
+        self,
+        method: str,
+        url: str,
+        json: Any = None,
+        data: RequestBody = None,
+        headers: Optional[Dict[str, str]] = None,
+        timeout: Optional[float] = None,
+        before_attempt: BeforeAttempt = None,
+    ) -> Iterator[str]:
+        """
+        リクエストを送信し、応答本文を1行ずつ受信した順に返す（Server-Sent Events 用）
+        逐次受信するため gzip は要求しない。途中で打ち切った場合、接続はプールに戻さず閉じる
+        エラー応答（4xx/5xx）は本文を読み切って urllib.error.HTTPError を送出する
+        """
+        response, data, reused = self._send(
+            method, url, json, data, {"Accept-Encoding": "identity", **(headers or {})}, timeout, True, before_attempt
+        )
+        if response.status_code >= 400:
+            try:
+                content = response.content
+            finally:
+                response.close()
+            self.stats.record_request(reused, _body_length(data), len(content), len(content))
+            HTTPResponse(url, response.status_code, response.reason, response.headers, content).raise_for_status()
+
+        received = 0
+        finished = False
+        try:
+            pending = b""
+            while True:
+                # 届いた分だけ読み込む（行の途中で止まらないよう、改行ごとに区切って返す）
+                chunk = response.raw.read1(UPLOAD_BLOCK_SIZE)
+                if not chunk:
+                    break
+                received += len(chunk)
+                *lines, pending = (pending + chunk).split(b"\n")
+                for line in lines:
+                    yield line.decode('utf-8').rstrip("\r")
+            if pending:
+                yield pending.decode('utf-8').rstrip("\r")
+            finished = True
+        finally:
+            if finished:
+                response.raw.release_conn()
+            else:
+                response.close()
+            self.stats.record_request(reused, _body_length(data), received, received)
+
+    def get(self, url: str, **kwargs) -> HTTPResponse:
+        return self.request("GET", url, **kwargs)
+
+    def post(self, url: str, **kwargs) -> HTTPResponse:
+        return self.request("POST", url, **kwargs)
+
+    def close(self):
+        """プール内の接続をすべて閉じる"""
+        self._session.close()
+
+
+class HTTP2Client:
+    """
+    httpx（h2導入時）によるHTTP/2クライアント
+    PooledHTTPClient と同じインターフェース・統計を提供する
+    DNS解決はTCP接続時間に含まれる（httpcoreのトレースでは分離できないため）
+    """
+
+    def __init__(
+        self,
+        pool_size: int = DEFAULT_POOL_SIZE,
+        connect_timeout: float = DEFAULT_CONNECT_TIMEOUT,
+        read_timeout: float = DEFAULT_READ_TIMEOUT,
+    ):
+        import httpx
+
+        self._httpx = httpx
+        self.read_timeout = read_timeout
+        self.connect_timeout = connect_timeout
+        self.stats = ConnectionStats()
+        self._client = httpx.Client(
+            http2=True,
+            limits=httpx.Limits(max_connections=None, max_keepalive_connections=pool_size),
+            timeout=httpx.Timeout(read_timeout, connect=connect_timeout),
+            headers={"User-Agent": USER_AGENT, "Accept-Encoding": "gzip"},
+            verify=_ca_bundle(),
+        )
+        self._local = threading.local()
+
+    def _trace(self, event_name: str, info: Dict):
+        # 接続確立イベントの時刻から接続・TLSの所要時間を求める
+        now = time.perf_counter()
+        if event_name == "connection.connect_tcp.started":
+            self._local.tcp_started = now
+        elif event_name == "connection.connect_tcp.complete":
+            self._local.tcp_ms = (now - self._local.tcp_started) * 1000
+            self._local.new_connection = True
+        elif event_name == "connection.start_tls.started":
+            self._local.tls_started = now
+        elif event_name == "connection.start_tls.complete":
+            self._local.tls_ms = (now - self._local.tls_started) * 1000
+
+    def _prepare_body(
+        self, json: Any, data: RequestBody, headers: Optional[Dict[str, str]]
+    ) -> Tuple[RequestBody, Any, Optional[Dict[str, str]]]:
+        """(統計用のボディ, httpxに渡すcontent, ヘッダー)"""
+        if json is not None:
+            data = _json_dumps(json)
+            headers = {"Content-Type": "application/json", **(headers or {})}
+        if _is_file_body(data):
+            # ファイルは行単位ではなくブロック単位で送信し、chunked 転送にならないようサイズを明示する
+            headers = {"Content-Length": str(_body_length(data)), **(headers or {})}
+            return data, _iter_file_body(data), headers
+        return data, data, headers
+
+    def request(
+        self,
+        method: str,
+        url: str,
+        json: Any = None,
+        data: RequestBody = None,
+        headers: Optional[Dict[str, str]] = None,
+        timeout: Optional[float] = None,
+        before_attempt: BeforeAttempt = None,
+    ) -> HTTPResponse:
+        if before_attempt is not None:
+            before_attempt()
+        self._local.new_connection = False
+        self._local.tcp_ms = 0.0
+        self._local.tls_ms = 0.0
+
+        data, content, headers = self._prepare_body(json, data, headers)
+
+        read_timeout = timeout if timeout is not None else self.read_timeout
+        response = self._client.request(
+            method, url, content=content, headers=headers,
+            timeout=self._httpx.Timeout(read_timeout, connect=self.connect_timeout),
+            extensions={"trace": self._trace},
+        )
+
+        if self._local.new_connection:
+            self.stats.record_connect(None, self._local.tcp_ms, self._local.tls_ms)
+        content = response.content
+        wire_bytes = response.num_bytes_downloaded
+        self.stats.record_request(not self._local.new_connection, _body_length(data), wire_bytes, len(content))
+        return HTTPResponse(url, response.status_code, response.reason_phrase, response.headers, content)
+
+    def stream_lines(
+        self,
+        method: str,
+        url: str,
+        json: Any = None,
+        data: RequestBody = None,
+        headers: Optional[Dict[str, str]] = None,
+        timeout: Optional[float] = None,
+        before_attempt: BeforeAttempt = None,
+    ) -> Iterator[str]:
+        """応答本文を1行ずつ受信した順に返す（PooledHTTPClient.stream_lines と同じ）"""
+        if before_attempt is not None:
+            before_attempt()
+        self._local.new_connection = False
+        self._local.tcp_ms = 0.0
+        self._local.tls_ms = 0.0
+
+        data, content, headers = self._prepare_body(json, data, headers)
+        headers = {"Accept-Encoding": "identity", **(headers or {})}
+
+        read_timeout = timeout if timeout is not None else self.read_timeout
+        with self._client.stream(
+            method, url, content=content, headers=headers,
+            timeout=self._httpx.Timeout(read_timeout, connect=self.connect_timeout),
+            extensions={"trace": self._trace},
+        ) as response:
+            if self._local.new_connection:
+                self.stats.record_connect(None, self._local.tcp_ms, self._local.tls_ms)
+            reused = not self._local.new_connection
+            try:
+                if response.status_code >= 400:
+                    content = response.read()
+                    HTTPResponse(
+                        url, response.status_code, response.reason_phrase, response.headers, content
+                    ).raise_for_status()
+                for line in response.iter_lines():
+                    yield line
+            finally:
+                wire_bytes = response.num_bytes_downloaded
+                self.stats.record_request(reused, _body_length(data), wire_bytes, wire_bytes)
+
+    def get(self, url: str, **kwargs) -> HTTPResponse:
+        return self.request("GET", url, **kwargs)
+
+    def post(self, url: str, **kwargs) -> HTTPResponse:
+        return self.request("POST", url, **kwargs)
+
+    def close(self):
+        self._client.close()
+
+
+def iter_sse_data(lines: Iterator[str]) -> Iterator[str]:
+    """
+    Server-Sent Events の行ストリームから各イベントの data を取り出す
+    複数行の data は改行で連結し、空行でイベントを区切る
+    """
+    data_lines: List[str] = []
+    for line in lines:
+        if not line:
+            if data_lines:
+                yield "\n".join(data_lines)
+                data_lines = []
+        elif line.startswith("data:"):
+            data_lines.append(line[5:].lstrip(" "))
+    if data_lines:
+        yield "\n".join(data_lines)
+
+
+def _json_dumps(payload: Any) -> bytes:
+    return json.dumps(payload, ensure_ascii=False).encode('utf-8')
+
+
+def _http2_available() -> bool:
+    try:
+        import httpx  # noqa: F401
+        import h2  # noqa: F401
+        return True
+    except ImportError:
+        return False
+
+
+def create_client(http2: bool = HTTP2_ENABLED, **kwargs):
+    """
+    HTTPクライアントを作成
+    HTTP/2が有効かつ httpx[http2] が導入されていればHTTP/2、それ以外はHTTP/1.1 Keep-Alive
+    """
+    if http2 and _http2_available():
+        return HTTP2Client(**kwargs)
+    return PooledHTTPClient(**kwargs)
+
+
+_shared_client = None
+_shared_client_lock = threading.Lock()
+
+
+def get_shared_client():
+    """プロセス内で共有するHTTPクライアント"""
+    global _shared_client
+    with _shared_client_lock:
+        if _shared_client is None:
+            _shared_client = create_client()
+        return _shared_client
@@ -0,0 +1,147 @@
+"""
+画像前処理（OCRService / OCRServiceAPIKey 共通）
+グレースケールで直接デコードし、事前確保したバッファ上でノイズ除去・二値化を行う
+二値化後のエンコード方式（1bit PNG・縮小等）は upload_encoding で選択する
+"""
+
+import os
+import time
+import threading
+import logging
+from typing import Dict, Optional, Tuple
+
+import cv2
+import numpy as np
+
+from upload_encoding import UploadEncoder, DEFAULT_UPLOAD_ENCODING
+
+# ログ設定
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# ノイズ除去プロファイル
+#   quality: Non-local Means（従来の処理。高品質だが低速）
+#   fast:    メディアンフィルタ（ごま塩ノイズに強く高速）
+#   bilateral: バイラテラルフィルタ（文字エッジを保ちつつ平滑化）
+PREPROCESS_PROFILES: Dict[str, Dict] = {
+    "quality": {"denoise": "nlm", "h": 3, "template_window": 7, "search_window": 21},
+    "fast": {"denoise": "median", "ksize": 3},
+    "bilateral": {"denoise": "bilateral", "diameter": 5, "sigma_color": 50, "sigma_space": 50},
+}
+
+DEFAULT_PREPROCESS_PROFILE = os.getenv("OCR_PREPROCESS_PROFILE", "quality")
+
+# 適応的閾値処理のパラメータ（従来値）
+ADAPTIVE_BLOCK_SIZE = 11
+ADAPTIVE_C = 2
+
+
+class _FrameBuffers:
+    """同一サイズのページで使い回す作業バッファ"""
+
+    def __init__(self, shape: Tuple[int, int]):
+        self.shape = shape
+        self.denoised = np.empty(shape, dtype=np.uint8)
+        self.binary = np.empty(shape, dtype=np.uint8)
+
+
+class ImagePreprocessor:
+    """
+    画像前処理: ノイズ除去、二値化
+    作業バッファはスレッドごとに保持するため、複数スレッドから同時に呼び出せる
+    """
+
+    def __init__(
+        self,
+        profile: str = DEFAULT_PREPROCESS_PROFILE,
+        upload_encoding: str = DEFAULT_UPLOAD_ENCODING,
+        source_dpi: Optional[int] = None
+    ):
+        """
+        Args:
+            profile: ノイズ除去プロファイル
+            upload_encoding: 二値化後のエンコード方式（"png1@200" 等。upload_encoding 参照）
+            source_dpi: 入力画像のレンダリングDPI（縮小を伴うエンコード方式で使用）
+        """
+        if profile not in PREPROCESS_PROFILES:
+            raise ValueError(f"未知の前処理プロファイルです: {profile}")
+        self.profile = profile
+        self.params = PREPROCESS_PROFILES[profile]
+        self.encoder = UploadEncoder(upload_encoding, source_dpi)
+        if not self.encoder.format.images_annotate:
+            raise ValueError(f"Vision API（images:annotate）に送信できないエンコード方式です: {upload_encoding}")
+        self._local = threading.local()
+
+    def _buffers(self, shape: Tuple[int, int]) -> _FrameBuffers:
+        buffers = getattr(self._local, "buffers", None)
+        if buffers is None or buffers.shape != shape:
+            buffers = _FrameBuffers(shape)
+            self._local.buffers = buffers
+        return buffers
+
+    def decode(self, image_data: bytes) -> np.ndarray:
+        """
+        画像バイト列をグレースケールで直接デコード（RGB経由の変換を行わない）
+        """
+        gray = cv2.imdecode(np.frombuffer(image_data, dtype=np.uint8), cv2.IMREAD_GRAYSCALE)
+        if gray is None:
+            raise ValueError("画像のデコードに失敗しました")
+        return gray
+
+    def denoise(self, gray: np.ndarray, dst: np.ndarray) -> np.ndarray:
+        """プロファイルに応じたノイズ除去を dst に書き込む"""
+        params = self.params
+        method = params["denoise"]
+        if method == "nlm":
+            return cv2.fastNlMeansDenoising(
+                gray, dst, params["h"], params["template_window"], params["search_window"]
+            )
+        if method == "median":
+            return cv2.medianBlur(gray, params["ksize"], dst)
+        if method == "bilateral":
+            return cv2.bilateralFilter(
+                gray, params["diameter"], params["sigma_color"], params["sigma_space"], dst
+            )
+        raise ValueError(f"未知のノイズ除去方式です: {method}")
+
+    def binarize(self, gray: np.ndarray, dst: np.ndarray) -> np.ndarray:
+        """適応的閾値処理（二値化）を dst に書き込む"""
+        return cv2.adaptiveThreshold(
+            gray, 255, cv2.ADAPTIVE_THRESH_GAUSSIAN_C, cv2.THRESH_BINARY,
+            ADAPTIVE_BLOCK_SIZE, ADAPTIVE_C, dst
+        )
+
+    def encode(self, binary: np.ndarray) -> bytes:
+        """二値画像を送信用にエンコード（既定はフル解像度の8bit PNG）"""
+        return self.encoder.encode(binary)
+
+    def process(self, image_data: bytes, timings: Optional[Dict[str, float]] = None) -> bytes:
+        """
+        前処理を実行してエンコード済みの画像バイト列を返す
+
+        Args:
+            image_data: 入力画像（PNG/JPEG等）
+            timings: 指定された場合、各ステージの処理時間(ms)を書き込む
+        """
+        stage_start = time.perf_counter()
+
+        def lap(stage: str):
+            nonlocal stage_start
+            if timings is not None:
+                now = time.perf_counter()
+                timings[stage] = (now - stage_start) * 1000
+                stage_start = now
+
+        gray = self.decode(image_data)
+        lap("decode")
+
+        buffers = self._buffers(gray.shape)
+        denoised = self.denoise(gray, buffers.denoised)
+        lap("denoise")
+
+        binary = self.binarize(denoised, buffers.binary)
+        lap("threshold")
+
+        encoded = self.encode(binary)
+        lap("encode")
+        return encoded
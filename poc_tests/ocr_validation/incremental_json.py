@@ -0,0 +1,207 @@
+"""
+インクリメンタルJSONパーサー
+Gemini のストリーミング応答をチャンク単位で受け取り、オブジェクトのメンバーが確定した時点で通知する
+応答が途中で切れた・壊れている場合も、それまでに確定したメンバーを含む部分結果を返す
+"""
+
+import json
+import logging
+from typing import Any, Callable, Dict, List, Optional, Tuple, Union
+
+# ログ設定
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+JSONPath = Tuple[Union[str, int], ...]
+MemberCallback = Callable[[JSONPath, Any], None]
+
+_WHITESPACE = " \t\r\n"
+_SCALAR_CHARS = set("+-0123456789.eEtruefalsn")
+
+
+class _Frame:
+    """解析中のオブジェクト／配列"""
+
+    __slots__ = ("container", "path", "key", "state")
+
+    def __init__(self, container: Union[Dict, List], path: JSONPath):
+        self.container = container
+        self.path = path
+        self.key: Optional[str] = None
+        # オブジェクト: key → colon → value → comma / 配列: value → comma
+        self.state = "key" if isinstance(container, dict) else "value"
+
+
+class IncrementalJSONParser:
+    """
+    文字単位の状態機械によるJSONパーサー
+    - ルートのオブジェクトより前の文字（```json 等のコードフェンス）は読み飛ばす
+    - メンバー（値）が確定するたびに on_member(パス, 値) を呼び出す
+    - 構文エラーを検出した時点で解析を止め、それまでの部分結果を保持する
+    """
+
+    def __init__(self, on_member: Optional[MemberCallback] = None):
+        self.on_member = on_member
+        self.root: Optional[Dict] = None
+        self.complete = False
+        self.error: Optional[str] = None
+        self._stack: List[_Frame] = []
+        self._token: List[str] = []
+        self._in_string = False
+        self._escape = False
+
+    def feed(self, chunk: str):
+        """チャンクを解析"""
+        for char in chunk:
+            if self.complete or self.error:
+                return
+            self._feed_char(char)
+
+    def _feed_char(self, char: str):
+        if self._in_string:
+            self._token.append(char)
+            if self._escape:
+                self._escape = False
+            elif char == "\\":
+                self._escape = True
+            elif char == '"':
+                self._in_string = False
+                self._finish_string()
+            return
+
+        if self._token and char not in _SCALAR_CHARS:
+            if not self._finish_scalar():
+                return
+
+        if not self._stack:
+            # ルートのオブジェクト開始まで読み飛ばす
+            if char == "{":
+                self.root = {}
+                self._stack.append(_Frame(self.root, ()))
+            return
+
+        if char in _WHITESPACE:
+            return
+
+        frame = self._stack[-1]
+        if frame.state == "key":
+            if char == '"':
+                self._begin_string()
+            elif char == "}" and not frame.container:
+                self._close(frame)
+            else:
+                self._fail(f"キーが必要な位置に '{char}' があります")
+        elif frame.state == "colon":
+            if char == ":":
+                frame.state = "value"
+            else:
+                self._fail(f"':' が必要な位置に '{char}' があります")
+        elif frame.state == "value":
+            if char == '"':
+                self._begin_string()
+            elif char in "{[":
+                container: Union[Dict, List] = {} if char == "{" else []
+                self._attach(frame, container)
+                self._stack.append(_Frame(container, self._member_path(frame)))
+            elif char == "]" and isinstance(frame.container, list) and not frame.container:
+                self._close(frame)
+            elif char in _SCALAR_CHARS:
+                self._token.append(char)
+            else:
+                self._fail(f"値が必要な位置に '{char}' があります")
+        elif frame.state == "comma":
+            if char == ",":
+                frame.state = "key" if isinstance(frame.container, dict) else "value"
+            elif char in "}]":
+                self._close(frame)
+            else:
+                self._fail(f"',' が必要な位置に '{char}' があります")
+
+    def _begin_string(self):
+        self._in_string = True
+        self._token = ['"']
+
+    def _finish_string(self):
+        raw = "".join(self._token)
+        self._token = []
+        try:
+            value = json.loads(raw)
+        except json.JSONDecodeError:
+            self._fail(f"文字列を解釈できません: {raw[:40]}")
+            return
+
+        frame = self._stack[-1]
+        if frame.state == "key":
+            frame.key = value
+            frame.state = "colon"
+        else:
+            self._complete_value(frame, value)
+
+    def _finish_scalar(self) -> bool:
+        raw = "".join(self._token)
+        self._token = []
+        try:
+            value = json.loads(raw)
+        except json.JSONDecodeError:
+            self._fail(f"値を解釈できません: {raw[:40]}")
+            return False
+        self._complete_value(self._stack[-1], value)
+        return True
+
+    def _member_path(self, frame: _Frame) -> JSONPath:
+        if isinstance(frame.container, dict):
+            return frame.path + (frame.key,)
+        return frame.path + (len(frame.container) - 1,)
+
+    def _attach(self, frame: _Frame, value: Any):
+        if isinstance(frame.container, dict):
+            frame.container[frame.key] = value
+        else:
+            frame.container.append(value)
+        frame.state = "comma"
+
+    def _complete_value(self, frame: _Frame, value: Any):
+        self._attach(frame, value)
+        self._emit(self._member_path(frame), value)
+
+    def _close(self, frame: _Frame):
+        self._stack.pop()
+        if not self._stack:
+            self.complete = True
+            return
+        self._emit(frame.path, frame.container)
+
+    def _emit(self, path: JSONPath, value: Any):
+        if self.on_member is not None:
+            try:
+                self.on_member(path, value)
+            except Exception as e:
+                logger.warning(f"メンバー通知でエラー発生: {e}")
+
+    def _fail(self, message: str):
+        self.error = message
+        logger.warning(f"JSON解析を中断しました（部分結果を使用）: {message}")
+
+    def result(self) -> Optional[Dict]:
+        """
+        解析結果（完了していない場合は確定済みのメンバーのみを含む部分結果）
+        ルートのオブジェクトが始まっていない場合は None
+        """
+        if self.root is None:
+            return None
+        if self._token and not self._in_string and not self.error and self._stack:
+            # 末尾の数値・リテラルは区切りが来ないと確定しないため、ここで確定させる
+            self._finish_scalar()
+        return self.root
+
+
+def parse_partial_json(text: str) -> Tuple[Optional[Dict], bool]:
+    """
+    JSONテキストを解析し、壊れている場合は解釈できた部分までを返す
+
+    Returns:
+        (解析結果, 完全に解析できたか)
+    """
+    parser = IncrementalJSONParser()
+    parser.feed(text)
+    return parser.result(), parser.complete
@@ -0,0 +1,213 @@
+"""
+OCR結果キャッシュ（コンテンツアドレス方式）
+前処理済みページ画像のハッシュ＋前処理プロファイルをキーに Vision API の結果を SQLite に保存する
+同じ謄本PDFが別案件で再添付された場合に Vision API の呼び出しを省略する
+"""
+
+import os
+import time
+import sqlite3
+import hashlib
+import threading
+import logging
+from typing import Dict, Optional, Tuple
+
+# ログ設定
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# キャッシュ設定
+OCR_CACHE_ENABLED = os.getenv("OCR_CACHE_ENABLED", "true").lower() == "true"
+OCR_CACHE_PATH = os.getenv("OCR_CACHE_PATH", "ocr_cache.sqlite3")
+OCR_CACHE_MAX_MB = float(os.getenv("OCR_CACHE_MAX_MB", "256"))
+
+# 1エントリあたりの行オーバーヘッドの見積もり（キー・数値列）
+ENTRY_OVERHEAD_BYTES = 128
+# 上限超過時は上限のこの割合まで削除する（保存のたびに削除が走らないように）
+EVICTION_TARGET_RATIO = 0.9
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS ocr_results (
+    cache_key TEXT PRIMARY KEY,
+    profile TEXT NOT NULL,
+    text TEXT NOT NULL,
+    confidence REAL NOT NULL,
+    api_latency REAL NOT NULL,
+    size_bytes INTEGER NOT NULL,
+    created_at REAL NOT NULL,
+    last_access REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_ocr_results_last_access ON ocr_results (last_access);
+"""
+
+
+class CacheStats:
+    """ヒット・ミス数と、ヒットにより省略できた Vision API 呼び出しの集計"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.stores = 0
+        self.evictions = 0
+        self.saved_latency_seconds = 0.0
+
+    def record_hit(self, api_latency: float):
+        with self._lock:
+            self.hits += 1
+            self.saved_latency_seconds += api_latency
+
+    def record_miss(self):
+        with self._lock:
+            self.misses += 1
+
+    def record_store(self, evicted: int):
+        with self._lock:
+            self.stores += 1
+            self.evictions += evicted
+
+    def as_dict(self) -> Dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "stores": self.stores,
+                "evictions": self.evictions,
+                # ヒット1件 = Vision API 1ページ分の呼び出しを省略
+                "saved_vision_calls": self.hits,
+                "saved_latency_seconds": self.saved_latency_seconds,
+            }
+
+
+class OCRResultCache:
+    """
+    SQLite によるサイズ上限付き LRU キャッシュ
+    1つの接続をロックで保護するため、複数スレッドから同時に呼び出せる
+    """
+
+    def __init__(self, path: str = OCR_CACHE_PATH, max_mb: float = OCR_CACHE_MAX_MB):
+        self.path = path
+        self.max_bytes = int(max_mb * 1024 * 1024)
+        self.stats = CacheStats()
+        self._lock = threading.Lock()
+
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(_SCHEMA)
+
+        logger.info(f"OCRResultCache initialized ({path}, 上限 {max_mb:.0f}MB)")
+
+    @staticmethod
+    def make_key(processed_image: bytes, profile: str) -> str:
+        """前処理済み画像バイト列と前処理プロファイルからキャッシュキーを作成"""
+        digest = hashlib.sha256()
+        digest.update(profile.encode('utf-8'))
+        digest.update(b"\0")
+        digest.update(processed_image)
+        return digest.hexdigest()
+
+    def get(self, cache_key: str) -> Optional[Tuple[str, float]]:
+        """
+        キャッシュを参照し、ヒットした場合は (抽出テキスト, 信頼度) を返す
+        """
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT text, confidence, api_latency FROM ocr_results WHERE cache_key = ?",
+                (cache_key,)
+            ).fetchone()
+            if row is not None:
+                self._conn.execute(
+                    "UPDATE ocr_results SET last_access = ? WHERE cache_key = ?",
+                    (time.time(), cache_key)
+                )
+
+        if row is None:
+            self.stats.record_miss()
+            return None
+
+        text, confidence, api_latency = row
+        self.stats.record_hit(api_latency)
+        return text, confidence
+
+    def put(self, cache_key: str, profile: str, text: str, confidence: float, api_latency: float):
+        """
+        Vision API の結果を保存し、上限を超えた分を最終参照の古い順に削除
+        """
+        size_bytes = len(text.encode('utf-8')) + ENTRY_OVERHEAD_BYTES
+        now = time.time()
+
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                self._conn.execute(
+                    "INSERT OR REPLACE INTO ocr_results "
+                    "(cache_key, profile, text, confidence, api_latency, size_bytes, created_at, last_access) "
+                    "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                    (cache_key, profile, text, confidence, api_latency, size_bytes, now, now)
+                )
+                evicted = self._evict_locked()
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+
+        self.stats.record_store(evicted)
+
+    def _evict_locked(self) -> int:
+        (total_bytes,) = self._conn.execute(
+            "SELECT COALESCE(SUM(size_bytes), 0) FROM ocr_results"
+        ).fetchone()
+        if total_bytes <= self.max_bytes:
+            return 0
+
+        target_bytes = self.max_bytes * EVICTION_TARGET_RATIO
+        evicted = 0
+        rows = self._conn.execute(
+            "SELECT cache_key, size_bytes FROM ocr_results ORDER BY last_access ASC"
+        ).fetchall()
+        for cache_key, size_bytes in rows:
+            if total_bytes <= target_bytes:
+                break
+            self._conn.execute("DELETE FROM ocr_results WHERE cache_key = ?", (cache_key,))
+            total_bytes -= size_bytes
+            evicted += 1
+
+        return evicted
+
+    def size_bytes(self) -> int:
+        """保存中のエントリの合計サイズ（見積もり）"""
+        with self._lock:
+            (total_bytes,) = self._conn.execute(
+                "SELECT COALESCE(SUM(size_bytes), 0) FROM ocr_results"
+            ).fetchone()
+        return total_bytes
+
+    def clear(self):
+        """全エントリを削除"""
+        with self._lock:
+            self._conn.execute("DELETE FROM ocr_results")
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+_shared_cache: Optional[OCRResultCache] = None
+_shared_cache_lock = threading.Lock()
+
+
+def get_shared_cache() -> OCRResultCache:
+    """
+    プロセス内で共有するキャッシュを返す
+    """
+    global _shared_cache
+    with _shared_cache_lock:
+        if _shared_cache is None:
+            _shared_cache = OCRResultCache()
+        return _shared_cache
@@ -0,0 +1,824 @@
+"""
+OCRジョブキュー（永続化・ワーカープール・中断からの再開・優先レーン）
+大量取り込み中にプロセスが落ちても処理済みの結果を失わず、未完了のジョブだけを再実行できるようにする
+
+- ジョブIDはPDFファイルの内容のハッシュ（同じファイルを何度投入しても1ジョブ。処理済みなら再処理しない）
+- 少なくとも1回の実行（at-least-once）: 取得したジョブには可視性タイムアウトのリースを付け、
+  完了を記録する前にワーカーが落ちた場合はリースの期限切れ後に別のワーカーが再取得する
+- 処理中のジョブのリースはワーカープールが定期的に延長する（処理時間が可視性タイムアウトを超えても重複させない）
+- 優先レーン: 窓口で待っている利用者のアップロード（interactive）を夜間の一括取り込み（bulk）より先に処理する
+  レーン内は期限の早い順（EDF）。期限を過ぎた interactive のジョブは bulk に格下げする
+  ワーカーの一部を interactive 専用に確保し、一括取り込み中も窓口の処理が上流の同時実行枠を待たないようにする
+- バックエンド: SQLite（sqlite、既定）、Redis互換サーバー（redis、Celery のブローカーと同じ Redis を使用可能）
+"""
+
+import os
+import math
+import json
+import time
+import socket
+import uuid
+import sqlite3
+import hashlib
+import threading
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, List, Optional, Sequence
+
+from tracing import percentile
+
+# ログ設定
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+JOB_QUEUE_BACKEND = os.getenv("OCR_JOB_QUEUE_BACKEND", "sqlite")
+JOB_QUEUE_PATH = os.getenv("OCR_JOB_QUEUE_PATH", "ocr_jobs.sqlite3")
+JOB_QUEUE_REDIS_URL = os.getenv("OCR_JOB_QUEUE_REDIS_URL", os.getenv("REDIS_URL", "redis://localhost:6379/0"))
+# 取得したジョブを他のワーカーから見えなくする時間（この間に完了・延長されない場合は再取得される）
+JOB_VISIBILITY_TIMEOUT = float(os.getenv("OCR_JOB_VISIBILITY_TIMEOUT", "300"))
+# 1ジョブの最大試行回数（超えた場合は failed）
+JOB_MAX_ATTEMPTS = int(os.getenv("OCR_JOB_MAX_ATTEMPTS", "3"))
+# ワーカー数
+JOB_WORKERS = int(os.getenv("OCR_JOB_WORKERS", "4"))
+# 失敗したジョブを再実行するまでの待ち時間（試行回数に比例）
+JOB_RETRY_DELAY = float(os.getenv("OCR_JOB_RETRY_DELAY", "5"))
+# interactive 専用に確保するワーカーの割合（bulk のジョブは残りのワーカーでのみ実行する）
+JOB_INTERACTIVE_SHARE = float(os.getenv("OCR_JOB_INTERACTIVE_SHARE", "0.25"))
+# レーンごとの既定の期限（投入からの秒数、0 は期限なし）
+JOB_INTERACTIVE_DEADLINE = float(os.getenv("OCR_JOB_INTERACTIVE_DEADLINE", "30"))
+JOB_BULK_DEADLINE = float(os.getenv("OCR_JOB_BULK_DEADLINE", "0"))
+
+# ジョブの状態
+QUEUED = "queued"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+
+# 優先レーン（優先度の高い順）
+INTERACTIVE = "interactive"
+BULK = "bulk"
+LANES = (INTERACTIVE, BULK)
+_DEFAULT_DEADLINES = {INTERACTIVE: JOB_INTERACTIVE_DEADLINE, BULK: JOB_BULK_DEADLINE}
+
+# 期限のないジョブの並び順（期限のあるジョブの後ろに投入順で並べる）
+_NO_DEADLINE_OFFSET = 1e10
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS ocr_jobs (
+    job_id TEXT PRIMARY KEY,
+    path TEXT NOT NULL,
+    batch TEXT,
+    state TEXT NOT NULL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    visible_at REAL NOT NULL,
+    lease_owner TEXT,
+    result TEXT,
+    error TEXT,
+    created_at REAL NOT NULL,
+    updated_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_ocr_jobs_claim ON ocr_jobs (state, visible_at, created_at);
+CREATE INDEX IF NOT EXISTS idx_ocr_jobs_batch ON ocr_jobs (batch);
+"""
+
+# 優先レーン・期限・レイテンシ計測用の列（既存のデータベースには ALTER TABLE で追加する）
+_LANE_COLUMNS = {
+    "lane": f"TEXT NOT NULL DEFAULT '{BULK}'",
+    "submitted_lane": f"TEXT NOT NULL DEFAULT '{BULK}'",
+    "deadline": "REAL",
+    "submitted_at": "REAL",
+    "started_at": "REAL",
+    "finished_at": "REAL",
+}
+
+
+def file_job_id(path: str, block_size: int = 1024 * 1024) -> str:
+    """PDFファイルの内容の SHA-256（ジョブID）"""
+    digest = hashlib.sha256()
+    with open(path, "rb") as file:
+        for block in iter(lambda: file.read(block_size), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def _deadline(lane: str, deadline_seconds: Optional[float], now: float) -> Optional[float]:
+    """投入からの秒数（未指定はレーンの既定値）を期限の時刻に変換（0以下は期限なし）"""
+    if lane not in LANES:
+        raise ValueError(f"不明なレーンです: {lane}")
+    seconds = _DEFAULT_DEADLINES[lane] if deadline_seconds is None else deadline_seconds
+    return now + seconds if seconds > 0 else None
+
+
+class Job:
+    """取得したジョブ"""
+
+    __slots__ = ("job_id", "path", "batch", "attempts", "lane", "deadline")
+
+    def __init__(
+        self,
+        job_id: str,
+        path: str,
+        batch: Optional[str],
+        attempts: int,
+        lane: str = BULK,
+        deadline: Optional[float] = None
+    ):
+        self.job_id = job_id
+        self.path = path
+        self.batch = batch
+        self.attempts = attempts
+        self.lane = lane
+        self.deadline = deadline
+
+
+class SQLiteJobQueue:
+    """
+    SQLite によるジョブキュー（同一ホストの複数プロセスから共有可能）
+    取得は BEGIN IMMEDIATE で排他し、同じジョブを2つのワーカーが同時に取得しない
+    """
+
+    def __init__(
+        self,
+        path: str = JOB_QUEUE_PATH,
+        visibility_timeout: float = JOB_VISIBILITY_TIMEOUT,
+        max_attempts: int = JOB_MAX_ATTEMPTS
+    ):
+        self.path = path
+        self.visibility_timeout = visibility_timeout
+        self.max_attempts = max_attempts
+        self._lock = threading.Lock()
+
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None, timeout=30)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(_SCHEMA)
+        self._migrate()
+
+    def _migrate(self):
+        existing = {row[1] for row in self._conn.execute("PRAGMA table_info(ocr_jobs)")}
+        for column, definition in _LANE_COLUMNS.items():
+            if column not in existing:
+                self._conn.execute(f"ALTER TABLE ocr_jobs ADD COLUMN {column} {definition}")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_ocr_jobs_lane ON ocr_jobs (lane, state, deadline)")
+
+    def enqueue(
+        self,
+        path: str,
+        batch: Optional[str] = None,
+        job_id: Optional[str] = None,
+        lane: str = BULK,
+        deadline_seconds: Optional[float] = None
+    ) -> str:
+        """
+        ジョブを投入（同じジョブIDが投入済みの場合は再投入しない）
+        投入済みで未完了のジョブは batch に移す（ジョブは最後に投入したバッチのワーカープールが処理する）
+        待機中の bulk のジョブを interactive で投入し直した場合は interactive に引き上げる
+
+        Returns:
+            ジョブID
+        """
+        job_id = job_id or file_job_id(path)
+        now = time.time()
+        deadline = _deadline(lane, deadline_seconds, now)
+        with self._lock:
+            cursor = self._conn.execute(
+                "INSERT OR IGNORE INTO ocr_jobs (job_id, path, batch, state, visible_at, created_at, updated_at, "
+                "lane, submitted_lane, deadline, submitted_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (job_id, path, batch, QUEUED, now, now, now, lane, lane, deadline, now)
+            )
+            if cursor.rowcount == 0 and batch is not None:
+                self._conn.execute(
+                    "UPDATE ocr_jobs SET batch = ?, updated_at = ? WHERE job_id = ? AND state != ? AND batch IS NOT ?",
+                    (batch, now, job_id, DONE, batch)
+                )
+            if cursor.rowcount == 0 and lane == INTERACTIVE:
+                self._conn.execute(
+                    "UPDATE ocr_jobs SET lane = ?, submitted_lane = ?, deadline = ?, submitted_at = ?, updated_at = ? "
+                    "WHERE job_id = ? AND state = ? AND lane = ?",
+                    (INTERACTIVE, INTERACTIVE, deadline, now, now, job_id, QUEUED, BULK)
+                )
+        return job_id
+
+    def claim(self, worker_id: str, lanes: Sequence[str] = LANES, batch: Optional[str] = None) -> Optional[Job]:
+        """
+        実行可能なジョブ（待機中、またはリースの期限が切れた実行中のジョブ）を1件取得してリースする
+        lanes のうち優先度の高いレーンから、レーン内は期限の早い順（期限なしは投入順）に取得する
+        batch を指定した場合はそのバッチのジョブのみ取得する
+        """
+        now = time.time()
+        placeholders = ", ".join("?" for _ in lanes)
+        batch_clause, batch_args = ("AND batch = ? ", (batch,)) if batch is not None else ("", ())
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                # 期限を過ぎても取得されていない interactive のジョブは bulk に格下げ
+                self._conn.execute(
+                    "UPDATE ocr_jobs SET lane = ?, updated_at = ? "
+                    "WHERE lane = ? AND deadline < ? AND state IN (?, ?) AND visible_at <= ?",
+                    (BULK, now, INTERACTIVE, now, QUEUED, RUNNING, now)
+                )
+                while True:
+                    row = self._conn.execute(
+                        f"SELECT job_id, path, batch, attempts, lane, deadline FROM ocr_jobs "
+                        f"WHERE state IN (?, ?) AND visible_at <= ? AND lane IN ({placeholders}) {batch_clause}"
+                        f"ORDER BY CASE lane WHEN ? THEN 0 ELSE 1 END, deadline IS NULL, deadline, created_at LIMIT 1",
+                        (QUEUED, RUNNING, now, *lanes, *batch_args, INTERACTIVE)
+                    ).fetchone()
+                    if row is None:
+                        self._conn.execute("COMMIT")
+                        return None
+                    job_id, path, batch, attempts, lane, deadline = row
+                    if attempts < self.max_attempts:
+                        break
+                    # 実行中にワーカーが落ちる・タイムアウトするを繰り返したジョブ
+                    self._conn.execute(
+                        "UPDATE ocr_jobs SET state = ?, error = ?, lease_owner = NULL, updated_at = ? WHERE job_id = ?",
+                        (FAILED, "試行回数の上限に達しました（リース期限切れ）", now, job_id)
+                    )
+                    logger.warning(f"ジョブを失敗にしました（リース期限切れ {attempts}回）: {path}")
+                self._conn.execute(
+                    "UPDATE ocr_jobs SET state = ?, attempts = attempts + 1, visible_at = ?, lease_owner = ?, "
+                    "started_at = COALESCE(started_at, ?), updated_at = ? WHERE job_id = ?",
+                    (RUNNING, now + self.visibility_timeout, worker_id, now, now, job_id)
+                )
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+        return Job(job_id, path, batch, attempts + 1, lane, deadline)
+
+    def extend(self, job_id: str, worker_id: str) -> bool:
+        """リースを延長（他のワーカーに再取得されていた場合は False）"""
+        now = time.time()
+        with self._lock:
+            cursor = self._conn.execute(
+                "UPDATE ocr_jobs SET visible_at = ?, updated_at = ? WHERE job_id = ? AND state = ? AND lease_owner = ?",
+                (now + self.visibility_timeout, now, job_id, RUNNING, worker_id)
+            )
+        return cursor.rowcount > 0
+
+    def complete(self, job_id: str, result: Dict):
+        """
+        結果を保存して完了にする
+        リース期限切れで再実行されたジョブが両方完了した場合は、先に完了した結果を残す
+        """
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "UPDATE ocr_jobs SET state = ?, result = ?, error = NULL, lease_owner = NULL, finished_at = ?, "
+                "updated_at = ? WHERE job_id = ? AND state != ?",
+                (DONE, json.dumps(result, ensure_ascii=False), now, now, job_id, DONE)
+            )
+
+    def fail(self, job_id: str, error: str, attempts: int):
+        """失敗を記録（試行回数が上限未満なら待ち時間の後に再実行する）"""
+        now = time.time()
+        retry = attempts < self.max_attempts
+        with self._lock:
+            self._conn.execute(
+                "UPDATE ocr_jobs SET state = ?, error = ?, visible_at = ?, lease_owner = NULL, finished_at = ?, "
+                "updated_at = ? WHERE job_id = ? AND state != ?",
+                (QUEUED if retry else FAILED, error, now + JOB_RETRY_DELAY * attempts, None if retry else now, now,
+                 job_id, DONE)
+            )
+
+    def resume(self, batch: Optional[str] = None, retry_failed: bool = False) -> int:
+        """
+        中断した実行の続きから再開するため、実行中のまま残ったジョブを直ちに再取得可能にする
+        （前回のプロセスが終了していることが前提。retry_failed の場合は失敗したジョブも試行回数を戻して再実行）
+
+        Returns:
+            再実行可能にしたジョブ数
+        """
+        states = (RUNNING, FAILED) if retry_failed else (RUNNING,)
+        placeholders = ", ".join("?" for _ in states)
+        batch_clause, batch_args = ("AND batch = ?", (batch,)) if batch is not None else ("", ())
+        now = time.time()
+        with self._lock:
+            cursor = self._conn.execute(
+                f"UPDATE ocr_jobs SET state = ?, visible_at = ?, lease_owner = NULL, updated_at = ?, "
+                f"attempts = CASE WHEN state = ? THEN 0 ELSE attempts END "
+                f"WHERE state IN ({placeholders}) {batch_clause}",
+                (QUEUED, now, now, FAILED, *states, *batch_args)
+            )
+        return cursor.rowcount
+
+    def results(self, job_ids: List[str]) -> Dict[str, Dict]:
+        """
+        ジョブIDごとの {"state", "attempts", "result", "error", "lane", "submitted_lane", "deadline",
+        "submitted_at", "started_at", "finished_at"}
+        """
+        found: Dict[str, Dict] = {}
+        with self._lock:
+            for start in range(0, len(job_ids), 500):
+                chunk = job_ids[start:start + 500]
+                rows = self._conn.execute(
+                    f"SELECT job_id, state, attempts, result, error, lane, submitted_lane, deadline, "
+                    f"submitted_at, started_at, finished_at FROM ocr_jobs "
+                    f"WHERE job_id IN ({', '.join('?' for _ in chunk)})",
+                    chunk
+                ).fetchall()
+                for (job_id, state, attempts, result, error, lane, submitted_lane, deadline,
+                     submitted_at, started_at, finished_at) in rows:
+                    found[job_id] = {
+                        "state": state,
+                        "attempts": attempts,
+                        "result": json.loads(result) if result else None,
+                        "error": error,
+                        "lane": lane,
+                        "submitted_lane": submitted_lane,
+                        "deadline": deadline,
+                        "submitted_at": submitted_at,
+                        "started_at": started_at,
+                        "finished_at": finished_at,
+                    }
+        return found
+
+    def counts(self, batch: Optional[str] = None) -> Dict[str, int]:
+        """状態ごとのジョブ数"""
+        batch_clause, batch_args = ("WHERE batch = ?", (batch,)) if batch is not None else ("", ())
+        with self._lock:
+            rows = self._conn.execute(
+                f"SELECT state, COUNT(*) FROM ocr_jobs {batch_clause} GROUP BY state", batch_args
+            ).fetchall()
+        counts = {QUEUED: 0, RUNNING: 0, DONE: 0, FAILED: 0}
+        counts.update(dict(rows))
+        return counts
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+# SQLiteJobQueue.claim と同じ処理を Redis 上でアトミックに実行する
+# 取得可能なジョブはレーンごとの {prefix}ready:{lane}（期限の早い順）、リース中・再試行待ちのジョブは
+# {prefix}delayed（再取得可能になる時刻順）の sorted set に入っている
+_REDIS_CLAIM_SCRIPT = """
+local now = tonumber(ARGV[1])
+local timeout = tonumber(ARGV[2])
+local max_attempts = tonumber(ARGV[3])
+local worker = ARGV[4]
+local prefix = ARGV[5]
+local batch = ARGV[6]
+local delayed = prefix .. 'delayed'
+local function finished(key)
+  local state = redis.call('HGET', key, 'state')
+  return state == 'done' or state == 'failed'
+end
+-- 取得待ちのうち最も優先度の高いジョブ（batch を指定した場合はそのバッチのジョブのみ）
+local function next_id(ready)
+  if batch == '' then
+    return redis.call('ZRANGE', ready, 0, 0)[1]
+  end
+  local members = prefix .. 'batch:' .. batch
+  if redis.call('SCARD', members) <= redis.call('ZCARD', ready) then
+    local best, best_score = nil, nil
+    for _, id in ipairs(redis.call('SMEMBERS', members)) do
+      local score = redis.call('ZSCORE', ready, id)
+      if score and (best == nil or tonumber(score) < best_score) then
+        best, best_score = id, tonumber(score)
+      end
+    end
+    return best
+  end
+  for _, id in ipairs(redis.call('ZRANGE', ready, 0, -1)) do
+    if redis.call('SISMEMBER', members, id) == 1 then
+      return id
+    end
+  end
+  return nil
+end
+for _, id in ipairs(redis.call('ZRANGEBYSCORE', delayed, '-inf', now)) do
+  local key = prefix .. 'job:' .. id
+  redis.call('ZREM', delayed, id)
+  if not finished(key) then
+    redis.call('ZADD', prefix .. 'ready:' .. redis.call('HGET', key, 'lane'), redis.call('HGET', key, 'priority'), id)
+  end
+end
+local interactive = prefix .. 'ready:interactive'
+for _, id in ipairs(redis.call('ZRANGEBYSCORE', interactive, '-inf', now)) do
+  redis.call('ZREM', interactive, id)
+  redis.call('ZADD', prefix .. 'ready:bulk', redis.call('HGET', prefix .. 'job:' .. id, 'priority'), id)
+  redis.call('HSET', prefix .. 'job:' .. id, 'lane', 'bulk', 'updated_at', now)
+end
+for i = 7, #ARGV do
+  local ready = prefix .. 'ready:' .. ARGV[i]
+  while true do
+    local id = next_id(ready)
+    if not id then
+      break
+    end
+    local key = prefix .. 'job:' .. id
+    local attempts = tonumber(redis.call('HGET', key, 'attempts') or '0')
+    redis.call('ZREM', ready, id)
+    if finished(key) then
+      -- リース期限切れで取得待ちに戻った後に、元のワーカーが完了・失敗を記録したジョブ
+    elseif attempts >= max_attempts then
+      redis.call('HSET', key, 'state', 'failed', 'error', 'lease expired too many times', 'updated_at', now)
+    else
+      redis.call('ZADD', delayed, now + timeout, id)
+      redis.call('HSET', key, 'state', 'running', 'attempts', attempts + 1, 'lease_owner', worker, 'updated_at', now)
+      redis.call('HSETNX', key, 'started_at', now)
+      return {id, redis.call('HGET', key, 'path'), redis.call('HGET', key, 'batch') or '', attempts + 1,
+              ARGV[i], redis.call('HGET', key, 'deadline') or ''}
+    end
+  end
+end
+return nil
+"""
+
+
+class RedisJobQueue:
+    """
+    Redis互換サーバーによるジョブキュー（複数ホストのワーカーで共有、redis パッケージが必要）
+    ジョブは {prefix}job:{ID} のハッシュで管理し、取得待ち・リース中のジョブを sorted set に入れる
+    """
+
+    def __init__(
+        self,
+        url: str = JOB_QUEUE_REDIS_URL,
+        visibility_timeout: float = JOB_VISIBILITY_TIMEOUT,
+        max_attempts: int = JOB_MAX_ATTEMPTS,
+        prefix: str = "ocr_jobs:",
+        client=None
+    ):
+        """client を指定した場合はその Redis クライアント（decode_responses=True）を使う"""
+        if client is None:
+            import redis
+
+            client = redis.Redis.from_url(url, decode_responses=True)
+        self.visibility_timeout = visibility_timeout
+        self.max_attempts = max_attempts
+        self.prefix = prefix
+        self._client = client
+        self._claim_script = self._client.register_script(_REDIS_CLAIM_SCRIPT)
+        self._delayed = prefix + "delayed"
+
+    def _key(self, job_id: str) -> str:
+        return f"{self.prefix}job:{job_id}"
+
+    def _ready(self, lane: str) -> str:
+        return f"{self.prefix}ready:{lane}"
+
+    def enqueue(
+        self,
+        path: str,
+        batch: Optional[str] = None,
+        job_id: Optional[str] = None,
+        lane: str = BULK,
+        deadline_seconds: Optional[float] = None
+    ) -> str:
+        job_id = job_id or file_job_id(path)
+        now = time.time()
+        deadline = _deadline(lane, deadline_seconds, now)
+        priority = deadline if deadline is not None else now + _NO_DEADLINE_OFFSET
+        lane_fields = {
+            "lane": lane, "submitted_lane": lane, "deadline": deadline if deadline is not None else "",
+            "priority": priority, "submitted_at": now, "updated_at": now,
+        }
+        key = self._key(job_id)
+        if self._client.hsetnx(key, "state", QUEUED):
+            pipe = self._client.pipeline()
+            pipe.hset(key, mapping=dict(lane_fields, path=path, batch=batch or "", attempts=0, created_at=now))
+            pipe.zadd(self._ready(lane), {job_id: priority})
+            if batch is not None:
+                pipe.sadd(f"{self.prefix}batch:{batch}", job_id)
+            pipe.execute()
+        else:
+            state, current_batch, current_lane = self._client.hmget(key, "state", "batch", "lane")
+            if batch is not None and state != DONE and current_batch != batch:
+                pipe = self._client.pipeline()
+                if current_batch:
+                    pipe.srem(f"{self.prefix}batch:{current_batch}", job_id)
+                pipe.sadd(f"{self.prefix}batch:{batch}", job_id)
+                pipe.hset(key, mapping={"batch": batch, "updated_at": now})
+                pipe.execute()
+            if lane == INTERACTIVE and [state, current_lane] == [QUEUED, BULK]:
+                self._client.hset(key, mapping=lane_fields)
+                if self._client.zrem(self._ready(BULK), job_id):
+                    self._client.zadd(self._ready(INTERACTIVE), {job_id: priority})
+        return job_id
+
+    def claim(self, worker_id: str, lanes: Sequence[str] = LANES, batch: Optional[str] = None) -> Optional[Job]:
+        claimed = self._claim_script(
+            keys=[],
+            args=[time.time(), self.visibility_timeout, self.max_attempts, worker_id, self.prefix, batch or "", *lanes]
+        )
+        if not claimed:
+            return None
+        job_id, path, batch, attempts, lane, deadline = claimed
+        return Job(job_id, path, batch or None, int(attempts), lane, float(deadline) if deadline else None)
+
+    def extend(self, job_id: str, worker_id: str) -> bool:
+        if self._client.hget(self._key(job_id), "lease_owner") != worker_id:
+            return False
+        self._client.zadd(self._delayed, {job_id: time.time() + self.visibility_timeout}, xx=True)
+        return True
+
+    def _dequeue(self, pipe, job_id: str):
+        # リース期限切れで取得待ちに戻っている場合もあるため、全レーンから取り除く
+        pipe.zrem(self._delayed, job_id)
+        for lane in LANES:
+            pipe.zrem(self._ready(lane), job_id)
+
+    def complete(self, job_id: str, result: Dict):
+        now = time.time()
+        pipe = self._client.pipeline()
+        self._dequeue(pipe, job_id)
+        # 再実行されたジョブが両方完了した場合は、先に完了した結果を残す
+        if self._client.hget(self._key(job_id), "state") != DONE:
+            pipe.hset(self._key(job_id), mapping={
+                "state": DONE, "result": json.dumps(result, ensure_ascii=False), "error": "",
+                "finished_at": now, "updated_at": now,
+            })
+        pipe.execute()
+
+    def fail(self, job_id: str, error: str, attempts: int):
+        now = time.time()
+        if self._client.hget(self._key(job_id), "state") == DONE:
+            return
+        pipe = self._client.pipeline()
+        self._dequeue(pipe, job_id)
+        if attempts < self.max_attempts:
+            pipe.hset(self._key(job_id), mapping={"state": QUEUED, "error": error, "updated_at": now})
+            pipe.zadd(self._delayed, {job_id: now + JOB_RETRY_DELAY * attempts})
+        else:
+            pipe.hset(self._key(job_id), mapping={"state": FAILED, "error": error, "finished_at": now, "updated_at": now})
+        pipe.execute()
+
+    def _batch_ids(self, batch: Optional[str]) -> List[str]:
+        if batch is not None:
+            return list(self._client.smembers(f"{self.prefix}batch:{batch}"))
+        return [key[len(self.prefix) + 4:] for key in self._client.scan_iter(f"{self.prefix}job:*")]
+
+    def resume(self, batch: Optional[str] = None, retry_failed: bool = False) -> int:
+        now = time.time()
+        resumed = 0
+        for job_id in self._batch_ids(batch):
+            state, lane, priority = self._client.hmget(self._key(job_id), "state", "lane", "priority")
+            if state == RUNNING or (retry_failed and state == FAILED):
+                mapping = {"state": QUEUED, "updated_at": now}
+                if state == FAILED:
+                    mapping["attempts"] = 0
+                self._client.hset(self._key(job_id), mapping=mapping)
+                self._client.zrem(self._delayed, job_id)
+                self._client.zadd(self._ready(lane), {job_id: float(priority)})
+                resumed += 1
+        return resumed
+
+    def results(self, job_ids: List[str]) -> Dict[str, Dict]:
+        found: Dict[str, Dict] = {}
+        for job_id in job_ids:
+            data = self._client.hgetall(self._key(job_id))
+            if data:
+                found[job_id] = {
+                    "state": data.get("state"),
+                    "attempts": int(data.get("attempts", 0)),
+                    "result": json.loads(data["result"]) if data.get("result") else None,
+                    "error": data.get("error") or None,
+                    "lane": data.get("lane"),
+                    "submitted_lane": data.get("submitted_lane"),
+                    **{
+                        field: float(data[field]) if data.get(field) else None
+                        for field in ("deadline", "submitted_at", "started_at", "finished_at")
+                    },
+                }
+        return found
+
+    def counts(self, batch: Optional[str] = None) -> Dict[str, int]:
+        counts = {QUEUED: 0, RUNNING: 0, DONE: 0, FAILED: 0}
+        for job_id in self._batch_ids(batch):
+            state = self._client.hget(self._key(job_id), "state")
+            if state in counts:
+                counts[state] += 1
+        return counts
+
+    def close(self):
+        self._client.close()
+
+
+def create_job_queue(name: str = JOB_QUEUE_BACKEND):
+    """ジョブキューを作成（redis パッケージが未導入の場合は SQLite にフォールバック）"""
+    if name == "redis":
+        try:
+            return RedisJobQueue()
+        except ImportError as e:
+            logger.warning(f"ジョブキューのバックエンド redis を使用できないため SQLite を使用します: {e}")
+    return SQLiteJobQueue()
+
+
+def _job_failed(result: Dict) -> Optional[str]:
+    """process_pdf の結果が失敗の場合はエラー内容"""
+    if result.get("success") is False or "error" in result:
+        return str(result.get("error", "処理に失敗しました"))
+    return None
+
+
+def reserved_workers(workers: int, interactive_share: float = JOB_INTERACTIVE_SHARE) -> int:
+    """interactive 専用に確保するワーカー数（bulk が処理できなくならないよう、1ワーカーは必ず bulk に使える）"""
+    if interactive_share <= 0:
+        return 0
+    return min(workers - 1, math.ceil(workers * interactive_share))
+
+
+class JobWorkerPool:
+    """
+    ジョブキューからジョブを取得して handler(PDFパス) を実行するワーカースレッドのプール
+    上流の呼び出しはクォータ制御・同時実行数の制限を受けるため、ワーカー数に比例して上限までスループットが伸びる
+    bulk のジョブを同時に実行するワーカーは interactive 専用の確保分を除いた数までに制限する
+    """
+
+    def __init__(
+        self,
+        queue,
+        handler: Callable[[str], Dict],
+        workers: int = JOB_WORKERS,
+        poll_interval: float = 0.5,
+        interactive_share: float = JOB_INTERACTIVE_SHARE,
+        batch: Optional[str] = None
+    ):
+        """batch を指定した場合は、そのバッチのジョブのみ取得し、なくなった時点で終了する（until_empty の場合）"""
+        self.queue = queue
+        self.handler = handler
+        self.batch = batch
+        self.workers = max(1, workers)
+        self.poll_interval = poll_interval
+        self.bulk_workers = self.workers - reserved_workers(self.workers, interactive_share)
+        self.worker_prefix = f"{socket.gethostname()}:{os.getpid()}"
+        self._in_flight: Dict[str, str] = {}
+        self._in_flight_lock = threading.Lock()
+        self._claim_lock = threading.Lock()
+        self._bulk_running = 0
+        self._stop = threading.Event()
+
+    def _heartbeat(self):
+        # 処理中のジョブのリースを可視性タイムアウトの1/3ごとに延長する
+        interval = max(1.0, self.queue.visibility_timeout / 3)
+        while not self._stop.wait(interval):
+            with self._in_flight_lock:
+                leases = list(self._in_flight.items())
+            for job_id, worker_id in leases:
+                try:
+                    if not self.queue.extend(job_id, worker_id):
+                        logger.warning(f"ジョブのリースが他のワーカーに移りました: {job_id[:12]}")
+                except Exception as e:
+                    logger.warning(f"ジョブのリース延長エラー: {e}")
+
+    def _claim(self, worker_id: str) -> Optional[Job]:
+        # bulk の実行数が上限に達している間は interactive のジョブのみ取得する
+        with self._claim_lock:
+            lanes = LANES if self._bulk_running < self.bulk_workers else (INTERACTIVE,)
+            job = self.queue.claim(worker_id, lanes, self.batch)
+            if job is not None and job.lane == BULK:
+                self._bulk_running += 1
+        return job
+
+    def _run_job(self, job: Job, worker_id: str):
+        with self._in_flight_lock:
+            self._in_flight[job.job_id] = worker_id
+        try:
+            try:
+                result = self.handler(job.path)
+                error = _job_failed(result)
+            except Exception as e:
+                result, error = None, str(e)
+            if error is None:
+                self.queue.complete(job.job_id, result)
+            else:
+                logger.warning(f"ジョブ失敗（{job.attempts}回目）: {job.path}: {error}")
+                self.queue.fail(job.job_id, error, job.attempts)
+        finally:
+            with self._in_flight_lock:
+                self._in_flight.pop(job.job_id, None)
+            if job.lane == BULK:
+                with self._claim_lock:
+                    self._bulk_running -= 1
+
+    def _worker(self, index: int, until_empty: bool):
+        worker_id = f"{self.worker_prefix}:{index}"
+        while not self._stop.is_set():
+            job = self._claim(worker_id)
+            if job is None:
+                if until_empty and self._idle():
+                    return
+                self._stop.wait(self.poll_interval)
+                continue
+            self._run_job(job, worker_id)
+
+    def _idle(self) -> bool:
+        # 他のワーカーが処理中・再試行待ちのジョブがある間は終了しない（batch を指定した場合は他のバッチのジョブは待たない）
+        counts = self.queue.counts(self.batch)
+        return counts[QUEUED] == 0 and counts[RUNNING] == 0
+
+    def run(self, until_empty: bool = True):
+        """
+        ワーカーを起動して処理する（until_empty=False の場合は stop() まで待ち受ける）
+        """
+        self._stop.clear()
+        heartbeat = threading.Thread(target=self._heartbeat, daemon=True)
+        heartbeat.start()
+        try:
+            with ThreadPoolExecutor(max_workers=self.workers) as executor:
+                futures = [executor.submit(self._worker, index, until_empty) for index in range(self.workers)]
+                for future in futures:
+                    future.result()
+        finally:
+            self._stop.set()
+            heartbeat.join()
+
+    def stop(self):
+        self._stop.set()
+
+
+def _job_output(path: str, job_id: str, job: Dict) -> Dict:
+    """ジョブの状態から process_files の1件分の結果を作成（待ち時間・処理時間はミリ秒）"""
+    result = job.get("result") or {"error": job.get("error") or "処理が完了しませんでした", "success": False}
+    submitted_at, started_at, finished_at = job.get("submitted_at"), job.get("started_at"), job.get("finished_at")
+    deadline = job.get("deadline")
+    return {
+        "file": path,
+        "job_id": job_id,
+        "state": job.get("state"),
+        "attempts": job.get("attempts", 0),
+        "lane": job.get("submitted_lane"),
+        "downgraded": job.get("lane") != job.get("submitted_lane"),
+        "wait_ms": (started_at - submitted_at) * 1000 if submitted_at and started_at else None,
+        "latency_ms": (finished_at - submitted_at) * 1000 if submitted_at and finished_at else None,
+        "deadline_met": finished_at <= deadline if deadline and finished_at else None,
+        "result": result,
+    }
+
+
+def process_files(
+    paths: List[str],
+    handler: Callable[[str], Dict],
+    workers: int = JOB_WORKERS,
+    batch: Optional[str] = None,
+    resume: bool = False,
+    queue=None,
+    lane: str = BULK,
+    deadline_seconds: Optional[float] = None
+) -> List[Dict]:
+    """
+    PDFファイルを lane のジョブとしてジョブキュー経由で処理し、入力順の
+    {"file", "job_id", "state", "attempts", "lane", "downgraded", "wait_ms", "latency_ms", "deadline_met", "result"} を返す
+    処理済みのファイルは再処理せず保存済みの結果を返す。resume の場合は前回の実行で処理中のまま残ったジョブも再実行する
+    batch を省略した場合は呼び出しごとのバッチに投入し、投入したジョブのみ処理して返す
+    （窓口の1件の処理が、同じキューの一括取り込みのジョブの完了を待たないようにする）
+    """
+    queue = queue or create_job_queue()
+    batch = batch or uuid.uuid4().hex
+    job_ids = [
+        queue.enqueue(path, batch=batch, lane=lane, deadline_seconds=deadline_seconds) for path in paths
+    ]
+    if resume:
+        resumed = queue.resume(batch)
+        if resumed:
+            logger.info(f"前回中断したジョブを再実行します: {resumed}件")
+    before = queue.counts(batch)
+    logger.info(
+        f"ジョブキュー: {len(paths)}件（処理済み {before[DONE]} / 待機 {before[QUEUED]} / "
+        f"実行中 {before[RUNNING]} / 失敗 {before[FAILED]}）, ワーカー {workers}"
+    )
+
+    JobWorkerPool(queue, handler, workers=workers, batch=batch).run(until_empty=True)
+
+    found = queue.results(job_ids)
+    return [_job_output(path, job_id, found.get(job_id, {})) for path, job_id in zip(paths, job_ids)]
+
+
+def summarize_lanes(outputs: Sequence[Dict], quantiles=(50, 95, 99)) -> Dict[str, Dict]:
+    """
+    process_files の結果から投入時のレーンごとの件数・待ち時間・処理完了までの時間のパーセンタイル・
+    期限超過数・格下げ数を集計
+    """
+    summary: Dict[str, Dict] = {}
+    for lane in LANES:
+        jobs = [output for output in outputs if output.get("lane") == lane]
+        if not jobs:
+            continue
+        waits = sorted(job["wait_ms"] for job in jobs if job.get("wait_ms") is not None)
+        latencies = sorted(job["latency_ms"] for job in jobs if job.get("latency_ms") is not None)
+        summary[lane] = {
+            "count": len(jobs),
+            "wait_ms": {f"p{q}": percentile(waits, q) for q in quantiles},
+            "latency_ms": {f"p{q}": percentile(latencies, q) for q in quantiles},
+            "deadline_missed": sum(1 for job in jobs if job.get("deadline_met") is False),
+            "downgraded": sum(1 for job in jobs if job.get("downgraded")),
+        }
+    return summary
+
+
+def print_lane_report(summary: Dict[str, Dict]):
+    """レーン別のレイテンシレポートを表示"""
+    print("\n=== レーン別レイテンシ ===")
+    print(f"{'レーン':<14}{'件数':>6}{'待ちp95':>10}{'p50':>10}{'p95':>10}{'p99':>10}{'期限超過':>10}{'格下げ':>8}")
+    for lane, stats in summary.items():
+        latency = stats["latency_ms"]
+        print(
+            f"{lane:<14}{stats['count']:>6}{stats['wait_ms']['p95']:>10.0f}{latency['p50']:>10.0f}"
+            f"{latency['p95']:>10.0f}{latency['p99']:>10.0f}{stats['deadline_missed']:>10}{stats['downgraded']:>8}"
+        )
@@ -0,0 +1,426 @@
+"""
+ページ単位のパイプライン処理
+ラスタライズ（CPU）→ 前処理（CPU）→ Vision API（I/O）→ Gemini（I/O）の各ステージを
+上限付きキューでつなぎ、ページ k の Vision API 呼び出し中にページ k+1 の前処理を進める
+ステージごとのキュー滞留数・稼働率を集計し、ボトルネックのステージを特定できるようにする
+"""
+
+import os
+import time
+import queue
+import threading
+import logging
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from config import PERFORMANCE_TARGETS
+from ocr_service import OCRService, VISION_CONCURRENCY
+from page_spool import PageSpool
+from pdf_text_layer import TEXT_LAYER_CONFIDENCE
+from tracing import Span, start_span, activate
+
+# ログ設定
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# ステージ間キューの上限・ステージごとのワーカー数
+PIPELINE_QUEUE_SIZE = int(os.getenv("OCR_PIPELINE_QUEUE_SIZE", "8"))
+PIPELINE_PREPROCESS_WORKERS = int(os.getenv("OCR_PIPELINE_PREPROCESS_WORKERS", str(os.cpu_count() or 1)))
+PIPELINE_GEMINI_WORKERS = int(os.getenv("OCR_PIPELINE_GEMINI_WORKERS", "2"))
+
+# ステージの終了を伝える番兵
+_DONE = object()
+
+
+class StageStats:
+    """ステージごとの処理件数・稼働時間・入力キュー滞留数（スレッドセーフ）"""
+
+    def __init__(self, name: str, workers: int, queue_size: int):
+        self.name = name
+        self.workers = workers
+        self.queue_size = queue_size
+        self._lock = threading.Lock()
+        self.processed = 0
+        self.errors = 0
+        self.busy_seconds = 0.0
+        self.depth_samples = 0
+        self.depth_total = 0
+        self.max_depth = 0
+
+    def record_depth(self, depth: int):
+        with self._lock:
+            self.depth_samples += 1
+            self.depth_total += depth
+            self.max_depth = max(self.max_depth, depth)
+
+    def record_item(self, busy_seconds: float, error: bool = False):
+        with self._lock:
+            self.processed += 1
+            self.busy_seconds += busy_seconds
+            if error:
+                self.errors += 1
+
+    def as_dict(self, wall_seconds: float) -> Dict:
+        with self._lock:
+            capacity = self.workers * wall_seconds
+            return {
+                "stage": self.name,
+                "workers": self.workers,
+                "processed": self.processed,
+                "errors": self.errors,
+                "busy_seconds": self.busy_seconds,
+                # 稼働率 = 処理時間の合計 / (ワーカー数 × 経過時間)
+                "utilization": self.busy_seconds / capacity if capacity else 0.0,
+                "avg_queue_depth": self.depth_total / self.depth_samples if self.depth_samples else 0.0,
+                "max_queue_depth": self.max_depth,
+                "queue_size": self.queue_size,
+            }
+
+
+class _Stage:
+    """
+    入力キューと複数ワーカースレッドからなるステージ
+    全ワーカーが番兵を受け取ったら後段のステージへ番兵を送る
+    func でエラーが発生した場合は on_error(item, error) の戻り値を後段に送る（None の場合は送らない）
+    """
+
+    def __init__(
+        self,
+        name: str,
+        func: Callable[[Any], Any],
+        workers: int,
+        queue_size: int,
+        on_error: Optional[Callable[[Any, Exception], Any]] = None
+    ):
+        self.name = name
+        self.func = func
+        self.on_error = on_error
+        self.workers = workers
+        self.input: "queue.Queue" = queue.Queue(maxsize=queue_size)
+        self.stats = StageStats(name, workers, queue_size)
+        self.next: Optional["_Stage"] = None
+        self._remaining_workers = workers
+        self._lock = threading.Lock()
+        self._threads: List[threading.Thread] = []
+
+    def put(self, item: Any):
+        self.input.put(item)
+        self.stats.record_depth(self.input.qsize())
+
+    def start(self):
+        for index in range(self.workers):
+            thread = threading.Thread(target=self._run, name=f"pipeline-{self.name}-{index}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def close(self):
+        """ワーカー数分の番兵を入力キューに送る"""
+        for _ in range(self.workers):
+            self.input.put(_DONE)
+
+    def _run(self):
+        while True:
+            item = self.input.get()
+            if item is _DONE:
+                break
+
+            start = time.perf_counter()
+            error = False
+            try:
+                output = self.func(item)
+            except Exception as e:
+                logger.error(f"パイプライン {self.name} ステージでエラー発生: {e}")
+                output = self.on_error(item, e) if self.on_error is not None else None
+                error = True
+            self.stats.record_item(time.perf_counter() - start, error)
+
+            if output is not None and self.next is not None:
+                self.next.put(output)
+
+        with self._lock:
+            self._remaining_workers -= 1
+            last = self._remaining_workers == 0
+        if last and self.next is not None:
+            self.next.close()
+
+    def join(self):
+        for thread in self._threads:
+            thread.join()
+
+
+class _Document:
+    """1ファイル分の処理状態"""
+
+    def __init__(self, index: int, pdf_path: str):
+        self.index = index
+        self.pdf_path = pdf_path
+        self.start_time = time.time()
+        self.page_count = 0
+        self.page_results: List[Tuple[str, float]] = []
+        self.text_layer_pages = 0
+        self.error: Optional[str] = None
+        self.result: Optional[Dict] = None
+        # 文書のルートスパン（各ステージのスレッドで activate して子スパンを記録し、Gemini ステージで終了する）
+        self.span: Optional[Span] = None
+        # レンダリング済みページのスプール（前処理後にページを解放し、Gemini ステージで削除する）
+        self.spool: Optional[PageSpool] = None
+        self._remaining = 0
+        self._lock = threading.Lock()
+
+    def expect_pages(self, page_count: int):
+        self.page_count = page_count
+        self.page_results = [("", 0.0)] * page_count
+        self._remaining = page_count
+
+    def complete_pages(self, count: int = 1) -> bool:
+        """count ページ分の完了を記録し、全ページ完了した場合は True"""
+        with self._lock:
+            self._remaining -= count
+            return self._remaining == 0
+
+    def fail(self, error: str):
+        """文書をエラーとして記録（最初のエラーを残す）。残りのページの完了後にエラー結果を返す"""
+        with self._lock:
+            if self.error is None:
+                self.error = error
+
+
+class _PassThrough:
+    """
+    全ページが揃った文書を Gemini ステージへ送るための包み
+    前処理ステージで完了した場合は Vision ステージをそのまま通過する
+    """
+
+    __slots__ = ("document",)
+
+    def __init__(self, document: _Document):
+        self.document = document
+
+
+class OCRPipeline:
+    """
+    OCRService のステージをパイプライン化して複数PDFを処理
+    ラスタライズは PDFRasterizer のプロセスプール、その他のステージはスレッドで並列化する
+    Gemini ステージは文書の全ページが揃った時点で実行されるため、次の文書のOCRと重なる
+    """
+
+    def __init__(
+        self,
+        service: Optional[OCRService] = None,
+        queue_size: int = PIPELINE_QUEUE_SIZE,
+        preprocess_workers: int = PIPELINE_PREPROCESS_WORKERS,
+        vision_workers: int = VISION_CONCURRENCY,
+        gemini_workers: int = PIPELINE_GEMINI_WORKERS
+    ):
+        self.service = service or OCRService()
+        self.queue_size = queue_size
+        self.preprocess_workers = preprocess_workers
+        self.vision_workers = vision_workers
+        self.gemini_workers = gemini_workers
+        self.last_report: Optional[Dict] = None
+
+    def run(self, pdf_paths: List[str]) -> List[Dict]:
+        """
+        複数PDFをパイプライン処理
+
+        Returns:
+            入力順の process_pdf と同じ形式の結果のリスト
+        """
+        start = time.perf_counter()
+        documents = [_Document(index, path) for index, path in enumerate(pdf_paths)]
+
+        rasterize_stats = StageStats("rasterize", 1, 0)
+        preprocess = _Stage(
+            "preprocess", self._preprocess, self.preprocess_workers, self.queue_size, on_error=self._fail_page
+        )
+        vision = _Stage("vision", self._vision, self.vision_workers, self.queue_size, on_error=self._fail_page)
+        gemini = _Stage("gemini", self._structure, self.gemini_workers, self.queue_size)
+        preprocess.next = vision
+        vision.next = gemini
+        stages = [preprocess, vision, gemini]
+
+        for stage in stages:
+            stage.start()
+
+        # ラスタライズ（メインスレッドでレンダリング済みのページから順に投入）
+        for document in documents:
+            self._rasterize(document, preprocess, gemini, rasterize_stats)
+        preprocess.close()
+
+        for stage in stages:
+            stage.join()
+
+        wall_seconds = time.perf_counter() - start
+        self.last_report = self._build_report(wall_seconds, [rasterize_stats] + [s.stats for s in stages], documents)
+        return [
+            document.result or {"error": document.error or "処理が完了しませんでした", "success": False}
+            for document in documents
+        ]
+
+    def _rasterize(self, document: _Document, preprocess: _Stage, gemini: _Stage, stats: StageStats):
+        document.span = start_span("process_pdf", file=os.path.basename(document.pdf_path))
+        with activate(document.span):
+            emitted = 0
+            document.start_time = time.time()
+            try:
+                started = time.perf_counter()
+                page_count, page_texts = self.service._read_pages(document.pdf_path)
+                stats.record_item(time.perf_counter() - started)
+                if page_count == 0:
+                    document.error = "PDFにページが含まれていません"
+                    gemini.put(document)
+                    return
+                document.expect_pages(page_count)
+
+                # テキストレイヤーのあるページはラスタライズ・Vision API を経由せず完了扱いにする
+                ocr_pages = [page_index for page_index, text in enumerate(page_texts) if text is None]
+                for page_index, text in enumerate(page_texts):
+                    if text is not None:
+                        document.page_results[page_index] = (text, TEXT_LAYER_CONFIDENCE)
+                document.text_layer_pages = page_count - len(ocr_pages)
+                if not ocr_pages:
+                    document.complete_pages(page_count)
+                    gemini.put(_PassThrough(document))
+                    return
+                document.complete_pages(document.text_layer_pages)
+
+                if self.service.use_page_spool:
+                    document.spool = PageSpool()
+                pages = self.service.rasterizer.iter_pages(document.pdf_path, page_count, ocr_pages, document.spool)
+                while True:
+                    started = time.perf_counter()
+                    try:
+                        page_index, image_data = next(pages)
+                    except StopIteration:
+                        break
+                    # 後段のキューが詰まっている間の待ちは稼働時間に含めない
+                    stats.record_item(time.perf_counter() - started)
+                    preprocess.put((document, page_index, image_data))
+                    emitted += 1
+            except Exception as e:
+                logger.error(f"PDF to Image変換エラー: {e}")
+                document.error = "PDF to Image変換に失敗しました"
+                # 投入できなかったページを完了扱いにし、投入済みページの完了後にエラー結果を返す
+                not_emitted = document.page_count - document.text_layer_pages - emitted
+                if document.page_count == 0 or (not_emitted > 0 and document.complete_pages(not_emitted)):
+                    gemini.put(document)
+
+    def _preprocess(self, item: Tuple[_Document, int, bytes]):
+        document, page_index, image_data = item
+        try:
+            with activate(document.span):
+                processed_image = self.service.preprocess_image(image_data)
+        finally:
+            if document.spool is not None:
+                document.spool.release(page_index)
+        cache_key, cached = self.service._lookup_cache(processed_image)
+        if cached is not None:
+            # キャッシュにヒットしたページは Vision ステージを経由しない
+            return self._complete_page(document, page_index, cached)
+        return document, page_index, processed_image, cache_key
+
+    def _vision(self, item) -> Optional[_PassThrough]:
+        if isinstance(item, _PassThrough):
+            return item
+        document, page_index, processed_image, cache_key = item
+        try:
+            with activate(document.span):
+                page_result = self.service._annotate_processed_image(processed_image, cache_key)
+        except Exception as e:
+            logger.error(f"Vision API エラー（{page_index + 1}ページ目）: {e}")
+            page_result = ("", 0.0)
+        return self._complete_page(document, page_index, page_result)
+
+    def _fail_page(self, item, error: Exception) -> Optional[_PassThrough]:
+        """
+        ページのステージでエラーが発生した場合、文書をエラーとしてそのページを完了扱いにする
+        文書の全ページが揃った時点で Gemini ステージへ渡し、エラー結果の記録・スプールとスパンの終了を行う
+        """
+        document, page_index = item[0], item[1]
+        if document.span is not None:
+            document.span.record_error(error)
+        document.fail(f"{page_index + 1}ページ目の処理に失敗しました")
+        if not document.complete_pages():
+            return None
+        return _PassThrough(document)
+
+    def _complete_page(self, document: _Document, page_index: int, page_result: Tuple[str, float]):
+        """
+        ページの結果を記録し、文書の全ページが揃った場合は Gemini ステージへ文書を渡す
+        前処理ステージで完了した場合も Vision ステージを素通りさせて Gemini ステージへ届ける
+        """
+        document.page_results[page_index] = page_result
+        if not document.complete_pages():
+            return None
+        return _PassThrough(document)
+
+    def _structure(self, item) -> None:
+        document = item.document if isinstance(item, _PassThrough) else item
+        try:
+            with activate(document.span):
+                self._structure_document(document)
+        except Exception as e:
+            if document.span is not None:
+                document.span.record_error(e)
+            document.fail("構造化処理に失敗しました")
+            raise
+        finally:
+            if document.spool is not None:
+                document.spool.close()
+            if document.span is not None:
+                document.span.end()
+        return None
+
+    def _structure_document(self, document: _Document):
+        if document.error:
+            document.result = {"error": document.error, "success": False}
+            return
+
+        combined = self.service._combine_page_results(document.page_results)
+        if combined is None:
+            document.result = {"error": "テキスト抽出に失敗しました", "success": False}
+            return
+
+        extracted_text, vision_confidence = combined
+        structuring_start = time.time()
+        structured_data = self.service.structure_data_with_gemini_hybrid(extracted_text)
+        document.result = self.service._build_result(
+            document.start_time, document.page_count, extracted_text, vision_confidence, structured_data,
+            text_layer_pages=document.text_layer_pages,
+            timings={"structuring": (time.time() - structuring_start) * 1000}
+        )
+
+    def _build_report(self, wall_seconds: float, stage_stats: List[StageStats], documents: List[_Document]) -> Dict:
+        stages = [stats.as_dict(wall_seconds) for stats in stage_stats]
+        bottleneck = max(stages, key=lambda stage: stage["utilization"])
+        document_times = [
+            document.result["processing_time"]
+            for document in documents
+            if document.result and document.result.get("success")
+        ]
+        mvp_target = PERFORMANCE_TARGETS["mvp"]["processing_time"]
+        return {
+            "wall_seconds": wall_seconds,
+            "documents": len(documents),
+            "pages": sum(document.page_count for document in documents),
+            "stages": stages,
+            "bottleneck": bottleneck["stage"],
+            "mvp_target_seconds": mvp_target,
+            "documents_over_mvp_target": sum(1 for t in document_times if t > mvp_target),
+        }
+
+
+def print_pipeline_report(report: Dict):
+    """パイプラインのステージ別レポートを表示"""
+    print(f"\n=== パイプラインレポート ===")
+    print(f"経過時間: {report['wall_seconds']:.2f}秒 ({report['documents']}ファイル / {report['pages']}ページ)")
+    print(f"{'ステージ':<12}{'ワーカー':>8}{'処理数':>8}{'稼働率':>10}{'平均滞留':>10}{'最大滞留':>10}")
+    for stage in report["stages"]:
+        print(
+            f"{stage['stage']:<12}{stage['workers']:>8}{stage['processed']:>8}"
+            f"{stage['utilization']:>10.1%}{stage['avg_queue_depth']:>10.1f}{stage['max_queue_depth']:>10}"
+        )
+    print(f"ボトルネック: {report['bottleneck']}")
+    print(
+        f"MVP目標（{report['mvp_target_seconds']}秒）超過: "
+        f"{report['documents_over_mvp_target']}/{report['documents']}ファイル"
+    )
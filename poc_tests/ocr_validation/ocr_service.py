@@ -3,20 +3,18 @@ OCR サービス実装
 Google Cloud Vision API + Gemini Flash の組み合わせテスト
 """
 
+import os
 import time
 import json
 import base64
+from concurrent.futures import ThreadPoolExecutor
 from typing import Dict, List, Optional, Tuple
-from io import BytesIO
 import logging
 
 import PyPDF2
-from PIL import Image
-import cv2
-import numpy as np
 from google.cloud import vision
 import vertexai
-from vertexai.generative_models import GenerativeModel, Part
+from vertexai.generative_models import GenerativeModel, GenerationConfig, Part
 
 from config import (
     GOOGLE_CLOUD_PROJECT, 
@@ -25,55 +23,129 @@ from config import (
     TARGET_FIELDS,
     PERFORMANCE_TARGETS
 )
+from image_preprocessing import DEFAULT_PREPROCESS_PROFILE
+from preprocess_pool import create_preprocessor, PreprocessPool, PREPROCESS_PROCESSES
+from pdf_rasterizer import PDFRasterizer, DEFAULT_RENDER_DPI, DEFAULT_RENDER_WORKERS
+from page_spool import PageSpool, PAGE_SPOOL_ENABLED
+from deed_layout import DocumentLayout, LAYOUT_CROP_ENABLED, sections_for_fields, combine_section_results
+from pdf_text_layer import read_text_layer, TEXT_LAYER_ENABLED, TEXT_LAYER_CONFIDENCE
+from prompt_compaction import (
+    PromptCompactor,
+    get_shared_usage_log,
+    usage_from_sdk_response,
+    join_pages,
+    filter_sections,
+    PROMPT_COMPACTION_ENABLED,
+)
+from structured_output import (
+    StructuredDataValidator,
+    ValidationResult,
+    get_validator,
+    build_response_schema,
+    STRUCTURED_OUTPUT_ENABLED,
+)
+from tracing import span, record_span, bind, stage_timings
+from ocr_cache import OCRResultCache, get_shared_cache, OCR_CACHE_ENABLED
+from structuring_cache import (
+    StructuringCache,
+    get_shared_structuring_cache,
+    prompt_version,
+    GEMINI_CACHE_ENABLED
+)
+from deed_field_extractor import DeedFieldExtractor, merge_structured_data
+from incremental_json import parse_partial_json
 
 # ログ設定
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# ページ単位のVision API同時呼び出し数
+VISION_CONCURRENCY = int(os.getenv("OCR_VISION_CONCURRENCY", "8"))
+
+# ルールベース抽出の高速パスを使用するか
+RULE_EXTRACTION_ENABLED = os.getenv("OCR_RULE_EXTRACTION", "true").lower() == "true"
+
 class OCRService:
-    def __init__(self):
-        """OCRサービスの初期化"""
-        self.vision_client = vision.ImageAnnotatorClient()
+    def __init__(
+        self,
+        render_dpi: int = DEFAULT_RENDER_DPI,
+        render_workers: int = DEFAULT_RENDER_WORKERS,
+        preprocess_profile: str = DEFAULT_PREPROCESS_PROFILE,
+        use_cache: bool = OCR_CACHE_ENABLED,
+        use_structuring_cache: bool = GEMINI_CACHE_ENABLED,
+        use_rule_extraction: bool = RULE_EXTRACTION_ENABLED,
+        use_text_layer: bool = TEXT_LAYER_ENABLED,
+        preprocess_processes: int = PREPROCESS_PROCESSES,
+        use_prompt_compaction: bool = PROMPT_COMPACTION_ENABLED,
+        use_structured_output: bool = STRUCTURED_OUTPUT_ENABLED,
+        use_page_spool: bool = PAGE_SPOOL_ENABLED,
+        use_layout_crop: bool = LAYOUT_CROP_ENABLED,
+        vision_client: Optional[vision.ImageAnnotatorClient] = None,
+        gemini_model: Optional[GenerativeModel] = None
+    ):
+        """
+        OCRサービスの初期化
+        vision_client / gemini_model を指定した場合はそのクライアントを使う（ローカルのフェイクサーバーに向ける場合など）
+        """
+        self.vision_client = vision_client or vision.ImageAnnotatorClient()
         
         # Vertex AI初期化
-        vertexai.init(project=GOOGLE_CLOUD_PROJECT, location=VERTEX_AI_LOCATION)
-        self.gemini_model = GenerativeModel(GEMINI_MODEL)
+        if gemini_model is None:
+            vertexai.init(project=GOOGLE_CLOUD_PROJECT, location=VERTEX_AI_LOCATION)
+        self.gemini_model = gemini_model or GenerativeModel(GEMINI_MODEL)
+        
+        # 電子PDFのテキストレイヤーを優先して使用するか
+        self.use_text_layer = use_text_layer
+        
+        # PDF→画像変換（全ページをプロセスプールで並列レンダリング）
+        self.rasterizer = PDFRasterizer(dpi=render_dpi, max_workers=render_workers)
+        # レンダリング済みページを一時ファイルにスプールし、ページ数によらずメモリ使用量を一定に保つ
+        self.use_page_spool = use_page_spool
+        # 罫線から区を判定し、抽出項目に必要な区だけを切り出して Vision API に送る（None は切り出さない）
+        self.layout_sections = sections_for_fields(TARGET_FIELDS) if use_layout_crop else None
+        if use_layout_crop and self.layout_sections is None:
+            logger.warning("区の対応表にない抽出項目があるため、レイアウト解析による切り出しを無効化")
+        
+        # 画像前処理（作業バッファを使い回す。preprocess_processes が 1 以上ならワーカープロセスで実行）
+        self.preprocessor = create_preprocessor(preprocess_profile, render_dpi, preprocess_processes)
+        
+        # Vision API結果キャッシュ（前処理済み画像のハッシュで参照）
+        self.ocr_cache: Optional[OCRResultCache] = get_shared_cache() if use_cache else None
+        
+        # Gemini構造化結果キャッシュ（プロンプトテンプレート・抽出項目・モデルが変わると自動的に無効化）
+        self.structuring_cache: Optional[StructuringCache] = (
+            get_shared_structuring_cache() if use_structuring_cache else None
+        )
+        # 抽出プロンプトの圧縮（定型行・ページ間の重複行の除去と、最も短い回答フォーマットの選択）
+        self.prompt_compactor: Optional[PromptCompactor] = PromptCompactor() if use_prompt_compaction else None
+        self.usage_log = get_shared_usage_log()
+
+        # 構造化出力（responseSchema で JSON を強制）と、抽出項目ごとに一度だけ作成する検証器
+        self.use_structured_output = use_structured_output
+        self.validator: StructuredDataValidator = get_validator(tuple(TARGET_FIELDS))
+        self.prompt_version = prompt_version(self._create_extraction_prompt(""), GEMINI_MODEL)
+        
+        # ルールベース抽出（定型項目は正規表現で抽出し、不足項目のみGeminiに問い合わせる）
+        self.field_extractor: Optional[DeedFieldExtractor] = DeedFieldExtractor() if use_rule_extraction else None
         
         logger.info("OCRService initialized")
 
     def preprocess_image(self, image_data: bytes) -> bytes:
         """
-        画像前処理: 傾き補正、ノイズ除去、二値化
+        画像前処理: ノイズ除去、二値化（image_preprocessing に委譲）
         """
         try:
-            # PIL Image として読み込み
-            pil_image = Image.open(BytesIO(image_data))
-            
-            # OpenCV形式に変換
-            opencv_image = cv2.cvtColor(np.array(pil_image), cv2.COLOR_RGB2BGR)
-            
-            # グレースケール変換
-            gray = cv2.cvtColor(opencv_image, cv2.COLOR_BGR2GRAY)
-            
-            # ノイズ除去
-            denoised = cv2.fastNlMeansDenoising(gray)
-            
-            # 適応的閾値処理（二値化）
-            binary = cv2.adaptiveThreshold(
-                denoised, 255, cv2.ADAPTIVE_THRESH_GAUSSIAN_C, cv2.THRESH_BINARY, 11, 2
-            )
-            
-            # PIL Imageに戻す
-            processed_image = Image.fromarray(binary)
-            
-            # バイト形式で返す
-            output_buffer = BytesIO()
-            processed_image.save(output_buffer, format='PNG')
-            return output_buffer.getvalue()
-            
+            with span("preprocess"):
+                timings: Dict[str, float] = {}
+                processed_image = self.preprocessor.process(image_data, timings)
+                # エンコードは前処理の最後の段階のため、前処理スパンの子として記録する
+                if "encode" in timings:
+                    record_span("encode", timings["encode"])
+                return processed_image
         except Exception as e:
             logger.warning(f"前処理でエラー発生: {e}. 元画像を使用します。")
-            return image_data
+            # スプール上の memoryview は解放後に参照できなくなるため複製する
+            return bytes(image_data)
 
     def extract_text_with_vision(self, image_data: bytes) -> Tuple[str, float]:
         """
@@ -88,29 +160,13 @@ class OCRService:
             # 前処理
             processed_image = self.preprocess_image(image_data)
             
-            # Vision API呼び出し
-            image = vision.Image(content=processed_image)
-            response = self.vision_client.text_detection(image=image)
-            
-            if response.error.message:
-                raise Exception(f'Vision API Error: {response.error.message}')
-            
-            # テキスト抽出
-            texts = response.text_annotations
-            if not texts:
-                return "", 0.0
+            # キャッシュ参照
+            cache_key, cached = self._lookup_cache(processed_image)
+            if cached is not None:
+                logger.info("Vision API結果をキャッシュから取得")
+                return cached
             
-            full_text = texts[0].description
-            
-            # 信頼度計算（各単語の信頼度の平均）
-            total_confidence = 0
-            word_count = 0
-            for text in texts[1:]:  # 最初は全体テキストなのでスキップ
-                if hasattr(text, 'confidence'):
-                    total_confidence += text.confidence
-                    word_count += 1
-            
-            confidence = total_confidence / word_count if word_count > 0 else 0.0
+            full_text, confidence = self._annotate_processed_image(processed_image, cache_key)
             
             processing_time = time.time() - start_time
             logger.info(f"Vision API処理時間: {processing_time:.2f}秒, 信頼度: {confidence:.2%}")
@@ -121,39 +177,206 @@ class OCRService:
             logger.error(f"Vision API エラー: {e}")
             return "", 0.0
 
-    def structure_data_with_gemini(self, text: str) -> Dict:
+    def _annotate_processed_image(self, processed_image: bytes, cache_key: Optional[str]) -> Tuple[str, float]:
+        """
+        前処理済み画像を Vision API に送信し、結果をキャッシュに保存
+        """
+        api_start = time.time()
+        image = vision.Image(content=processed_image)
+        with span("vision", image_bytes=len(processed_image)):
+            response = self.vision_client.text_detection(image=image)
+        
+        with span("parse", upstream="vision"):
+            full_text, confidence = self._parse_vision_response(response)
+        self._store_cache(cache_key, full_text, confidence, time.time() - api_start)
+        return full_text, confidence
+
+    def _lookup_cache(self, processed_image: bytes) -> Tuple[Optional[str], Optional[Tuple[str, float]]]:
+        """
+        Vision API結果キャッシュを参照
+        
+        Returns:
+            (キャッシュキー, ヒットした場合は (抽出テキスト, 信頼度))。キャッシュ無効時・エラー時は (None, None)
+        """
+        if self.ocr_cache is None:
+            return None, None
+        try:
+            cache_key = OCRResultCache.make_key(processed_image, self.preprocessor.profile)
+            return cache_key, self.ocr_cache.get(cache_key)
+        except Exception as e:
+            logger.warning(f"OCRキャッシュ参照エラー: {e}")
+            return None, None
+
+    def _store_cache(self, cache_key: Optional[str], full_text: str, confidence: float, api_latency: float):
+        """
+        Vision API結果をキャッシュに保存（保存に失敗しても処理は継続）
+        """
+        if self.ocr_cache is None or cache_key is None:
+            return
+        try:
+            self.ocr_cache.put(cache_key, self.preprocessor.profile, full_text, confidence, api_latency)
+        except Exception as e:
+            logger.warning(f"OCRキャッシュ保存エラー: {e}")
+
+    def _parse_vision_response(self, response) -> Tuple[str, float]:
+        """
+        AnnotateImageResponse から (抽出テキスト, 信頼度) を取り出す
+        """
+        if response.error.message:
+            raise Exception(f'Vision API Error: {response.error.message}')
+        
+        # テキスト抽出
+        texts = response.text_annotations
+        if not texts:
+            return "", 0.0
+        
+        full_text = texts[0].description
+        
+        # 信頼度計算（各単語の信頼度の平均）
+        total_confidence = 0
+        word_count = 0
+        for text in texts[1:]:  # 最初は全体テキストなのでスキップ
+            if hasattr(text, 'confidence'):
+                total_confidence += text.confidence
+                word_count += 1
+        
+        confidence = total_confidence / word_count if word_count > 0 else 0.0
+        
+        return full_text, confidence
+
+    def structure_data_with_gemini(self, text: str, fields: Optional[List[str]] = None) -> Dict:
         """
         Gemini Flashで構造化データに変換
+        fields を指定した場合はその項目のみを問い合わせる
         """
         try:
             start_time = time.time()
             
+            # キャッシュ参照
+            cache_key, cached = self._lookup_structuring_cache(text, fields)
+            if cached is not None:
+                logger.info("構造化結果をキャッシュから取得")
+                return cached
+            
             # プロンプト作成
-            prompt = self._create_extraction_prompt(text)
+            prompt = self._create_extraction_prompt(text, fields)
             
             # Gemini API呼び出し
-            response = self.gemini_model.generate_content(prompt)
+            api_start = time.time()
+            with span("gemini", fields=len(fields or TARGET_FIELDS)):
+                response = self.gemini_model.generate_content(prompt, generation_config=self._generation_config(fields))
+            self.usage_log.record(prompt, time.time() - api_start, usage_from_sdk_response(response), response.text)
             
             processing_time = time.time() - start_time
             logger.info(f"Gemini処理時間: {processing_time:.2f}秒")
             
-            # JSONパース
-            try:
-                result = json.loads(response.text)
-                return result
-            except json.JSONDecodeError:
-                logger.error("Geminiの応答がJSONパースできませんでした")
-                return {"error": "JSON parse error", "raw_response": response.text}
+            with span("parse", upstream="gemini"):
+                structured_data = self._parse_gemini_response(response.text)
+            self._store_structuring_cache(cache_key, structured_data, processing_time)
+            return structured_data
                 
         except Exception as e:
             logger.error(f"Gemini API エラー: {e}")
             return {"error": str(e)}
 
-    def _create_extraction_prompt(self, text: str) -> str:
+    def _generation_config(self, fields: Optional[List[str]] = None) -> Optional[GenerationConfig]:
+        """
+        構造化出力が有効な場合の生成設定（JSON応答と responseSchema を指定）
+        """
+        if not self.use_structured_output:
+            return None
+        return GenerationConfig(
+            response_mime_type="application/json",
+            response_schema=build_response_schema(tuple(fields or TARGET_FIELDS), property_ordering=False),
+        )
+
+    def structure_data_with_gemini_hybrid(self, text: str, sectioned: bool = False) -> Dict:
+        """
+        ルールベース抽出で埋まらなかった項目のみ Gemini で構造化して統合
+        ルール抽出が無効の場合は全項目を Gemini に問い合わせる
+        sectioned: text がレイアウト解析で区ごとに切り出したOCRテキスト（区の見出しタグ付き）の場合に True
+        """
+        if self.field_extractor is None:
+            return self.structure_data_with_gemini(text)
+        
+        start_time = time.time()
+        rule_result = self.field_extractor.extract(text, TARGET_FIELDS)
+        missing = self.field_extractor.missing_fields(rule_result, TARGET_FIELDS)
+        logger.info(
+            f"ルールベース抽出: {len(TARGET_FIELDS) - len(missing)}/{len(TARGET_FIELDS)}項目 "
+            f"({(time.time() - start_time) * 1000:.2f}ms)"
+        )
+        
+        # 区ごとに切り出したテキストは、未抽出項目の記載される区だけを Gemini に渡す
+        if sectioned:
+            text = filter_sections(text, sections_for_fields(missing))
+        llm_result = self.structure_data_with_gemini(text, fields=missing) if missing else None
+        return merge_structured_data(rule_result, llm_result, TARGET_FIELDS, missing)
+
+    def _lookup_structuring_cache(
+        self, text: str, fields: Optional[List[str]] = None
+    ) -> Tuple[Optional[str], Optional[Dict]]:
+        """
+        構造化結果キャッシュを参照（キーは正規化したOCRテキスト＋プロンプトバージョン＋問い合わせ項目）
+        
+        Returns:
+            (キャッシュキー, ヒットした場合は構造化データ)。キャッシュ無効時は (None, None)
+        """
+        if self.structuring_cache is None:
+            return None, None
+        version = self.prompt_version if fields is None else f"{self.prompt_version}:{','.join(fields)}"
+        cache_key = StructuringCache.make_key(text, version)
+        return cache_key, self.structuring_cache.get(cache_key)
+
+    def _store_structuring_cache(self, cache_key: Optional[str], structured_data: Dict, api_latency: float):
+        """
+        構造化結果をキャッシュに保存（エラー応答・部分的な応答は保存しない）
+        """
+        if self.structuring_cache is None or cache_key is None:
+            return
+        if "error" in structured_data or structured_data.get("partial"):
+            return
+        self.structuring_cache.put(cache_key, structured_data, api_latency)
+
+    def _parse_gemini_response(self, response_text: str) -> Dict:
+        """
+        Geminiの応答テキストをJSONとしてパース
+        """
+        try:
+            return json.loads(response_text)
+        except json.JSONDecodeError:
+            return self._recover_partial_json(response_text)
+
+    def _recover_partial_json(self, response_text: str) -> Dict:
+        """
+        JSONとして解釈できない応答から、解析できた項目を取り出す
+        コードフェンス付きなど本体が完全なJSONの場合はそのまま返し、途中で壊れている場合は partial=True を付ける
+        """
+        recovered, complete = parse_partial_json(response_text)
+        if recovered is not None and complete:
+            return recovered
+        if recovered and recovered.get("extracted_data"):
+            logger.warning("Geminiの応答が不完全なため、解析できた項目のみ使用します")
+            recovered["partial"] = True
+            return recovered
+        logger.error("Geminiの応答がJSONパースできませんでした")
+        return {"error": "JSON parse error", "raw_response": response_text}
+
+    def _create_extraction_prompt(self, text: str, fields: Optional[List[str]] = None) -> str:
         """
         登記簿謄本用の抽出プロンプト作成
+        fields を指定した場合はその項目のみを問い合わせる縮小プロンプトを作成
         """
-        fields_list = "\n".join([f"- {field}" for field in TARGET_FIELDS])
+        fields = fields or TARGET_FIELDS
+        if self.prompt_compactor is not None:
+            return self.prompt_compactor.build(text, fields)
+        fields_list = "\n".join([f"- {field}" for field in fields])
+        data_example = ",\n".join(f'        "{field}": "抽出された値または空文字"' for field in fields[:3])
+        scores_example = ",\n".join(f'        "{field}": 0.95' for field in fields[:2])
+        if len(fields) > 3:
+            data_example += ",\n        ...（他の項目も同様）"
+        if len(fields) > 2:
+            scores_example += ",\n        ...（各項目の信頼度0.0-1.0）"
         
         prompt = f"""
 以下は登記簿謄本から抽出したテキストです。
@@ -168,15 +391,10 @@ class OCRService:
 回答フォーマット:
 {{
     "extracted_data": {{
-        "不動産の表示": "抽出された値または空文字",
-        "所在": "抽出された値または空文字",
-        "地番": "抽出された値または空文字",
-        ...（他の項目も同様）
+{data_example}
     }},
     "confidence_scores": {{
-        "不動産の表示": 0.95,
-        "所在": 0.90,
-        ...（各項目の信頼度0.0-1.0）
+{scores_example}
     }},
     "metadata": {{
         "total_fields": 抽出された項目数,
@@ -194,89 +412,209 @@ class OCRService:
     def process_pdf(self, pdf_path: str) -> Dict:
         """
         PDFファイル全体を処理
+        ステージごとの処理時間は process_pdf スパン配下のスパンから集計し、結果の timings_ms に含める
         """
-        try:
-            start_time = time.time()
-            logger.info(f"PDF処理開始: {pdf_path}")
+        with span("process_pdf", file=os.path.basename(pdf_path)):
+            try:
+                start_time = time.time()
+                logger.info(f"PDF処理開始: {pdf_path}")
             
-            # PDF読み込み
-            with open(pdf_path, 'rb') as file:
-                pdf_reader = PyPDF2.PdfReader(file)
-                
-                if len(pdf_reader.pages) == 0:
+                # PDF読み込み（ページ数・テキストレイヤーの確認）
+                page_count, page_texts = self._read_pages(pdf_path)
+            
+                if page_count == 0:
                     return {"error": "PDFにページが含まれていません"}
-                
-                # 最初のページを処理（登記簿謄本は通常1ページ）
-                page = pdf_reader.pages[0]
-                
-                # ページを画像に変換（実際の実装では pdf2image を使用）
-                # ここではサンプル画像を使用
-                image_data = self._convert_page_to_image(page)
-                
-                if not image_data:
+            
+                # テキストレイヤーのないページのみ画像化してVision APIでテキスト抽出
+                page_results = self._extract_pages(pdf_path, page_count, page_texts)
+            
+                if page_results is None:
                     return {"error": "PDF to Image変換に失敗しました"}
-                
-                # Vision APIでテキスト抽出
-                extracted_text, vision_confidence = self.extract_text_with_vision(image_data)
-                
-                if not extracted_text:
+            
+                combined = self._combine_page_results(page_results)
+                if combined is None:
                     return {"error": "テキスト抽出に失敗しました"}
-                
+            
+                extracted_text, vision_confidence = combined
+            
                 # Geminiで構造化
-                structured_data = self.structure_data_with_gemini(extracted_text)
-                
-                total_time = time.time() - start_time
-                
-                # 結果まとめ
-                result = {
-                    "success": True,
-                    "processing_time": total_time,
-                    "vision_confidence": vision_confidence,
-                    "extracted_text": extracted_text[:500] + "..." if len(extracted_text) > 500 else extracted_text,
-                    "structured_data": structured_data,
-                    "performance_evaluation": self._evaluate_performance(total_time, structured_data)
-                }
-                
-                logger.info(f"PDF処理完了: {total_time:.2f}秒")
-                return result
+                structuring_start = time.time()
+                structured_data = self.structure_data_with_gemini_hybrid(
+                    extracted_text, sectioned=self.layout_sections is not None
+                )
+            
+                return self._build_result(
+                    start_time, page_count, extracted_text, vision_confidence, structured_data,
+                    text_layer_pages=sum(1 for text in page_texts if text is not None),
+                    timings={"structuring": (time.time() - structuring_start) * 1000}
+                )
                 
+            except Exception as e:
+                logger.error(f"PDF処理エラー: {e}")
+                return {"error": str(e), "success": False}
+
+    def _count_pages(self, pdf_path: str) -> int:
+        """
+        PDFのページ数を取得
+        """
+        with open(pdf_path, 'rb') as file:
+            pdf_reader = PyPDF2.PdfReader(file)
+            return len(pdf_reader.pages)
+
+    def _read_pages(self, pdf_path: str) -> Tuple[int, List[Optional[str]]]:
+        """
+        PDFのページ数と、ページごとのテキストレイヤー（OCRが必要なページは None）を取得
+        """
+        with span("open"):
+            if self.use_text_layer:
+                return read_text_layer(pdf_path)
+            page_count = self._count_pages(pdf_path)
+            return page_count, [None] * page_count
+
+    def _extract_pages(
+        self, pdf_path: str, page_count: int, page_texts: Optional[List[Optional[str]]] = None
+    ) -> Optional[List[Tuple[str, float]]]:
+        """
+        テキストレイヤーのないページを画像化してVision APIでテキスト抽出
+        後続ページのレンダリングと前のページのVision API呼び出しを重ねて実行する
+        
+        Returns:
+            ページ順の (抽出テキスト, 信頼度) のリスト。画像化に失敗した場合はNone
+        """
+        page_texts = page_texts or [None] * page_count
+        page_results: List[Tuple[str, float]] = [
+            (text, TEXT_LAYER_CONFIDENCE) if text is not None else ("", 0.0) for text in page_texts
+        ]
+        ocr_pages = [page_index for page_index, text in enumerate(page_texts) if text is None]
+        if not ocr_pages:
+            logger.info("全ページでテキストレイヤーを使用（ラスタライズ・Vision APIを省略）")
+            return page_results
+        
+        spool = PageSpool() if self.use_page_spool else None
+        # テキストレイヤーのページは画像化しないため、その見出しで区の判定を進める
+        layout = (
+            DocumentLayout(self.layout_sections, text_pages=page_texts) if self.layout_sections is not None else None
+        )
+        try:
+            with ThreadPoolExecutor(max_workers=min(VISION_CONCURRENCY, len(ocr_pages))) as vision_pool:
+                futures = {}
+                for page_index, image_data in self.rasterizer.iter_pages(pdf_path, page_count, ocr_pages, spool):
+                    if layout is None:
+                        futures[page_index] = [(None, vision_pool.submit(bind(self._extract_page), image_data, page_index, spool))]
+                        continue
+                    with span("layout", page=page_index):
+                        regions = layout.split_page(image_data, page_index)
+                    if regions and regions[0][0] is None:
+                        futures[page_index] = [(None, vision_pool.submit(bind(self._extract_page), image_data, page_index, spool))]
+                        continue
+                    # 切り出した画像は元のページと別のバッファのため、スプール上のページはここで解放する
+                    if spool is not None:
+                        spool.release(page_index)
+                    futures[page_index] = [
+                        (section, vision_pool.submit(bind(self.extract_text_with_vision), crop))
+                        for section, crop in regions
+                    ]
+                for page_index, parts in futures.items():
+                    if parts:
+                        page_results[page_index] = combine_section_results(
+                            [(section, future.result()) for section, future in parts]
+                        )
+                if layout is not None:
+                    logger.info(f"レイアウト解析: {layout.stats()}")
+                return page_results
         except Exception as e:
-            logger.error(f"PDF処理エラー: {e}")
-            return {"error": str(e), "success": False}
+            logger.error(f"PDF to Image変換エラー: {e}")
+            return None
+        finally:
+            if spool is not None:
+                spool.close()
+
+    def _extract_page(self, image_data: bytes, page_index: int, spool: Optional[PageSpool] = None) -> Tuple[str, float]:
+        """
+        1ページのテキスト抽出（スプール上のページは抽出後に解放する）
+        """
+        try:
+            return self.extract_text_with_vision(image_data)
+        finally:
+            if spool is not None:
+                spool.release(page_index)
 
-    def _convert_page_to_image(self, page) -> Optional[bytes]:
+    def _combine_page_results(self, page_results: List[Tuple[str, float]]) -> Optional[Tuple[str, float]]:
         """
-        PDFページを画像に変換（実装例）
-        実際の実装ではpdf2imageライブラリを使用推奨
+        ページごとの (抽出テキスト, 信頼度) をページ順に連結
+        
+        Returns:
+            (全文テキスト, テキストのあるページの平均信頼度)。全ページ空の場合はNone
         """
-        # TODO: 実際の実装では pdf2image.convert_from_path を使用
-        # ここではダミー画像データを返す
+        page_texts = [text for text, _ in page_results if text]
+        if not page_texts:
+            return None
         
-        # サンプル画像（1x1ピクセルの白画像）
-        sample_image = Image.new('RGB', (1, 1), color='white')
-        buffer = BytesIO()
-        sample_image.save(buffer, format='PNG')
-        return buffer.getvalue()
+        extracted_text = join_pages(page_texts)
+        vision_confidence = sum(conf for text, conf in page_results if text) / len(page_texts)
+        return extracted_text, vision_confidence
 
-    def _evaluate_performance(self, processing_time: float, structured_data: Dict) -> Dict:
+    def _build_result(
+        self,
+        start_time: float,
+        page_count: int,
+        extracted_text: str,
+        vision_confidence: float,
+        structured_data: Dict,
+        text_layer_pages: int = 0,
+        timings: Optional[Dict[str, float]] = None
+    ) -> Dict:
+        """
+        process_pdf の結果をまとめる
+        構造化データを検証・評価し、トレースのステージ別処理時間と検証時間を timings（ms）に加える
+        """
+        with span("evaluate"):
+            validation = self.validator.validate(structured_data)
+            total_time = time.time() - start_time
+            performance_evaluation = self._evaluate_performance(total_time, structured_data, validation)
+        timings = dict(stage_timings(), **(timings or {}), validation=validation.elapsed_ms)
+        
+        result = {
+            "success": True,
+            "processing_time": total_time,
+            "page_count": page_count,
+            "vision_confidence": vision_confidence,
+            "text_layer_pages": text_layer_pages,
+            "extracted_text": extracted_text[:500] + "..." if len(extracted_text) > 500 else extracted_text,
+            "structured_data": structured_data,
+            "validation": validation.as_dict(),
+            "timings_ms": timings,
+            "performance_evaluation": performance_evaluation
+        }
+        
+        if self.ocr_cache is not None:
+            result["ocr_cache"] = self.ocr_cache.stats.as_dict()
+        if self.structuring_cache is not None:
+            result["structuring_cache"] = self.structuring_cache.stats()
+        
+        logger.info(f"PDF処理完了: {total_time:.2f}秒 ({page_count}ページ)")
+        return result
+
+    def shutdown(self):
+        """ラスタライズ・前処理のプロセスプールを停止"""
+        self.rasterizer.shutdown()
+        if isinstance(self.preprocessor, PreprocessPool):
+            self.preprocessor.shutdown()
+
+    def _evaluate_performance(
+        self, processing_time: float, structured_data: Dict, validation: Optional[ValidationResult] = None
+    ) -> Dict:
         """
         パフォーマンス評価
+        抽出率・平均信頼度は検証結果から取得する（validation を省略した場合はここで検証する）
         """
         mvp_target = PERFORMANCE_TARGETS["mvp"]
         rc_target = PERFORMANCE_TARGETS["rc"]
         
-        # 抽出成功率計算
-        if "extracted_data" in structured_data:
-            extracted_fields = sum(1 for v in structured_data["extracted_data"].values() if v)
-            extraction_rate = extracted_fields / len(TARGET_FIELDS)
-        else:
-            extraction_rate = 0.0
-        
-        # 平均信頼度
-        if "metadata" in structured_data and "average_confidence" in structured_data["metadata"]:
-            avg_confidence = structured_data["metadata"]["average_confidence"]
-        else:
-            avg_confidence = 0.0
+        if validation is None:
+            validation = self.validator.validate(structured_data)
+        extraction_rate = validation.extraction_rate
+        avg_confidence = validation.average_confidence
         
         return {
             "processing_time": {
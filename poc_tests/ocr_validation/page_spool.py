@@ -0,0 +1,104 @@
+"""
+レンダリング済みページ画像のスプール（メモリマップした一時ファイル）
+200ページ規模のスキャン謄本でも全ページの画像を bytes のままメモリに保持しないよう、
+レンダリング結果を一時ファイルに書き出し、後段には一時ファイルをメモリマップした memoryview を渡す
+
+- ページはページ番号 → (オフセット, 長さ) の索引で管理し、オフセットは mmap の境界に揃える
+- view() はそのページの範囲だけをマップするため、後段が読み込むまで常駐メモリに載らない
+- release() で処理済みのページのマップを解除し、ページキャッシュからも追い出す（ページ数によらず常駐メモリを一定に保つ）
+"""
+
+import os
+import mmap
+import tempfile
+import threading
+import logging
+from typing import Dict, Optional, Tuple
+
+# ログ設定
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+PAGE_SPOOL_ENABLED = os.getenv("OCR_PAGE_SPOOL", "true").lower() == "true"
+# 一時ファイルの作成先（未指定はOSの一時ディレクトリ）
+PAGE_SPOOL_DIR = os.getenv("OCR_PAGE_SPOOL_DIR") or None
+
+
+class PageSpool:
+    """
+    1文書分のページ画像のスプール（書き込み・参照・解放はスレッドセーフ）
+    close() で一時ファイルを削除する
+    """
+
+    def __init__(self, directory: Optional[str] = PAGE_SPOOL_DIR):
+        self._file = tempfile.TemporaryFile(prefix="ocr_pages_", dir=directory, buffering=0)
+        self._lock = threading.Lock()
+        self._index: Dict[int, Tuple[int, int]] = {}
+        self._views: Dict[int, memoryview] = {}
+        self._end = 0
+        self.pages_written = 0
+        self.bytes_written = 0
+        self.peak_mapped_pages = 0
+
+    def write(self, page_index: int, data: bytes):
+        """ページ画像を一時ファイルの末尾（mmap の境界に揃えた位置）に追記して索引に登録"""
+        with self._lock:
+            offset = -(-self._end // mmap.ALLOCATIONGRANULARITY) * mmap.ALLOCATIONGRANULARITY
+            self._file.seek(offset)
+            remaining = memoryview(data)
+            while remaining:
+                remaining = remaining[self._file.write(remaining):]
+            self._end = offset + len(data)
+            self._index[page_index] = (offset, len(data))
+            self.pages_written += 1
+            self.bytes_written += len(data)
+
+    def view(self, page_index: int) -> memoryview:
+        """
+        ページ画像の読み取り専用 memoryview（ページの範囲だけをメモリマップする）
+        使い終わったら release(page_index) を呼ぶ
+        """
+        with self._lock:
+            offset, length = self._index[page_index]
+            if length == 0:
+                return memoryview(b"")
+            mapped = mmap.mmap(self._file.fileno(), length, offset=offset, access=mmap.ACCESS_READ)
+            view = memoryview(mapped)
+            self._views[page_index] = view
+            self.peak_mapped_pages = max(self.peak_mapped_pages, len(self._views))
+            return view
+
+    def release(self, page_index: int):
+        """
+        処理済みのページのマップを解除し、ページキャッシュからも追い出す
+        （ページから作った配列などがまだ残っている場合は、それらが解放された時点でマップが解除される）
+        """
+        with self._lock:
+            view = self._views.pop(page_index, None)
+            offset, length = self._index.pop(page_index, (0, 0))
+        if view is not None:
+            try:
+                view.release()
+            except BufferError:
+                pass
+        if length and hasattr(os, "posix_fadvise"):
+            os.posix_fadvise(self._file.fileno(), offset, length, os.POSIX_FADV_DONTNEED)
+
+    def close(self):
+        """全ページのマップを解除して一時ファイルを削除"""
+        with self._lock:
+            views = list(self._views.values())
+            self._views.clear()
+            self._index.clear()
+        for view in views:
+            try:
+                view.release()
+            except BufferError:
+                pass
+        self._file.close()
+
+    def __enter__(self) -> "PageSpool":
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
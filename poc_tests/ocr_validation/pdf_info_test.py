@@ -4,11 +4,13 @@ PDFファイルの情報確認とテキスト抽出テスト
 
 import os
 import sys
-import json
-import urllib.request
+import urllib.error
 import base64
 import time
 
+from http_client import get_shared_client, vision_annotate_url, gemini_url
+from streaming_payload import Base64FilePart, UploadMemoryTracker, build_json_body
+
 # 設定
 GOOGLE_API_KEY = os.getenv('GOOGLE_API_KEY', '')
 
@@ -18,6 +20,9 @@ if not GOOGLE_API_KEY:
     print("環境変数を設定してください: export GOOGLE_API_KEY='your-api-key'")
     sys.exit(1)
 
+# 共通HTTPクライアント（Keep-Alive接続を使い回す）
+api_client = get_shared_client()
+
 def analyze_pdf_file(pdf_path):
     """
     PDFファイルの基本情報を確認
@@ -57,7 +62,7 @@ def test_document_ai_api(pdf_path):
             pdf_base64 = base64.b64encode(pdf_content).decode('utf-8')
         
         # Document AI API エンドポイント (簡易的にVision APIの文書解析機能を使用)
-        url = f"https://vision.googleapis.com/v1/images:annotate?key={GOOGLE_API_KEY}"
+        url = vision_annotate_url(GOOGLE_API_KEY)
         
         # まず小さなサンプル画像でテスト
         test_image_base64 = "iVBORw0KGgoAAAANSUhEUgAAAAEAAAABCAYAAAAfFcSJAAAADUlEQVR42mP8/5+hHgAHggJ/PchI7wAAAABJRU5ErkJggg=="
@@ -79,12 +84,10 @@ def test_document_ai_api(pdf_path):
         }
         
         print("Vision API接続テスト中...")
-        data = json.dumps(payload).encode('utf-8')
-        req = urllib.request.Request(url, data=data)
-        req.add_header('Content-Type', 'application/json')
         
-        with urllib.request.urlopen(req, timeout=30) as response:
-            result = json.loads(response.read().decode('utf-8'))
+        response = api_client.post(url, json=payload, timeout=30)
+        response.raise_for_status()
+        result = response.json()
         
         print("✅ Vision API接続成功")
         return True
@@ -100,13 +103,11 @@ def extract_text_alternative_method(pdf_path):
     print(f"\n=== Gemini API 直接PDF処理テスト ===")
     
     try:
-        # PDFファイルを読み込み
-        with open(pdf_path, 'rb') as file:
-            pdf_content = file.read()
-            pdf_base64 = base64.b64encode(pdf_content).decode('utf-8')
+        # PDFファイルの参照（送信時にチャンク単位でBase64エンコード）
+        pdf_base64 = Base64FilePart(pdf_path)
         
         # Gemini APIに直接PDFを送信
-        url = f"https://generativelanguage.googleapis.com/v1beta/models/gemini-1.5-flash:generateContent?key={GOOGLE_API_KEY}"
+        url = gemini_url(GOOGLE_API_KEY)
         
         payload = {
             "contents": [
@@ -133,15 +134,17 @@ def extract_text_alternative_method(pdf_path):
         print("Gemini APIでPDF処理中...")
         start_time = time.time()
         
-        data = json.dumps(payload).encode('utf-8')
-        req = urllib.request.Request(url, data=data)
-        req.add_header('Content-Type', 'application/json')
-        
-        with urllib.request.urlopen(req, timeout=120) as response:
-            result = json.loads(response.read().decode('utf-8'))
+        with UploadMemoryTracker("Gemini API アップロード") as memory:
+            with build_json_body(payload) as body:
+                response = api_client.post(
+                    url, data=body.file, headers={"Content-Type": "application/json"}, timeout=120
+                )
+            response.raise_for_status()
+            result = response.json()
         
         processing_time = time.time() - start_time
         print(f"処理時間: {processing_time:.2f}秒")
+        print(f"リクエストサイズ: {body.length / (1024*1024):.2f} MB, ピークメモリ: {memory.peak_mb:.2f} MB")
         
         # レスポンス解析
         if "candidates" in result and result["candidates"]:
@@ -183,7 +186,7 @@ def test_simple_text_extraction():
 """
     
     try:
-        url = f"https://generativelanguage.googleapis.com/v1beta/models/gemini-1.5-flash:generateContent?key={GOOGLE_API_KEY}"
+        url = gemini_url(GOOGLE_API_KEY)
         
         prompt = f"""
 以下のテキストから重要な情報を抽出してJSON形式で回答してください：
@@ -206,12 +209,9 @@ JSON形式:
             "generationConfig": {"temperature": 0.1, "maxOutputTokens": 1000}
         }
         
-        data = json.dumps(payload).encode('utf-8')
-        req = urllib.request.Request(url, data=data)
-        req.add_header('Content-Type', 'application/json')
-        
-        with urllib.request.urlopen(req, timeout=30) as response:
-            result = json.loads(response.read().decode('utf-8'))
+        response = api_client.post(url, json=payload, timeout=30)
+        response.raise_for_status()
+        result = response.json()
         
         if "candidates" in result and result["candidates"]:
             response_text = result["candidates"][0]["content"]["parts"][0]["text"]
@@ -4,14 +4,17 @@ PDFを画像に変換してVision API + Geminiで処理
 """
 
 import json
-import urllib.request
+import urllib.error
 import urllib.parse
-import base64
 import os
 import sys
 import time
 from io import BytesIO
 
+from http_client import get_shared_client, vision_annotate_url, gemini_url
+from pdf_text_layer import read_text_layer, TEXT_LAYER_ENABLED, TEXT_LAYER_CONFIDENCE
+from streaming_payload import Base64FilePart, UploadMemoryTracker, build_json_body
+
 # 設定
 GOOGLE_CLOUD_PROJECT = "real-estate-dx"
 GOOGLE_API_KEY = os.getenv('GOOGLE_API_KEY', '')
@@ -22,11 +25,16 @@ if not GOOGLE_API_KEY:
     print("環境変数を設定してください: export GOOGLE_API_KEY='your-api-key'")
     sys.exit(1)
 
+# 共通HTTPクライアント（Keep-Alive接続を使い回す）
+api_client = get_shared_client()
+
 def pdf_to_image_base64(pdf_path):
     """
     PDFファイルを画像に変換してBase64エンコード
     注意: 実際の実装ではpdf2imageライブラリを使用推奨
     今回は簡易的にPDFの最初のページを読み込み
+    
+    ファイル全体をメモリに読み込まず、リクエスト送信時にチャンク単位でエンコードするファイル参照を返す
     """
     try:
         # PDFファイルサイズチェック
@@ -38,11 +46,9 @@ def pdf_to_image_base64(pdf_path):
             return None
         
         # PDFファイルを直接Base64エンコード（Vision APIはPDFも処理可能）
-        with open(pdf_path, 'rb') as file:
-            pdf_content = file.read()
-            pdf_base64 = base64.b64encode(pdf_content).decode('utf-8')
+        pdf_base64 = Base64FilePart(pdf_path)
         
-        print(f"✅ PDFファイル読み込み完了: {len(pdf_base64)} 文字")
+        print(f"✅ PDFファイル読み込み完了: {pdf_base64.encoded_length} 文字")
         return pdf_base64
         
     except Exception as e:
@@ -57,7 +63,7 @@ def extract_text_from_pdf(pdf_base64):
     
     try:
         # Vision API エンドポイント
-        url = f"https://vision.googleapis.com/v1/images:annotate?key={GOOGLE_API_KEY}"
+        url = vision_annotate_url(GOOGLE_API_KEY)
         
         # ペイロード作成
         payload = {
@@ -76,19 +82,22 @@ def extract_text_from_pdf(pdf_base64):
             ]
         }
         
-        # APIリクエスト送信
+        # APIリクエスト送信（JSONはチャンク単位で一時ファイルに書き出して送信）
         print("Vision APIリクエスト送信中...")
         start_time = time.time()
         
-        data = json.dumps(payload).encode('utf-8')
-        req = urllib.request.Request(url, data=data)
-        req.add_header('Content-Type', 'application/json')
-        
-        with urllib.request.urlopen(req, timeout=60) as response:
-            result = json.loads(response.read().decode('utf-8'))
+        with UploadMemoryTracker("Vision API アップロード") as memory:
+            with build_json_body(payload) as body:
+                response = api_client.post(
+                    url, data=body.file, headers={"Content-Type": "application/json"}, timeout=60
+                )
+            response.raise_for_status()
+            result = response.json()
         
         processing_time = time.time() - start_time
         print(f"Vision API処理時間: {processing_time:.2f}秒")
+        print(f"リクエストサイズ: {body.length / (1024*1024):.2f} MB"
+              f"（{'ディスク' if body.on_disk else 'メモリ'}上に作成）, ピークメモリ: {memory.peak_mb:.2f} MB")
         
         # レスポンス解析
         if "responses" not in result or not result["responses"]:
@@ -206,7 +215,7 @@ def structure_data_with_gemini(text):
     
     try:
         # Gemini API エンドポイント
-        url = f"https://generativelanguage.googleapis.com/v1beta/models/gemini-1.5-flash:generateContent?key={GOOGLE_API_KEY}"
+        url = gemini_url(GOOGLE_API_KEY)
         
         payload = {
             "contents": [
@@ -228,12 +237,9 @@ def structure_data_with_gemini(text):
         print("Gemini APIリクエスト送信中...")
         start_time = time.time()
         
-        data = json.dumps(payload).encode('utf-8')
-        req = urllib.request.Request(url, data=data)
-        req.add_header('Content-Type', 'application/json')
-        
-        with urllib.request.urlopen(req, timeout=60) as response:
-            result = json.loads(response.read().decode('utf-8'))
+        response = api_client.post(url, json=payload, timeout=60)
+        response.raise_for_status()
+        result = response.json()
         
         processing_time = time.time() - start_time
         print(f"Gemini処理時間: {processing_time:.2f}秒")
@@ -318,6 +324,23 @@ def evaluate_performance(vision_time, gemini_time, structured_data, vision_confi
     
     return {"processing_time": total_time, "accuracy": 0}
 
+def extract_text_layer(pdf_path):
+    """
+    全ページに十分なテキストレイヤーがある場合はその文字列を返す（OCR不要）
+    1ページでもテキストレイヤーが不十分な場合は None（PDF全体をVision APIで処理）
+    """
+    if not TEXT_LAYER_ENABLED:
+        return None
+    try:
+        page_count, page_texts = read_text_layer(pdf_path)
+    except Exception as e:
+        print(f"⚠️ テキストレイヤーの確認に失敗しました: {e}")
+        return None
+    if page_count == 0 or any(text is None for text in page_texts):
+        return None
+    print(f"✅ 全{page_count}ページでテキストレイヤーを使用（Vision APIを省略）")
+    return "\n".join(page_texts)
+
 def test_pdf_ocr(pdf_path):
     """
     PDFファイルのOCRテスト実行
@@ -328,15 +351,19 @@ def test_pdf_ocr(pdf_path):
         print(f"❌ ファイルが見つかりません: {pdf_path}")
         return False
     
-    # 1. PDFを画像に変換
-    pdf_base64 = pdf_to_image_base64(pdf_path)
-    if not pdf_base64:
-        return False
-    
-    # 2. Vision APIでテキスト抽出
-    start_vision = time.time()
-    extracted_text, vision_confidence = extract_text_from_pdf(pdf_base64)
-    vision_time = time.time() - start_vision
+    # 1. テキストレイヤーの確認（電子PDFはアップロード・Vision APIを省略）
+    extracted_text = extract_text_layer(pdf_path)
+    if extracted_text:
+        vision_time, vision_confidence = 0.0, TEXT_LAYER_CONFIDENCE
+    else:
+        # 2. PDFを読み込み、Vision APIでテキスト抽出
+        pdf_base64 = pdf_to_image_base64(pdf_path)
+        if not pdf_base64:
+            return False
+        
+        start_vision = time.time()
+        extracted_text, vision_confidence = extract_text_from_pdf(pdf_base64)
+        vision_time = time.time() - start_vision
     
     if not extracted_text:
         print("❌ テキスト抽出に失敗しました")
@@ -0,0 +1,173 @@
+"""
+PDFラスタライズ処理
+全ページを指定DPIで画像化し、プロセスプールで並列レンダリングする
+スプール（page_spool.PageSpool）を指定した場合はレンダリング結果を受信直後に一時ファイルへ書き出し、
+ページ画像を bytes のままメモリに溜めない
+"""
+
+import os
+import threading
+import logging
+from concurrent.futures import ProcessPoolExecutor, Future
+from functools import partial
+from io import BytesIO
+from typing import Dict, Iterator, List, Optional, Sequence, Tuple, Union
+
+import pypdfium2 as pdfium
+
+from page_spool import PageSpool
+from tracing import span
+
+# ログ設定
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# PDFの座標系は 1inch = 72pt
+PDF_POINTS_PER_INCH = 72
+
+DEFAULT_RENDER_DPI = int(os.getenv("OCR_RENDER_DPI", "300"))
+DEFAULT_RENDER_WORKERS = int(os.getenv("OCR_RENDER_WORKERS", str(os.cpu_count() or 1)))
+
+
+def render_page(pdf_path: str, page_index: int, dpi: int = DEFAULT_RENDER_DPI) -> bytes:
+    """
+    1ページをグレースケールでレンダリングしPNGバイト列で返す
+    ワーカープロセスから呼ばれるためモジュールレベル関数にしている
+    """
+    pdf = pdfium.PdfDocument(pdf_path)
+    try:
+        page = pdf[page_index]
+        bitmap = page.render(scale=dpi / PDF_POINTS_PER_INCH, grayscale=True)
+        pil_image = bitmap.to_pil()
+
+        # 後段で再デコードするだけの中間形式なので圧縮率より速度を優先
+        buffer = BytesIO()
+        pil_image.save(buffer, format='PNG', compress_level=1)
+        return buffer.getvalue()
+    finally:
+        pdf.close()
+
+
+class PDFRasterizer:
+    """
+    PDFの全ページをページ順に画像化する
+    レンダリングはバックグラウンドのプロセスプールで先行するため、
+    呼び出し側が前のページを処理している間に後続ページの変換が進む
+    """
+
+    def __init__(self, dpi: int = DEFAULT_RENDER_DPI, max_workers: int = DEFAULT_RENDER_WORKERS):
+        self.dpi = dpi
+        self.max_workers = max(1, max_workers)
+        self._executor: Optional[ProcessPoolExecutor] = None
+
+    def _get_executor(self) -> ProcessPoolExecutor:
+        # プロセス起動コストを毎回払わないようプールは使い回す
+        if self._executor is None:
+            self._executor = ProcessPoolExecutor(max_workers=self.max_workers)
+        return self._executor
+
+    def submit(self, pdf_path: str, page_index: int) -> Future:
+        """
+        1ページのレンダリングをプロセスプールに投入
+        """
+        return self._get_executor().submit(render_page, pdf_path, page_index, self.dpi)
+
+    def iter_pages(
+        self,
+        pdf_path: str,
+        page_count: int,
+        page_indices: Optional[Sequence[int]] = None,
+        spool: Optional[PageSpool] = None
+    ) -> Iterator[Tuple[int, Union[bytes, memoryview]]]:
+        """
+        (ページ番号, PNGバイト列) をページ順に返すイテレータ
+        ページごとにレンダリング結果を待った時間を rasterize スパンとして記録する
+        spool を指定した場合はスプール上の memoryview を返す（呼び出し側が処理後に spool.release(ページ番号) を呼ぶ）
+        """
+        indices = list(page_indices) if page_indices is not None else list(range(page_count))
+        if not indices:
+            return
+
+        # 1ページ・単一ワーカーならプールを介さずに直接レンダリング
+        if len(indices) == 1 or self.max_workers == 1:
+            for page_index in indices:
+                with span("rasterize", page=page_index):
+                    image_data = render_page(pdf_path, page_index, self.dpi)
+                    if spool is not None:
+                        spool.write(page_index, image_data)
+                        image_data = spool.view(page_index)
+                yield page_index, image_data
+            return
+
+        if spool is not None:
+            yield from self._iter_spooled(pdf_path, indices, spool)
+            return
+
+        futures: Dict[int, Future] = {
+            page_index: self.submit(pdf_path, page_index) for page_index in indices
+        }
+        try:
+            for page_index in indices:
+                with span("rasterize", page=page_index):
+                    image_data = futures[page_index].result()
+                yield page_index, image_data
+        finally:
+            # 途中で打ち切られた場合は未着手のレンダリングを取り消す
+            for future in futures.values():
+                future.cancel()
+
+    def _iter_spooled(self, pdf_path: str, indices: List[int], spool: PageSpool) -> Iterator[Tuple[int, memoryview]]:
+        """
+        レンダリングしたページをワーカーからの受信直後にスプールへ書き出し、ページ順に memoryview を返す
+        Future に結果を持たせたままにしないため、先行したページの数によらずメモリ使用量が増えない
+        """
+        futures: Dict[int, Future] = {}
+        done = {page_index: threading.Event() for page_index in indices}
+        errors: Dict[int, BaseException] = {}
+        lock = threading.Lock()
+
+        def spool_page(page_index: int, future: Future):
+            try:
+                if not future.cancelled():
+                    spool.write(page_index, future.result())
+            except BaseException as e:
+                errors[page_index] = e
+            finally:
+                with lock:
+                    futures.pop(page_index, None)
+                done[page_index].set()
+
+        for page_index in indices:
+            future = self.submit(pdf_path, page_index)
+            with lock:
+                futures[page_index] = future
+            future.add_done_callback(partial(spool_page, page_index))
+        # ループ変数が最後のページの Future（と結果）を参照し続けないようにする
+        del future
+
+        try:
+            for page_index in indices:
+                with span("rasterize", page=page_index):
+                    done[page_index].wait()
+                    if page_index in errors:
+                        raise errors[page_index]
+                    image_data = spool.view(page_index)
+                yield page_index, image_data
+        finally:
+            # 途中で打ち切られた場合は未着手のレンダリングを取り消す
+            with lock:
+                pending = list(futures.values())
+            for future in pending:
+                future.cancel()
+
+    def render_all(self, pdf_path: str, page_count: int, spool: Optional[PageSpool] = None) -> List[Union[bytes, memoryview]]:
+        """
+        全ページをページ順のリストで返す（spool を指定した場合はスプール上の memoryview）
+        """
+        return [image_data for _, image_data in self.iter_pages(pdf_path, page_count, spool=spool)]
+
+    def shutdown(self):
+        """プロセスプールを停止"""
+        if self._executor is not None:
+            self._executor.shutdown(wait=True)
+            self._executor = None
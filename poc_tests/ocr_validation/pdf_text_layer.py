@@ -0,0 +1,77 @@
+"""
+PDFテキストレイヤーの抽出
+登記情報提供サービス等から取得した電子PDFはテキストレイヤーを持つため、
+ページごとに十分なテキストが取れる場合はラスタライズ・Vision API を省略する
+"""
+
+import os
+import re
+import logging
+from typing import List, Optional, Tuple
+
+import PyPDF2
+
+# ログ設定
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# テキストレイヤーを採用する条件
+#   空白を除いた文字数が TEXT_LAYER_MIN_CHARS 以上で、
+#   かつ有効な文字（かな・漢字・英数字・記号）の割合が TEXT_LAYER_MIN_VALID_RATIO 以上
+TEXT_LAYER_ENABLED = os.getenv("OCR_TEXT_LAYER", "true").lower() == "true"
+TEXT_LAYER_MIN_CHARS = int(os.getenv("OCR_TEXT_LAYER_MIN_CHARS", "50"))
+TEXT_LAYER_MIN_VALID_RATIO = float(os.getenv("OCR_TEXT_LAYER_MIN_VALID_RATIO", "0.8"))
+
+# テキストレイヤーのページに付与する信頼度
+TEXT_LAYER_CONFIDENCE = 1.0
+
+_WHITESPACE_PATTERN = re.compile(r"\s+")
+# 有効な文字: かな（半角カナを含む）・漢字・英数字（全角を含む）・登記簿で使う記号
+# （ToUnicode 対応表のないフォントは、キリル文字・シリア文字など無関係な文字や U+FFFD・制御文字に化けるため数えない）
+_VALID_PATTERN = re.compile(
+    r"["
+    r"\u3040-\u30ff\u31f0-\u31ff\uff66-\uff9f"  # ひらがな・カタカナ（・ー を含む）・半角カナ
+    r"\u3400-\u4dbf\u4e00-\u9fff\uf900-\ufaff"  # 漢字
+    r"0-9A-Za-z\uff10-\uff19\uff21-\uff3a\uff41-\uff5a"  # 英数字
+    r"!-/:-@\[-`{-~\u3000-\u303f\uff01-\uff0f\uff1a-\uff20\uff3b-\uff40\uff5b-\uff65"  # ASCII・全角の記号、句読点・括弧
+    r"\u2010-\u203b\u2460-\u24ff\u2500-\u257f\u3300-\u33ff\u00d7"  # ダッシュ・※、丸数字、罫線、㎡、×
+    r"]"
+)
+
+
+def is_sufficient_text(text: Optional[str]) -> bool:
+    """
+    テキストレイヤーの文字列がOCRの代わりに使えるか判定
+    """
+    if not text:
+        return False
+    compact = _WHITESPACE_PATTERN.sub("", text)
+    if len(compact) < TEXT_LAYER_MIN_CHARS:
+        return False
+    valid_chars = len(_VALID_PATTERN.findall(compact))
+    return valid_chars / len(compact) >= TEXT_LAYER_MIN_VALID_RATIO
+
+
+def read_text_layer(pdf_path: str) -> Tuple[int, List[Optional[str]]]:
+    """
+    PDFのページ数と、ページごとのテキストレイヤー（不十分なページは None）を返す
+
+    Returns:
+        (ページ数, ページ順のテキストのリスト)
+    """
+    with open(pdf_path, 'rb') as file:
+        pdf_reader = PyPDF2.PdfReader(file)
+        page_count = len(pdf_reader.pages)
+
+        page_texts: List[Optional[str]] = []
+        for page_index, page in enumerate(pdf_reader.pages):
+            try:
+                text = page.extract_text()
+            except Exception as e:
+                logger.warning(f"{page_index + 1}ページ目のテキストレイヤー抽出でエラー発生: {e}")
+                text = None
+            page_texts.append(text.strip() if is_sufficient_text(text) else None)
+
+    usable = sum(1 for text in page_texts if text is not None)
+    logger.info(f"テキストレイヤー: {usable}/{page_count}ページで利用可能")
+    return page_count, page_texts
@@ -0,0 +1,159 @@
+"""
+画像前処理のプロセスプール
+cv2.fastNlMeansDenoising は処理中にGILを長く保持するため、スレッドで並列化しても実質直列になる
+前処理をワーカープロセスで実行し、ページ画像は pickle せず multiprocessing.shared_memory で受け渡す
+
+- 親プロセスがページごとに共有メモリを確保して入力画像を書き込み、ワーカーは名前で参照する
+- 前処理結果が同じ共有メモリに収まる場合はそこに書き戻す（収まらない場合のみ戻り値で返す）
+- OpenCV のメモリ増加を抑えるため、ワーカーは max_tasks_per_child 件処理するごとに再起動する
+ImagePreprocessor と同じ process() / profile を持つため、OCRService・OCRServiceAPIKey の preprocessor として使える
+"""
+
+import os
+import sys
+import time
+import logging
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, Future
+from multiprocessing import shared_memory
+from typing import Dict, Optional, Tuple
+
+from image_preprocessing import ImagePreprocessor, DEFAULT_PREPROCESS_PROFILE
+from upload_encoding import DEFAULT_UPLOAD_ENCODING
+
+# ログ設定
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# 前処理ワーカープロセス数（0 の場合はプロセスプールを使わず呼び出し元のスレッドで処理）
+PREPROCESS_PROCESSES = int(os.getenv("OCR_PREPROCESS_PROCESSES", "0"))
+# ワーカーを再起動するまでの処理件数
+PREPROCESS_MAX_TASKS_PER_CHILD = int(os.getenv("OCR_PREPROCESS_MAX_TASKS_PER_CHILD", "50"))
+
+# ワーカープロセス内の前処理インスタンス（初期化時に作成）
+_worker_preprocessor: Optional[ImagePreprocessor] = None
+
+
+def _init_worker(profile: str, upload_encoding: str, source_dpi: Optional[int]):
+    global _worker_preprocessor
+    _worker_preprocessor = ImagePreprocessor(profile, upload_encoding, source_dpi)
+
+
+def _process_shared(name: str, size: int) -> Tuple[int, Optional[bytes], Dict[str, float]]:
+    """
+    共有メモリ上の画像を前処理する（ワーカープロセスで実行）
+
+    Returns:
+        (結果のバイト数, 共有メモリに収まらなかった場合の結果, ステージ別処理時間)
+    """
+    shm = shared_memory.SharedMemory(name=name)
+    try:
+        timings: Dict[str, float] = {}
+        # 入力は共有メモリをそのまま参照してデコードする（コピーしない）
+        processed = _worker_preprocessor.process(shm.buf[:size], timings)
+        if len(processed) > shm.size:
+            return len(processed), processed, timings
+        shm.buf[:len(processed)] = processed
+        return len(processed), None, timings
+    finally:
+        shm.close()
+
+
+class PreprocessPool:
+    """
+    前処理をワーカープロセスで実行するプール
+    複数スレッドから同時に process() を呼び出せる
+    """
+
+    def __init__(
+        self,
+        profile: str = DEFAULT_PREPROCESS_PROFILE,
+        upload_encoding: str = DEFAULT_UPLOAD_ENCODING,
+        source_dpi: Optional[int] = None,
+        max_workers: int = PREPROCESS_PROCESSES or (os.cpu_count() or 1),
+        max_tasks_per_child: int = PREPROCESS_MAX_TASKS_PER_CHILD
+    ):
+        # 設定の検証を親プロセスで先に行う（不正な設定でワーカーが起動に失敗し続けないように）
+        self.encoder = ImagePreprocessor(profile, upload_encoding, source_dpi).encoder
+        self.profile = profile
+        self.max_workers = max(1, max_workers)
+        self.max_tasks_per_child = max_tasks_per_child
+        self._initargs = (profile, upload_encoding, source_dpi)
+        self._executor: Optional[ProcessPoolExecutor] = None
+
+    def _get_executor(self) -> ProcessPoolExecutor:
+        if self._executor is None:
+            kwargs = {}
+            if self.max_tasks_per_child > 0:
+                if sys.version_info >= (3, 11):
+                    kwargs["max_tasks_per_child"] = self.max_tasks_per_child
+                else:
+                    logger.warning("max_tasks_per_child は Python 3.11 以降でのみ有効です（ワーカーを再起動しません）")
+            # max_tasks_per_child は fork 以外の起動方式が必要なため spawn で統一する
+            self._executor = ProcessPoolExecutor(
+                max_workers=self.max_workers,
+                mp_context=multiprocessing.get_context("spawn"),
+                initializer=_init_worker,
+                initargs=self._initargs,
+                **kwargs
+            )
+        return self._executor
+
+    def submit(self, image_data: bytes) -> Tuple[Future, shared_memory.SharedMemory]:
+        """
+        入力画像を共有メモリに書き込んで前処理を投入
+        返した共有メモリは collect() で結果を取り出した後に解放される
+        """
+        shm = shared_memory.SharedMemory(create=True, size=max(1, len(image_data)))
+        try:
+            shm.buf[:len(image_data)] = image_data
+            return self._get_executor().submit(_process_shared, shm.name, len(image_data)), shm
+        except Exception:
+            shm.close()
+            shm.unlink()
+            raise
+
+    def collect(
+        self, future: Future, shm: shared_memory.SharedMemory, timings: Optional[Dict[str, float]] = None
+    ) -> bytes:
+        """投入した前処理の結果を取り出し、共有メモリを解放する"""
+        try:
+            size, overflow, worker_timings = future.result()
+            if timings is not None:
+                timings.update(worker_timings)
+            return overflow if overflow is not None else bytes(shm.buf[:size])
+        finally:
+            shm.close()
+            shm.unlink()
+
+    def process(self, image_data: bytes, timings: Optional[Dict[str, float]] = None) -> bytes:
+        """
+        前処理を実行してエンコード済みの画像バイト列を返す（ImagePreprocessor.process と同じ）
+        timings を指定した場合はワーカー内のステージ別処理時間に加え、受け渡しを含む往復時間を書き込む
+        """
+        start = time.perf_counter()
+        future, shm = self.submit(image_data)
+        processed = self.collect(future, shm, timings)
+        if timings is not None:
+            timings["round_trip"] = (time.perf_counter() - start) * 1000
+        return processed
+
+    def shutdown(self):
+        """ワーカープロセスを停止"""
+        if self._executor is not None:
+            self._executor.shutdown(wait=True)
+            self._executor = None
+
+
+def create_preprocessor(
+    profile: str = DEFAULT_PREPROCESS_PROFILE,
+    source_dpi: Optional[int] = None,
+    processes: int = PREPROCESS_PROCESSES
+):
+    """
+    前処理インスタンスを作成
+    processes が 1 以上ならプロセスプール、0 なら呼び出し元のスレッドで処理する ImagePreprocessor
+    """
+    if processes > 0:
+        return PreprocessPool(profile, source_dpi=source_dpi, max_workers=processes)
+    return ImagePreprocessor(profile, source_dpi=source_dpi)
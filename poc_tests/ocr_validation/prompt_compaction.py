@@ -0,0 +1,309 @@
+"""
+Gemini 抽出プロンプトの圧縮とトークン使用量の記録
+- OCRテキストから対象項目を含まない定型部分（証明文・抹消事項の注記・ページ番号・余白）を除去
+- ページごとに繰り返されるヘッダー行などを、2ページ目以降から除去（最初の出現のみ残す）
+- 区ごとに切り出してOCRしたテキストは区の見出しタグ（【甲区】等）で区切る（タグは重複除去の対象外）
+- 回答フォーマットの記述が異なるテンプレートのうち、全項目を列挙していて最も短いものを選択
+- 呼び出しごとの入力/出力トークン数とレイテンシを記録し、コストと p50 を合わせて確認できるようにする
+"""
+
+import os
+import re
+import threading
+import statistics
+import logging
+from collections import deque
+from functools import lru_cache
+from typing import Callable, Deque, Dict, Iterable, List, Optional, Tuple
+
+from deed_layout import SECTION_ORDER, SECTION_UNKNOWN, SECTION_TAG
+
+# ログ設定
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+PROMPT_COMPACTION_ENABLED = os.getenv("OCR_PROMPT_COMPACTION", "true").lower() == "true"
+# 使用量の集計に使う直近の呼び出し数
+USAGE_WINDOW = int(os.getenv("GEMINI_USAGE_WINDOW", "1000"))
+
+# ページの区切り（OCRテキストはページごとに改行＋改ページ文字＋改行で連結する）
+PAGE_BREAK = "\f"
+
+# deed_layout.tag_sections が区のテキストの前に付ける見出しタグ
+# （OCRテキスト中の「【権利部】」「【所有者】」などの見出し行は区の区切りとして扱わない）
+_SECTION_TAGS = frozenset(SECTION_TAG.format(section=section) for section in SECTION_ORDER + (SECTION_UNKNOWN,))
+
+# 対象項目を含まない定型行（行全体が一致した場合に除去）
+BOILERPLATE_PATTERNS = [
+    re.compile(pattern) for pattern in (
+        # 証明文
+        r"これは登記(?:記録|簿)に記録されている事項の(?:全部|一部)を証明した書面である。?",
+        # 証明年月日・登記官（「令和6年1月15日 東京法務局新宿出張所 登記官 山田 花子」）
+        r".*法務局.*登記官.*",
+        # 抹消事項の注記（同じ行に整理番号・ページ番号が続く場合を含む）
+        r"[*＊※]?\s*下線のあるものは抹消事項であることを示す。?(?:\s*整理番号.*)?",
+        # ページ番号・整理番号（「1/2」「(1/2)」「- 1 -」「整理番号 D12345 (1/2)」）
+        r"(?:整理番号\s*\S+\s*)?[(（]?\s*\d+\s*/\s*\d+\s*[)）]?",
+        r"整理番号\s*\S+",
+        r"[-－]\s*\d+\s*[-－]",
+        # 余白の表示
+        r"[(（]?\s*(?:以\s*下\s*)?余\s*白\s*[)）]?",
+    )
+]
+
+_HORIZONTAL_SPACE_PATTERN = re.compile(r"[ \t　]+")
+
+
+def estimate_tokens(text: str) -> int:
+    """
+    トークン数の概算（ASCIIは4文字で1トークン、日本語等は1文字1トークンとして多めに見積もる）
+    """
+    ascii_chars = sum(1 for char in text if ord(char) < 128)
+    return max(1, ascii_chars // 4 + (len(text) - ascii_chars))
+
+
+def join_pages(page_texts: List[str]) -> str:
+    """
+    ページごとのテキストを PAGE_BREAK を挟んで連結
+    改ページ文字は単独の行になるため、行単位の正規表現やキャッシュキーの正規化には影響しない
+    """
+    return f"\n{PAGE_BREAK}\n".join(page_texts)
+
+
+def filter_sections(text: str, sections: Optional[Iterable[str]]) -> str:
+    """
+    deed_layout.tag_sections で見出しタグを付けたテキストから sections の区のみを残す
+    タグのないテキスト（ページ全体をOCRしたページ）は残す。sections が None の場合はそのまま返す
+    レイアウト解析で区ごとに切り出したテキストにのみ使用する
+    """
+    if sections is None or "【" not in text:
+        return text
+    keep = {SECTION_TAG.format(section=section) for section in sections}
+    lines: List[str] = []
+    current: Optional[str] = None
+    # splitlines() は改ページ文字でも分割するため、改行のみで分割して改ページの行を残す
+    for line in text.split("\n"):
+        if line == PAGE_BREAK:
+            current = None
+        elif line.strip() in _SECTION_TAGS:
+            current = line.strip()
+        if current is None or current in keep:
+            lines.append(line)
+    return "\n".join(lines)
+
+
+def compact_ocr_text(text: str) -> str:
+    """
+    OCRテキストから定型行と、前のページに同じ行があるページ間の重複行を除去
+    行内の連続空白は1つにまとめる（同じページ内の重複行は内容として残す）
+    """
+    seen_pages: Dict[str, int] = {}
+    lines: List[str] = []
+    for page_index, page in enumerate(text.split(PAGE_BREAK)):
+        for line in page.splitlines():
+            line = _HORIZONTAL_SPACE_PATTERN.sub(" ", line).strip()
+            if not line or any(pattern.fullmatch(line) for pattern in BOILERPLATE_PATTERNS):
+                continue
+            # 見出しタグは後続ページの区の区切りにも必要なため残す
+            first_page = seen_pages.setdefault(line, page_index)
+            if first_page != page_index and line not in _SECTION_TAGS:
+                continue
+            lines.append(line)
+    return "\n".join(lines)
+
+
+def _quoted(fields: List[str]) -> str:
+    return ", ".join(f'"{field}"' for field in fields)
+
+
+def _full_template(fields: List[str]) -> Tuple[str, str]:
+    """項目ごとに値・信頼度の例を記述するテンプレート"""
+    fields_list = "\n".join(f'- "{field}"' for field in fields)
+    data_example = ",\n".join(f'        "{field}": "抽出された値または空文字"' for field in fields)
+    scores_example = ",\n".join(f'        "{field}": 0.90' for field in fields)
+    head = f"""
+以下は登記簿謄本から抽出したテキストです。
+このテキストから以下の項目を抽出し、JSON形式で回答してください。
+
+抽出項目:
+{fields_list}
+
+抽出したテキスト:
+"""
+    tail = f"""
+
+回答フォーマット:
+{{
+    "extracted_data": {{
+{data_example}
+    }},
+    "confidence_scores": {{
+{scores_example}
+    }},
+    "metadata": {{
+        "total_fields": {len(fields)},
+        "average_confidence": 0.85
+    }}
+}}
+
+注意:
+- 抽出できない項目は空文字 "" にしてください
+- 信頼度は0.0から1.0の数値で設定してください
+- 必ずJSONフォーマットで回答してください
+- 上記の全ての項目を含めてください
+"""
+    return head, tail
+
+
+def _compact_template(fields: List[str]) -> Tuple[str, str]:
+    """項目を1回だけ列挙し、回答フォーマットは1行で記述するテンプレート"""
+    head = f"""登記簿謄本のOCRテキストから次の項目を抽出し、JSONのみで回答してください。
+項目: [{_quoted(fields)}]
+テキスト:
+"""
+    tail = f"""
+形式: {{"extracted_data": {{項目: 値}}, "confidence_scores": {{項目: 0.0〜1.0}}, "metadata": {{"total_fields": {len(fields)}, "average_confidence": 平均}}}}
+全項目を含め、抽出できない項目は "" にしてください。
+"""
+    return head, tail
+
+
+def _skeleton_template(fields: List[str]) -> Tuple[str, str]:
+    """回答JSONの雛形に項目を埋め込み、列挙を兼ねるテンプレート"""
+    skeleton = ", ".join(f'"{field}": ""' for field in fields)
+    head = f"""登記簿謄本のOCRテキストから抽出し、次のJSONの "" を値で埋めて回答（該当なしは ""）。
+{{"extracted_data": {{{skeleton}}}, "confidence_scores": {{項目: 0.0〜1.0}}, "metadata": {{"total_fields": {len(fields)}, "average_confidence": 平均}}}}
+テキスト:
+"""
+    return head, "\n"
+
+
+PROMPT_TEMPLATES: Dict[str, Callable[[List[str]], Tuple[str, str]]] = {
+    "full": _full_template,
+    "compact": _compact_template,
+    "skeleton": _skeleton_template,
+}
+
+
+@lru_cache(maxsize=64)
+def select_template(fields: Tuple[str, ...]) -> Tuple[str, str, str]:
+    """
+    全項目を列挙しているテンプレートのうち、推定トークン数が最も少ないものを選択
+
+    Returns:
+        (テンプレート名, テキストの前に置く部分, テキストの後に置く部分)
+    """
+    candidates = []
+    for name, build in PROMPT_TEMPLATES.items():
+        head, tail = build(list(fields))
+        rendered = head + tail
+        if all(f'"{field}"' in rendered for field in fields):
+            candidates.append((estimate_tokens(rendered), name, head, tail))
+    if not candidates:
+        raise ValueError(f"全項目を列挙するテンプレートがありません: {fields}")
+    _, name, head, tail = min(candidates)
+    return name, head, tail
+
+
+class PromptCompactor:
+    """
+    OCRテキストの圧縮とテンプレート選択を行う抽出プロンプトの作成
+    """
+
+    def __init__(self, compact_text: bool = True):
+        self.compact_text = compact_text
+
+    def build(self, text: str, fields: List[str]) -> str:
+        _, head, tail = select_template(tuple(fields))
+        body = compact_ocr_text(text) if self.compact_text else text
+        return head + body + tail
+
+
+def usage_from_metadata(usage_metadata: Optional[Dict]) -> Optional[Tuple[int, int]]:
+    """
+    REST応答の usageMetadata から (入力トークン数, 出力トークン数) を取り出す（含まれない場合は None）
+    """
+    if not usage_metadata or "promptTokenCount" not in usage_metadata:
+        return None
+    return usage_metadata["promptTokenCount"], usage_metadata.get("candidatesTokenCount", 0)
+
+
+def usage_from_sdk_response(response) -> Optional[Tuple[int, int]]:
+    """
+    Vertex AI SDK の応答の usage_metadata から (入力トークン数, 出力トークン数) を取り出す（含まれない場合は None）
+    """
+    usage_metadata = getattr(response, "usage_metadata", None)
+    if usage_metadata is None or not getattr(usage_metadata, "prompt_token_count", 0):
+        return None
+    return usage_metadata.prompt_token_count, getattr(usage_metadata, "candidates_token_count", 0)
+
+
+class GeminiUsageLog:
+    """
+    Gemini 呼び出しごとのトークン数・レイテンシの記録（スレッドセーフ）
+    直近 window 件から p50/p95 レイテンシを集計する
+    """
+
+    def __init__(self, window: int = USAGE_WINDOW):
+        self._lock = threading.Lock()
+        self._latencies: Deque[float] = deque(maxlen=window)
+        self.calls = 0
+        self.tokens_in = 0
+        self.tokens_out = 0
+        self.estimated_calls = 0
+
+    def record(
+        self,
+        prompt: str,
+        latency: float,
+        usage: Optional[Tuple[int, int]] = None,
+        response_text: str = ""
+    ):
+        """
+        呼び出し1回分を記録（usage がない場合はプロンプト・応答テキストから推定）
+
+        Args:
+            prompt: 送信したプロンプト
+            latency: 呼び出しの所要時間（秒）
+            usage: API が返した (入力トークン数, 出力トークン数)
+            response_text: 応答テキスト（usage がない場合の出力トークン数の推定に使用）
+        """
+        estimated = usage is None
+        tokens_in, tokens_out = usage if usage is not None else (
+            estimate_tokens(prompt), estimate_tokens(response_text) if response_text else 0
+        )
+        with self._lock:
+            self.calls += 1
+            self.tokens_in += tokens_in
+            self.tokens_out += tokens_out
+            self.estimated_calls += int(estimated)
+            self._latencies.append(latency * 1000)
+        logger.info(
+            f"Gemini使用量: 入力 {tokens_in} tokens, 出力 {tokens_out} tokens"
+            f"{'（推定）' if estimated else ''}, {latency * 1000:.0f}ms"
+        )
+
+    def summary(self) -> Dict:
+        with self._lock:
+            latencies = sorted(self._latencies)
+            return {
+                "calls": self.calls,
+                "tokens_in": self.tokens_in,
+                "tokens_out": self.tokens_out,
+                "estimated_calls": self.estimated_calls,
+                "p50_ms": statistics.median(latencies) if latencies else 0.0,
+                "p95_ms": latencies[int(0.95 * (len(latencies) - 1))] if latencies else 0.0,
+            }
+
+
+_shared_usage_log: Optional[GeminiUsageLog] = None
+_shared_usage_log_lock = threading.Lock()
+
+
+def get_shared_usage_log() -> GeminiUsageLog:
+    """プロセス内で共有する使用量の記録"""
+    global _shared_usage_log
+    with _shared_usage_log_lock:
+        if _shared_usage_log is None:
+            _shared_usage_log = GeminiUsageLog()
+        return _shared_usage_log
@@ -0,0 +1,291 @@
+"""
+Vision API / Gemini API のクォータ制御（クライアント側トークンバケット）
+複数のバッチジョブ・ワーカープロセスで同じ API キーを使っても、分あたりのクォータを超えて 429 が多発しないよう
+呼び出し前にエンドポイントごとのリクエスト数（rpm）・トークン数（tpm）のバケットから予約する
+
+- 予約方式: バケットが足りなくても残量をマイナスにして予約し、残量が0に戻るまでの時間だけ待つ
+  （呼び出し元を失敗させず、予約した順に待ち行列として処理される）
+- バックエンド: プロセス内（local）、同一ホストのプロセス間でファイルロック共有（file）、Redis互換サーバー（redis）
+"""
+
+import os
+import json
+import time
+import tempfile
+import threading
+import logging
+from typing import Dict, List, Optional, Tuple
+
+# ログ設定
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+QUOTA_ENABLED = os.getenv("OCR_QUOTA_ENABLED", "true").lower() == "true"
+QUOTA_BACKEND = os.getenv("OCR_QUOTA_BACKEND", "file")
+QUOTA_FILE_PATH = os.getenv("OCR_QUOTA_FILE", os.path.join(tempfile.gettempdir(), "ocr_quota_state.json"))
+QUOTA_REDIS_URL = os.getenv("OCR_QUOTA_REDIS_URL", os.getenv("REDIS_URL", "redis://localhost:6379/0"))
+# バケットの容量（何秒分のクォータまで一度に使えるか。60 で1分間分をまとめて使える）
+QUOTA_BURST_SECONDS = float(os.getenv("OCR_QUOTA_BURST_SECONDS", "10"))
+# Gemini の出力トークン数の見込み（tpm の予約に入力トークン数と合わせて計上する）
+GEMINI_OUTPUT_TOKEN_ESTIMATE = int(os.getenv("OCR_QUOTA_GEMINI_OUTPUT_TOKENS", "512"))
+
+
+class QuotaLimit:
+    """1エンドポイントのクォータ（0 は無制限）"""
+
+    def __init__(self, requests_per_minute: float = 0, tokens_per_minute: float = 0):
+        self.requests_per_minute = requests_per_minute
+        self.tokens_per_minute = tokens_per_minute
+
+
+def _limits_from_env() -> Dict[str, QuotaLimit]:
+    # 既定値は Vision API の既定クォータ・Gemini 1.5 Flash（従量課金）の上限
+    return {
+        "vision": QuotaLimit(
+            float(os.getenv("OCR_QUOTA_VISION_RPM", "1800")),
+        ),
+        "gemini": QuotaLimit(
+            float(os.getenv("OCR_QUOTA_GEMINI_RPM", "2000")),
+            float(os.getenv("OCR_QUOTA_GEMINI_TPM", "4000000")),
+        ),
+    }
+
+
+# (バケットキー, 予約量, 補充レート[/秒], 容量)
+BucketRequest = Tuple[str, float, float, float]
+
+
+def _reserve(state: Dict[str, List[float]], buckets: List[BucketRequest], now: float) -> float:
+    """
+    state 上の各バケットから予約し、全バケットの残量が0以上に戻るまでの待ち時間（秒）を返す
+    予約量が負の場合は返却（容量を超えては戻らない）
+    """
+    wait = 0.0
+    for key, amount, rate, capacity in buckets:
+        tokens, updated = state.get(key, (capacity, now))
+        tokens = min(capacity, tokens + max(0.0, now - updated) * rate) - amount
+        tokens = min(capacity, tokens)
+        state[key] = [tokens, now]
+        if tokens < 0:
+            wait = max(wait, -tokens / rate)
+    return wait
+
+
+class LocalQuotaBackend:
+    """プロセス内でのみ共有するバックエンド"""
+
+    def __init__(self):
+        self._state: Dict[str, List[float]] = {}
+        self._lock = threading.Lock()
+
+    def reserve(self, buckets: List[BucketRequest]) -> float:
+        with self._lock:
+            return _reserve(self._state, buckets, time.time())
+
+
+class FileQuotaBackend:
+    """
+    同一ホストのプロセス間で共有するバックエンド
+    状態をJSONファイルに保存し、読み書きの間は fcntl.flock で排他ロックする
+    """
+
+    def __init__(self, path: str = QUOTA_FILE_PATH):
+        import fcntl
+
+        self._fcntl = fcntl
+        self.path = path
+        self._lock = threading.Lock()
+
+    def reserve(self, buckets: List[BucketRequest]) -> float:
+        with self._lock, open(self.path, "a+", encoding="utf-8") as file:
+            self._fcntl.flock(file.fileno(), self._fcntl.LOCK_EX)
+            try:
+                file.seek(0)
+                content = file.read()
+                try:
+                    state = json.loads(content) if content else {}
+                except json.JSONDecodeError:
+                    logger.warning(f"クォータ状態ファイルが壊れているため初期化します: {self.path}")
+                    state = {}
+                wait = _reserve(state, buckets, time.time())
+                file.seek(0)
+                file.truncate()
+                file.write(json.dumps(state))
+                file.flush()
+                return wait
+            finally:
+                self._fcntl.flock(file.fileno(), self._fcntl.LOCK_UN)
+
+
+# _reserve と同じ計算を Redis 上でアトミックに実行する
+_REDIS_RESERVE_SCRIPT = """
+local now = tonumber(ARGV[1])
+local wait = 0
+for i, key in ipairs(KEYS) do
+  local amount = tonumber(ARGV[(i - 1) * 3 + 2])
+  local rate = tonumber(ARGV[(i - 1) * 3 + 3])
+  local capacity = tonumber(ARGV[(i - 1) * 3 + 4])
+  local state = redis.call('HMGET', key, 'tokens', 'updated')
+  local tokens = tonumber(state[1]) or capacity
+  local updated = tonumber(state[2]) or now
+  tokens = math.min(capacity, math.min(capacity, tokens + math.max(0, now - updated) * rate) - amount)
+  redis.call('HSET', key, 'tokens', tostring(tokens), 'updated', tostring(now))
+  redis.call('EXPIRE', key, math.ceil(capacity / rate) + 60)
+  if tokens < 0 then
+    wait = math.max(wait, -tokens / rate)
+  end
+end
+return tostring(wait)
+"""
+
+
+class RedisQuotaBackend:
+    """
+    複数ホストで共有するバックエンド（Redis互換サーバー、redis パッケージが必要）
+    時刻は呼び出し側ホストの時計を使うため、ホスト間の時計はNTP等で合わせておく
+    """
+
+    def __init__(self, url: str = QUOTA_REDIS_URL, prefix: str = "ocr_quota:"):
+        import redis
+
+        self.prefix = prefix
+        self._client = redis.Redis.from_url(url)
+        self._script = self._client.register_script(_REDIS_RESERVE_SCRIPT)
+
+    def reserve(self, buckets: List[BucketRequest]) -> float:
+        keys = [self.prefix + key for key, _, _, _ in buckets]
+        args: List[float] = [time.time()]
+        for _, amount, rate, capacity in buckets:
+            args.extend([amount, rate, capacity])
+        return float(self._script(keys=keys, args=args))
+
+
+def create_backend(name: str = QUOTA_BACKEND):
+    """
+    バックエンドを作成（file は fcntl のない環境、redis はパッケージ未導入・接続設定誤りの場合 local にフォールバック）
+    """
+    try:
+        if name == "file":
+            return FileQuotaBackend()
+        if name == "redis":
+            return RedisQuotaBackend()
+    except (ImportError, ValueError) as e:
+        # ValueError は OCR_QUOTA_REDIS_URL の形式誤り
+        logger.warning(f"クォータバックエンド {name} を使用できないためプロセス内で制御します: {e}")
+    return LocalQuotaBackend()
+
+
+class QuotaStats:
+    """エンドポイントごとの待ち時間の統計（スレッドセーフ）"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.acquired = 0
+        self.queued = 0
+        self.total_wait_seconds = 0.0
+        self.max_wait_seconds = 0.0
+
+    def record(self, wait: float):
+        with self._lock:
+            self.acquired += 1
+            if wait > 0:
+                self.queued += 1
+                self.total_wait_seconds += wait
+                self.max_wait_seconds = max(self.max_wait_seconds, wait)
+
+    def as_dict(self) -> Dict:
+        with self._lock:
+            return {
+                "acquired": self.acquired,
+                "queued": self.queued,
+                "total_wait_seconds": self.total_wait_seconds,
+                "max_wait_seconds": self.max_wait_seconds,
+            }
+
+
+class QuotaGovernor:
+    """
+    エンドポイントごとのトークンバケットで上流呼び出しを制御
+    acquire() はクォータが空くまで呼び出し元をブロックする
+    """
+
+    def __init__(
+        self,
+        limits: Optional[Dict[str, QuotaLimit]] = None,
+        backend=None,
+        burst_seconds: float = QUOTA_BURST_SECONDS
+    ):
+        self.limits = limits if limits is not None else _limits_from_env()
+        self.backend = backend if backend is not None else create_backend()
+        self.burst_seconds = burst_seconds
+        self._stats: Dict[str, QuotaStats] = {}
+        self._stats_lock = threading.Lock()
+
+    def _buckets(self, endpoint: str, requests: float, tokens: float) -> List[BucketRequest]:
+        limit = self.limits.get(endpoint)
+        if limit is None:
+            return []
+        buckets: List[BucketRequest] = []
+        for suffix, per_minute, amount in (
+            ("rpm", limit.requests_per_minute, requests),
+            ("tpm", limit.tokens_per_minute, tokens),
+        ):
+            if per_minute > 0 and amount:
+                rate = per_minute / 60
+                buckets.append((f"{endpoint}:{suffix}", amount, rate, rate * self.burst_seconds))
+        return buckets
+
+    def _endpoint_stats(self, endpoint: str) -> QuotaStats:
+        with self._stats_lock:
+            return self._stats.setdefault(endpoint, QuotaStats())
+
+    def acquire(self, endpoint: str, requests: float = 1, tokens: float = 0, timeout: Optional[float] = None) -> float:
+        """
+        クォータを予約し、使用可能になるまで待つ
+
+        Args:
+            endpoint: "vision" / "gemini"（limits に定義のないエンドポイントは制御しない）
+            requests: 消費するリクエスト数（Vision API の一括リクエストは画像数）
+            tokens: 消費するトークン数（入力＋出力の見込み）
+            timeout: 待ち時間の上限（超える場合は予約を取り消して TimeoutError。None は無制限に待つ）
+        Returns:
+            待った秒数
+        """
+        buckets = self._buckets(endpoint, requests, tokens)
+        if not buckets:
+            return 0.0
+
+        try:
+            wait = self.backend.reserve(buckets)
+        except Exception as e:
+            # クォータ制御の障害で本処理を止めない（429 は耐障害クライアントの再試行で扱う）
+            logger.warning(f"クォータ予約エラー（制御せずに続行）: {e}")
+            return 0.0
+
+        if timeout is not None and wait > timeout:
+            self.backend.reserve([(key, -amount, rate, capacity) for key, amount, rate, capacity in buckets])
+            raise TimeoutError(f"{endpoint} のクォータ待ちが上限を超えます（{wait:.1f}秒 > {timeout:.1f}秒）")
+
+        self._endpoint_stats(endpoint).record(wait)
+        if wait > 0:
+            logger.debug(f"{endpoint} のクォータ待ち: {wait:.2f}秒")
+            time.sleep(wait)
+        return wait
+
+    def stats(self) -> Dict[str, Dict]:
+        with self._stats_lock:
+            endpoints = dict(self._stats)
+        return {endpoint: stats.as_dict() for endpoint, stats in endpoints.items()}
+
+
+_shared_governor: Optional[QuotaGovernor] = None
+_shared_governor_lock = threading.Lock()
+
+
+def get_shared_governor() -> QuotaGovernor:
+    """プロセス内で共有するクォータ制御"""
+    global _shared_governor
+    with _shared_governor_lock:
+        if _shared_governor is None:
+            _shared_governor = QuotaGovernor()
+        return _shared_governor
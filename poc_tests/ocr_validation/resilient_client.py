@@ -0,0 +1,534 @@
+"""
+Vision API / Gemini API 呼び出しの耐障害ラッパー
+http_client のクライアント（PooledHTTPClient / HTTP2Client）を包み、同じインターフェースで以下を提供する
+
+- 指数バックオフ＋ジッター（full jitter）による再試行。429/5xx・接続エラー・タイムアウトのみ再試行する
+- 再試行バジェット: 直近のリクエスト数に比例した再試行（ヘッジを含む）しか許可せず、障害時の再試行の嵐を防ぐ
+- ヘッジリクエスト: 応答がエンドポイントの p95 レイテンシを超えたら同じリクエストをもう1本送り、先に返った方を採用
+- エンドポイントごとのサーキットブレーカー: 失敗率が閾値を超えたら一定時間即座に失敗させる
+- メトリクス: metrics()（dict）/ prometheus_text()（Prometheus テキスト形式）で出力
+
+fake_google_server.py の障害注入（--error_rate / --slow_rate）で動作を確認できる
+"""
+
+import os
+import time
+import random
+import threading
+import logging
+import http.client
+import urllib.error
+import urllib.parse
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, Future, wait, FIRST_COMPLETED
+from typing import Any, Deque, Dict, Iterator, List, Optional, Tuple
+
+from http_client import BeforeAttempt, HTTPResponse, get_shared_client
+
+# ログ設定
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+RESILIENT_CLIENT_ENABLED = os.getenv("OCR_RESILIENT_CLIENT", "true").lower() == "true"
+
+# 再試行（初回を含む最大試行回数、バックオフの基準・上限秒数）
+RETRY_MAX_ATTEMPTS = int(os.getenv("OCR_RETRY_MAX_ATTEMPTS", "4"))
+RETRY_BASE_DELAY = float(os.getenv("OCR_RETRY_BASE_DELAY", "0.2"))
+RETRY_MAX_DELAY = float(os.getenv("OCR_RETRY_MAX_DELAY", "5"))
+
+# 再試行バジェット: 直近 RETRY_BUDGET_WINDOW 秒のリクエスト数 × 比率 ＋ 毎秒の最低保証 まで再試行できる
+RETRY_BUDGET_RATIO = float(os.getenv("OCR_RETRY_BUDGET_RATIO", "0.2"))
+RETRY_BUDGET_MIN_PER_SECOND = float(os.getenv("OCR_RETRY_BUDGET_MIN_PER_SECOND", "1"))
+RETRY_BUDGET_WINDOW = 10.0
+
+# ヘッジ: エンドポイントのレイテンシが HEDGE_MIN_SAMPLES 件集まるまでは送らない
+HEDGING_ENABLED = os.getenv("OCR_HEDGING", "true").lower() == "true"
+HEDGE_PERCENTILE = float(os.getenv("OCR_HEDGE_PERCENTILE", "0.95"))
+HEDGE_MIN_DELAY = float(os.getenv("OCR_HEDGE_MIN_DELAY", "0.05"))
+HEDGE_MIN_SAMPLES = 20
+HEDGE_WORKERS = int(os.getenv("OCR_HEDGE_WORKERS", "32"))
+
+# サーキットブレーカー: 直近 BREAKER_WINDOW 件中の失敗率が閾値以上で開き、BREAKER_RESET_TIMEOUT 秒後に1件だけ試す
+BREAKER_FAILURE_RATIO = float(os.getenv("OCR_BREAKER_FAILURE_RATIO", "0.5"))
+BREAKER_MIN_CALLS = int(os.getenv("OCR_BREAKER_MIN_CALLS", "10"))
+BREAKER_RESET_TIMEOUT = float(os.getenv("OCR_BREAKER_RESET_TIMEOUT", "30"))
+BREAKER_WINDOW = 20
+
+# 再試行する応答ステータス（それ以外の4xxはリクエスト自体の誤りなので再試行しない）
+RETRYABLE_STATUS = frozenset({408, 429, 500, 502, 503, 504})
+
+LATENCY_WINDOW = 1000
+
+_TRANSIENT_ERRORS: Tuple[type, ...] = (OSError, TimeoutError, http.client.HTTPException)
+try:
+    import httpx
+    _TRANSIENT_ERRORS += (httpx.TransportError,)
+except ImportError:
+    pass
+
+
+class CircuitOpenError(Exception):
+    """サーキットブレーカーが開いているため呼び出さなかった"""
+
+    def __init__(self, endpoint: str, retry_in: float):
+        super().__init__(f"サーキットブレーカー開放中: {endpoint}（{retry_in:.1f}秒後に再試行可能）")
+        self.endpoint = endpoint
+        self.retry_in = retry_in
+
+
+def endpoint_name(url: str) -> str:
+    """URLからエンドポイント名（"images:annotate"、"gemini-1.5-flash:generateContent" 等）を取り出す"""
+    return urllib.parse.urlsplit(url).path.rsplit("/", 1)[-1] or url
+
+
+def _is_retryable_error(error: Exception) -> bool:
+    if isinstance(error, urllib.error.HTTPError):
+        return error.code in RETRYABLE_STATUS
+    if isinstance(error, CircuitOpenError):
+        return False
+    return isinstance(error, _TRANSIENT_ERRORS)
+
+
+def _retry_after_seconds(headers) -> Optional[float]:
+    """Retry-After ヘッダー（秒数指定のみ対応）"""
+    if headers is None:
+        return None
+    value = headers.get("Retry-After")
+    try:
+        return float(value) if value is not None else None
+    except ValueError:
+        return None
+
+
+def _percentile(values: List[float], fraction: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+class RetryBudget:
+    """
+    クライアント全体で共有する再試行バジェット（スレッドセーフ）
+    直近のリクエスト数に比例した回数までしか再試行・ヘッジを許可しない
+    """
+
+    def __init__(
+        self,
+        ratio: float = RETRY_BUDGET_RATIO,
+        min_per_second: float = RETRY_BUDGET_MIN_PER_SECOND,
+        window: float = RETRY_BUDGET_WINDOW
+    ):
+        self.ratio = ratio
+        self.min_per_second = min_per_second
+        self.window = window
+        self._requests: Deque[float] = deque()
+        self._retries: Deque[float] = deque()
+        self._lock = threading.Lock()
+        self.exhausted = 0
+
+    def _trim(self, now: float):
+        cutoff = now - self.window
+        for events in (self._requests, self._retries):
+            while events and events[0] < cutoff:
+                events.popleft()
+
+    def record_request(self):
+        with self._lock:
+            now = time.monotonic()
+            self._trim(now)
+            self._requests.append(now)
+
+    def try_spend(self) -> bool:
+        """再試行（またはヘッジ）1回分を消費できれば True"""
+        with self._lock:
+            now = time.monotonic()
+            self._trim(now)
+            allowed = self.min_per_second * self.window + self.ratio * len(self._requests)
+            if len(self._retries) >= allowed:
+                self.exhausted += 1
+                return False
+            self._retries.append(now)
+            return True
+
+    def as_dict(self) -> Dict:
+        with self._lock:
+            self._trim(time.monotonic())
+            return {
+                "requests_in_window": len(self._requests),
+                "retries_in_window": len(self._retries),
+                "exhausted": self.exhausted,
+            }
+
+
+class CircuitBreaker:
+    """
+    エンドポイントごとのサーキットブレーカー
+    closed → (失敗率が閾値以上) → open → (reset_timeout 経過) → half_open → 成功で closed / 失敗で open
+    """
+
+    def __init__(
+        self,
+        failure_ratio: float = BREAKER_FAILURE_RATIO,
+        min_calls: int = BREAKER_MIN_CALLS,
+        reset_timeout: float = BREAKER_RESET_TIMEOUT,
+        window: int = BREAKER_WINDOW
+    ):
+        self.failure_ratio = failure_ratio
+        self.min_calls = min_calls
+        self.reset_timeout = reset_timeout
+        self.state = "closed"
+        self.opened = 0
+        self._results: Deque[bool] = deque(maxlen=window)
+        self._opened_at = 0.0
+        self._trial_in_flight = False
+        self._lock = threading.Lock()
+
+    def before_call(self, endpoint: str):
+        """呼び出し可否を判定（開いている場合は CircuitOpenError）"""
+        with self._lock:
+            if self.state == "open":
+                elapsed = time.monotonic() - self._opened_at
+                if elapsed < self.reset_timeout:
+                    raise CircuitOpenError(endpoint, self.reset_timeout - elapsed)
+                self.state = "half_open"
+                self._trial_in_flight = False
+            if self.state == "half_open":
+                if self._trial_in_flight:
+                    raise CircuitOpenError(endpoint, 0.0)
+                self._trial_in_flight = True
+
+    def record(self, success: bool, endpoint: str):
+        with self._lock:
+            if self.state == "half_open":
+                self._trial_in_flight = False
+                if success:
+                    self.state = "closed"
+                    self._results.clear()
+                    logger.info(f"サーキットブレーカーを閉じました: {endpoint}")
+                else:
+                    self._open(endpoint)
+                return
+            self._results.append(success)
+            failures = self._results.count(False)
+            if (
+                self.state == "closed"
+                and len(self._results) >= self.min_calls
+                and failures / len(self._results) >= self.failure_ratio
+            ):
+                self._open(endpoint)
+
+    def _open(self, endpoint: str):
+        self.state = "open"
+        self.opened += 1
+        self._opened_at = time.monotonic()
+        logger.warning(f"サーキットブレーカーを開きました: {endpoint}（{self.reset_timeout:.0f}秒間）")
+
+
+class EndpointState:
+    """エンドポイントごとのブレーカー・レイテンシ・カウンター"""
+
+    def __init__(self, name: str):
+        self.name = name
+        self.breaker = CircuitBreaker()
+        self._lock = threading.Lock()
+        # 上流の1回ごとの応答時間（ヘッジ判定用）と、呼び出し全体の所要時間（再試行・ヘッジ込み）
+        self._attempt_latencies: Deque[float] = deque(maxlen=LATENCY_WINDOW)
+        self._call_latencies: Deque[float] = deque(maxlen=LATENCY_WINDOW)
+        self.counters: Dict[str, int] = {
+            "requests": 0,
+            "successes": 0,
+            "failures": 0,
+            "attempts": 0,
+            "retries": 0,
+            "retry_budget_exhausted": 0,
+            "hedges": 0,
+            "hedge_wins": 0,
+            "circuit_rejections": 0,
+        }
+
+    def count(self, name: str, value: int = 1):
+        with self._lock:
+            self.counters[name] += value
+
+    def record_attempt_latency(self, seconds: float):
+        with self._lock:
+            self._attempt_latencies.append(seconds)
+
+    def record_call_latency(self, seconds: float):
+        with self._lock:
+            self._call_latencies.append(seconds)
+
+    def hedge_delay(self) -> Optional[float]:
+        """ヘッジを送るまでの待ち時間（サンプル不足の場合は None = ヘッジしない）"""
+        with self._lock:
+            if len(self._attempt_latencies) < HEDGE_MIN_SAMPLES:
+                return None
+            samples = list(self._attempt_latencies)
+        return max(HEDGE_MIN_DELAY, _percentile(samples, HEDGE_PERCENTILE))
+
+    def as_dict(self) -> Dict:
+        with self._lock:
+            counters = dict(self.counters)
+            calls = list(self._call_latencies)
+        result: Dict[str, Any] = {"circuit_state": self.breaker.state, "circuit_opened": self.breaker.opened}
+        result.update(counters)
+        for label, fraction in (("p50", 0.5), ("p95", 0.95), ("p99", 0.99)):
+            result[f"latency_{label}_ms"] = _percentile(calls, fraction) * 1000 if calls else None
+        return result
+
+
+class ResilientClient:
+    """
+    再試行・ヘッジ・サーキットブレーカー付きHTTPクライアント
+    request / get / post / stream_lines は包んだクライアントと同じ引数・戻り値
+    （再試行しても回復しなかった 429/5xx 応答はそのまま返すため、呼び出し側の raise_for_status() で扱える）
+    """
+
+    def __init__(
+        self,
+        client=None,
+        max_attempts: int = RETRY_MAX_ATTEMPTS,
+        base_delay: float = RETRY_BASE_DELAY,
+        max_delay: float = RETRY_MAX_DELAY,
+        hedging: bool = HEDGING_ENABLED,
+        budget: Optional[RetryBudget] = None
+    ):
+        self.client = client if client is not None else get_shared_client()
+        self.max_attempts = max(1, max_attempts)
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.hedging = hedging
+        self.budget = budget or RetryBudget()
+        self._endpoints: Dict[str, EndpointState] = {}
+        self._lock = threading.Lock()
+        self._hedge_executor: Optional[ThreadPoolExecutor] = None
+
+    @property
+    def stats(self):
+        """包んだクライアントの接続統計"""
+        return self.client.stats
+
+    def _endpoint(self, url: str) -> EndpointState:
+        name = endpoint_name(url)
+        with self._lock:
+            state = self._endpoints.get(name)
+            if state is None:
+                state = self._endpoints[name] = EndpointState(name)
+            return state
+
+    def _executor(self) -> ThreadPoolExecutor:
+        with self._lock:
+            if self._hedge_executor is None:
+                self._hedge_executor = ThreadPoolExecutor(max_workers=HEDGE_WORKERS, thread_name_prefix="hedge")
+            return self._hedge_executor
+
+    def _backoff(self, attempt: int, retry_after: Optional[float]) -> float:
+        """full jitter: [0, min(上限, 基準 × 2^attempt)) の一様乱数（Retry-After があればそれ以上待つ）"""
+        delay = random.uniform(0, min(self.max_delay, self.base_delay * (2 ** attempt)))
+        if retry_after is not None:
+            delay = max(delay, min(self.max_delay, retry_after))
+        return delay
+
+    def _timed_request(
+        self, state: EndpointState, method: str, url: str, kwargs: Dict, before_attempt: BeforeAttempt = None
+    ) -> HTTPResponse:
+        if before_attempt is not None:
+            before_attempt()
+        start = time.perf_counter()
+        response = self.client.request(method, url, **kwargs)
+        if response.status not in RETRYABLE_STATUS:
+            state.record_attempt_latency(time.perf_counter() - start)
+        return response
+
+    def _attempt(
+        self, state: EndpointState, method: str, url: str, kwargs: Dict, before_attempt: BeforeAttempt = None
+    ) -> HTTPResponse:
+        """
+        1回分の呼び出し。p95 を超えても応答がなければヘッジを1本送り、先に成功した応答を返す
+        ファイルのリクエストボディは同時に2本送れないためヘッジしない
+        before_attempt は初回の送信の前（ヘッジの待ち時間に含めない）と、ヘッジの送信の前に呼ぶ
+        """
+        if before_attempt is not None:
+            before_attempt()
+        delay = state.hedge_delay() if self.hedging and not hasattr(kwargs.get("data"), "read") else None
+        if delay is None:
+            return self._timed_request(state, method, url, kwargs)
+
+        primary = self._executor().submit(self._timed_request, state, method, url, kwargs)
+        done, _ = wait([primary], timeout=delay)
+        if done or not self.budget.try_spend():
+            return primary.result()
+
+        state.count("hedges")
+        hedge = self._executor().submit(self._timed_request, state, method, url, kwargs, before_attempt)
+        pending = {primary, hedge}
+        fallback: Optional[Future] = None
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                if future.exception() is None and future.result().status not in RETRYABLE_STATUS:
+                    if future is hedge:
+                        state.count("hedge_wins")
+                    # 遅れた方は完了後に接続がプールへ戻る（http.client は送信中の取り消しができない）
+                    return future.result()
+                fallback = future
+        return fallback.result()
+
+    def request(self, method: str, url: str, before_attempt: BeforeAttempt = None, **kwargs) -> HTTPResponse:
+        """before_attempt は上流へ送る試行（再試行・ヘッジを含む）ごとに呼ぶ"""
+        state = self._endpoint(url)
+        state.count("requests")
+        self.budget.record_request()
+        start = time.perf_counter()
+
+        attempt = 0
+        while True:
+            try:
+                state.breaker.before_call(state.name)
+            except CircuitOpenError:
+                state.count("circuit_rejections")
+                state.count("failures")
+                raise
+
+            state.count("attempts")
+            error: Optional[Exception] = None
+            response: Optional[HTTPResponse] = None
+            retry_after: Optional[float] = None
+            try:
+                response = self._attempt(state, method, url, kwargs, before_attempt)
+                retryable = response.status in RETRYABLE_STATUS
+                retry_after = _retry_after_seconds(response.headers) if retryable else None
+            except Exception as e:
+                error = e
+                retryable = _is_retryable_error(e)
+
+            state.breaker.record(not retryable, state.name)
+            if not retryable:
+                state.record_call_latency(time.perf_counter() - start)
+                state.count("successes" if error is None else "failures")
+                if error is not None:
+                    raise error
+                return response
+
+            attempt += 1
+            if attempt >= self.max_attempts or not self._spend_retry(state):
+                state.record_call_latency(time.perf_counter() - start)
+                state.count("failures")
+                if error is not None:
+                    raise error
+                return response
+
+            delay = self._backoff(attempt, retry_after)
+            reason = f"HTTP {response.status}" if response is not None else repr(error)
+            logger.warning(f"{state.name} を再試行します（{attempt}/{self.max_attempts - 1}、{delay:.2f}秒後）: {reason}")
+            time.sleep(delay)
+
+    def _spend_retry(self, state: EndpointState) -> bool:
+        if self.budget.try_spend():
+            state.count("retries")
+            return True
+        state.count("retry_budget_exhausted")
+        logger.warning(f"再試行バジェットを使い切ったため再試行しません: {state.name}")
+        return False
+
+    def stream_lines(self, method: str, url: str, before_attempt: BeforeAttempt = None, **kwargs) -> Iterator[str]:
+        """
+        ストリーミング受信（SSE）。最初の行を受信するまでのエラーのみ再試行する
+        受信開始後の切断は再試行せず例外をそのまま伝える（受信済みの部分結果は呼び出し側で扱う）
+        before_attempt は試行ごとに呼ぶ
+        """
+        state = self._endpoint(url)
+        state.count("requests")
+        self.budget.record_request()
+        start = time.perf_counter()
+
+        attempt = 0
+        while True:
+            try:
+                state.breaker.before_call(state.name)
+            except CircuitOpenError:
+                state.count("circuit_rejections")
+                state.count("failures")
+                raise
+
+            state.count("attempts")
+            lines = self.client.stream_lines(method, url, before_attempt=before_attempt, **kwargs)
+            try:
+                first_line = next(lines)
+            except StopIteration:
+                first_line = None
+            except Exception as e:
+                retryable = _is_retryable_error(e)
+                state.breaker.record(not retryable, state.name)
+                attempt += 1
+                if not retryable or attempt >= self.max_attempts or not self._spend_retry(state):
+                    state.record_call_latency(time.perf_counter() - start)
+                    state.count("failures")
+                    raise
+                retry_after = _retry_after_seconds(getattr(e, "headers", None))
+                delay = self._backoff(attempt, retry_after)
+                logger.warning(f"{state.name} を再試行します（{attempt}/{self.max_attempts - 1}、{delay:.2f}秒後）: {e!r}")
+                time.sleep(delay)
+                continue
+
+            state.breaker.record(True, state.name)
+            state.record_attempt_latency(time.perf_counter() - start)
+            state.record_call_latency(time.perf_counter() - start)
+            state.count("successes")
+            if first_line is None:
+                return
+            yield first_line
+            yield from lines
+            return
+
+    def get(self, url: str, **kwargs) -> HTTPResponse:
+        return self.request("GET", url, **kwargs)
+
+    def post(self, url: str, **kwargs) -> HTTPResponse:
+        return self.request("POST", url, **kwargs)
+
+    def metrics(self) -> Dict:
+        """エンドポイントごとのメトリクスと再試行バジェット"""
+        with self._lock:
+            endpoints = dict(self._endpoints)
+        return {
+            "endpoints": {name: state.as_dict() for name, state in endpoints.items()},
+            "retry_budget": self.budget.as_dict(),
+        }
+
+    def prometheus_text(self, prefix: str = "ocr_upstream") -> str:
+        """メトリクスを Prometheus のテキスト形式で出力"""
+        metrics = self.metrics()
+        lines: List[str] = []
+        for name, values in metrics["endpoints"].items():
+            label = f'{{endpoint="{name}"}}'
+            for key, value in values.items():
+                if key == "circuit_state":
+                    for state in ("closed", "open", "half_open"):
+                        lines.append(
+                            f'{prefix}_circuit_state{{endpoint="{name}",state="{state}"}} {int(value == state)}'
+                        )
+                elif value is not None:
+                    suffix = "" if key.startswith("latency_") else "_total"
+                    lines.append(f"{prefix}_{key}{suffix}{label} {value}")
+        for key, value in metrics["retry_budget"].items():
+            lines.append(f"{prefix}_retry_budget_{key} {value}")
+        return "\n".join(lines) + "\n"
+
+    def close(self):
+        if self._hedge_executor is not None:
+            self._hedge_executor.shutdown(wait=False)
+            self._hedge_executor = None
+        self.client.close()
+
+
+_shared_resilient_client: Optional[ResilientClient] = None
+_shared_resilient_client_lock = threading.Lock()
+
+
+def get_shared_resilient_client() -> ResilientClient:
+    """プロセス内で共有する耐障害クライアント（共通HTTPクライアントを包む）"""
+    global _shared_resilient_client
+    with _shared_resilient_client_lock:
+        if _shared_resilient_client is None:
+            _shared_resilient_client = ResilientClient(get_shared_client())
+        return _shared_resilient_client
@@ -4,12 +4,14 @@
 """
 
 import json
-import urllib.request
+import urllib.error
 import urllib.parse
 import base64
 import os
 import sys
 
+from http_client import get_shared_client, vision_annotate_url, gemini_url
+
 # 設定
 GOOGLE_CLOUD_PROJECT = "real-estate-dx"
 GOOGLE_API_KEY = os.getenv('GOOGLE_API_KEY', '')
@@ -20,6 +22,9 @@ if not GOOGLE_API_KEY:
     print("環境変数を設定してください: export GOOGLE_API_KEY='your-api-key'")
     sys.exit(1)
 
+# 共通HTTPクライアント（Keep-Alive接続を使い回す）
+api_client = get_shared_client()
+
 def test_gemini_api():
     """
     Gemini API接続テスト
@@ -28,7 +33,7 @@ def test_gemini_api():
     
     try:
         # エンドポイント
-        url = f"https://generativelanguage.googleapis.com/v1beta/models/gemini-1.5-flash:generateContent?key={GOOGLE_API_KEY}"
+        url = gemini_url(GOOGLE_API_KEY)
         
         # テストペイロード
         payload = {
@@ -47,15 +52,11 @@ def test_gemini_api():
             }
         }
         
-        # リクエスト作成
-        data = json.dumps(payload).encode('utf-8')
-        req = urllib.request.Request(url, data=data)
-        req.add_header('Content-Type', 'application/json')
-        
         # APIリクエスト実行
         print("Gemini APIリクエスト送信中...")
-        with urllib.request.urlopen(req, timeout=30) as response:
-            result = json.loads(response.read().decode('utf-8'))
+        response = api_client.post(url, json=payload, timeout=30)
+        response.raise_for_status()
+        result = response.json()
         
         # レスポンス確認
         if "candidates" in result and result["candidates"]:
@@ -83,7 +84,7 @@ def test_vision_api():
     
     try:
         # エンドポイント
-        url = f"https://vision.googleapis.com/v1/images:annotate?key={GOOGLE_API_KEY}"
+        url = vision_annotate_url(GOOGLE_API_KEY)
         
         # テスト用1x1ピクセル画像（Base64エンコード済み）
         # 白色1ピクセルPNG画像
@@ -106,15 +107,11 @@ def test_vision_api():
             ]
         }
         
-        # リクエスト作成
-        data = json.dumps(payload).encode('utf-8')
-        req = urllib.request.Request(url, data=data)
-        req.add_header('Content-Type', 'application/json')
-        
         # APIリクエスト実行
         print("Vision APIリクエスト送信中...")
-        with urllib.request.urlopen(req, timeout=30) as response:
-            result = json.loads(response.read().decode('utf-8'))
+        response = api_client.post(url, json=payload, timeout=30)
+        response.raise_for_status()
+        result = response.json()
         
         # レスポンス確認
         if "responses" in result:
@@ -185,20 +182,17 @@ def test_ocr_integration():
     
     try:
         # Gemini API呼び出し
-        url = f"https://generativelanguage.googleapis.com/v1beta/models/gemini-1.5-flash:generateContent?key={GOOGLE_API_KEY}"
+        url = gemini_url(GOOGLE_API_KEY)
         
         payload = {
             "contents": [{"parts": [{"text": extraction_prompt}]}],
             "generationConfig": {"temperature": 0.1, "maxOutputTokens": 1000}
         }
         
-        data = json.dumps(payload).encode('utf-8')
-        req = urllib.request.Request(url, data=data)
-        req.add_header('Content-Type', 'application/json')
-        
         print("登記簿情報抽出テスト実行中...")
-        with urllib.request.urlopen(req, timeout=30) as response:
-            result = json.loads(response.read().decode('utf-8'))
+        response = api_client.post(url, json=payload, timeout=30)
+        response.raise_for_status()
+        result = response.json()
         
         if "candidates" in result and result["candidates"]:
             response_text = result["candidates"][0]["content"]["parts"][0]["text"]
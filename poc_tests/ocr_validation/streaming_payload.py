@@ -0,0 +1,151 @@
+"""
+大容量ファイル（PDF・画像）アップロード用のJSONリクエストボディ生成
+ファイル全体を読み込んでBase64文字列・dict・JSONバイト列を順に作る代わりに、
+ファイルをチャンク単位でBase64エンコードしながらJSONを一時ファイル（SpooledTemporaryFile）へ書き出す
+一定サイズまではメモリ上、それを超えるとディスク上に置かれ、http_client はそのファイルをブロック単位で送信する
+"""
+
+import os
+import json
+import base64
+import tempfile
+import tracemalloc
+import logging
+from typing import Any, BinaryIO, Dict
+
+# ログ設定
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# このサイズを超えたリクエストボディはディスク上の一時ファイルに書き出す
+UPLOAD_SPOOL_MAX_BYTES = int(float(os.getenv("OCR_UPLOAD_SPOOL_MAX_MB", "8")) * 1024 * 1024)
+
+# Base64エンコードの読み込み単位（3の倍数にするとチャンク境界でパディングが発生しない）
+BASE64_CHUNK_BYTES = 3 * 256 * 1024
+
+
+class Base64FilePart:
+    """
+    リクエストのペイロード中でBase64文字列の代わりに置くファイル参照
+    build_json_body() がJSONを書き出す際に、ファイルをチャンク単位でエンコードして埋め込む
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.size = os.path.getsize(path)
+
+    @property
+    def encoded_length(self) -> int:
+        """Base64エンコード後の文字数"""
+        return (self.size + 2) // 3 * 4
+
+    def write_to(self, out: BinaryIO):
+        with open(self.path, 'rb') as file:
+            while True:
+                chunk = file.read(BASE64_CHUNK_BYTES)
+                if not chunk:
+                    break
+                out.write(base64.b64encode(chunk))
+
+
+class JSONRequestBody:
+    """
+    書き出し済みのJSONリクエストボディ
+    file は http_client の data にそのまま渡せる（送信時に先頭へ巻き戻される）
+    """
+
+    def __init__(self, file: tempfile.SpooledTemporaryFile, length: int):
+        self.file = file
+        self.length = length
+
+    @property
+    def on_disk(self) -> bool:
+        """メモリ上の上限を超えてディスクに書き出されたか"""
+        return bool(getattr(self.file, "_rolled", False))
+
+    def close(self):
+        self.file.close()
+
+    def __enter__(self) -> "JSONRequestBody":
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+
+def _write_json(value: Any, out: BinaryIO):
+    if isinstance(value, Base64FilePart):
+        out.write(b'"')
+        value.write_to(out)
+        out.write(b'"')
+    elif isinstance(value, dict):
+        out.write(b'{')
+        for index, (key, item) in enumerate(value.items()):
+            if index:
+                out.write(b',')
+            out.write(json.dumps(str(key), ensure_ascii=False).encode('utf-8'))
+            out.write(b':')
+            _write_json(item, out)
+        out.write(b'}')
+    elif isinstance(value, (list, tuple)):
+        out.write(b'[')
+        for index, item in enumerate(value):
+            if index:
+                out.write(b',')
+            _write_json(item, out)
+        out.write(b']')
+    else:
+        out.write(json.dumps(value, ensure_ascii=False).encode('utf-8'))
+
+
+def build_json_body(payload: Dict, spool_max_bytes: int = UPLOAD_SPOOL_MAX_BYTES) -> JSONRequestBody:
+    """
+    ペイロードをJSONとして一時ファイルに書き出す
+    ペイロード中の Base64FilePart はファイルをチャンク単位でBase64エンコードして埋め込む
+
+    Returns:
+        JSONRequestBody（使用後は close() するか with 文で使用）
+    """
+    file = tempfile.SpooledTemporaryFile(max_size=spool_max_bytes, mode='w+b')
+    try:
+        _write_json(payload, file)
+        length = file.tell()
+        file.seek(0)
+    except Exception:
+        file.close()
+        raise
+    return JSONRequestBody(file, length)
+
+
+class UploadMemoryTracker:
+    """
+    アップロード処理中のPythonヒープのピーク使用量を計測（tracemalloc）
+    Cloud Run のインスタンスメモリ見積もり用。計測中は tracemalloc のオーバーヘッドがかかる
+    """
+
+    def __init__(self, label: str = "upload"):
+        self.label = label
+        self.peak_bytes = 0
+        self._started = False
+
+    def __enter__(self) -> "UploadMemoryTracker":
+        self._started = not tracemalloc.is_tracing()
+        if self._started:
+            tracemalloc.start()
+        tracemalloc.reset_peak()
+        self._baseline = tracemalloc.get_traced_memory()[0]
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        _, peak = tracemalloc.get_traced_memory()
+        self.peak_bytes = max(0, peak - self._baseline)
+        if self._started:
+            tracemalloc.stop()
+        logger.info(f"{self.label}: ピークメモリ {self.peak_mb:.2f} MB")
+
+    @property
+    def peak_mb(self) -> float:
+        return self.peak_bytes / (1024 * 1024)
+
+    def as_dict(self) -> Dict[str, Any]:
+        return {"label": self.label, "peak_bytes": self.peak_bytes, "peak_mb": self.peak_mb}
@@ -0,0 +1,176 @@
+"""
+Gemini の構造化出力（responseSchema）と構造化データの検証
+- 抽出項目から responseSchema を生成し、JSON 以外の応答・項目の欠落をモデル側で防ぐ
+- 抽出項目ごとに一度だけ作成する検証器で、項目の有無・型・抽出率・平均信頼度を1回の走査で求める
+  （_evaluate_performance や一括構造化の検証で辞書を何度も走査しない）
+"""
+
+import os
+import time
+import logging
+from functools import lru_cache
+from numbers import Real
+from typing import Dict, List, Optional, Sequence, Tuple
+
+# ログ設定
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+STRUCTURED_OUTPUT_ENABLED = os.getenv("GEMINI_STRUCTURED_OUTPUT", "true").lower() == "true"
+
+
+def _document_schema(fields: Sequence[str], property_ordering: bool) -> Dict:
+    """1文書分の回答（extracted_data / confidence_scores / metadata）のスキーマ"""
+    sections = ["extracted_data", "confidence_scores", "metadata"]
+    schema = {
+        "type": "OBJECT",
+        "properties": {
+            "extracted_data": {
+                "type": "OBJECT",
+                "properties": {field: {"type": "STRING"} for field in fields},
+                "required": list(fields),
+            },
+            "confidence_scores": {
+                "type": "OBJECT",
+                "properties": {field: {"type": "NUMBER"} for field in fields},
+            },
+            "metadata": {
+                "type": "OBJECT",
+                "properties": {
+                    "total_fields": {"type": "INTEGER"},
+                    "average_confidence": {"type": "NUMBER"},
+                },
+            },
+        },
+        "required": ["extracted_data", "confidence_scores"],
+    }
+    if property_ordering:
+        # 指定しない場合はキーの辞書順で生成されるため、extracted_data を先頭にしてストリーミング時に早く確定させる
+        schema["propertyOrdering"] = sections
+        schema["properties"]["extracted_data"]["propertyOrdering"] = list(fields)
+    return schema
+
+
+@lru_cache(maxsize=64)
+def build_response_schema(fields: Tuple[str, ...], property_ordering: bool = True) -> Dict:
+    """
+    抽出項目から generationConfig.responseSchema を生成
+    property_ordering は REST API（v1beta）のみ対応のため、Vertex AI SDK では False を指定する
+    """
+    return _document_schema(fields, property_ordering)
+
+
+def build_batch_response_schema(document_ids: Sequence[str], fields: Tuple[str, ...]) -> Dict:
+    """複数文書の一括構造化の responseSchema（文書IDごとに1文書分のスキーマ）"""
+    document = build_response_schema(fields)
+    return {
+        "type": "OBJECT",
+        "properties": {
+            "documents": {
+                "type": "OBJECT",
+                "properties": {doc_id: document for doc_id in document_ids},
+                "required": list(document_ids),
+            },
+        },
+        "required": ["documents"],
+    }
+
+
+class ValidationResult:
+    """構造化データの検証結果"""
+
+    __slots__ = ("valid", "errors", "missing_fields", "extracted_fields", "total_fields",
+                 "average_confidence", "elapsed_ms")
+
+    def __init__(
+        self,
+        errors: List[str],
+        missing_fields: List[str],
+        extracted_fields: int,
+        total_fields: int,
+        average_confidence: float,
+        elapsed_ms: float
+    ):
+        self.valid = not errors
+        self.errors = errors
+        self.missing_fields = missing_fields
+        self.extracted_fields = extracted_fields
+        self.total_fields = total_fields
+        self.average_confidence = average_confidence
+        self.elapsed_ms = elapsed_ms
+
+    @property
+    def extraction_rate(self) -> float:
+        return self.extracted_fields / self.total_fields if self.total_fields else 0.0
+
+    def as_dict(self) -> Dict:
+        return {
+            "valid": self.valid,
+            "errors": self.errors,
+            "missing_fields": self.missing_fields,
+            "extracted_fields": self.extracted_fields,
+            "extraction_rate": self.extraction_rate,
+            "average_confidence": self.average_confidence,
+            "elapsed_ms": self.elapsed_ms,
+        }
+
+
+class StructuredDataValidator:
+    """
+    抽出項目ごとの検証器（get_validator で項目の組み合わせごとに共有する）
+    全項目が文字列で含まれていれば valid。信頼度は数値のもののみ平均に使う
+    """
+
+    def __init__(self, fields: Sequence[str]):
+        self.fields = tuple(fields)
+
+    def validate(self, data: Optional[Dict]) -> ValidationResult:
+        start = time.perf_counter()
+        errors: List[str] = []
+        missing: List[str] = []
+        extracted = 0
+        score_total = 0.0
+        score_count = 0
+
+        if not isinstance(data, dict):
+            errors.append("構造化データがオブジェクトではありません")
+            data = {}
+        elif "error" in data:
+            errors.append(f"構造化エラー: {data['error']}")
+
+        extracted_data = data.get("extracted_data")
+        scores = data.get("confidence_scores")
+        if not isinstance(scores, dict):
+            scores = {}
+        if not isinstance(extracted_data, dict):
+            errors.append("extracted_data がありません")
+            missing = list(self.fields)
+        else:
+            for field in self.fields:
+                value = extracted_data.get(field)
+                if not isinstance(value, str):
+                    missing.append(field)
+                elif value:
+                    extracted += 1
+                    score = scores.get(field)
+                    if isinstance(score, Real) and not isinstance(score, bool):
+                        score_total += score
+                        score_count += 1
+            if missing:
+                errors.append(f"項目がありません: {', '.join(missing)}")
+
+        # 平均信頼度はモデル・統合処理が付けた metadata を優先し、ない場合は抽出できた項目の信頼度から求める
+        metadata = data.get("metadata")
+        average = metadata.get("average_confidence") if isinstance(metadata, dict) else None
+        if not isinstance(average, Real) or isinstance(average, bool):
+            average = score_total / score_count if score_count else 0.0
+
+        return ValidationResult(
+            errors, missing, extracted, len(self.fields), float(average), (time.perf_counter() - start) * 1000
+        )
+
+
+@lru_cache(maxsize=64)
+def get_validator(fields: Tuple[str, ...]) -> StructuredDataValidator:
+    """抽出項目の組み合わせごとに共有する検証器"""
+    return StructuredDataValidator(fields)
@@ -0,0 +1,164 @@
+"""
+Gemini構造化結果キャッシュ
+OCRテキストを正規化（空白・全角半角・和暦表記）した上で、プロンプトのバージョンと合わせてハッシュし、
+構造化JSONを TTL＋LRU のメモリキャッシュから返す
+プロンプトテンプレートや TARGET_FIELDS を変更するとバージョンが変わり、古い結果は参照されなくなる
+"""
+
+import os
+import re
+import copy
+import time
+import hashlib
+import threading
+import unicodedata
+import logging
+from collections import OrderedDict
+from typing import Dict, Optional, Tuple
+
+# ログ設定
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# キャッシュ設定
+GEMINI_CACHE_ENABLED = os.getenv("GEMINI_CACHE_ENABLED", "true").lower() == "true"
+GEMINI_CACHE_TTL_SECONDS = float(os.getenv("GEMINI_CACHE_TTL_SECONDS", "86400"))
+GEMINI_CACHE_MAX_ENTRIES = int(os.getenv("GEMINI_CACHE_MAX_ENTRIES", "1024"))
+
+# 和暦の日付（OCRで「平成 20 年 3 月 15 日」のように空白が混入する）
+_ERA_DATE_PATTERN = re.compile(
+    r"(明治|大正|昭和|平成|令和)\s*(元|\d+)\s*年(?:\s*(\d+)\s*月(?:\s*(\d+)\s*日)?)?"
+)
+_HORIZONTAL_SPACE_PATTERN = re.compile(r"[ \t　]+")
+
+
+def _normalize_era_date(match: re.Match) -> str:
+    era, year, month, day = match.groups()
+    year = "1" if year == "元" else str(int(year))
+    normalized = f"{era}{year}年"
+    if month:
+        normalized += f"{int(month)}月"
+        if day:
+            normalized += f"{int(day)}日"
+    return normalized
+
+
+def normalize_ocr_text(text: str) -> str:
+    """
+    キャッシュキー用にOCRテキストを正規化
+    - NFKC（全角英数字・全角空白を半角に）
+    - 行ごとの前後空白の除去、連続空白の圧縮、空行の除去
+    - 和暦表記の統一（元年→1年、数字の先頭ゼロ・空白の除去）
+    """
+    text = unicodedata.normalize("NFKC", text)
+    lines = []
+    for line in text.splitlines():
+        line = _HORIZONTAL_SPACE_PATTERN.sub(" ", line).strip()
+        if line:
+            lines.append(_ERA_DATE_PATTERN.sub(_normalize_era_date, line))
+    return "\n".join(lines)
+
+
+def prompt_version(prompt_template: str, model: str) -> str:
+    """
+    プロンプトテンプレート（抽出項目を含む）とモデル名からバージョンタグを作成
+    """
+    digest = hashlib.sha256()
+    digest.update(model.encode('utf-8'))
+    digest.update(b"\0")
+    digest.update(prompt_template.encode('utf-8'))
+    return digest.hexdigest()[:16]
+
+
+class StructuringCache:
+    """
+    TTL付き LRU キャッシュ（スレッドセーフ）
+    値は呼び出し元で変更されても影響しないようコピーして返す
+    """
+
+    def __init__(self, max_entries: int = GEMINI_CACHE_MAX_ENTRIES, ttl_seconds: float = GEMINI_CACHE_TTL_SECONDS):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self._entries: "OrderedDict[str, Tuple[float, float, Dict]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.expirations = 0
+        self.evictions = 0
+        self.saved_latency_seconds = 0.0
+
+    @staticmethod
+    def make_key(text: str, version: str) -> str:
+        """正規化済みテキストとプロンプトバージョンからキャッシュキーを作成"""
+        digest = hashlib.sha256()
+        digest.update(version.encode('utf-8'))
+        digest.update(b"\0")
+        digest.update(normalize_ocr_text(text).encode('utf-8'))
+        return digest.hexdigest()
+
+    def get(self, cache_key: str) -> Optional[Dict]:
+        """
+        キャッシュを参照し、有効期限内であれば構造化データを返す
+        """
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(cache_key)
+            if entry is not None and entry[0] <= now:
+                del self._entries[cache_key]
+                self.expirations += 1
+                entry = None
+
+            if entry is None:
+                self.misses += 1
+                return None
+
+            self._entries.move_to_end(cache_key)
+            self.hits += 1
+            self.saved_latency_seconds += entry[1]
+            structured_data = entry[2]
+
+        return copy.deepcopy(structured_data)
+
+    def put(self, cache_key: str, structured_data: Dict, api_latency: float):
+        """
+        構造化データを保存し、上限を超えた分を最終参照の古い順に削除
+        """
+        entry = (time.monotonic() + self.ttl_seconds, api_latency, copy.deepcopy(structured_data))
+        with self._lock:
+            self._entries[cache_key] = entry
+            self._entries.move_to_end(cache_key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> Dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "expirations": self.expirations,
+                "evictions": self.evictions,
+                "saved_latency_seconds": self.saved_latency_seconds,
+            }
+
+
+_shared_cache: Optional[StructuringCache] = None
+_shared_cache_lock = threading.Lock()
+
+
+def get_shared_structuring_cache() -> StructuringCache:
+    """
+    プロセス内で共有するキャッシュを返す
+    """
+    global _shared_cache
+    with _shared_cache_lock:
+        if _shared_cache is None:
+            _shared_cache = StructuringCache()
+        return _shared_cache
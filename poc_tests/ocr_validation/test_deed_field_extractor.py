@@ -0,0 +1,47 @@
+"""
+登記簿謄本のルールベース項目抽出のテスト（pytest）
+"""
+
+from deed_field_extractor import DeedFieldExtractor, latest_ownership_entry
+
+MULTI_ENTRY_TEXT = """権 利 部 （甲 区） （所有権に関する事項）
+順位番号 1
+登記の目的 所有権保存
+受付年月日・受付番号 平成20年3月15日 第5678号
+所有者 田中太郎
+順位番号 2
+登記の目的 所有権移転
+受付年月日・受付番号 令和3年4月1日 第1234号
+原因 令和3年4月1日売買
+所有者 山田花子
+権 利 部 （乙 区） （所有権以外の権利に関する事項）
+順位番号 1
+登記の目的 抵当権設定
+受付年月日・受付番号 令和3年4月1日 第1235号
+原因 令和3年4月1日金銭消費貸借同日設定
+"""
+
+
+def test_ownership_fields_come_from_latest_entry():
+    """甲区の項目はすべて最新の登記から抽出し、乙区の登記は使わない"""
+    result = DeedFieldExtractor().extract(MULTI_ENTRY_TEXT)
+    assert result["extracted_data"] == {
+        "受付年月日・受付番号": "令和3年4月1日 第1234号",
+        "登記の目的": "所有権移転",
+        "登記原因": "令和3年4月1日売買",
+        "所有者の氏名又は名称": "山田花子",
+    }
+
+
+def test_latest_entry_without_rank_numbers():
+    """順位番号の行がない場合は登記の目的の行で登記を区切る"""
+    text = "登記の目的 所有権保存\n所有者 田中太郎\n登記の目的 所有権移転\n所有者 山田花子"
+    assert latest_ownership_entry(text) == "登記の目的 所有権移転\n所有者 山田花子"
+
+
+def test_owner_address_is_not_taken_as_name():
+    """所有者の行が住所の場合は次の行の氏名を抽出し、Gemini にも問い合わせる（閾値未満の信頼度）"""
+    extractor = DeedFieldExtractor()
+    result = extractor.extract("所有者 東京都新宿区西新宿一丁目1番1号\n田中太郎", ["所有者の氏名又は名称"])
+    assert result["extracted_data"] == {"所有者の氏名又は名称": "田中太郎"}
+    assert extractor.missing_fields(result, ["所有者の氏名又は名称"]) == ["所有者の氏名又は名称"]
@@ -0,0 +1,93 @@
+"""
+登記簿謄本のレイアウト解析のテスト（pytest）
+罫線だけを描いた合成ページで、テキストレイヤーのページをまたいだ区の判定を確認する
+区の見出しタグによるテキストの絞り込み（prompt_compaction.filter_sections）も確認する
+"""
+
+import cv2
+import numpy as np
+
+from deed_layout import DocumentLayout, last_section_heading, tag_sections, SECTION_ORDER
+from prompt_compaction import filter_sections, join_pages
+
+PAGE_WIDTH = 1240
+PAGE_HEIGHT = 1754
+ROW_HEIGHT = 40
+ALL_SECTIONS = frozenset(SECTION_ORDER)
+
+
+def _draw_table(page: np.ndarray, top: int, rows: int, starts_section: bool) -> int:
+    """
+    罫線の表を描いて下端を返す
+    starts_section の場合は1行目を縦罫線のない見出し行にする（区の始まり）
+    """
+    left, right = 100, PAGE_WIDTH - 100
+    bottom = top + rows * ROW_HEIGHT
+    for row in range(rows + 1):
+        y = top + row * ROW_HEIGHT
+        cv2.line(page, (left, y), (right, y), 0, 2)
+    cv2.line(page, (left, top), (left, bottom), 0, 2)
+    cv2.line(page, (right, top), (right, bottom), 0, 2)
+    divider_top = top + ROW_HEIGHT if starts_section else top
+    for x in (left + 150, left + 450, left + 700):
+        cv2.line(page, (x, divider_top), (x, bottom), 0, 2)
+    return bottom
+
+
+def _page(*tables) -> bytes:
+    page = np.full((PAGE_HEIGHT, PAGE_WIDTH), 255, dtype=np.uint8)
+    top = 150
+    for rows, starts_section in tables:
+        top = _draw_table(page, top, rows, starts_section) + 60
+    ok, encoded = cv2.imencode(".png", page)
+    assert ok
+    return encoded.tobytes()
+
+
+def _sections(regions):
+    return [section for section, _ in regions]
+
+
+def test_last_section_heading():
+    text = "表　題　部　（土地の表示）\n所在 東京都\n権 利 部 （甲 区）（所有権に関する事項）\n甲区1番の登記"
+    assert last_section_heading(text) == "甲区"
+    assert last_section_heading("所在 東京都") is None
+
+
+def test_sections_across_scanned_pages():
+    """画像化したページだけの文書: 最初の表が表題部、見出し行のある表で次の区に進む"""
+    layout = DocumentLayout(ALL_SECTIONS)
+    assert _sections(layout.split_page(_page((6, True), (5, True)))) == ["表題部", "甲区"]
+    assert _sections(layout.split_page(_page((4, False), (4, True)))) == ["甲区", "乙区"]
+
+
+def test_text_layer_page_seeds_section():
+    """
+    1ページ目がテキストレイヤー（表題部・甲区の見出しを含む）で2ページ目以降が画像の文書でも、
+    画像の最初の表を表題部としない（区の判定がテキストレイヤーのページの分だけずれない）
+    """
+    text_pages = ["表題部（土地の表示）\n所在 東京都\n権利部（甲区）（所有権に関する事項）\n1 所有権保存", None, None]
+    layout = DocumentLayout(ALL_SECTIONS, text_pages=text_pages)
+    assert _sections(layout.split_page(_page((4, False), (4, True)), 1)) == ["甲区", "乙区"]
+    assert _sections(layout.split_page(_page((4, False), (3, True)), 2)) == ["乙区", "共同担保目録"]
+
+
+def test_text_layer_page_without_heading_sends_whole_page():
+    """見出しのないテキストレイヤーのページから始まる文書は区を判定できないため、ページ全体を送る"""
+    text_pages = ["所在 東京都", None]
+    layout = DocumentLayout(frozenset({"甲区"}), text_pages=text_pages)
+    image = _page((4, False), (4, True))
+    assert layout.split_page(image, 1) == [(None, image)]
+
+
+def test_filter_sections_keeps_bracket_headings_in_ocr_text():
+    """OCRテキスト中の【】の見出し行は区の見出しタグとして扱わない（後続の行を落とさない）"""
+    text = "所在 東京都千代田区\n【 権 利 部 】\n地番 1番1\n【所有者】\n田中太郎\n住所 東京都新宿区"
+    assert filter_sections(text, {"甲区"}) == text
+
+
+def test_filter_sections_keeps_requested_sections():
+    """区ごとに切り出したテキストは指定した区と、ページ全体をOCRしたページのみ残す"""
+    tagged = tag_sections([("表題部", "所在 東京都千代田区"), ("甲区", "【所有者】\n田中太郎")])
+    text = join_pages([tagged, "所有者 山田花子"])
+    assert filter_sections(text, {"甲区"}) == join_pages(["【甲区】\n【所有者】\n田中太郎", "所有者 山田花子"])
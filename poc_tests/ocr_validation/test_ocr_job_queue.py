@@ -0,0 +1,129 @@
+"""
+OCRジョブキューのテスト（pytest）
+Redis バックエンドは fakeredis[lua]、または OCR_JOB_QUEUE_TEST_REDIS_URL の Redis サーバーで実行する
+"""
+
+import os
+import time
+import threading
+
+import pytest
+
+from ocr_job_queue import (
+    SQLiteJobQueue, RedisJobQueue, JobWorkerPool, process_files, file_job_id,
+    BULK, INTERACTIVE, QUEUED, RUNNING, DONE
+)
+
+VISIBILITY_TIMEOUT = 0.2
+
+
+def _redis_queue() -> RedisJobQueue:
+    url = os.getenv("OCR_JOB_QUEUE_TEST_REDIS_URL")
+    if url:
+        queue = RedisJobQueue(url=url, visibility_timeout=VISIBILITY_TIMEOUT, prefix=f"ocr_jobs_test:{os.getpid()}:")
+    else:
+        fakeredis = pytest.importorskip("fakeredis")
+        pytest.importorskip("lupa")
+        queue = RedisJobQueue(
+            visibility_timeout=VISIBILITY_TIMEOUT, client=fakeredis.FakeRedis(decode_responses=True)
+        )
+    return queue
+
+
+@pytest.fixture(params=["sqlite", "redis"])
+def queue(request, tmp_path):
+    if request.param == "sqlite":
+        queue = SQLiteJobQueue(str(tmp_path / "jobs.sqlite3"), visibility_timeout=VISIBILITY_TIMEOUT)
+    else:
+        queue = _redis_queue()
+    yield queue
+    queue.close()
+
+
+def test_late_complete_after_lease_expiry_is_not_rerun(queue):
+    """リース期限切れで取得待ちに戻った後に元のワーカーが完了したジョブは、再取得されない"""
+    job_id = queue.enqueue("a.pdf", batch="b1", job_id="job-a", lane=BULK)
+    job = queue.claim("w1")
+    assert job is not None and job.job_id == job_id
+
+    time.sleep(VISIBILITY_TIMEOUT * 2)
+    # interactive のみ取得するワーカーの claim でも、期限切れのリースは取得待ちに戻る
+    assert queue.claim("w2", (INTERACTIVE,)) is None
+
+    queue.complete(job_id, {"success": True})
+    assert queue.claim("w2") is None
+
+    found = queue.results([job_id])[job_id]
+    assert found["state"] == DONE
+    assert found["attempts"] == 1
+    assert found["result"] == {"success": True}
+
+
+def test_late_fail_after_completion_keeps_result(queue):
+    """再実行されたジョブの一方が完了した後に、もう一方が失敗しても完了の結果を残す"""
+    job_id = queue.enqueue("a.pdf", batch="b1", job_id="job-a", lane=BULK)
+    first = queue.claim("w1")
+    time.sleep(VISIBILITY_TIMEOUT * 2)
+    second = queue.claim("w2")
+    assert second is not None and second.job_id == job_id
+
+    queue.complete(job_id, {"success": True})
+    queue.fail(job_id, "timeout", first.attempts)
+    assert queue.claim("w3") is None
+    assert queue.results([job_id])[job_id]["state"] == DONE
+
+
+def test_pool_does_not_wait_for_other_batches(queue):
+    """バッチを指定したワーカープールは、他のバッチのリース中のジョブ（中断した実行の残り）を待たずに終了する"""
+    queue.visibility_timeout = 30
+    queue.enqueue("stale.pdf", batch="old", job_id="job-stale")
+    assert queue.claim("crashed-worker") is not None
+    queue.enqueue("a.pdf", batch="b1", job_id="job-a")
+
+    handled = []
+    pool = JobWorkerPool(queue, lambda path: handled.append(path) or {"success": True}, workers=2,
+                         poll_interval=0.05, batch="b1")
+    worker = threading.Thread(target=pool.run, daemon=True)
+    worker.start()
+    worker.join(timeout=5)
+    if worker.is_alive():
+        pool.stop()
+        worker.join()
+        pytest.fail("他のバッチのジョブを待って終了しませんでした")
+    assert handled == ["a.pdf"]
+    assert queue.counts("b1")[DONE] == 1
+    assert queue.counts("old")[RUNNING] == 1
+
+
+def _pdf(tmp_path, name: str) -> str:
+    path = tmp_path / name
+    path.write_bytes(f"%PDF-1.4 {name}".encode())
+    return str(path)
+
+
+def test_interactive_call_does_not_drain_bulk_backlog(queue, tmp_path):
+    """窓口の1件の process_files は、同じキューに溜まった一括取り込みのジョブを処理せずに返る"""
+    for index in range(6):
+        queue.enqueue(f"bulk{index}.pdf", batch="/overnight", job_id=f"job-bulk{index}", lane=BULK)
+    counter = _pdf(tmp_path, "counter.pdf")
+
+    handled = []
+    output = process_files([counter], lambda path: handled.append(path) or {"success": True},
+                           workers=2, queue=queue, lane=INTERACTIVE)[0]
+    assert handled == [counter]
+    assert output["state"] == DONE and output["lane"] == INTERACTIVE
+    assert queue.counts("/overnight")[QUEUED] == 6
+
+
+def test_interactive_call_takes_over_queued_bulk_job(queue, tmp_path):
+    """一括取り込みで待機中のファイルを窓口で投入し直した場合は、その呼び出しで処理する"""
+    path = _pdf(tmp_path, "a.pdf")
+    queue.enqueue(path, batch="/overnight", lane=BULK)
+    queue.enqueue("bulk.pdf", batch="/overnight", job_id="job-bulk", lane=BULK)
+
+    handled = []
+    output = process_files([path], lambda path: handled.append(path) or {"success": True},
+                           workers=2, queue=queue, lane=INTERACTIVE)[0]
+    assert handled == [path]
+    assert output["job_id"] == file_job_id(path) and output["state"] == DONE
+    assert queue.counts("/overnight")[QUEUED] == 1
@@ -0,0 +1,97 @@
+"""
+ページ単位のパイプライン処理のテスト（pytest）
+OCRService の代わりに API を呼ばないスタブのサービスを渡し、ステージでエラーが発生したページの文書が
+エラー結果で完了し、スプールとスパンが閉じられることを確認する
+"""
+
+import threading
+
+import ocr_pipeline
+from ocr_pipeline import OCRPipeline
+
+
+class _StubRasterizer:
+    def iter_pages(self, pdf_path, page_count, pages, spool=None):
+        for page_index in pages:
+            image_data = f"{pdf_path}:{page_index}".encode()
+            if spool is not None:
+                spool.write(page_index, image_data)
+                image_data = spool.view(page_index)
+            yield page_index, image_data
+
+
+class _StubService:
+    """失敗させるページの前処理で例外を送出するサービス"""
+
+    use_page_spool = True
+
+    def __init__(self, page_count: int, failing_page=None):
+        self.page_count = page_count
+        self.failing_page = failing_page
+        self.rasterizer = _StubRasterizer()
+        self.structured = []
+        self._lock = threading.Lock()
+
+    def _read_pages(self, pdf_path):
+        return self.page_count, [None] * self.page_count
+
+    def preprocess_image(self, image_data):
+        image_data = bytes(image_data)
+        if image_data == f"broken.pdf:{self.failing_page}".encode():
+            raise ValueError("前処理エラー")
+        return image_data
+
+    def _lookup_cache(self, processed_image):
+        return None, None
+
+    def _annotate_processed_image(self, processed_image, cache_key):
+        return processed_image.decode(), 0.9
+
+    def _combine_page_results(self, page_results):
+        return "\n".join(text for text, _ in page_results), 0.9
+
+    def structure_data_with_gemini_hybrid(self, text):
+        with self._lock:
+            self.structured.append(text)
+        return {"extracted_data": {}, "confidence_scores": {}}
+
+    def _build_result(self, start_time, page_count, extracted_text, vision_confidence, structured_data, **kwargs):
+        return {"success": True, "processing_time": 0.0, "page_count": page_count}
+
+
+def test_failing_page_finishes_document_with_error(monkeypatch):
+    spools = []
+    spans = []
+
+    class RecordingSpool(ocr_pipeline.PageSpool):
+        def __init__(self, *args, **kwargs):
+            super().__init__(*args, **kwargs)
+            self.closed = False
+            spools.append(self)
+
+        def close(self):
+            self.closed = True
+            super().close()
+
+    def recording_start_span(*args, **kwargs):
+        span = start_span(*args, **kwargs)
+        spans.append(span)
+        return span
+
+    start_span = ocr_pipeline.start_span
+    monkeypatch.setattr(ocr_pipeline, "PageSpool", RecordingSpool)
+    monkeypatch.setattr(ocr_pipeline, "start_span", recording_start_span)
+
+    service = _StubService(page_count=5, failing_page=2)
+    pipeline = OCRPipeline(service=service, queue_size=2, preprocess_workers=2, vision_workers=2, gemini_workers=1)
+    results = pipeline.run(["broken.pdf", "ok.pdf"])
+
+    assert results[0] == {"error": "3ページ目の処理に失敗しました", "success": False}
+    assert results[1]["success"]
+    # エラーの文書は Gemini に送らない
+    assert len(service.structured) == 1
+    assert all(spool.closed for spool in spools) and len(spools) == 2
+    assert all(span.end_ns is not None for span in spans) and len(spans) == 2
+    assert spans[0].status_message == "ValueError: 前処理エラー"
+    errors = {stage["stage"]: stage["errors"] for stage in pipeline.last_report["stages"]}
+    assert errors == {"rasterize": 0, "preprocess": 1, "vision": 0, "gemini": 0}
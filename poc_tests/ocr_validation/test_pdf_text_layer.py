@@ -0,0 +1,41 @@
+"""
+PDFテキストレイヤーの採用判定のテスト（pytest）
+"""
+
+import pytest
+
+from pdf_text_layer import is_sufficient_text
+
+DEED_TEXT = (
+    "権利部（甲区）（所有権に関する事項）\n"
+    "順位番号 2 所有権移転 令和3年4月1日 第1234号\n"
+    "原因 令和3年4月1日売買 所有者 東京都新宿区西新宿一丁目1番1号 山田花子\n"
+    "地積 500.00㎡ ※下線のあるものは抹消事項であることを示す。"
+)
+
+
+@pytest.mark.parametrize("text", [
+    DEED_TEXT,
+    # 全角英数字・半角カナ・罫線を含むテキスト
+    "ＡＢＣ１２３ ｶﾌﾞｼｷｶﾞｲｼｬ ─── 所在 東京都千代田区丸の内一丁目 地番 2番3 地目 宅地 地積 320.15㎡ ① ② ③",
+    # 英数字のみの電子PDF
+    "Certificate of registered matters. Lot 12-3, Nishi-Shinjuku, Shinjuku-ku, Tokyo.",
+])
+def test_accepts_readable_text(text):
+    assert is_sufficient_text(text)
+
+
+@pytest.mark.parametrize("text", [
+    None,
+    "",
+    # 文字数が足りない
+    "所在 東京都",
+    # ToUnicode 対応表のないフォントの文字化け
+    "Ԓܳ" * 40,
+    "�" * 60,
+    "\x01\x02\x03" * 20,
+    # 有効な文字が一部のみ
+    "所有者 山田花子 " + "ԒܳԱ" * 20,
+])
+def test_rejects_garbled_or_short_text(text):
+    assert not is_sufficient_text(text)
@@ -9,7 +9,11 @@ import argparse
 from pathlib import Path
 from typing import List, Dict
 
-from ocr_service import OCRService
+from ocr_service import OCRService, VISION_CONCURRENCY
+from async_ocr_service import AsyncOCRService, GEMINI_CONCURRENCY
+from ocr_pipeline import OCRPipeline, print_pipeline_report
+from ocr_job_queue import JOB_WORKERS, LANES, BULK, process_files, summarize_lanes, print_lane_report
+from tracing import percentile, summarize_stage_timings
 from config import TARGET_FIELDS, PERFORMANCE_TARGETS
 
 def test_single_pdf(ocr_service: OCRService, pdf_path: str) -> Dict:
@@ -22,6 +26,13 @@ def test_single_pdf(ocr_service: OCRService, pdf_path: str) -> Dict:
     result = ocr_service.process_pdf(pdf_path)
     total_time = time.time() - start_time
     
+    print_single_result(result, total_time)
+    return result
+
+def print_single_result(result: Dict, total_time: float):
+    """
+    単一PDFファイルの結果表示
+    """
     if result.get("success"):
         print(f"✅ 処理成功 (総処理時間: {total_time:.2f}秒)")
         
@@ -49,12 +60,26 @@ def test_single_pdf(ocr_service: OCRService, pdf_path: str) -> Dict:
                 print(f"  {field}: {value[:50]}..." if len(str(value)) > 50 else f"  {field}: {value}")
     else:
         print(f"❌ 処理失敗: {result.get('error', 'Unknown error')}")
-    
-    return result
 
-def run_batch_test(pdf_directory: str) -> Dict:
+def run_batch_test(
+    pdf_directory: str,
+    concurrency: int = 1,
+    vision_concurrency: int = VISION_CONCURRENCY,
+    gemini_concurrency: int = GEMINI_CONCURRENCY,
+    pipeline: bool = False,
+    job_queue: bool = False,
+    workers: int = JOB_WORKERS,
+    resume: bool = False,
+    lane: str = BULK,
+    deadline_seconds: float = None
+) -> Dict:
     """
     複数PDFファイルの一括テスト
+    concurrency が2以上の場合は AsyncOCRService で同時に concurrency 件ずつ処理する
+    pipeline を指定した場合は OCRPipeline でステージを重ねて処理し、ステージ別レポートを表示する
+    job_queue を指定した場合は永続ジョブキュー経由で workers 件ずつ処理する
+    （処理済みのファイルは再処理しない。resume の場合は前回中断したジョブも再実行する）
+    ジョブは lane の優先レーンに期限 deadline_seconds 秒（未指定はレーンの既定値）で投入し、レーン別のレイテンシを表示する
     """
     pdf_dir = Path(pdf_directory)
     pdf_files = list(pdf_dir.glob("*.pdf"))
@@ -63,17 +88,77 @@ def run_batch_test(pdf_directory: str) -> Dict:
         print(f"❌ PDFファイルが見つかりません: {pdf_directory}")
         return {}
     
-    print(f"\n=== 一括テスト開始: {len(pdf_files)}ファイル ===")
+    print(f"\n=== 一括テスト開始: {len(pdf_files)}ファイル (同時処理数: {concurrency}) ===")
     
-    ocr_service = OCRService()
+    batch_start = time.time()
     results = []
     
-    for pdf_file in pdf_files:
-        result = test_single_pdf(ocr_service, str(pdf_file))
-        results.append({
-            "file": pdf_file.name,
-            "result": result
-        })
+    if job_queue:
+        ocr_service = OCRService()
+        job_results = process_files(
+            [str(f) for f in pdf_files],
+            ocr_service.process_pdf,
+            workers=workers,
+            batch=str(pdf_dir.resolve()),
+            resume=resume,
+            lane=lane,
+            deadline_seconds=deadline_seconds
+        )
+        
+        for pdf_file, job_result in zip(pdf_files, job_results):
+            print(f"\n=== {pdf_file.name} (試行 {job_result['attempts']}回) ===")
+            print_single_result(job_result["result"], job_result["result"].get("processing_time", 0))
+            results.append({
+                "file": pdf_file.name,
+                "job_id": job_result["job_id"],
+                "lane": job_result["lane"],
+                "latency_ms": job_result["latency_ms"],
+                "result": job_result["result"]
+            })
+        print_lane_report(summarize_lanes(job_results))
+    elif pipeline:
+        ocr_pipeline = OCRPipeline(
+            OCRService(),
+            vision_workers=vision_concurrency,
+            gemini_workers=gemini_concurrency
+        )
+        pipeline_results = ocr_pipeline.run([str(f) for f in pdf_files])
+        
+        for pdf_file, result in zip(pdf_files, pipeline_results):
+            print(f"\n=== {pdf_file.name} ===")
+            print_single_result(result, result.get("processing_time", 0))
+            results.append({
+                "file": pdf_file.name,
+                "result": result
+            })
+        print_pipeline_report(ocr_pipeline.last_report)
+    elif concurrency > 1:
+        ocr_service = AsyncOCRService(
+            vision_concurrency=vision_concurrency,
+            gemini_concurrency=gemini_concurrency
+        )
+        try:
+            batch_results = ocr_service.process_batch([str(f) for f in pdf_files], concurrency)
+        finally:
+            ocr_service.shutdown()
+        
+        for pdf_file, batch_result in zip(pdf_files, batch_results):
+            print(f"\n=== {pdf_file.name} ===")
+            print_single_result(batch_result["result"], batch_result["result"].get("processing_time", 0))
+            results.append({
+                "file": pdf_file.name,
+                "result": batch_result["result"]
+            })
+    else:
+        ocr_service = OCRService()
+        for pdf_file in pdf_files:
+            result = test_single_pdf(ocr_service, str(pdf_file))
+            results.append({
+                "file": pdf_file.name,
+                "result": result
+            })
+    
+    print(f"\n一括処理の総所要時間: {time.time() - batch_start:.2f}秒")
     
     # 統計レポート
     generate_batch_report(results)
@@ -93,9 +178,22 @@ def generate_batch_report(results: List[Dict]):
     print(f"失敗: {len(failed_tests)}/{len(results)} ({len(failed_tests)/len(results)*100:.1f}%)")
     
     if successful_tests:
-        # 平均処理時間
-        avg_time = sum(r["result"]["processing_time"] for r in successful_tests) / len(successful_tests)
-        print(f"平均処理時間: {avg_time:.2f}秒")
+        # 処理時間（平均だけではテールレイテンシが見えないため p50/p95/p99 も表示）
+        times = sorted(r["result"]["processing_time"] for r in successful_tests)
+        print(f"平均処理時間: {sum(times) / len(times):.2f}秒 "
+              f"(p50 {percentile(times, 50):.2f}秒 / p95 {percentile(times, 95):.2f}秒 / p99 {percentile(times, 99):.2f}秒)")
+        
+        # ステージ別処理時間（文書ごとの timings_ms から集計）
+        stage_summary = summarize_stage_timings(
+            [r["result"]["timings_ms"] for r in successful_tests if "timings_ms" in r["result"]]
+        )
+        if stage_summary:
+            print(f"\nステージ別処理時間(ms):")
+            print(f"  {'ステージ':<12}{'件数':>6}{'p50':>10}{'p95':>10}{'p99':>10}")
+            for stage, summary in stage_summary.items():
+                print(f"  {stage:<12}{summary['count']:>6}{summary['p50']:>10.1f}"
+                      f"{summary['p95']:>10.1f}{summary['p99']:>10.1f}")
+            print()
         
         # MVP/RC目標達成率
         mvp_time_success = sum(1 for r in successful_tests 
@@ -106,6 +204,28 @@ def generate_batch_report(results: List[Dict]):
         print(f"MVP時間目標達成: {mvp_time_success}/{len(successful_tests)} ({mvp_time_success/len(successful_tests)*100:.1f}%)")
         print(f"RC時間目標達成: {rc_time_success}/{len(successful_tests)} ({rc_time_success/len(successful_tests)*100:.1f}%)")
     
+    # OCRキャッシュ（累計値のため最も参照回数の多い結果を使用）
+    cache_stats = max(
+        (r["result"]["ocr_cache"] for r in results if "ocr_cache" in r["result"]),
+        key=lambda stats: stats["hits"] + stats["misses"],
+        default=None
+    )
+    if cache_stats:
+        print(f"OCRキャッシュ: ヒット {cache_stats['hits']} / ミス {cache_stats['misses']} "
+              f"(ヒット率 {cache_stats['hit_rate']:.1%})")
+        print(f"  省略したVision API呼び出し: {cache_stats['saved_vision_calls']}ページ分, "
+              f"短縮時間: {cache_stats['saved_latency_seconds']:.2f}秒")
+    
+    structuring_stats = max(
+        (r["result"]["structuring_cache"] for r in results if "structuring_cache" in r["result"]),
+        key=lambda stats: stats["hits"] + stats["misses"],
+        default=None
+    )
+    if structuring_stats:
+        print(f"構造化キャッシュ: ヒット {structuring_stats['hits']} / ミス {structuring_stats['misses']} "
+              f"(ヒット率 {structuring_stats['hit_rate']:.1%}, "
+              f"短縮時間: {structuring_stats['saved_latency_seconds']:.2f}秒)")
+    
     if failed_tests:
         print(f"\n失敗したファイル:")
         for failed in failed_tests:
@@ -140,6 +260,15 @@ def main():
     parser.add_argument("--pdf_path", help="テスト対象PDFファイルまたはディレクトリパス")
     parser.add_argument("--connectivity_test", action="store_true", help="API接続テストのみ実行")
     parser.add_argument("--output", help="結果出力JSONファイルパス")
+    parser.add_argument("--concurrency", type=int, default=1, help="一括テストで同時に処理するPDF数")
+    parser.add_argument("--vision_concurrency", type=int, default=VISION_CONCURRENCY, help="Vision APIの同時呼び出し数")
+    parser.add_argument("--gemini_concurrency", type=int, default=GEMINI_CONCURRENCY, help="Gemini APIの同時呼び出し数")
+    parser.add_argument("--pipeline", action="store_true", help="ステージ間をキューでつないだパイプラインで一括処理")
+    parser.add_argument("--job_queue", action="store_true", help="永続ジョブキュー経由で一括処理（中断しても処理済みの結果を保持）")
+    parser.add_argument("--workers", type=int, default=JOB_WORKERS, help="ジョブキューのワーカー数")
+    parser.add_argument("--resume", action="store_true", help="前回中断したジョブキューの実行を再開")
+    parser.add_argument("--lane", choices=LANES, default=BULK, help="ジョブキューに投入する優先レーン（窓口の処理は interactive）")
+    parser.add_argument("--deadline", type=float, help="ジョブの期限（投入からの秒数、未指定はレーンの既定値）")
     
     args = parser.parse_args()
     
@@ -166,11 +295,34 @@ def main():
         if pdf_path.is_file() and pdf_path.suffix.lower() == '.pdf':
             # 単一ファイルテスト
             ocr_service = OCRService()
-            result = test_single_pdf(ocr_service, str(pdf_path))
+            if args.job_queue:
+                # 一括取り込みと同じジョブキューに投入（interactive の場合は bulk より先に処理される）
+                result = process_files(
+                    [str(pdf_path)],
+                    ocr_service.process_pdf,
+                    workers=args.workers,
+                    lane=args.lane,
+                    deadline_seconds=args.deadline
+                )[0]
+                print_single_result(result["result"], result["result"].get("processing_time", 0))
+                print_lane_report(summarize_lanes([result]))
+            else:
+                result = test_single_pdf(ocr_service, str(pdf_path))
             
         elif pdf_path.is_dir():
             # ディレクトリ一括テスト
-            result = run_batch_test(str(pdf_path))
+            result = run_batch_test(
+                str(pdf_path),
+                concurrency=args.concurrency,
+                vision_concurrency=args.vision_concurrency,
+                gemini_concurrency=args.gemini_concurrency,
+                pipeline=args.pipeline,
+                job_queue=args.job_queue or args.resume,
+                workers=args.workers,
+                resume=args.resume,
+                lane=args.lane,
+                deadline_seconds=args.deadline
+            )
             
         else:
             print(f"❌ 無効なパス: {pdf_path}")
@@ -188,6 +340,8 @@ def main():
         print("  python test_vision_gemini.py --connectivity_test")
         print("  python test_vision_gemini.py --pdf_path sample.pdf")
         print("  python test_vision_gemini.py --pdf_path sample_documents/")
+        print("  python test_vision_gemini.py --pdf_path sample_documents/ --concurrency 16")
+        print("  python test_vision_gemini.py --pdf_path sample_documents/ --job_queue --workers 8")
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
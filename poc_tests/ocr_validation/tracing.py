@@ -0,0 +1,396 @@
+"""
+OCRパイプラインのステージ別計測（トレース）
+PDFの読み込み・ラスタライズ・前処理・エンコード・送信・Vision API・Gemini・応答解析・評価をスパンで囲み、
+どのステージがレイテンシの原因かを文書ごとに確認できるようにする
+
+- 所要時間は単調時計（time.perf_counter_ns）で計測し、出力用の時刻のみ壁時計に換算する
+- 現在のスパンは contextvars で保持する（スレッドプール・run_in_executor には bind() で引き継ぐ）
+- ルートスパン（process_pdf）配下の終了したスパンは名前ごとに集計し、結果の timings_ms に加える
+- 出力先: なし（none）、JSON Lines ファイル（jsonl）、OpenTelemetry Collector の OTLP/HTTP JSON（otlp）
+  OTLP は JSON エンコーディングを urllib で送信するため、opentelemetry パッケージは不要
+"""
+
+import os
+import json
+import time
+import queue
+import random
+import atexit
+import threading
+import contextvars
+import logging
+import urllib.request
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Iterator, List, Optional, Sequence
+
+# ログ設定
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# スパンの出力先（カンマ区切りで複数指定可: none / jsonl / otlp）
+TRACE_EXPORTER = os.getenv("OCR_TRACE_EXPORTER", "none")
+TRACE_FILE = os.getenv("OCR_TRACE_FILE", "ocr_traces.jsonl")
+OTLP_ENDPOINT = os.getenv("OTEL_EXPORTER_OTLP_ENDPOINT", "http://localhost:4318")
+SERVICE_NAME = os.getenv("OTEL_SERVICE_NAME", "ocr-validation")
+# OTLP で1回に送信するスパン数
+TRACE_BATCH_SIZE = int(os.getenv("OCR_TRACE_BATCH_SIZE", "128"))
+# OTLP の送信待ちバッチ数の上限（送信が追いつかない場合は新しいバッチを破棄する）
+TRACE_QUEUE_SIZE = int(os.getenv("OCR_TRACE_QUEUE_SIZE", "8"))
+
+# 単調時計の値を壁時計（UNIXエポックns）に換算するための基準
+_WALL_ANCHOR_NS = time.time_ns() - time.perf_counter_ns()
+
+# OTLP のステータスコード
+_STATUS_OK = 1
+_STATUS_ERROR = 2
+
+
+class _TraceTotals:
+    """1トレース内で終了したスパンの名前ごとの合計時間（スレッドセーフ）"""
+
+    __slots__ = ("_lock", "totals_ms")
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.totals_ms: Dict[str, float] = {}
+
+    def add(self, name: str, duration_ms: float):
+        with self._lock:
+            self.totals_ms[name] = self.totals_ms.get(name, 0.0) + duration_ms
+
+    def snapshot(self) -> Dict[str, float]:
+        with self._lock:
+            return dict(self.totals_ms)
+
+
+class Span:
+    """
+    計測区間（OpenTelemetry のスパンと同じ ID 体系・属性を持つ）
+    start_span() / span() で作成し、end() で終了する
+    """
+
+    __slots__ = ("name", "trace_id", "span_id", "parent_id", "attributes", "start_ns", "end_ns",
+                 "status_code", "status_message", "_totals")
+
+    def __init__(self, name: str, parent: Optional["Span"] = None, attributes: Optional[Dict[str, Any]] = None):
+        self.name = name
+        self.trace_id = parent.trace_id if parent is not None else f"{random.getrandbits(128):032x}"
+        self.span_id = f"{random.getrandbits(64):016x}"
+        self.parent_id = parent.span_id if parent is not None else None
+        self.attributes: Dict[str, Any] = dict(attributes or {})
+        self.start_ns = time.perf_counter_ns()
+        self.end_ns: Optional[int] = None
+        self.status_code = _STATUS_OK
+        self.status_message = ""
+        self._totals = parent._totals if parent is not None else _TraceTotals()
+
+    @property
+    def duration_ms(self) -> float:
+        end_ns = self.end_ns if self.end_ns is not None else time.perf_counter_ns()
+        return (end_ns - self.start_ns) / 1e6
+
+    def set_attribute(self, key: str, value: Any):
+        self.attributes[key] = value
+
+    def record_error(self, error: BaseException):
+        self.status_code = _STATUS_ERROR
+        self.status_message = f"{type(error).__name__}: {error}"
+
+    def end(self, end_ns: Optional[int] = None):
+        """スパンを終了し、トレースの集計と出力先に渡す（2回目以降の呼び出しは無視）"""
+        if self.end_ns is not None:
+            return
+        self.end_ns = end_ns if end_ns is not None else time.perf_counter_ns()
+        if self.parent_id is not None:
+            self._totals.add(self.name, self.duration_ms)
+        for exporter in get_exporters():
+            exporter.export(self)
+
+    def stage_totals(self) -> Dict[str, float]:
+        """同じトレースで終了したスパンの名前ごとの合計時間(ms)（ルートスパン自身は含まない）"""
+        return self._totals.snapshot()
+
+    def to_otlp(self) -> Dict:
+        """OTLP/JSON の Span 形式"""
+        span = {
+            "traceId": self.trace_id,
+            "spanId": self.span_id,
+            "name": self.name,
+            "kind": 1,
+            "startTimeUnixNano": str(_WALL_ANCHOR_NS + self.start_ns),
+            "endTimeUnixNano": str(_WALL_ANCHOR_NS + (self.end_ns or time.perf_counter_ns())),
+            "attributes": [_otlp_attribute(key, value) for key, value in self.attributes.items()],
+            "status": {"code": self.status_code},
+        }
+        if self.parent_id is not None:
+            span["parentSpanId"] = self.parent_id
+        if self.status_message:
+            span["status"]["message"] = self.status_message
+        return span
+
+
+def _otlp_attribute(key: str, value: Any) -> Dict:
+    if isinstance(value, bool):
+        return {"key": key, "value": {"boolValue": value}}
+    if isinstance(value, int):
+        return {"key": key, "value": {"intValue": str(value)}}
+    if isinstance(value, float):
+        return {"key": key, "value": {"doubleValue": value}}
+    return {"key": key, "value": {"stringValue": str(value)}}
+
+
+_current_span: contextvars.ContextVar[Optional[Span]] = contextvars.ContextVar("ocr_current_span", default=None)
+
+
+def current_span() -> Optional[Span]:
+    return _current_span.get()
+
+
+def start_span(name: str, parent: Optional[Span] = None, **attributes) -> Span:
+    """
+    スパンを開始（現在のスパンにはしない。スレッドをまたいで end() する場合に使用）
+    parent を省略した場合は現在のスパンの子、現在のスパンがない場合は新しいトレースのルートになる
+    """
+    return Span(name, parent if parent is not None else _current_span.get(), attributes)
+
+
+@contextmanager
+def activate(span: Optional[Span]) -> Iterator[Optional[Span]]:
+    """with の間 span を現在のスパンにする（終了はしない）"""
+    token = _current_span.set(span)
+    try:
+        yield span
+    finally:
+        _current_span.reset(token)
+
+
+@contextmanager
+def span(name: str, parent: Optional[Span] = None, **attributes) -> Iterator[Span]:
+    """
+    with の間を計測するスパン（例外は記録して再送出する）
+    """
+    current = start_span(name, parent, **attributes)
+    token = _current_span.set(current)
+    try:
+        yield current
+    except BaseException as e:
+        current.record_error(e)
+        raise
+    finally:
+        _current_span.reset(token)
+        current.end()
+
+
+def record_span(name: str, duration_ms: float, **attributes) -> Span:
+    """
+    計測済みの処理時間から、現在時刻に終了した子スパンを記録
+    （前処理ワーカー内のエンコード時間など、スパンで囲めない区間に使用）
+    """
+    end_ns = time.perf_counter_ns()
+    child = start_span(name, **attributes)
+    child.start_ns = end_ns - int(duration_ms * 1e6)
+    child.end(end_ns)
+    return child
+
+
+def bind(fn: Callable) -> Callable:
+    """
+    呼び出し時点の現在のスパンを、別スレッドで実行される fn に引き継ぐ
+    （ThreadPoolExecutor.submit・loop.run_in_executor はコンテキストを引き継がないため）
+    """
+    parent = _current_span.get()
+
+    def run(*args, **kwargs):
+        token = _current_span.set(parent)
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            _current_span.reset(token)
+
+    return run
+
+
+def stage_timings() -> Dict[str, float]:
+    """現在のトレースで終了したスパンの名前ごとの合計時間(ms)（トレース外では空）"""
+    current = _current_span.get()
+    return current.stage_totals() if current is not None else {}
+
+
+class JSONLinesExporter:
+    """終了したスパンを1行1スパンの JSON（OTLP の Span 形式）でファイルに追記"""
+
+    def __init__(self, path: str = TRACE_FILE, service_name: str = SERVICE_NAME):
+        self.path = path
+        self.service_name = service_name
+        self._lock = threading.Lock()
+
+    def export(self, span: Span):
+        record = span.to_otlp()
+        record["serviceName"] = self.service_name
+        record["durationMs"] = span.duration_ms
+        line = json.dumps(record, ensure_ascii=False)
+        with self._lock, open(self.path, "a", encoding="utf-8") as file:
+            file.write(line + "\n")
+
+    def flush(self):
+        pass
+
+
+class OTLPHTTPExporter:
+    """
+    OpenTelemetry Collector 等に OTLP/HTTP（JSON エンコーディング）でスパンを送信
+    batch_size 件ごとのバッチを送信スレッド（デーモン）に渡して POST {endpoint}/v1/traces する
+    （呼び出し元のスレッドでは送信しない）。flush() は未送信のバッチを送り終えるまで待つ
+    送信待ちが queue_size バッチを超えた場合や送信に失敗したスパンは破棄する（計測の障害で本処理を止めない）
+    """
+
+    def __init__(
+        self,
+        endpoint: str = OTLP_ENDPOINT,
+        service_name: str = SERVICE_NAME,
+        batch_size: int = TRACE_BATCH_SIZE,
+        timeout: float = 5.0,
+        queue_size: int = TRACE_QUEUE_SIZE
+    ):
+        self.url = endpoint.rstrip("/") + "/v1/traces"
+        self.service_name = service_name
+        self.batch_size = max(1, batch_size)
+        self.timeout = timeout
+        self.queue_size = max(1, queue_size)
+        self._lock = threading.Lock()
+        self._pending: List[Dict] = []
+        self._queue: Optional[queue.Queue] = None
+        self._worker_pid: Optional[int] = None
+
+    def export(self, span: Span):
+        with self._lock:
+            self._pending.append(span.to_otlp())
+            if len(self._pending) < self.batch_size:
+                return
+            spans, self._pending = self._pending, []
+        try:
+            self._batches().put_nowait(spans)
+        except queue.Full:
+            logger.warning(f"トレースの送信が追いつかないため{len(spans)}スパンを破棄します")
+
+    def flush(self):
+        """未送信のスパンを送信スレッドに渡し、それまでのバッチを送り終えるまで待つ"""
+        with self._lock:
+            spans, self._pending = self._pending, []
+            if not spans and self._queue is None:
+                return
+        batches = self._batches()
+        # 送信待ちのバッチ数に応じて待つ（Collector が応答しない場合もプロセス終了を止めない）
+        deadline = time.monotonic() + self.timeout * (batches.qsize() + 2)
+        done = threading.Event()
+        try:
+            if spans:
+                batches.put(spans, timeout=max(0.0, deadline - time.monotonic()))
+            batches.put(done, timeout=max(0.0, deadline - time.monotonic()))
+        except queue.Full:
+            logger.warning(f"トレースの送信待ちが解消しないため{len(spans)}スパンを破棄します")
+            return
+        if not done.wait(max(0.0, deadline - time.monotonic())):
+            logger.warning("トレースの送信が終わらないまま終了します")
+
+    def _batches(self) -> queue.Queue:
+        """送信待ちのキュー（送信スレッドはプロセスごとに最初の送信時に起動する。fork 後の子プロセスでは作り直す）"""
+        with self._lock:
+            pid = os.getpid()
+            if self._queue is None or self._worker_pid != pid:
+                self._queue = queue.Queue(maxsize=self.queue_size)
+                self._worker_pid = pid
+                threading.Thread(
+                    target=self._run, args=(self._queue,), name="otlp-exporter", daemon=True
+                ).start()
+            return self._queue
+
+    def _run(self, batches: queue.Queue):
+        while True:
+            item = batches.get()
+            if isinstance(item, threading.Event):
+                item.set()
+            else:
+                self._post(item)
+
+    def _post(self, spans: List[Dict]):
+        body = {
+            "resourceSpans": [{
+                "resource": {"attributes": [_otlp_attribute("service.name", self.service_name)]},
+                "scopeSpans": [{"scope": {"name": "ocr_validation"}, "spans": spans}],
+            }]
+        }
+        # 共有HTTPクライアントは送信自体をスパンで計測するため使わない
+        request = urllib.request.Request(
+            self.url, data=json.dumps(body).encode("utf-8"), headers={"Content-Type": "application/json"}
+        )
+        try:
+            with urllib.request.urlopen(request, timeout=self.timeout) as response:
+                response.read()
+        except Exception as e:
+            logger.warning(f"トレースの送信に失敗しました（{len(spans)}スパンを破棄）: {e}")
+
+
+def create_exporters(names: str = TRACE_EXPORTER) -> List:
+    exporters = []
+    for name in (name.strip().lower() for name in names.split(",")):
+        if name in ("", "none"):
+            continue
+        if name == "jsonl":
+            exporters.append(JSONLinesExporter())
+        elif name == "otlp":
+            exporters.append(OTLPHTTPExporter())
+        else:
+            logger.warning(f"未知のトレース出力先のため無視します: {name}")
+    return exporters
+
+
+_exporters: Optional[List] = None
+_exporters_lock = threading.Lock()
+
+
+def get_exporters() -> List:
+    """プロセス内で共有する出力先（プロセス終了時に未送信のスパンを送信する）"""
+    global _exporters
+    if _exporters is None:
+        with _exporters_lock:
+            if _exporters is None:
+                _exporters = create_exporters()
+                if _exporters:
+                    atexit.register(flush)
+    return _exporters
+
+
+def flush():
+    for exporter in get_exporters():
+        exporter.flush()
+
+
+def percentile(sorted_values: Sequence[float], q: float) -> float:
+    """昇順の値の q パーセンタイル（線形補間）"""
+    if not sorted_values:
+        return 0.0
+    position = (len(sorted_values) - 1) * q / 100
+    lower = int(position)
+    upper = min(lower + 1, len(sorted_values) - 1)
+    return sorted_values[lower] + (sorted_values[upper] - sorted_values[lower]) * (position - lower)
+
+
+def summarize_stage_timings(timings: Sequence[Dict[str, float]], quantiles=(50, 95, 99)) -> Dict[str, Dict]:
+    """
+    文書ごとの timings_ms からステージ別のパーセンタイルを集計
+
+    Returns:
+        {ステージ名: {"count": 件数, "p50": ms, "p95": ms, "p99": ms}}（ステージ名は最初の出現順）
+    """
+    values: Dict[str, List[float]] = {}
+    for stage_timings in timings:
+        for stage, ms in stage_timings.items():
+            values.setdefault(stage, []).append(ms)
+    summary: Dict[str, Dict] = {}
+    for stage, stage_values in values.items():
+        stage_values.sort()
+        summary[stage] = {"count": len(stage_values)}
+        for q in quantiles:
+            summary[stage][f"p{q}"] = percentile(stage_values, q)
+    return summary
@@ -0,0 +1,116 @@
+"""
+Vision API へ送信する二値画像のエンコード方式
+二値化後のページを 8bit PNG のまま送る代わりに、1bit PNG・可逆WebP・CCITT G4 TIFF や
+目標DPIへの縮小を組み合わせて送信バイト数を減らす（支店の細い上り回線ではアップロードが最大の待ち時間）
+
+エンコード方式の指定: "<形式>" または "<形式>@<DPI>"（例: "png1", "png1@200"）
+どの方式がOCR精度を保てるかは calibrate_upload_encoding.py でサンプル謄本を使って確認する
+"""
+
+import os
+import logging
+from io import BytesIO
+from typing import Callable, Dict, Optional, Tuple
+
+import cv2
+import numpy as np
+from PIL import Image
+
+# ログ設定
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# 既定は従来どおりのフル解像度 8bit PNG
+DEFAULT_UPLOAD_ENCODING = os.getenv("OCR_UPLOAD_ENCODING", "png")
+
+
+def _encode_png(binary: np.ndarray) -> bytes:
+    ok, encoded = cv2.imencode('.png', binary)
+    if not ok:
+        raise ValueError("PNGエンコードに失敗しました")
+    return encoded.tobytes()
+
+
+def _encode_png_1bit(binary: np.ndarray) -> bytes:
+    # 圧縮レベル 9 はサイズが数%しか減らない一方でエンコード時間が3倍以上になるため 6 を使用
+    ok, encoded = cv2.imencode('.png', binary, [cv2.IMWRITE_PNG_BILEVEL, 1, cv2.IMWRITE_PNG_COMPRESSION, 6])
+    if not ok:
+        raise ValueError("1bit PNGエンコードに失敗しました")
+    return encoded.tobytes()
+
+
+def _encode_webp_lossless(binary: np.ndarray) -> bytes:
+    # 品質 100 超で可逆圧縮
+    ok, encoded = cv2.imencode('.webp', binary, [cv2.IMWRITE_WEBP_QUALITY, 101])
+    if not ok:
+        raise ValueError("WebPエンコードに失敗しました")
+    return encoded.tobytes()
+
+
+def _encode_tiff_g4(binary: np.ndarray) -> bytes:
+    buffer = BytesIO()
+    Image.fromarray(binary).convert("1").save(buffer, format="TIFF", compression="group4")
+    return buffer.getvalue()
+
+
+class _Format:
+    """エンコード形式（images_annotate: images:annotate に送信できるか）"""
+
+    def __init__(self, encode: Callable[[np.ndarray], bytes], mime_type: str, images_annotate: bool = True):
+        self.encode = encode
+        self.mime_type = mime_type
+        self.images_annotate = images_annotate
+
+
+UPLOAD_FORMATS: Dict[str, _Format] = {
+    "png": _Format(_encode_png, "image/png"),
+    "png1": _Format(_encode_png_1bit, "image/png"),
+    "webp": _Format(_encode_webp_lossless, "image/webp"),
+    # TIFF は files:annotate のみ対応のため、images:annotate では使用しない（容量比較用）
+    "tiff_g4": _Format(_encode_tiff_g4, "image/tiff", images_annotate=False),
+}
+
+
+def parse_encoding(spec: str) -> Tuple[str, Optional[int]]:
+    """
+    "<形式>[@<DPI>]" を (形式, 目標DPI) に分解（DPI省略時は None = 縮小しない）
+    """
+    name, _, dpi = spec.strip().partition("@")
+    if name not in UPLOAD_FORMATS:
+        raise ValueError(f"未知のエンコード方式です: {spec}")
+    return name, int(dpi) if dpi else None
+
+
+class UploadEncoder:
+    """
+    二値画像を指定方式でエンコード
+    目標DPIが元のDPIより低い場合は面積平均で縮小し、再度二値化してからエンコードする
+    """
+
+    def __init__(self, spec: str = DEFAULT_UPLOAD_ENCODING, source_dpi: Optional[int] = None):
+        self.spec = spec
+        self.format_name, self.target_dpi = parse_encoding(spec)
+        self.format = UPLOAD_FORMATS[self.format_name]
+        self.source_dpi = source_dpi
+        if self.target_dpi and not source_dpi:
+            raise ValueError(f"縮小を伴うエンコード方式には元画像のDPIが必要です: {spec}")
+
+    @property
+    def scale(self) -> float:
+        if not self.target_dpi or self.target_dpi >= self.source_dpi:
+            return 1.0
+        return self.target_dpi / self.source_dpi
+
+    def downscale(self, binary: np.ndarray) -> np.ndarray:
+        scale = self.scale
+        if scale == 1.0:
+            return binary
+        height, width = binary.shape[:2]
+        size = (max(1, round(width * scale)), max(1, round(height * scale)))
+        resized = cv2.resize(binary, size, interpolation=cv2.INTER_AREA)
+        # 縮小で生じた中間調を二値に戻す（細い線が消えないよう閾値はやや明るめ）
+        _, rebinarized = cv2.threshold(resized, 160, 255, cv2.THRESH_BINARY)
+        return rebinarized
+
+    def encode(self, binary: np.ndarray) -> bytes:
+        return self.format.encode(self.downscale(binary))